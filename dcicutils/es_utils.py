@@ -1,6 +1,9 @@
 import logging
 import boto3
-from .misc_utils import PRINT
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import functools
+from .misc_utils import PRINT, chunked
+from .task_utils import TaskGroup
 import dcicutils.hack_for_elasticsearch_numpy_usage  # noqa
 from elasticsearch import Elasticsearch, RequestsHttpConnection
 from aws_requests_auth.boto_utils import BotoAWSRequestsAuth
@@ -162,9 +165,15 @@ def execute_lucene_query_on_es(client, index, query):
         return None
 
 
-def get_bulk_uuids_embedded(client, index, uuids, is_generator=False):
+ES_MGET_CHUNK_SIZE = 500
+ES_MGET_MAX_WORKERS = 4
+
+
+def get_bulk_uuids_embedded(client, index, uuids, is_generator=False, source=None,
+                            chunk_size=ES_MGET_CHUNK_SIZE, max_workers=ES_MGET_MAX_WORKERS):
     """
-    Gets the embedded view for all uuids in an index with a single multi-get ES request.
+    Gets the embedded view for all uuids in an index with multi-get ES requests of chunk_size uuids each,
+    up to max_workers of them at once. Any uuids not found in the index are skipped.
 
     NOTE: because an index is required, when passing uuids to this method they must all be
     of the same item type. The index can be determined by:
@@ -173,24 +182,48 @@ def get_bulk_uuids_embedded(client, index, uuids, is_generator=False):
 
     :param client: elasticsearch client
     :param index: index to search
-    :param uuids: list of uuids (all of the same type)
-    :param is_generator: whether to use a generator over the response (NOT paginate)
+    :param uuids: list (or other iterable) of uuids (all of the same type)
+    :param is_generator: whether to return a generator that yields results as each chunk's request completes
+                         (so not necessarily in the order of uuids), rather than a list (in the order of uuids)
+    :param source: list of _source fields to get, if not the embedded view (in which case each _source is returned)
+    :param chunk_size: number of uuids per multi-get request
+    :param max_workers: number of multi-get requests to make at once
 
     :returns: list of embedded views of the given uuids, if any
     """
-    def return_generator(resp):
-        for d in resp['docs']:
-            yield d['_source']['embedded']
-
-    final_result = []
-    response = client.mget(body={  # XXX: this could still be slow even if you use is_generator
-        'docs': [{'_id': _id,
-                  '_source': ['embedded.*'],
-                  '_index': index} for _id in uuids]
+    def mget(chunk):
+        response = client.mget(body={
+            'docs': [{'_id': _id,
+                      '_source': source or ['embedded.*'],
+                      '_index': index} for _id in chunk]
         })
+        return [doc['_source'] if source else doc['_source'].get('embedded', {})
+                for doc in response['docs'] if doc.get('found', True) and '_source' in doc]
+
+    def return_generator():
+        # Not a TaskGroup, since this yields the results of each request as it completes (rather than all of them,
+        # in order, once they have all completed), and makes the requests only as the results are consumed.
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            try:
+                for chunk in chunked(uuids, chunk_size=chunk_size):
+                    if len(pending) >= max_workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield from future.result()
+                    pending.add(executor.submit(mget, chunk))
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
     if is_generator is True:
-        return return_generator(response)
+        return return_generator()
     else:
-        for doc in response['docs']:
-            final_result.append(doc['_source']['embedded'])
-        return final_result
+        return [doc for docs in TaskGroup.run([functools.partial(mget, chunk)
+                                               for chunk in chunked(uuids, chunk_size=chunk_size)],
+                                              max_workers=max_workers)
+                for doc in docs]
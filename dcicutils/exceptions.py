@@ -254,6 +254,20 @@ class LegacyDispatchDisabled(Exception):
                             f" with args={call_args} kwargs={call_kwargs} mode={mode}.")
 
 
+class S3TransferVerificationError(Exception):
+
+    def __init__(self, *, bucket, key, expected, actual, part_number=None):
+        self.bucket = bucket
+        self.key = key
+        self.expected = expected
+        self.actual = actual
+        self.part_number = part_number
+        super().__init__("The ETag of {what} s3://{bucket}/{key}, {actual},"
+                         " does not match the expected ETag, {expected}."
+                         .format(what=f"part {part_number} of" if part_number else "the transferred",
+                                 bucket=bucket, key=key, actual=actual, expected=expected))
+
+
 class MultiError(Exception):
 
     def __init__(self, *errors, flatten=True):
@@ -234,6 +234,8 @@ def internal_compute_authorized_request(url, *, auth, ff_env, verb, retry_fxn, *
     Verb should be one of: GET, POST, PATCH, PUT, or DELETE
     auth should be obtained using s3Utils.get_key.
     If not provided, try to get the key using s3_utils if 'ff_env' in kwargs
+    If a rate_limiter kwarg is given (e.g. a misc_utils.TokenBucket, or a redis_utils.RedisTokenBucket
+    to share the rate with other processes), a token is acquired from it before each attempt of the request.
 
     usage:
     authorized_request('https://data.4dnucleome.org/<some path>', (authId, authSecret))
@@ -249,11 +251,15 @@ def internal_compute_authorized_request(url, *, auth, ff_env, verb, retry_fxn, *
     if 'timeout' not in kwargs:
         kwargs['timeout'] = 60  # default timeout
 
+    rate_limiter = kwargs.pop('rate_limiter', None)
+
     verb_upper = verb.upper()
     try:
         the_verb = REQUESTS_VERBS[verb_upper]
     except KeyError:
         raise ValueError(f"Provided verb {verb} is not valid. Must be one of {disjoined_list(REQUESTS_VERBS)}.")
+    if rate_limiter:
+        the_verb = rate_limiter.limited(the_verb)
     # automatically detect a search and overwrite the retry if it is standard
     if '/search/' in url and retry_fxn == standard_request_with_retries:
         retry_fxn = search_request_with_retries
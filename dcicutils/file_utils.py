@@ -1,17 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
 import glob
 import hashlib
 import io
+import json
+import mmap
 import os
 import pathlib
 from datetime import datetime
 import random
+import stat
 import string
-from tempfile import gettempdir as get_temporary_directory
+from tempfile import gettempdir as get_temporary_directory, NamedTemporaryFile
+import threading
 from typing import List, Optional, Union
 from uuid import uuid4 as uuid
 
 HOME_DIRECTORY = str(pathlib.Path().home())
 
+# Files of at least this size get a multipart style S3 ETag, for parts of this chunk size; as per (the defaults of)
+# boto3 and the AWS CLI, and thus as per our compute_file_etag, and the s3Utils.s3_upload_file which matches it.
+S3_ETAG_MULTIPART_THRESHOLD = 8388608
+S3_ETAG_MULTIPART_CHUNK_SIZE = 8388608
+
 
 def search_for_file(file: str,
                     location: Union[str, pathlib.PosixPath, Optional[List[Union[str, pathlib.PosixPath]]]] = None,
@@ -156,43 +166,196 @@ def are_files_equal(filea: str, fileb: str, raise_exception: bool = True) -> boo
         return False
 
 
-def compute_file_md5(file: str, raise_exception: bool = True) -> str:
+def compute_file_md5(file: str, raise_exception: bool = True, cache: Optional["FileDigestCache"] = None) -> str:
     """
-    Returns the md5 checksum for the given file.
+    Returns the md5 checksum for the given file. See compute_file_digests (e.g. for the cache argument).
     """
     if not isinstance(file, str):
         return ""
     try:
-        md5 = hashlib.md5()
-        with open(file, "rb") as file:
-            for chunk in iter(lambda: file.read(4096), b""):
-                md5.update(chunk)
-        return md5.hexdigest()
+        return compute_file_digests(file, etag=False, cache=cache)["md5"]
     except Exception:
         if raise_exception is True:
             raise
         return ""
 
 
-def compute_file_etag(file: str, raise_exception: bool = True) -> Optional[str]:
+def compute_file_etag(file: str, raise_exception: bool = True,
+                      cache: Optional["FileDigestCache"] = None) -> Optional[str]:
     """
     Returns the AWS S3 "etag" for the given file; this value is md5-like but
     not the same as a normal md5. We use this to compare that a file in S3
     appears to be the exact the same file as a local file.
+    See compute_file_digests (e.g. for the cache argument).
     """
     try:
-        with io.open(file, "rb") as f:
-            return _compute_file_etag(f)
+        return compute_file_digests(file, md5=False, cache=cache)["etag"]
     except Exception:
         if raise_exception is True:
             raise
         return None
 
 
+def compute_file_digests(file: str, md5: bool = True, etag: bool = True, sha256: bool = False,
+                         max_workers: Optional[int] = None, cache: Optional["FileDigestCache"] = None) -> dict:
+    """
+    Returns a dictionary with the size of the given file and (each as requested) its MD5, AWS S3 "etag" (as
+    for compute_file_etag), and SHA-256 (hex) digests. These are all computed in a single pass over the (memory
+    mapped) file, a window at a time, with the (8 MiB) part digests of a multipart "etag", and the MD5 and SHA-256
+    of the whole, computed concurrently; on up to max_workers threads (by default the number of CPUs), which
+    actually run in parallel since hashlib releases the GIL while hashing.
+
+    If a cache (FileDigestCache) is given, and it has the requested digests for this file (as identified by its
+    path, size, modification time, and inode), those are returned rather than rehashing the file; otherwise any
+    newly computed digests are added to it.
+    """
+    file_stat = os.stat(file)
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise ValueError(f"Not a regular file: {file}")
+    wanted = [name for name, wanted in (("md5", md5), ("etag", etag), ("sha256", sha256)) if wanted]
+    if cache is not None:
+        digests = cache.get(file, file_stat)
+        if digests and all(digests.get(name) for name in wanted):
+            return {name: digests[name] for name in ["size"] + wanted}
+    digests = _compute_file_digests(file, file_stat.st_size, md5=md5, etag=etag, sha256=sha256,
+                                    max_workers=max_workers or os.cpu_count() or 1)
+    if cache is not None:
+        cache.put(file, digests, file_stat)
+    return digests
+
+
+def _compute_file_digests(file: str, size: int, md5: bool, etag: bool, sha256: bool, max_workers: int) -> dict:
+    multipart = etag and size >= S3_ETAG_MULTIPART_THRESHOLD
+    whole_hashers = {}
+    if md5 or (etag and not multipart):
+        whole_hashers["md5"] = hashlib.md5()
+    if sha256:
+        whole_hashers["sha256"] = hashlib.sha256()
+    part_md5s = []
+    if size > 0:
+        # Each window is hashed (concurrently) while its pages are in memory, then the next; so the file is read
+        # (from disk) only once, though each byte is hashed by more than one of the hashers.
+        window_size = S3_ETAG_MULTIPART_CHUNK_SIZE * max(max_workers, 1)
+        with io.open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as content, ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for window_start in range(0, size, window_size):
+                    window = content[window_start:window_start + window_size]
+                    futures = [executor.submit(hasher.update, window) for hasher in whole_hashers.values()]
+                    if multipart:
+                        part_futures = [executor.submit(hashlib.md5, window[start:start + S3_ETAG_MULTIPART_CHUNK_SIZE])
+                                        for start in range(0, len(window), S3_ETAG_MULTIPART_CHUNK_SIZE)]
+                        part_md5s.extend(future.result().digest() for future in part_futures)
+                    for future in futures:
+                        future.result()
+                    window.release()
+    digests = {"size": size}
+    if md5:
+        digests["md5"] = whole_hashers["md5"].hexdigest()
+    if etag:
+        digests["etag"] = compute_multipart_etag(part_md5s) if multipart else whole_hashers["md5"].hexdigest()
+    if sha256:
+        digests["sha256"] = whole_hashers["sha256"].hexdigest()
+    return digests
+
+
+class FileDigestCache:
+    """
+    A persistent cache of file digests (see compute_file_digests), by file path, size, modification time,
+    and inode; so a file is rehashed only if it has (apparently) changed. It is kept in a JSON lines file, which
+    is appended to, so it may be shared by concurrent processes; by default this is in ~/.cache/dcicutils.
+    Once most of its lines (and at least COMPACT_THRESHOLD) are superseded, i.e. for a file since changed, or
+    with just some of its digests, the file is rewritten (atomically) with one line per (current) file.
+    """
+
+    COMPACT_THRESHOLD = 1000
+
+    def __init__(self, file: Optional[str] = None) -> None:
+        self.file = file or os.path.join(HOME_DIRECTORY, ".cache", "dcicutils", "file_digests.jsonl")
+        self._digests = {}
+        self._keys = {}  # The (latest) key of each path.
+        self._nlines = 0  # How many lines have been read.
+        self._offset = 0  # How much of the file has been read.
+        self._inode = None  # Of the file read; another if it has since been rewritten (by another process).
+        self._lock = threading.Lock()
+
+    def get(self, file: str, file_stat: Optional[os.stat_result] = None) -> Optional[dict]:
+        key = self._key(file, file_stat)
+        with self._lock:
+            self._load()  # Just what was added (e.g. by another process) since last read.
+            digests = self._digests.get(key)
+            return dict(digests) if digests else None
+
+    def put(self, file: str, digests: dict, file_stat: Optional[os.stat_result] = None) -> None:
+        key = self._key(file, file_stat)
+        path, size, mtime_ns, inode = key
+        with self._lock:
+            self._load()
+            self._digests[key] = dict(self._digests.get(key) or {}, **digests)
+            os.makedirs(os.path.dirname(os.path.abspath(self.file)), exist_ok=True)
+            with io.open(self.file, "a") as f:
+                f.write(json.dumps({"path": path, "size": size, "mtime_ns": mtime_ns, "inode": inode,
+                                    **digests}) + "\n")
+
+    def _load(self) -> None:
+        if not os.path.exists(self.file):
+            return
+        with io.open(self.file, "rb") as f:
+            file_stat = os.fstat(f.fileno())
+            if file_stat.st_ino != self._inode or file_stat.st_size < self._offset:
+                # Not yet read, or since rewritten (by another process); so read it all (again).
+                self._digests, self._keys, self._nlines, self._offset = {}, {}, 0, 0
+                self._inode = file_stat.st_ino
+            f.seek(self._offset)
+            data = f.read()
+        # Only complete lines; a partial last one might still be being written.
+        data = data[:data.rfind(b"\n") + 1]
+        self._offset += len(data)
+        for line in data.decode("utf-8").splitlines():
+            self._nlines += 1
+            try:
+                record = json.loads(line)
+                key = (record.pop("path"), record.pop("size"), record.pop("mtime_ns"), record.pop("inode"))
+            except (ValueError, KeyError):
+                continue
+            if (previous_key := self._keys.get(key[0])) and previous_key != key:
+                self._digests.pop(previous_key, None)  # The file has since changed.
+            self._keys[key[0]] = key
+            self._digests[key] = dict(self._digests.get(key) or {}, size=key[1], **record)
+        if self._nlines - len(self._digests) >= max(self.COMPACT_THRESHOLD, len(self._digests)):
+            self._compact()
+
+    def _compact(self) -> None:
+        # Written to a temporary file renamed into place, so other processes never see a partial file;
+        # anything they append in the meantime is lost, which just means those files are rehashed.
+        try:
+            f = NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(self.file)),
+                                   prefix=os.path.basename(self.file), suffix=".tmp", delete=False)
+        except OSError:
+            return
+        try:
+            with f:
+                for (path, size, mtime_ns, inode), digests in self._digests.items():
+                    f.write(json.dumps({"path": path, "size": size, "mtime_ns": mtime_ns, "inode": inode,
+                                        **{name: value for name, value in digests.items() if name != "size"}}) + "\n")
+                f.flush()
+                offset, inode = os.fstat(f.fileno()).st_size, os.fstat(f.fileno()).st_ino
+            os.replace(f.name, self.file)
+        except OSError:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+            return
+        self._nlines, self._offset, self._inode = len(self._digests), offset, inode
+
+    @staticmethod
+    def _key(file: str, file_stat: Optional[os.stat_result] = None) -> tuple:
+        file_stat = file_stat or os.stat(file)
+        return (os.path.realpath(file), file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+
 def _compute_file_etag(f: io.BufferedReader) -> str:
     # See: https://stackoverflow.com/questions/75723647/calculate-md5-from-aws-s3-etag
-    MULTIPART_THRESHOLD = 8388608
-    MULTIPART_CHUNKSIZE = 8388608
+    MULTIPART_THRESHOLD = S3_ETAG_MULTIPART_THRESHOLD
+    MULTIPART_CHUNKSIZE = S3_ETAG_MULTIPART_CHUNK_SIZE
     # BUFFER_SIZE = 1048576
     # Verify some assumptions are correct
     # assert(MULTIPART_CHUNKSIZE >= MULTIPART_THRESHOLD)
@@ -230,6 +393,13 @@ def _compute_file_etag(f: io.BufferedReader) -> str:
     return etag
 
 
+def compute_multipart_etag(part_md5s: List[bytes]) -> str:
+    """
+    Returns the AWS S3 "etag" for a multipart upload of parts with the given (binary) MD5 digests.
+    """
+    return hashlib.md5(b"".join(part_md5s)).hexdigest() + "-" + str(len(part_md5s))
+
+
 def create_random_file(file: Optional[str] = None, prefix: Optional[str] = None, suffix: Optional[str] = None,
                        nbytes: int = 1024, binary: bool = False, line_length: Optional[int] = None) -> str:
     """
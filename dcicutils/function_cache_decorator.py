@@ -1,14 +1,30 @@
+import asyncio
 from collections import namedtuple, OrderedDict
+import contextlib
 from datetime import datetime, timedelta
+import hashlib
+import inspect
+import io
+import os
+import shutil
+import threading
+from threading import Event, RLock, Thread
+import time
 import timeit
-from typing import Optional, Union
+from typing import Any, Callable, Coroutine, Optional, Tuple, Union
 import json
 import sys
+from dcicutils.redis_utils import RedisBase
 
 
 # Global list of all @function_decorator instances; for debugging/testing/troubleshooting.
 _function_cache_list = []
 
+# Global set of the (async) background refresh tasks in progress; the event loop keeps only weak references
+# to its tasks, so without these references a task could be garbage collected before it finishes, leaving
+# its cache key in flight forever (so never refreshed, and with callers waiting on it forever).
+_background_tasks = set()
+
 
 def function_cache(*decorator_args, **decorator_kwargs):
     """
@@ -39,16 +55,47 @@ def function_cache(*decorator_args, **decorator_kwargs):
     computes the key by which the function results should be cached; this lambda
     is passed the exact same arguments as the function itself.
 
-    Lastly, if the nokey kwarg is specified for the decorator then no key at all
+    If the nokey kwarg is specified for the decorator then no key at all
     will used (or more precisely, and single/constant key will be used) by which
     to cache the function result.
 
+    The cache is safe to use from multiple threads, and if several threads miss on the same key
+    at once, only one of them calls the function, and the others wait for (and return) its value
+    (or its exception); these count as hits.
+
+    A stale_while_revalidate decorator kwarg, as True or as a timedelta, may be
+    specified along with ttl (or ttl_none); then a stale cached value (no staler than that
+    timedelta beyond the ttl, if given as a timedelta) is returned immediately, while the
+    function is called in a background thread to refresh it.
+
+    Lastly, a backend decorator kwarg may be specified as a FunctionCacheBackend, i.e. a
+    RedisFunctionCacheBackend or DiskFunctionCacheBackend, to share cached values between
+    processes; on a miss in the (in-process) cache, a (non-stale) value from the backend is
+    used, if any, rather than calling the function, and values are stored in the backend
+    (expiring natively per any ttl). Note that cache_clear does not clear the backend.
+
+    Besides maxsize, a max_bytes decorator kwarg may be specified to bound the approximate total
+    size of the cached values (per approximate_sizeof, or a given sizeof kwarg callable); least
+    recently used values are evicted as needed. Values which have expired (per ttl or ttl_none)
+    are periodically swept from the cache. And the cache_entries function on the decorated
+    function returns timing (and hit and size) info for each cached value.
+
+    An async (def) function may also be decorated, with the same semantics; concurrent calls of
+    it (in the same event loop) for the same key await the same call of the function.
+
     Looked/tried and could not find an way to do this using @lru_cache;
     and also had issues trying to wrap @lru_cache with this functionality.
     First created (April 2023) to try simplify some of the caching in foursight-core APIs.
     """
     cache = OrderedDict()
     nhits = nmisses = 0
+    nbytes = nevictions = nexpired = 0
+    saved = 0.0
+    last_sweep = None
+    lock = RLock()
+    # The _FunctionCacheFlight (or for an async function, asyncio.Future) for each key for which the wrapped
+    # function is being called.
+    inflight = {}
 
     if len(decorator_args) == 1 and callable(decorator_args[0]) and decorator_args[0].__name__ != "<lambda>":
         decorator_invoked_without_args = True
@@ -66,6 +113,10 @@ def function_cache(*decorator_args, **decorator_kwargs):
     key = None
     serialize_key = False
     nokey = False
+    stale_while_revalidate = None
+    backend = None
+    max_bytes = None
+    sizeof = approximate_sizeof
 
     if decorator_args:
         maxsize_arg = decorator_args[0]
@@ -96,58 +147,241 @@ def function_cache(*decorator_args, **decorator_kwargs):
         nokey_kwarg = decorator_kwargs.get("nokey")
         if isinstance(nokey_kwarg, bool):
             nokey = nokey_kwarg
+        stale_while_revalidate_kwarg = decorator_kwargs.get("stale_while_revalidate")
+        if stale_while_revalidate_kwarg is True or isinstance(stale_while_revalidate_kwarg, timedelta):
+            stale_while_revalidate = stale_while_revalidate_kwarg
+        backend_kwarg = decorator_kwargs.get("backend")
+        if isinstance(backend_kwarg, FunctionCacheBackend):
+            backend = backend_kwarg
+        max_bytes_kwarg = decorator_kwargs.get("max_bytes")
+        if isinstance(max_bytes_kwarg, int) and max_bytes_kwarg > 0:
+            max_bytes = max_bytes_kwarg
+        sizeof_kwarg = decorator_kwargs.get("sizeof")
+        if callable(sizeof_kwarg):
+            sizeof = sizeof_kwarg
 
     def function_cache_decorator(wrapped_function):
 
-        def function_wrapper(*args, **kwargs):
+        function_name = _get_function_name(wrapped_function)
 
-            if nokey:
-                cache_key = 0
-            else:
-                cache_key = key(*args, **kwargs) if key else args + tuple(sorted(kwargs.items()))
-                if serialize_key:
-                    cache_key = json.dumps(cache_key, default=str, separators=(",", ":"))
-            cached = cache.get(cache_key, None)
-
-            now = None  # Do not call datetime.now more than once
-
-            if cached is not None:
-
-                if ttl or ttl_none:
-                    now = datetime.now()
-
-                def is_stale():
-                    """
-                    Returns True iff the cached value for the @function_cache decorated
-                    function is stale, according to any ttl related decorator kwargs.
-                    Uses outer variables: ttl, ttl_none, cached, now
-                    """
-                    if ttl and now > cached["timestamp"] + ttl:
-                        return True
-                    if ttl_none and cached["value"] is None and now > cached["timestamp"] + ttl_none:
-                        return True
-                    return False
-
-                if not is_stale():
-                    nonlocal nhits
+        def get_stale_since(cached, now):
+            """
+            Returns the time since which the given cached value is stale according to
+            any ttl related decorator kwargs, or None if it is not stale.
+            """
+            if ttl and now > cached["timestamp"] + ttl:
+                return cached["timestamp"] + ttl
+            if ttl_none and cached["value"] is None and now > cached["timestamp"] + ttl_none:
+                return cached["timestamp"] + ttl_none
+            return None
+
+        def is_servable_while_stale(stale_since, now):
+            return stale_while_revalidate is True or (stale_while_revalidate and
+                                                      now <= stale_since + stale_while_revalidate)
+
+        def backend_ttl(value):
+            """
+            Returns how long the backend should keep the given value, i.e. until it is stale
+            and (for stale_while_revalidate) too stale to return, or None for indefinitely.
+            """
+            ttls = [entry_ttl for entry_ttl in (ttl, ttl_none if value is None else None) if entry_ttl]
+            if not ttls or stale_while_revalidate is True:
+                return None
+            return min(ttls) + (stale_while_revalidate or timedelta(0))
+
+        def remove_locally(cache_key):
+            nonlocal nbytes
+            nbytes -= cache.pop(cache_key)["nbytes"]
+
+        def sweep_expired(now):
+            """
+            Removes all entries which are stale (and too stale to return, for stale_while_revalidate); to amortize
+            the cost of this, it is done (on any call) at most once per the shortest of ttl and ttl_none.
+            Must be called with the lock held.
+            """
+            nonlocal last_sweep, nexpired
+            if last_sweep and now < last_sweep + min(entry_ttl for entry_ttl in (ttl, ttl_none) if entry_ttl):
+                return
+            last_sweep = now
+            for cache_key, cached in list(cache.items()):
+                if (stale_since := get_stale_since(cached, now)) and not is_servable_while_stale(stale_since, now):
+                    remove_locally(cache_key)
+                    nexpired += 1
+
+        def cache_locally(cache_key, cached):
+            """
+            Caches the given entry, evicting least recently used entries as needed to stay within maxsize and
+            max_bytes; an entry too large ever to fit in max_bytes is not cached.
+            """
+            nonlocal nbytes, nevictions
+            cached = dict(cached, hits=0, nbytes=sizeof(cached["value"]) if max_bytes else 0)
+            with lock:
+                if cache_key in cache:
+                    remove_locally(cache_key)
+                if max_bytes and cached["nbytes"] > max_bytes:
+                    return
+                while cache and (len(cache) >= maxsize or (max_bytes and nbytes + cached["nbytes"] > max_bytes)):
+                    remove_locally(next(iter(cache)))
+                    nevictions += 1
+                cache[cache_key] = cached
+                nbytes += cached["nbytes"]
+
+        def lookup(cache_key, new_flight):
+            """
+            Looks up the given key in the cache, returning one of these, with the given (value or) flight:
+            - ("hit", value) if it has a (fresh) value;
+            - ("refresh", (value, flight)) if it has a stale value to return, but which the caller must refresh,
+              as the leader of the (new) flight for it (for stale_while_revalidate);
+            - ("wait", flight) if the caller must wait for the value from the flight already in progress for it;
+            - ("lead", flight) if the caller must get the value, as the leader of the (new) flight for it.
+            """
+            nonlocal nhits, nmisses, saved
+            with lock:
+                now = datetime.now() if ttl or ttl_none else None
+                if now:
+                    sweep_expired(now)
+                cached = cache.get(cache_key, None)
+                if cached is not None:
+                    stale_since = get_stale_since(cached, now) if now else None
+                    if not stale_since or is_servable_while_stale(stale_since, now):
+                        nhits += 1
+                        saved += cached["duration"]
+                        cached["hits"] += 1
+                        cache.move_to_end(cache_key)
+                        if not stale_since or cache_key in inflight:
+                            return "hit", cached["value"]
+                        # Return the stale value now, and refresh it in the background.
+                        nmisses += 1
+                        inflight[cache_key] = flight = new_flight()
+                        return "refresh", (cached["value"], flight)
+                # Single-flight: only one caller at a time gets the value for a key;
+                # any others wait for (and count as hits on) its value.
+                if (flight := inflight.get(cache_key)) is not None:
                     nhits += 1
-                    cache.move_to_end(cache_key)
-                    return cached["value"]
+                    return "wait", flight
+                nmisses += 1
+                inflight[cache_key] = flight = new_flight()
+                return "lead", flight
 
-            nonlocal nmisses
-            nmisses += 1
-            start_time = timeit.default_timer()
-            value = wrapped_function(*args, **kwargs)
-            duration = timeit.default_timer() - start_time
+        def get_backend_entry(cache_key):
+            """
+            Returns the (non-stale) value from the backend for the given key, caching it locally, if any,
+            or else the null_object.
+            """
+            cached = backend.get_entry(function_name, cache_key)
+            if cached is not None and not get_stale_since(cached, datetime.now()):
+                cache_locally(cache_key, cached)
+                return cached["value"]
+            return null_object
 
+        def cache_value(cache_key, value, duration):
             if nocache is null_object or nocache != value:
-                if len(cache) >= maxsize:
-                    cache.popitem(last=False)
-                if not now:
-                    now = datetime.now()
-                cache[cache_key] = {"value": value, "timestamp": now, "duration": duration}
+                cached = {"value": value, "timestamp": datetime.now(), "duration": duration}
+                cache_locally(cache_key, cached)
+                if backend:
+                    backend.set_entry(function_name, cache_key, cached, ttl=backend_ttl(value))
 
-            return value
+        def end_flight(cache_key):
+            with lock:
+                del inflight[cache_key]
+
+        def call_wrapped_function(cache_key, flight, args, kwargs):
+            """
+            Calls the wrapped function and caches its value (per nocache), as the leader of the given flight,
+            on behalf of any other callers waiting for it; returns the value or raises its exception.
+            If there is a backend, its value, if any and not stale, is used rather than calling the function.
+            """
+            try:
+                if not backend or (value := get_backend_entry(cache_key)) is null_object:
+                    start_time = timeit.default_timer()
+                    value = wrapped_function(*args, **kwargs)
+                    cache_value(cache_key, value, timeit.default_timer() - start_time)
+                flight.value = value
+                return value
+            except BaseException as e:
+                flight.exception = e
+                raise
+            finally:
+                end_flight(cache_key)
+                flight.done.set()
+
+        def function_wrapper(*args, **kwargs):
+            cache_key = get_cache_key(args, kwargs)
+            state, result = lookup(cache_key, _FunctionCacheFlight)
+            if state == "hit":
+                return result
+            if state == "refresh":
+                value, flight = result
+                Thread(target=_ignore_exception(call_wrapped_function),
+                       args=(cache_key, flight, args, kwargs), daemon=True).start()
+                return value
+            if state == "lead":
+                return call_wrapped_function(cache_key, result, args, kwargs)
+            result.done.wait()
+            if result.exception is not None:
+                raise result.exception
+            return result.value
+
+        async def call_wrapped_coroutine_function(cache_key, flight, args, kwargs):
+            """
+            Like call_wrapped_function, but for an async wrapped function; the flight is an asyncio.Future.
+            """
+            try:
+                loop = asyncio.get_running_loop()
+                if not backend or (value := await loop.run_in_executor(
+                        None, get_backend_entry, cache_key)) is null_object:
+                    start_time = timeit.default_timer()
+                    value = await wrapped_function(*args, **kwargs)
+                    if backend:
+                        await loop.run_in_executor(None, cache_value, cache_key, value,
+                                                   timeit.default_timer() - start_time)
+                    else:
+                        cache_value(cache_key, value, timeit.default_timer() - start_time)
+                flight.set_result(value)
+                return value
+            except BaseException as e:
+                if isinstance(e, asyncio.CancelledError):
+                    flight.cancel()
+                else:
+                    flight.set_exception(e)
+                    flight.exception()  # Retrieved, so not logged, if there are no callers waiting for it.
+                raise
+            finally:
+                end_flight(cache_key)
+
+        async def coroutine_function_wrapper(*args, **kwargs):
+            cache_key = get_cache_key(args, kwargs)
+            loop = asyncio.get_running_loop()
+            state, result = lookup(cache_key, loop.create_future)
+            if state == "hit":
+                return result
+            if state == "refresh":
+                value, flight = result
+                task = loop.create_task(_ignore_coroutine_exception(call_wrapped_coroutine_function(cache_key, flight,
+                                                                                                    args, kwargs)))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+                return value
+            if state == "lead":
+                return await call_wrapped_coroutine_function(cache_key, result, args, kwargs)
+            if result.get_loop() is not loop:
+                # The flight is in another event loop (thread), which cannot be awaited from this one.
+                return await wrapped_function(*args, **kwargs)
+            try:
+                return await asyncio.shield(result)
+            except asyncio.CancelledError:
+                if not result.cancelled():
+                    raise
+            # The leader was cancelled (rather than this caller); so try again (probably as the leader).
+            return await coroutine_function_wrapper(*args, **kwargs)
+
+        def get_cache_key(args, kwargs):
+            if nokey:
+                return 0
+            cache_key = key(*args, **kwargs) if key else args + tuple(sorted(kwargs.items()))
+            if serialize_key:
+                cache_key = json.dumps(cache_key, default=str, separators=(",", ":"))
+            return cache_key
 
         def cache_info(as_dict: bool = False) -> Union[namedtuple, dict]:
             """
@@ -157,30 +391,56 @@ def function_cache(*decorator_args, **decorator_kwargs):
             cache_info = namedtuple("cache_info",
                                     ["hits", "misses", "size", "maxsize", "ttl", "ttl_none",
                                      "nocache_none", "nocache_other",
-                                     "key", "serialize_key", "updated", "duration", "name"])
-            if len(cache) > 0:
-                cached = next(iter(cache.items()))[1]
-                # This is the timstamp of the most recent call to the wrapped function.
-                updated = cached["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
-                # This is the duration in milliseconds of the most recent call to the wrapped function.
-                duration = cached["duration"] * 1000
-            else:
-                updated = None
-                duration = None
-            info = cache_info(nhits, nmisses, len(cache), maxsize, ttl, ttl_none,
+                                     "key", "serialize_key", "updated", "duration", "name",
+                                     "backend", "backend_hits", "backend_misses",
+                                     "bytes", "max_bytes", "evictions", "expired", "saved"])
+            # These are the hits/misses on the backend by all processes (for this function), if shared.
+            backend_hits, backend_misses = backend.stats(function_name) if backend else (None, None)
+            with lock:
+                if len(cache) > 0:
+                    cached = next(iter(cache.items()))[1]
+                    # This is the timstamp of the most recent call to the wrapped function.
+                    updated = cached["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
+                    # This is the duration in milliseconds of the most recent call to the wrapped function.
+                    duration = cached["duration"] * 1000
+                else:
+                    updated = None
+                    duration = None
+                hits, misses, size = nhits, nmisses, len(cache)
+                # The saved is the time in milliseconds saved by hits (i.e. the sum of the durations of their calls).
+                bytes_info = (nbytes if max_bytes else None, max_bytes, nevictions, nexpired, saved * 1000)
+            info = cache_info(hits, misses, size, maxsize, ttl, ttl_none,
                               nocache is None, nocache is not None and nocache is not null_object,
-                              key, serialize_key, updated, duration, _get_function_name(wrapped_function))
+                              key, serialize_key, updated, duration, function_name,
+                              str(backend) if backend else None, backend_hits, backend_misses, *bytes_info)
             return dict(info._asdict()) if as_dict else info
 
+        def cache_entries() -> list:
+            """
+            Returns a list of dictionaries with info about each entry in the function cache for the
+            @function_cache decorated function, from least to most recently used: its key, when it
+            was cached, the duration in milliseconds of the call which got it, its hits, and its
+            (approximate) size in bytes (if max_bytes is specified).
+            """
+            with lock:
+                return [{"key": cache_key, "timestamp": cached["timestamp"], "duration": cached["duration"] * 1000,
+                         "hits": cached["hits"], "bytes": cached["nbytes"] if max_bytes else None}
+                        for cache_key, cached in cache.items()]
+
         def cache_clear() -> None:
             """
             Clears the cache for the @function_cache decorated function.
             """
-            nonlocal nhits, nmisses
-            nhits = nmisses = 0
-            cache.clear()
-
+            nonlocal nhits, nmisses, nbytes, nevictions, nexpired, saved
+            with lock:
+                nhits = nmisses = nbytes = nevictions = nexpired = 0
+                saved = 0.0
+                cache.clear()
+
+        if inspect.iscoroutinefunction(wrapped_function):
+            function_wrapper = coroutine_function_wrapper  # noqa: F811
         function_wrapper.cache_info = cache_info
+        function_wrapper.cache_entries = cache_entries
         function_wrapper.cache_clear = cache_clear
         _function_cache_list.append({"function_wrapper": function_wrapper, "wrapped_function": wrapped_function})
 
@@ -191,6 +451,33 @@ def function_cache(*decorator_args, **decorator_kwargs):
     return function_cache_decorator
 
 
+class _FunctionCacheFlight:
+    """
+    A call of a @function_cache decorated function's wrapped function (for some key) in progress,
+    for which other callers (for the same key) can wait.
+    """
+    def __init__(self) -> None:
+        self.done = Event()
+        self.value = None
+        self.exception = None
+
+
+def _ignore_exception(function: Callable) -> Callable:
+    def function_ignoring_exception(*args, **kwargs) -> None:
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            pass
+    return function_ignoring_exception
+
+
+async def _ignore_coroutine_exception(coroutine: Coroutine) -> None:
+    try:
+        await coroutine
+    except Exception:
+        pass
+
+
 def _get_function_name(wrapped_function: callable) -> str:
     """
     Returns a unique name for the given function/callable.
@@ -198,6 +485,167 @@ def _get_function_name(wrapped_function: callable) -> str:
     return f"{wrapped_function.__module__}.{wrapped_function.__qualname__}"
 
 
+class FunctionCacheBackend:
+    """
+    Base class for shared backends for @function_cache (see its backend kwarg), which store its cached
+    values, i.e. dicts with value, timestamp (datetime) and duration (seconds), keyed by function name
+    and cache key, under the given namespace. Values are serialized to strings by the serialize callable,
+    and back by the deserialize callable; by default JSON. Subclasses must implement _get, _set, and clear,
+    and may implement _record and stats to keep hit/miss counts shared between processes.
+    """
+    def __init__(self, namespace: str = "function_cache",
+                 serialize: Optional[Callable[[Any], str]] = None,
+                 deserialize: Optional[Callable[[str], Any]] = None) -> None:
+        self.namespace = namespace
+        self.serialize = serialize if callable(serialize) else json.dumps
+        self.deserialize = deserialize if callable(deserialize) else json.loads
+
+    def backend_key(self, function_name: str, cache_key: Any) -> str:
+        """
+        Returns the (namespaced) backend key for the given function and cache key; as the cache key
+        may be large, or have characters unsuitable for the backend, its (JSON) serialization is hashed.
+        """
+        cache_key = json.dumps(cache_key, default=str, separators=(",", ":"))
+        return f"{self.namespace}:{function_name}:{hashlib.sha256(cache_key.encode('utf-8')).hexdigest()}"
+
+    def get_entry(self, function_name: str, cache_key: Any) -> Optional[dict]:
+        """
+        Returns the cached entry for the given function and cache key, or None if there is none (or the
+        backend fails, as a shared cache is an optimization, and should not cause the function to fail).
+        """
+        try:
+            data = self._get(self.backend_key(function_name, cache_key))
+            if data is not None:
+                metadata, value = data.split("\n", 1)
+                metadata = json.loads(metadata)
+                entry = {"value": self.deserialize(value), "timestamp": datetime.fromtimestamp(metadata["timestamp"]),
+                         "duration": metadata["duration"]}
+            else:
+                entry = None
+        except Exception:
+            entry = None
+        self._record(function_name, hit=entry is not None)
+        return entry
+
+    def set_entry(self, function_name: str, cache_key: Any, entry: dict, ttl: Optional[timedelta] = None) -> None:
+        """
+        Stores the given cached entry for the given function and cache key, to expire after the given ttl.
+        """
+        try:
+            metadata = json.dumps({"timestamp": entry["timestamp"].timestamp(), "duration": entry["duration"]})
+            self._set(self.backend_key(function_name, cache_key), f"{metadata}\n{self.serialize(entry['value'])}",
+                      ttl=ttl)
+        except Exception:
+            pass
+
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError(f"{self.__class__.__name__} must implement _get.")
+
+    def _set(self, key: str, data: str, ttl: Optional[timedelta] = None) -> None:
+        raise NotImplementedError(f"{self.__class__.__name__} must implement _set.")
+
+    def clear(self) -> None:
+        """
+        Clears all entries (for all functions) in this backend's namespace.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} must implement clear.")
+
+    def _record(self, function_name: str, hit: bool) -> None:
+        pass
+
+    def stats(self, function_name: str) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Returns the hits and misses (by all processes sharing it) on this backend for the given function,
+        or None, None if these are not kept.
+        """
+        return None, None
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.namespace})"
+
+
+class RedisFunctionCacheBackend(FunctionCacheBackend):
+    """
+    Redis backend for @function_cache, using redis_utils.RedisBase; ttl is mapped to the native (Redis) key
+    expiration, and hit/miss counts (per function) are kept, for all processes, in a Redis hash.
+    """
+    def __init__(self, redis: RedisBase, namespace: str = "function_cache",
+                 serialize: Optional[Callable[[Any], str]] = None,
+                 deserialize: Optional[Callable[[str], Any]] = None) -> None:
+        super().__init__(namespace=namespace, serialize=serialize, deserialize=deserialize)
+        self.redis = redis
+
+    def _get(self, key: str) -> Optional[str]:
+        return self.redis.get(key)
+
+    def _set(self, key: str, data: str, ttl: Optional[timedelta] = None) -> None:
+        self.redis.set(key, data, exp=ttl)
+
+    def clear(self) -> None:
+        for key in self.redis.scan_keys(f"{self.namespace}:*"):
+            self.redis.delete(key)
+
+    def _stats_key(self) -> str:
+        return f"{self.namespace}::stats"
+
+    def _record(self, function_name: str, hit: bool) -> None:
+        try:
+            self.redis.hincrby(self._stats_key(), f"{function_name}:{'hits' if hit else 'misses'}", 1)
+        except Exception:
+            pass
+
+    def stats(self, function_name: str) -> Tuple[Optional[int], Optional[int]]:
+        try:
+            hits = self.redis.hget(self._stats_key(), f"{function_name}:hits")
+            misses = self.redis.hget(self._stats_key(), f"{function_name}:misses")
+            return int(hits or 0), int(misses or 0)
+        except Exception:
+            return None, None
+
+
+class DiskFunctionCacheBackend(FunctionCacheBackend):
+    """
+    Local disk backend for @function_cache, storing each entry in a file (written atomically) under
+    the given directory, by default ~/.cache/dcicutils/function_cache; shared between the processes on
+    a machine (e.g. workers, or successive command-line runs). Entries expire (per ttl) when next read.
+    """
+    def __init__(self, directory: Optional[str] = None, namespace: str = "function_cache",
+                 serialize: Optional[Callable[[Any], str]] = None,
+                 deserialize: Optional[Callable[[str], Any]] = None) -> None:
+        super().__init__(namespace=namespace, serialize=serialize, deserialize=deserialize)
+        self.directory = os.path.join(directory or os.path.expanduser("~/.cache/dcicutils/function_cache"),
+                                      namespace)
+
+    def _file(self, key: str) -> str:
+        function_name, key_hash = key.rsplit(":", 2)[1:]
+        return os.path.join(self.directory, function_name, key_hash)
+
+    def _get(self, key: str) -> Optional[str]:
+        file = self._file(key)
+        try:
+            with io.open(file, encoding="utf-8") as fp:
+                expires, data = fp.read().split("\n", 1)
+        except (FileNotFoundError, ValueError):
+            return None
+        if expires and float(expires) < time.time():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file)
+            return None
+        return data
+
+    def _set(self, key: str, data: str, ttl: Optional[timedelta] = None) -> None:
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        expires = str(time.time() + ttl.total_seconds()) if ttl else ""
+        temporary_file = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with io.open(temporary_file, "w", encoding="utf-8") as fp:
+            fp.write(f"{expires}\n{data}")
+        os.replace(temporary_file, file)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
 def function_cache_info() -> dict:
     """
     Returns a list of dictionaries representing all of the function_cache instances
@@ -230,3 +678,183 @@ def function_cache_clear(function_name: Optional[str] = None) -> int:
             if function_name:
                 break
     return ncleared
+
+
+class BoundedCache:
+    """
+    Simple thread-safe LRU cache bounded by number of entries (maxsize) and/or by the approximate total
+    size in bytes of its cached values (max_bytes); least recently used entries are evicted when either bound
+    would be exceeded. Keeps hit/miss/eviction counts; see info. The size of a value is approximated by the
+    sizeof callable if given, or otherwise by approximate_sizeof; this is only computed if max_bytes is given.
+    """
+    _MISSING = object()
+
+    def __init__(self, maxsize: Optional[int] = None, max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None) -> None:
+        self._maxsize = maxsize if isinstance(maxsize, int) and maxsize > 0 else sys.maxsize
+        self._max_bytes = max_bytes if isinstance(max_bytes, int) and max_bytes > 0 else None
+        self._sizeof = sizeof if callable(sizeof) else approximate_sizeof
+        self._cache = OrderedDict()
+        self._nbytes = 0
+        self._nhits = self._nmisses = self._nevictions = 0
+        self._lock = RLock()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            if (cached := self._cache.get(key, BoundedCache._MISSING)) is BoundedCache._MISSING:
+                self._nmisses += 1
+                return default
+            self._nhits += 1
+            self._cache.move_to_end(key)
+            return cached[0]
+
+    def put(self, key: Any, value: Any) -> None:
+        nbytes = self._sizeof(value) if self._max_bytes else 0
+        with self._lock:
+            if (cached := self._cache.pop(key, None)) is not None:
+                self._nbytes -= cached[1]
+            if self._max_bytes and nbytes > self._max_bytes:
+                return  # Too big to ever fit; do not cache (and do not evict everything else for it).
+            while self._cache and ((len(self._cache) >= self._maxsize) or
+                                   (self._max_bytes and self._nbytes + nbytes > self._max_bytes)):
+                self._nbytes -= self._cache.popitem(last=False)[1][1]
+                self._nevictions += 1
+            self._cache[key] = (value, nbytes)
+            self._nbytes += nbytes
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            if (cached := self._cache.pop(key, None)) is None:
+                return default
+            self._nbytes -= cached[1]
+            return cached[0]
+
+    def clear(self) -> None:
+        """
+        Clears this cache, and resets its statistics.
+        """
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
+            self._nhits = self._nmisses = self._nevictions = 0
+
+    def info(self, as_dict: bool = False) -> Union[namedtuple, dict]:
+        with self._lock:
+            info = _BoundedCacheInfo(self._nhits, self._nmisses, self._nevictions, len(self._cache),
+                                     self._maxsize, self._nbytes, self._max_bytes)
+        return dict(info._asdict()) if as_dict else info
+
+    def __contains__(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._cache
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._cache)
+
+
+_BoundedCacheInfo = namedtuple("cache_info", ["hits", "misses", "evictions", "size", "maxsize", "bytes", "max_bytes"])
+
+
+def approximate_sizeof(value: Any) -> int:
+    """
+    Returns the approximate (deep) size in bytes of the given value, as the sum of sys.getsizeof of it
+    and (non-recursively, for depth safety) of all of the items of any (nested) dict, list, tuple, or set.
+    """
+    nbytes = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        nbytes += sys.getsizeof(value)
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            stack.extend(value)
+    return nbytes
+
+
+class instance_cache:
+    """
+    Decorator for instance methods (or, underneath @property, instance properties) which caches results
+    per instance, in a BoundedCache stored on the instance itself (rather than, as with functools.lru_cache
+    or function_cache, in a single cache for all instances keyed by self); so cached values are released
+    along with their instance, and the maxsize (entries) and/or max_bytes bounds apply per instance.
+    The maxsize may be given as the first decorator argument or as a kwarg; default is unbounded.
+
+    Like function_cache, supports the serialize_key kwarg (for unhashable arguments), a custom key kwarg,
+    and the nocache_none kwarg. The bound method has cache_info (hits, misses, evictions, size, bytes, et cetera)
+    and cache_clear functions, for this instance only, i.e. e.g.: portal.get_schema.cache_info().hits
+    """
+    def __init__(self, *decorator_args, **decorator_kwargs) -> None:
+        if len(decorator_args) == 1 and callable(decorator_args[0]):
+            self._maxsize = None
+            self._set_wrapped_function(decorator_args[0])
+        else:
+            self._maxsize = decorator_args[0] if decorator_args else None
+            self._wrapped_function = None
+        if (maxsize := decorator_kwargs.get("maxsize")) is not None:
+            self._maxsize = maxsize
+        self._max_bytes = decorator_kwargs.get("max_bytes")
+        self._key = key if callable(key := decorator_kwargs.get("key")) else None
+        self._serialize_key = decorator_kwargs.get("serialize_key") is True
+        self._nocache_none = decorator_kwargs.get("nocache_none") is True
+
+    def _set_wrapped_function(self, wrapped_function: Callable) -> None:
+        self._wrapped_function = wrapped_function
+        self.__name__ = getattr(wrapped_function, "__name__", None)
+        self.__qualname__ = getattr(wrapped_function, "__qualname__", None)
+        self.__doc__ = getattr(wrapped_function, "__doc__", None)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        if self._wrapped_function is None:
+            # Here for decorator invoked with args, e.g. @instance_cache(maxsize=100).
+            self._set_wrapped_function(args[0])
+            return self
+        # Here for direct call with instance as first argument, e.g. via @property.
+        return self._call(args[0], *args[1:], **kwargs)
+
+    def __get__(self, instance: Any, instance_class: Optional[type] = None) -> Any:
+        if instance is None:
+            return self
+        return _InstanceCacheBoundMethod(self, instance)
+
+    def cache(self, instance: Any) -> BoundedCache:
+        """
+        Returns the cache for this decorated method for the given instance; creating it if necessary.
+        """
+        if (caches := instance.__dict__.get("_instance_caches")) is None:
+            caches = instance.__dict__.setdefault("_instance_caches", {})
+        if (cache := caches.get(self)) is None:
+            cache = caches.setdefault(self, BoundedCache(maxsize=self._maxsize, max_bytes=self._max_bytes))
+        return cache
+
+    def _call(self, instance: Any, *args, **kwargs) -> Any:
+        cache_key = self._key(instance, *args, **kwargs) if self._key else args + tuple(sorted(kwargs.items()))
+        if self._serialize_key:
+            cache_key = json.dumps(cache_key, default=str, separators=(",", ":"))
+        cache = self.cache(instance)
+        if (value := cache.get(cache_key, BoundedCache._MISSING)) is not BoundedCache._MISSING:
+            return value
+        value = self._wrapped_function(instance, *args, **kwargs)
+        if value is not None or not self._nocache_none:
+            cache.put(cache_key, value)
+        return value
+
+
+class _InstanceCacheBoundMethod:
+
+    def __init__(self, decorator: instance_cache, instance: Any) -> None:
+        self._decorator = decorator
+        self._instance = instance
+        self.__name__ = decorator.__name__
+        self.__doc__ = decorator.__doc__
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self._decorator._call(self._instance, *args, **kwargs)
+
+    def cache_info(self, as_dict: bool = False) -> Union[namedtuple, dict]:
+        return self._decorator.cache(self._instance).info(as_dict=as_dict)
+
+    def cache_clear(self) -> None:
+        self._decorator.cache(self._instance).clear()
@@ -1,13 +1,21 @@
 import boto3
+import functools
+import io
+import json
+import os
+import random
+import threading
+import time
 from typing import Union, List, Tuple
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from tqdm import tqdm
 from .common import (
     S3_GLACIER_CLASSES, S3StorageClass, MAX_MULTIPART_CHUNKS, MAX_STANDARD_COPY_SIZE,
     ENCODED_LIFECYCLE_TAG_KEY
 )
 from .command_utils import require_confirmation
-from .misc_utils import PRINT
+from .misc_utils import PRINT, ignored
+from .task_utils import TaskGroup
 from .ff_utils import get_metadata, search_metadata, get_health_page, patch_metadata
 from .creds_utils import CGAPKeyManager
 
@@ -18,6 +26,15 @@ class GlacierRestoreException(Exception):
 
 class GlacierUtils:
 
+    # Multipart copies (see _do_multipart_upload) copy up to this many parts at once, each part being about
+    # GLACIER_COPY_PART_SIZE bytes (see _choose_part_size), within the S3 limits on part size.
+    GLACIER_COPY_MAX_WORKERS = 16
+    GLACIER_COPY_PART_SIZE = 256 * 1024 * 1024
+    GLACIER_COPY_MIN_PART_SIZE = 5 * 1024 * 1024
+    GLACIER_COPY_MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+    GLACIER_COPY_RETRIES = 4
+    GLACIER_COPY_RETRY_WAIT_SECONDS = 1
+
     def __init__(self, env_name: str):
         """ Pass an env_name that exists in your ~/.cgap_keys.json or ~/.fourfront_keys.json file
             No support for admin keys!
@@ -51,6 +68,8 @@ class GlacierUtils:
                        * copy_object_back_to_original_location
                        * patch_file_lifecycle_status
                        * delete_glaciered_object_versions
+                4. Given a list of @ids, you can use a GlacierRestoreScheduler to run phases 1 and 2 together,
+                   copying each object as soon as its restore is complete.
         """
         self.s3 = boto3.client('s3')
         self.env_name = env_name
@@ -134,9 +153,7 @@ class GlacierUtils:
         file_meta = self.resolve_bucket_key_from_portal(atid, file_meta)
         for bucket, key in file_meta:
             if versioning:
-                response = self.s3.list_object_versions(Bucket=bucket, Prefix=key)
-                versions = sorted(response.get('Versions', []), key=lambda x: x['LastModified'], reverse=True)
-                version_id = versions[0]['VersionId']
+                version_id = self._latest_version_id(bucket, key)
             resp = self.restore_s3_from_glacier(bucket, key, version_id=version_id, days=days)
             if resp:
                 success.append((bucket, key))
@@ -145,13 +162,14 @@ class GlacierUtils:
         return success, fail
 
     def restore_s3_from_glacier(self, bucket: str, key: str, days: int = 7,
-                                version_id: str = None,) -> Union[dict, None]:
+                                version_id: str = None, tier: Union[str, None] = None) -> Union[dict, None]:
         """ Restores a file from glacier given the bucket, key and duration of restore
 
         :param bucket: bucket where the file is stored
         :param key: key under which the file is stored
         :param days: number of days to store in the temporary location
         :param version_id: version ID to restore if applicable
+        :param tier: restore tier (Expedited, Standard or Bulk), if not the S3 default (Standard)
         :return: response, if successful, or else None
         """
         try:
@@ -162,6 +180,8 @@ class GlacierUtils:
             }
             if version_id:
                 args['VersionId'] = version_id
+            if tier:
+                args['RestoreRequest']['GlacierJobParameters'] = {'Tier': tier}
             response = self.s3.restore_object(**args)
             PRINT(f'Object {bucket}/{key} restored from Glacier storage class and will be available in S3'
                   f' for {days} days after restore has been processed (24 hours)')
@@ -272,25 +292,66 @@ class GlacierUtils:
         """
         return '&'.join([f'{tag["Key"]}={tag["Value"]}' for tag in tags])
 
-    def _do_multipart_upload(self, bucket: str, key: str, total_size: int, part_size: int = 200,
+    @classmethod
+    def _choose_part_size(cls, total_size: int, max_workers: int) -> int:
+        """ Helper for _do_multipart_upload that chooses a part size (in bytes) for a multipart copy of an object
+            of the given size: GLACIER_COPY_PART_SIZE, except smaller if that would keep some of the max_workers
+            threads idle, and larger if that would need more than MAX_MULTIPART_CHUNKS parts, always within the
+            S3 part size limits.
+
+        :param total_size: total size of object
+        :param max_workers: number of threads that will copy the parts concurrently
+        :return: part size in bytes
+        """
+        part_size = min(cls.GLACIER_COPY_PART_SIZE, -(-total_size // max(max_workers, 1)))
+        part_size = max(part_size, -(-total_size // MAX_MULTIPART_CHUNKS), cls.GLACIER_COPY_MIN_PART_SIZE)
+        return min(part_size, cls.GLACIER_COPY_MAX_PART_SIZE)
+
+    def _upload_part_copy(self, **kwargs) -> dict:
+        """ Helper for _do_multipart_upload that copies one part, retrying up to GLACIER_COPY_RETRIES times, with
+            exponential backoff and jitter, if it fails
+
+        :param kwargs: arguments to upload_part_copy
+        :return: upload_part_copy response
+        """
+        wait_seconds = self.GLACIER_COPY_RETRY_WAIT_SECONDS
+        for retry in range(self.GLACIER_COPY_RETRIES + 1):
+            try:
+                return self.s3.upload_part_copy(**kwargs)
+            except Exception as e:
+                if retry >= self.GLACIER_COPY_RETRIES:
+                    raise
+                PRINT(f'Failed to upload part {kwargs["PartNumber"]}, retrying: {str(e)}')
+            time.sleep(wait_seconds * random.uniform(0.5, 1.5))
+            wait_seconds *= 2
+
+    def _do_multipart_upload(self, bucket: str, key: str, total_size: int, part_size: Union[int, None] = None,
                              storage_class: str = 'STANDARD', tags: str = '',
-                             version_id: Union[str, None] = None) -> Union[dict, None]:
+                             version_id: Union[str, None] = None,
+                             max_workers: Union[int, None] = None) -> Union[dict, None]:
         """ Helper function for copy_object_back_to_original_location, not intended to
             be called directly, will arrange for a multipart copy of large updates
-            to change storage class
+            to change storage class. Parts are copied concurrently, and if any part cannot
+            be copied the multipart upload is aborted, so no orphaned parts are left behind.
 
         :param bucket: bucket to copy from
         :param key: key to copy within bucket
         :param total_size: total size of object
-        :param part_size: what size to divide the object into when uploading the chunks
+        :param part_size: what size (in MB) to divide the object into when uploading the chunks,
+                          by default chosen based on the object size (see _choose_part_size)
         :param storage_class: new storage class to use
         :param tags: string of tags to apply
         :param version_id: object version ID, if applicable
+        :param max_workers: number of parts to copy at once, by default GLACIER_COPY_MAX_WORKERS
         :return: response, if successful, or else None
         """
+        max_workers = max_workers or self.GLACIER_COPY_MAX_WORKERS
         try:
-            part_size = part_size * 1024 * 1024  # convert MB to B
-            num_parts = int(total_size / part_size) + 1
+            if part_size:
+                part_size = part_size * 1024 * 1024  # convert MB to B
+            else:
+                part_size = self._choose_part_size(total_size, max_workers)
+            num_parts = max(-(-total_size // part_size), 1)
             if num_parts > MAX_MULTIPART_CHUNKS:
                 raise GlacierRestoreException(f'Must user a part_size larger than {part_size}'
                                               f' that will result in fewer than {MAX_MULTIPART_CHUNKS} chunks')
@@ -307,39 +368,40 @@ class GlacierUtils:
         except Exception as e:
             PRINT(f'Error creating multipart upload for {bucket}/{key} : {str(e)}')
             return None
-        parts = []
-        for i in range(num_parts):
-            start = i * part_size
+
+        copy_source = {'Bucket': bucket, 'Key': key}
+        copy_target = {
+            'Bucket': bucket, 'Key': key,
+        }
+        if version_id:
+            copy_source['VersionId'] = version_id
+            copy_target['CopySourceVersionId'] = version_id
+
+        def copy_part(part_number: int) -> dict:
+            start = (part_number - 1) * part_size
             end = min(start + part_size, total_size)
-            part = {
-                'PartNumber': i + 1
-            }
-            copy_source = {'Bucket': bucket, 'Key': key}
-            copy_target = {
-                'Bucket': bucket, 'Key': key,
-            }
-            if version_id:
-                copy_source['VersionId'] = version_id
-                copy_target['CopySourceVersionId'] = version_id
-
-            # retry upload a few times
-            for _ in range(3):
-                try:
-                    response = self.s3.upload_part_copy(
-                        CopySource=copy_source, **copy_target,
-                        PartNumber=i + 1,
-                        CopySourceRange=f'bytes={start}-{end-1}',
-                        UploadId=mpu_upload_id
-                    )
-                    break
-                except Exception as e:
-                    PRINT(f'Failed to upload part {i+1}, potentially retrying: {str(e)}')
-            else:
-                PRINT(f'Fatal error arranging multipart upload of {bucket}/{key},'
-                      f' see previous output')
-                return None
-            part['ETag'] = response['CopyPartResult']['ETag']
-            parts.append(part)
+            response = self._upload_part_copy(CopySource=copy_source, **copy_target,
+                                              PartNumber=part_number,
+                                              CopySourceRange=f'bytes={start}-{end-1}',
+                                              UploadId=mpu_upload_id)
+            return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+        # Not a TaskGroup, which abandons the copies in progress when one fails; they must have finished before
+        # the upload is aborted (below), or they could still be copying (or could fail noisily) afterward.
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(copy_part, part_number) for part_number in range(1, num_parts + 1)]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+        try:
+            parts = [future.result() for future in futures]  # in PartNumber order, as S3 requires
+        except Exception as e:
+            PRINT(f'Fatal error arranging multipart upload of {bucket}/{key}, aborting: {str(e)}')
+            try:
+                self.s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=mpu_upload_id)
+            except Exception as abort_error:
+                PRINT(f'Error aborting multipart upload {mpu_upload_id} of {bucket}/{key}: {str(abort_error)}')
+            return None
 
         # mark upload as completed
         # exception should be caught by caller
@@ -353,7 +415,7 @@ class GlacierUtils:
         )
 
     def copy_object_back_to_original_location(self, bucket: str, key: str, storage_class: str = 'STANDARD',
-                                              part_size: int = 200,  # MB
+                                              part_size: Union[int, None] = None,  # MB
                                               preserve_lifecycle_tag: bool = False,
                                               version_id: Union[str, None] = None) -> Union[dict, None]:
         """ Reads the temporary location from the restored object and copies it back to the original location
@@ -361,7 +423,8 @@ class GlacierUtils:
         :param bucket: bucket where object is stored
         :param key: key within bucket where object is stored
         :param storage_class: new storage class for this object
-        :param part_size: if doing a large copy, size of chunks to upload (in MB)
+        :param part_size: if doing a large copy, size of chunks to upload (in MB), by default chosen
+                          based on the object size
         :param preserve_lifecycle_tag: whether to keep existing lifecycle tag on the object
         :param version_id: version of object, if applicable
         :return: boolean whether the copy was successful
@@ -410,29 +473,92 @@ class GlacierUtils:
             PRINT(f'Error copying object {bucket}/{key} back to its original location in S3: {str(e)}')
             return None
 
+    def resolve_metadata_from_portal(self, atid_list: List[Union[dict, str]],
+                                     num_threads: int = 4) -> List[Union[dict, None]]:
+        """ Resolves the metadata for all the given @ids in one bulk step, looking up those given as
+            strings concurrently, so that the phases below need make no further portal lookups
+
+        :param atid_list: list of @ids or actual file object metadata
+        :param num_threads: number of portal lookups to make at once
+        :return: list of metadata, in the same order as atid_list, with None for any @id not found
+        """
+        def resolve(atid: Union[dict, str]) -> Union[dict, None]:
+            if isinstance(atid, dict):
+                return atid
+            try:
+                return get_metadata(atid, key=self.env_key, ff_env=self.env_name,
+                                    add_on='frame=object&datastore=database')
+            except Exception as e:
+                PRINT(f'Error resolving metadata for @id {atid}: {str(e)}')
+                return None
+
+        if not any(isinstance(atid, str) for atid in atid_list):
+            return list(atid_list)
+        with tqdm(total=len(atid_list), desc='Resolving @ids') as progress:
+            return TaskGroup.run([functools.partial(resolve, atid) for atid in atid_list], max_workers=num_threads,
+                                 fail_fast=False, progress=progress.update)
+
+    def _run_phase(self, description: str, atid_list: List[Union[dict, str]], function,
+                   num_threads: int = 4, resolve_metadata: bool = True) -> (List[str], List[str]):
+        """ Helper for the phase methods below, calls function(atid, atid_meta) -> bool for each @id
+            in atid_list, concurrently on num_threads threads, reporting progress as the calls finish
+
+        :param description: description of the phase, for progress reporting
+        :param atid_list: list of @ids or actual file object metadata
+        :param function: function of the @id and its metadata, returning whether it succeeded
+        :param num_threads: number of @ids to work on at once
+        :param resolve_metadata: whether to first resolve the metadata for all @ids (see resolve_metadata_from_portal)
+        :return: 2 tuple of success, error list of @ids, in the same order as atid_list
+        """
+        atids = [atid['@id'] if isinstance(atid, dict) else atid for atid in atid_list]
+        if resolve_metadata:
+            atid_metas = self.resolve_metadata_from_portal(atid_list, num_threads=num_threads)
+        else:
+            atid_metas = [atid if isinstance(atid, dict) else None for atid in atid_list]
+
+        def run(atid: str, atid_meta: Union[dict, None]) -> bool:
+            if resolve_metadata and atid_meta is None:
+                return False
+            try:
+                return bool(function(atid, atid_meta))
+            except Exception as e:
+                PRINT(f'Error encountered processing @id {atid}: {str(e)}')
+                return False
+
+        with tqdm(total=len(atids), desc=description) as progress:
+            results = TaskGroup.run([functools.partial(run, atid, atid_meta)
+                                     for atid, atid_meta in zip(atids, atid_metas)],
+                                    max_workers=num_threads, fail_fast=False, progress=progress.update)
+        success, errors = [], []
+        for atid, result in zip(atids, results):
+            (success if result else errors).append(atid)
+        return success, errors
+
+    def _latest_version_id(self, bucket: str, key: str) -> str:
+        """ Returns the version ID of the most recent version of the given object """
+        response = self.s3.list_object_versions(Bucket=bucket, Prefix=key)
+        versions = sorted(response.get('Versions', []), key=lambda x: x['LastModified'], reverse=True)
+        return versions[0]['VersionId']
+
     def restore_glacier_phase_one_restore(self, atid_list: List[Union[dict, str]], versioning: bool = False,
-                                          days: int = 7) -> (List[str], List[str]):
+                                          days: int = 7, num_threads: int = 4) -> (List[str], List[str]):
         """ Triggers a restore operation for all @id in the @id list, returning a list of success and
             error objects.
 
         :param atid_list: list of @ids or actual file object metadata to restore from glacier
         :param versioning: whether to consider versioning, most recent version is used
         :param days: days to store the temporary copy
+        :param num_threads: number of @ids to restore at once
         :return: 2 tuple of success, error list of @ids
         """
-        success, errors = [], []
-        for atid in atid_list:
-            if isinstance(atid, dict):
-                _atid = atid['@id']
-            else:
-                _atid = atid
-            _, current_error = self.get_portal_file_and_restore_from_glacier(_atid, file_meta=atid,
+        def restore(atid: str, atid_meta: dict) -> bool:
+            _, current_error = self.get_portal_file_and_restore_from_glacier(atid, file_meta=atid_meta,
                                                                              versioning=versioning, days=days)
             if current_error:
                 PRINT(f'Failed to restore bucket/keys: {current_error}')
-                errors.append(_atid)
-            else:  # no errors should occur
-                success.append(_atid)
+            return not current_error
+
+        success, errors = self._run_phase('Restoring', atid_list, restore, num_threads=num_threads)
         if len(errors) != 0:
             PRINT(f'Errors encountered restoring @ids: {errors}')
         else:
@@ -452,110 +578,64 @@ class GlacierUtils:
         :param num_threads: number of threads to use when parallelizing, default to 4
         :return: 2 tuple of success, error list of @ids
         """
-        success, errors = [], []
-        if parallel:
-            with ThreadPoolExecutor(max_workers=num_threads) as executor:
-                futures = []
-                for atid in atid_list:
-                    if isinstance(atid, dict):
-                        _atid = atid['@id']
-                    else:
-                        _atid = atid
-                    files_meta = self.resolve_bucket_key_from_portal(_atid, atid)
-                    version_id = None
-                    for bucket, key in files_meta:
-                        if versioning:
-                            response = self.s3.list_object_versions(Bucket=bucket, Prefix=key)
-                            versions = sorted(response.get('Versions', []), key=lambda x: x['LastModified'],
-                                              reverse=True)
-                            version_id = versions[0]['VersionId']
-                        future = executor.submit(  # noQA - TODO: PyCharm doesn't like this call for some reason
-                            self.copy_object_back_to_original_location,
-                            bucket=bucket, key=key, storage_class=storage_class, version_id=version_id)
-                        futures.append(future)
-                for future in tqdm(futures, total=len(atid_list)):
-                    res = future.result()
-                    if res:
-                        success.append(res)
-                    else:
-                        errors.append(res)
-        else:
-            for atid in atid_list:
-                if isinstance(atid, dict):
-                    _atid = atid['@id']
-                else:
-                    _atid = atid
-                files_meta = self.resolve_bucket_key_from_portal(_atid, atid)
-                accumulated_results = []
-                for bucket, key in files_meta:
-                    version_id = None
-                    if versioning:
-                        response = self.s3.list_object_versions(Bucket=bucket, Prefix=key)
-                        versions = sorted(response.get('Versions', []), key=lambda x: x['LastModified'], reverse=True)
-                        version_id = versions[0]['VersionId']
-                    resp = self.copy_object_back_to_original_location(bucket=bucket, key=key,
-                                                                      storage_class=storage_class,
-                                                                      version_id=version_id)
-                    if resp:
-                        accumulated_results.append(_atid)
-                if len(accumulated_results) == len(files_meta):  # all files for this @id were successful
-                    success.append(_atid)
-                else:
-                    errors.append(_atid)
+        def copy(atid: str, atid_meta: dict) -> bool:
+            accumulated_results = []
+            files_meta = self.resolve_bucket_key_from_portal(atid, atid_meta)
+            for bucket, key in files_meta:
+                version_id = self._latest_version_id(bucket, key) if versioning else None
+                resp = self.copy_object_back_to_original_location(bucket=bucket, key=key,
+                                                                  storage_class=storage_class,
+                                                                  version_id=version_id)
+                if resp:
+                    accumulated_results.append(atid)
+            return len(accumulated_results) == len(files_meta)  # all files for this @id were successful
+
+        success, errors = self._run_phase('Copying', atid_list, copy, num_threads=num_threads if parallel else 1)
         if len(errors) != 0:
             PRINT(f'Errors encountered copying @ids: {errors}')
         else:
             PRINT(f'Successfully triggered copy for all @ids passed {success}')
         return success, errors
 
-    def restore_glacier_phase_three_patch(self, atid_list: List[Union[str, dict]],
-                                          status: str = 'uploaded') -> (List[str], List[str]):
+    def restore_glacier_phase_three_patch(self, atid_list: List[Union[str, dict]], status: str = 'uploaded',
+                                          num_threads: int = 4) -> (List[str], List[str]):
         """ Patches out lifecycle information for @ids we've transferred back to standard
 
         :param atid_list: list of @ids or actual file metadata objects to patch info on
         :param status: top level status to replace for files
+        :param num_threads: number of @ids to patch at once
         :return: 2 tuple of success, error list of @ids
         """
-        success, errors = [], []
-        for atid in atid_list:
-            if isinstance(atid, dict):
-                atid = atid['@id']
-            try:
-                self.patch_file_lifecycle_status(atid, status=status)
-                success.append(atid)
-            except Exception as e:
-                PRINT(f'Error encountered patching @id {atid}, error: {str(e)}')
-                errors.append(atid)
-        return success, errors
+        def patch(atid: str, atid_meta: Union[dict, None]) -> bool:
+            ignored(atid_meta)
+            self.patch_file_lifecycle_status(atid, status=status)
+            return True
 
-    def restore_glacier_phase_four_cleanup(self, atid_list: List[str],
-                                           delete_all_versions: bool = False) -> (List[str], List[str]):
+        return self._run_phase('Patching', atid_list, patch, num_threads=num_threads, resolve_metadata=False)
+
+    def restore_glacier_phase_four_cleanup(self, atid_list: List[str], delete_all_versions: bool = False,
+                                           num_threads: int = 4) -> (List[str], List[str]):
         """ Triggers delete requests for all @ids for the glacierized objects, since they are in standard
 
         :param atid_list: list of @ids or actual file metadata objects to delete from glacier
         :param delete_all_versions: bool whether to clear all glacier versions
+        :param num_threads: number of @ids to clean up at once
         :return: 2 tuple of success, error list of @ids
         """
-        success, errors = [], []
-        for atid in atid_list:
-            if isinstance(atid, dict):
-                _atid = atid['@id']
-            else:
-                _atid = atid
-            bucket_key_pairs = self.resolve_bucket_key_from_portal(_atid, atid)
+        def cleanup(atid: str, atid_meta: dict) -> bool:
+            bucket_key_pairs = self.resolve_bucket_key_from_portal(atid, atid_meta)
             accumulated_results = []
             for bucket, key in bucket_key_pairs:
                 if self.non_glacier_versions_exist(bucket, key):
                     resp = self.delete_glaciered_object_versions(bucket, key, delete_all_versions=delete_all_versions)
                     if resp:
-                        accumulated_results.append(_atid)
+                        accumulated_results.append(atid)
                 else:
                     PRINT(f'Error cleaning up {bucket}/{key}, no non-glaciered versions'
-                          f' exist, ignoring this file and erroring on @id {_atid}')
-            if len(accumulated_results) == len(bucket_key_pairs):
-                success.append(_atid)
-            else:
-                errors.append(_atid)
+                          f' exist, ignoring this file and erroring on @id {atid}')
+            return len(accumulated_results) == len(bucket_key_pairs)
+
+        success, errors = self._run_phase('Cleaning up', atid_list, cleanup, num_threads=num_threads)
         if len(errors) != 0:
             PRINT(f'Errors encountered deleting glaciered @ids: {errors}')
         else:
@@ -579,7 +659,7 @@ class GlacierUtils:
         :param storage_class: new storage class for copy
         :param versioning: whether versioning should be taken into consideration - most recent version is used
         :param parallel: whether to use the parallel copy
-        :param num_threads: number of threads to use if parallel is active
+        :param num_threads: number of threads to use in phases 1, 3 and 4, and in phase 2 if parallel is active
         :param delete_all_versions: if deleting, whether to clear ALL glacier versions
         :param phase: which phase of the glacier restore to run, one of [1, 2, 3, 4]
         :return: 2-tuple of successful, failed @ids extracted from search
@@ -635,14 +715,225 @@ class GlacierUtils:
             )
             if phase == 1:
                 return self.restore_glacier_phase_one_restore(atid_list=search_results, versioning=versioning,
-                                                              days=restore_length)
+                                                              days=restore_length, num_threads=num_threads)
             elif phase == 2:
                 return self.restore_glacier_phase_two_copy(atid_list=search_results, versioning=versioning,
                                                            parallel=parallel, storage_class=storage_class,
                                                            num_threads=num_threads)
             elif phase == 3:
                 return self.restore_glacier_phase_three_patch(atid_list=search_results,
-                                                              status=new_status)
+                                                              status=new_status, num_threads=num_threads)
             else:  # phase == 4
                 return self.restore_glacier_phase_four_cleanup(atid_list=search_results,
-                                                               delete_all_versions=delete_all_versions)
+                                                               delete_all_versions=delete_all_versions,
+                                                               num_threads=num_threads)
+
+
+class GlacierRestoreScheduler:
+    """ Runs phases 1 and 2 of a glacier restore (see GlacierUtils) as a pipeline: tracks the pending
+        restores, polling them in batches at intervals adapted to their restore tier and how long they
+        have been pending, and copies each object back to its original location as soon as its restore
+        is complete, rather than waiting for the whole batch.
+
+        If given a state_file, the state of the pipeline is saved there as it progresses, so that a run
+        that crashes or times out can be resumed by a new scheduler given the same state_file.
+
+            scheduler = GlacierRestoreScheduler(GlacierUtils(env_name), state_file='restore-state.json')
+            scheduler.request_restores(atid_list, tier='Bulk')
+            success, errors = scheduler.run()
+    """
+
+    # Each object is in one of these states.
+    RESTORING = 'restoring'
+    COPYING = 'copying'
+    COPIED = 'copied'
+    FAILED = 'failed'
+
+    # How long (earliest, latest), in seconds, a restore takes, by tier and then storage class,
+    # per https://docs.aws.amazon.com/AmazonS3/latest/userguide/restoring-objects-retrieval-options.html
+    RESTORE_TIER_SECONDS = {
+        'Expedited': {'GLACIER': (60, 5 * 60)},
+        'Standard': {'GLACIER': (3 * 3600, 5 * 3600), 'DEEP_ARCHIVE': (12 * 3600, 12 * 3600)},
+        'Bulk': {'GLACIER': (5 * 3600, 12 * 3600), 'DEEP_ARCHIVE': (12 * 3600, 48 * 3600)},
+    }
+    POLLS_PER_RESTORE_WINDOW = 6
+    MIN_POLL_SECONDS = 30
+    MAX_POLL_SECONDS = 3600
+    POLL_BATCH_SIZE = 100
+
+    def __init__(self, glacier_utils: GlacierUtils, state_file: Union[str, None] = None,
+                 storage_class: S3StorageClass = 'STANDARD', num_threads: int = 4):
+        """ Creates a scheduler, resuming the pipeline saved in state_file, if it exists
+
+        :param glacier_utils: GlacierUtils to use for the S3 and portal operations
+        :param state_file: file in which to save the state of the pipeline, if any
+        :param storage_class: storage class into which to copy the restored objects
+        :param num_threads: number of objects to poll or copy at once
+        """
+        self.glacier_utils = glacier_utils
+        self.state_file = state_file
+        self.storage_class = storage_class
+        self.num_threads = num_threads
+        self.objects = {}  # bucket/key -> {bucket, key, version_id, tier, requested, storage_class, next_poll, state}
+        self.atids = {}  # @id -> list of bucket/key, or [] if its restore could not be requested
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        if state_file and os.path.exists(state_file):
+            with io.open(state_file) as fp:
+                state = json.load(fp)
+            self.objects, self.atids = state['objects'], state['atids']
+            for obj in self.objects.values():
+                if obj['state'] == self.COPYING:  # the copy was interrupted, so must be redone
+                    obj['state'] = self.RESTORING
+                    obj['next_poll'] = 0
+
+    def _save_state(self) -> None:
+        """ Saves the state of the pipeline (atomically) to the state_file, if any """
+        if self.state_file:
+            with self._save_lock:
+                with self._lock:
+                    state = json.dumps({'objects': self.objects, 'atids': self.atids})
+                with io.open(self.state_file + '.tmp', 'w') as fp:
+                    fp.write(state)
+                os.replace(self.state_file + '.tmp', self.state_file)
+
+    def request_restores(self, atid_list: List[Union[dict, str]], versioning: bool = False, days: int = 7,
+                         tier: str = 'Standard') -> (List[str], List[str]):
+        """ Requests restores (phase 1) for all the given @ids, other than those already in the pipeline,
+            which will be scheduled to be polled and copied by run
+
+        :param atid_list: list of @ids or actual file object metadata to restore from glacier
+        :param versioning: whether to consider versioning, most recent version is used
+        :param days: days to store the temporary copy
+        :param tier: restore tier, one of Expedited, Standard or Bulk
+        :return: 2 tuple of success, error list of @ids
+        """
+        gu = self.glacier_utils
+        atid_list = [atid for atid in atid_list if (atid['@id'] if isinstance(atid, dict) else atid) not in self.atids]
+        requested = {}  # @id -> objects whose restores were requested
+
+        def restore(atid: str, atid_meta: dict) -> bool:
+            objects = []
+            for bucket, key in gu.resolve_bucket_key_from_portal(atid, atid_meta):
+                version_id = gu._latest_version_id(bucket, key) if versioning else None
+                if not gu.restore_s3_from_glacier(bucket, key, days=days, version_id=version_id, tier=tier):
+                    return False
+                obj = {'bucket': bucket, 'key': key, 'version_id': version_id, 'tier': tier,
+                       'requested': time.time(), 'storage_class': None, 'state': self.RESTORING}
+                obj['next_poll'] = obj['requested'] + self._next_poll_seconds(obj, 0)
+                objects.append(obj)
+            requested[atid] = objects
+            return True
+
+        success, errors = gu._run_phase('Restoring', atid_list, restore, num_threads=self.num_threads)
+        with self._lock:
+            for atid in [atid['@id'] if isinstance(atid, dict) else atid for atid in atid_list]:
+                objects = requested.get(atid, [])
+                for obj in objects:
+                    self.objects[f'{obj["bucket"]}/{obj["key"]}'] = obj
+                self.atids[atid] = [f'{obj["bucket"]}/{obj["key"]}' for obj in objects]
+        self._save_state()
+        return success, errors
+
+    def _next_poll_seconds(self, obj: dict, elapsed: float) -> float:
+        """ Returns how long to wait before polling the given object, whose restore was requested elapsed
+            seconds ago: until the earliest it could finish, then POLLS_PER_RESTORE_WINDOW times until the
+            latest it should finish, then backing off (up to MAX_POLL_SECONDS) the longer it is overdue.
+        """
+        windows = self.RESTORE_TIER_SECONDS.get(obj['tier'], self.RESTORE_TIER_SECONDS['Standard'])
+        earliest, latest = windows.get(obj['storage_class'] or 'GLACIER', windows['GLACIER'])
+        if elapsed < earliest:
+            return earliest - elapsed
+        interval = (max(elapsed, latest) - earliest) / self.POLLS_PER_RESTORE_WINDOW
+        return min(max(interval, self.MIN_POLL_SECONDS), self.MAX_POLL_SECONDS)
+
+    def _poll(self, obj: dict) -> Union[bool, None]:
+        """ Returns whether the restore of the given object is complete, or None if it has failed """
+        args = {'Bucket': obj['bucket'], 'Key': obj['key']}
+        if obj['version_id']:
+            args['VersionId'] = obj['version_id']
+        try:
+            response = self.glacier_utils.s3.head_object(**args)
+        except Exception as e:
+            PRINT(f'Error checking restore status of object {obj["bucket"]}/{obj["key"]} in S3: {str(e)}')
+            return False  # probably transient, so poll again later
+        obj['storage_class'] = response.get('StorageClass')
+        restore = response.get('Restore')
+        if restore is None:
+            if GlacierUtils.is_glacier_storage_class(obj['storage_class']):
+                PRINT(f'Object {obj["bucket"]}/{obj["key"]} is not being restored from Glacier')
+                return None
+            return True  # not (or no longer) glacierized, so can be copied as is
+        return 'ongoing-request="false"' in restore
+
+    def _copy(self, obj: dict) -> None:
+        """ Copies the given (restored) object back to its original location (phase 2) """
+        response = self.glacier_utils.copy_object_back_to_original_location(
+            bucket=obj['bucket'], key=obj['key'], storage_class=self.storage_class, version_id=obj['version_id'])
+        with self._lock:
+            obj['state'] = self.COPIED if response else self.FAILED
+        self._save_state()
+
+    def run(self, timeout: Union[float, None] = None) -> (List[str], List[str]):
+        """ Polls the pending restores, copying each object as soon as its restore is complete, until all
+            objects have been copied (or have failed), or until timeout seconds have passed
+
+        :param timeout: how long to run for, in seconds, if not until all objects are done
+        :return: 2 tuple of success, error list of @ids, those not yet done being in neither
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        copies = set()
+        with ThreadPoolExecutor(max_workers=self.num_threads) as poll_executor:
+            with ThreadPoolExecutor(max_workers=self.num_threads) as copy_executor:
+                with tqdm(total=len(self.objects), desc='Restoring and copying') as progress:
+                    progress.update(sum(1 for obj in self.objects.values()
+                                        if obj['state'] in (self.COPIED, self.FAILED)))
+                    while True:
+                        now = time.time()
+                        restoring = [obj for obj in self.objects.values() if obj['state'] == self.RESTORING]
+                        due = sorted((obj for obj in restoring if obj['next_poll'] <= now),
+                                     key=lambda obj: obj['next_poll'])[:self.POLL_BATCH_SIZE]
+                        for obj, restored in zip(due, poll_executor.map(self._poll, due)):
+                            with self._lock:
+                                if restored is None:
+                                    obj['state'] = self.FAILED
+                                    progress.update(1)
+                                elif restored:
+                                    obj['state'] = self.COPYING
+                                    copies.add(copy_executor.submit(self._copy, obj))
+                                else:
+                                    obj['next_poll'] = now + self._next_poll_seconds(obj, now - obj['requested'])
+                        if due:
+                            self._save_state()
+                        if not restoring and not copies:
+                            break
+                        pending = [obj['next_poll'] for obj in self.objects.values() if obj['state'] == self.RESTORING]
+                        wait_seconds = max(min(pending) - time.time(), 0) if pending else None
+                        if deadline is not None:
+                            if time.time() >= deadline:
+                                break
+                            wait_seconds = min(deadline - time.time(),
+                                               wait_seconds if wait_seconds is not None else float('inf'))
+                        if copies:
+                            done, copies = wait(copies, timeout=wait_seconds, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                future.result()
+                            progress.update(len(done))
+                        elif wait_seconds:
+                            time.sleep(wait_seconds)
+        return self.results()
+
+    def results(self) -> (List[str], List[str]):
+        """ Returns the @ids whose objects have all been copied, and those whose restore or copy has failed
+
+        :return: 2 tuple of success, error list of @ids
+        """
+        success, errors = [], []
+        with self._lock:
+            for atid, keys in self.atids.items():
+                states = [self.objects[key]['state'] for key in keys]
+                if not states or self.FAILED in states:
+                    errors.append(atid)
+                elif all(state == self.COPIED for state in states):
+                    success.append(atid)
+        return success, errors
@@ -1,8 +1,10 @@
 import logging
 import structlog
 import datetime
+import time
 import uuid
-from threading import Timer
+from queue import Empty, Full, Queue
+from threading import Lock, Thread, Timer
 from dcicutils import es_utils
 from structlog.threadlocal import wrap_dict
 from elasticsearch import helpers
@@ -14,8 +16,28 @@ class ElasticsearchHandler(logging.Handler):
     Needed to sign ES requests with the AWS V4 Signature
     Loosely based off of code here:
     https://github.com/cmanaha/python-elasticsearch-logger
+
+    Records are not posted on the logging thread, but put on a bounded queue, from which a background
+    shipper thread posts them in bulk, whenever flush_size records are waiting or flush_seconds have
+    passed since the first of them was queued, and when the handler is flushed (e.g. at process exit).
+    If the queue is full, emit waits up to block_seconds for room and otherwise drops the record.
+
+    Loggers should share a handler per env and es_server (see get_shared_handler), rather than each having
+    its own shipper thread, queue and ES client; and a process which is frozen between requests rather than
+    exited (e.g. an AWS Lambda) should call flush_elasticsearch_logs before returning from each one.
     """
-    def __init__(self, env, es_server):
+    QUEUE_SIZE = 10000
+    FLUSH_SIZE = 500
+    FLUSH_SECONDS = 1.0
+    FLUSH_TIMEOUT_SECONDS = 10.0
+
+    _FLUSH = object()  # queued by flush to have the shipper post what it has without waiting
+    _STOP = object()  # queued by close to stop the shipper
+
+    _shared_handlers = {}  # by (env, es_server); see get_shared_handler
+    _shared_handlers_lock = Lock()
+
+    def __init__(self, env, es_server, queue_size=None, flush_size=None, flush_seconds=None, block_seconds=0):
         """
         Must be given a string es_server url to work.
         Calls __init__ of parent Handler
@@ -25,8 +47,35 @@ class ElasticsearchHandler(logging.Handler):
         self.retry_limit = 2
         self.namespace = self.get_namespace(env)
         self.es_client = es_utils.create_es_client(es_server, use_aws_auth=True)
+        self.flush_size = flush_size or self.FLUSH_SIZE
+        self.flush_seconds = self.FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.block_seconds = block_seconds
+        self.dropped = 0  # count of records dropped because the queue was full
+        self.log_index = None
+        self.log_index_expires = 0  # time at which the log_index (for the month) must be recalculated
+        self.resend_lock = Lock()
+        self.closed = False
+        self.queue = Queue(maxsize=queue_size or self.QUEUE_SIZE)
+        self.shipper = Thread(target=self.ship_messages, name='ElasticsearchHandler', daemon=True)
+        self.shipper.start()
         logging.Handler.__init__(self)
 
+    @classmethod
+    def get_shared_handler(cls, env, es_server):
+        """
+        Returns the (open) handler for the given env and es_server shared by all loggers, creating it if needed
+        """
+        with cls._shared_handlers_lock:
+            handler = cls._shared_handlers.get((env, es_server))
+            if handler is None or handler.closed:
+                handler = cls._shared_handlers[(env, es_server)] = cls(env, es_server)
+            return handler
+
+    @classmethod
+    def get_shared_handlers(cls):
+        with cls._shared_handlers_lock:
+            return list(cls._shared_handlers.values())
+
     @staticmethod
     def get_namespace(env):
         """ Grabs ES namespace from health page """
@@ -40,10 +89,11 @@ class ElasticsearchHandler(logging.Handler):
         records in self.resend_messages after 5 seconds.
         If already resending, do nothing
         """
-        if self.resend_timer is None:
-            self.resend_timer = Timer(5, self.resend_messages)
-            self.resend_timer.daemon = True
-            self.resend_timer.start()
+        with self.resend_lock:
+            if self.resend_timer is None:
+                self.resend_timer = Timer(5, self.resend_messages)
+                self.resend_timer.daemon = True
+                self.resend_timer.start()
 
     def resend_messages(self):
         """
@@ -51,38 +101,85 @@ class ElasticsearchHandler(logging.Handler):
         Keep track of subsequent errors and retry them, if they have been
         retried fewer times than self.retry_limit
         """
-        # clean up the timer
-        if self.resend_timer is not None and self.resend_timer.is_alive():
-            self.resend_timer.cancel()
-        self.resend_timer = None
-        if self.messages_to_resend:
+        with self.resend_lock:
+            # clean up the timer
+            if self.resend_timer is not None and self.resend_timer.is_alive():
+                self.resend_timer.cancel()
+            self.resend_timer = None
             messages_copy = self.messages_to_resend[:]
             self.messages_to_resend = []
-            idx_name = self.calculate_log_index()
-            actions = (
-                {
-                    '_index': idx_name,
-                    '_type': 'log',
-                    '_id': message[0],
-                    '_source': message[1]
-                }
-                for message in messages_copy
-            )
-            errors = []
-            for ok, resp in helpers.streaming_bulk(self.es_client, actions):
-                if not ok:
-                    errors.append(resp['index']['_id'])
+        if messages_copy:
+            errors = self.post_messages(messages_copy)
             for sent_message in messages_copy:
                 if sent_message[0] in errors and sent_message[2] < self.retry_limit:
                     sent_message[2] += 1  # increment retries
-                    self.messages_to_resend.append(sent_message)
+                    with self.resend_lock:
+                        self.messages_to_resend.append(sent_message)
         # trigger resending logs if any failed
         if self.messages_to_resend:
             self.schedule_resend()
 
+    def post_messages(self, messages):
+        """
+        Post the given messages ([<uuid>, <dict message>, <int retries>, <index>] lists) to Elasticsearch
+        in bulk, returning the set of uuids of those that could not be posted
+        """
+        actions = (
+            {
+                '_index': message[3] if len(message) > 3 else self.calculate_log_index(),
+                '_type': 'log',
+                '_id': message[0],
+                '_source': message[1]
+            }
+            for message in messages
+        )
+        errors = set()
+        try:
+            for ok, resp in helpers.streaming_bulk(self.es_client, actions, chunk_size=self.flush_size,
+                                                   raise_on_error=False, raise_on_exception=False):
+                if not ok:
+                    errors.add(resp['index']['_id'])
+        except Exception:
+            errors = {message[0] for message in messages}
+        return errors
+
+    def ship_messages(self):
+        """
+        Body of the shipper thread: post the queued messages in batches of up to flush_size, waiting
+        up to flush_seconds (from when the first was queued) for a batch to fill, and arrange to resend
+        any that could not be posted
+        """
+        stop = False
+        while not stop:
+            batch, queued = [], 0
+            item = self.queue.get()
+            queued += 1
+            deadline = time.time() + self.flush_seconds
+            while item is not self._FLUSH and item is not self._STOP:
+                batch.append(item)
+                if len(batch) >= self.flush_size:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.time(), 0))
+                    queued += 1
+                except Empty:
+                    break
+            stop = item is self._STOP
+            try:
+                if batch:
+                    errors = self.post_messages(batch)
+                    failed = [message for message in batch if message[0] in errors]
+                    if failed:
+                        with self.resend_lock:
+                            self.messages_to_resend.extend(failed)
+                        self.schedule_resend()
+            finally:
+                for _ in range(queued):
+                    self.queue.task_done()
+
     def emit(self, record):
         """
-        Overload the emit method to post logs to ES
+        Overload the emit method to queue logs to be posted to ES
         """
         # required?
         # entry = self.format(record)
@@ -96,25 +193,62 @@ class ElasticsearchHandler(logging.Handler):
         log_id = message.get('log_uuid', str(uuid.uuid4()))
         # for testing purposes. trigger the retry mechanism
         if message.get('_test_log_utils', False) is True:
-            self.messages_to_resend.append([log_id, message, 0])
+            with self.resend_lock:
+                self.messages_to_resend.append([log_id, message, 0, idx_name])
             self.schedule_resend()
             return
         try:
-            self.es_client.index(index=idx_name, doc_type='log', body=message, id=log_id)
-        except Exception:
-            # append resend messages as a list: [<uuid>, <dict message>, <int retries>]
-            self.messages_to_resend.append([log_id, message, 0])
-            self.schedule_resend()
+            # queue messages as a list: [<uuid>, <dict message>, <int retries>, <index>]
+            self.queue.put([log_id, message, 0, idx_name], timeout=self.block_seconds or None,
+                           block=bool(self.block_seconds))
+        except Full:
+            self.dropped += 1
+
+    def flush(self, timeout=None):
+        """
+        Wait (up to timeout seconds, by default FLUSH_TIMEOUT_SECONDS) for all queued logs to be posted
+        """
+        timeout = self.FLUSH_TIMEOUT_SECONDS if timeout is None else timeout
+        if self.shipper.is_alive():
+            try:
+                self.queue.put(self._FLUSH, timeout=timeout)
+            except Full:
+                pass
+            with self.queue.all_tasks_done:
+                self.queue.all_tasks_done.wait_for(lambda: not self.queue.unfinished_tasks, timeout=timeout)
+
+    def close(self):
+        """
+        Post all queued logs (see flush) and stop the shipper thread
+        """
+        with self._shared_handlers_lock:
+            self.closed = True
+            for shared_key, handler in list(self._shared_handlers.items()):
+                if handler is self:
+                    del self._shared_handlers[shared_key]
+        self.flush()
+        if self.shipper.is_alive():
+            try:
+                self.queue.put(self._STOP, timeout=self.FLUSH_TIMEOUT_SECONDS)
+            except Full:
+                pass
+        logging.Handler.close(self)
 
     def calculate_log_index(self):
         """
         Simple function to name the ES log index by month
         Convention is: logs-<yyyy>-<mm>
         * Uses UTC *
+        The name is cached until the end of the month.
         """
-        now = datetime.datetime.utcnow()
-        idx_suffix = datetime.datetime.strftime(now, '%Y-%m')
-        return self.namespace + 'logs-' + idx_suffix
+        if time.time() >= self.log_index_expires:
+            now = datetime.datetime.utcnow()
+            idx_suffix = datetime.datetime.strftime(now, '%Y-%m')
+            next_month = (now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+                          + datetime.timedelta(days=32)).replace(day=1)
+            self.log_index = self.namespace + 'logs-' + idx_suffix
+            self.log_index_expires = next_month.replace(tzinfo=datetime.timezone.utc).timestamp()
+        return self.log_index
 
 
 class ElasticsearchLoggerFactory(structlog.stdlib.LoggerFactory):
@@ -144,13 +278,25 @@ class ElasticsearchLoggerFactory(structlog.stdlib.LoggerFactory):
             _, name = structlog._frames._find_first_app_frame_and_name(self._ignore)
         logger = logging.getLogger(name)
         if self.es_server:
-            es_handler = ElasticsearchHandler(self.env, self.es_server)
-            logger.addHandler(es_handler)
+            es_handler = ElasticsearchHandler.get_shared_handler(self.env, self.es_server)
+            if es_handler not in logger.handlers:
+                logger.addHandler(es_handler)
             # also set level to info
             logger.setLevel(logging.INFO)
         return logger
 
 
+def flush_elasticsearch_logs(timeout=None):
+    """
+    Wait (up to timeout seconds for each, see ElasticsearchHandler.flush) for the logs queued by the shared
+    ElasticsearchHandlers (i.e. those of loggers from ElasticsearchLoggerFactory) to be posted. Logs are
+    posted in the background, and otherwise only flushed at process exit; so a process which is frozen
+    between requests rather than exited, e.g. an AWS Lambda, should call this before returning from each.
+    """
+    for handler in ElasticsearchHandler.get_shared_handlers():
+        handler.flush(timeout=timeout)
+
+
 def convert_ts_to_at_ts(logger, log_method, event_dict):
     '''
     this function is used to ensure filebeats
@@ -5,8 +5,7 @@ This file contains functions that might be generally useful.
 from collections import namedtuple
 from typing import Iterable  # would prefer this but error from Python 3.8: from collections.abc import Iterable
 import appdirs
-from copy import deepcopy
-import concurrent.futures
+import asyncio
 import contextlib
 import datetime
 import functools
@@ -19,10 +18,12 @@ import math
 import os
 import platform
 import pytz
+import random
 import re
 import rfc3986.validators
 import rfc3986.exceptions
 import shortuuid
+import threading
 import time
 import uuid
 import warnings
@@ -443,12 +444,58 @@ class Retry:
         See Retry._RETRY_OPTIONS_CATALOG.
         """
 
-        def __init__(self, retries_allowed=None, wait_seconds=None, wait_increment=None, wait_multiplier=None):
+        def __init__(self, retries_allowed=None, wait_seconds=None, wait_increment=None, wait_multiplier=None,
+                     retry_on=None, jitter=False, max_elapsed=None, on_retry=None, on_finish=None):
             self.retries_allowed = retries_allowed
             self.wait_seconds = wait_seconds or 0  # None or False mean 0 seconds
             self.wait_increment = wait_increment
             self.wait_multiplier = wait_multiplier
             self.wait_adjustor = self.make_wait_adjustor(wait_increment=wait_increment, wait_multiplier=wait_multiplier)
+            self.retry_on = retry_on
+            self.retryable = self.make_retryable(retry_on)
+            self.jitter = jitter
+            self.max_elapsed = max_elapsed
+            self.on_retry = on_retry
+            self.on_finish = on_finish
+
+        @staticmethod
+        def make_retryable(retry_on=None):
+            """
+            Returns a function that can be called with an exception to tell whether it is retryable, given either
+            an exception class (or tuple of them), or a predicate on the exception; by default, any Exception.
+            """
+            if retry_on is None:
+                return lambda e: True
+            elif isinstance(retry_on, tuple) or (isinstance(retry_on, type) and issubclass(retry_on, BaseException)):
+                return lambda e: isinstance(e, retry_on)
+            elif callable(retry_on):
+                return retry_on
+            else:
+                raise ValueError(f"The retry_on must be an exception class (or tuple of them) or a predicate:"
+                                 f" {retry_on!r}")
+
+        def wait_before_retry(self, tries, wait_seconds, error, started):
+            """
+            Returns the number of seconds to wait before retrying, after the given number of tries, the last of
+            which raised the given error, or None if it is not to be retried. (Calls the on_retry hook, if any.)
+            """
+            if tries >= self.tries_allowed or not self.retryable(error):
+                return None
+            if self.jitter:  # Full jitter, so concurrent retriers do not all retry at once.
+                wait_seconds = random.uniform(0, wait_seconds)
+            elapsed = time.monotonic() - started
+            if self.max_elapsed is not None and elapsed + wait_seconds > self.max_elapsed:
+                return None
+            if self.on_retry:
+                self.on_retry(tries=tries, error=error, wait_seconds=wait_seconds, elapsed=elapsed)
+            return wait_seconds
+
+        def finish(self, tries, error, started):
+            """
+            Calls the on_finish hook, if any, after the last of the given number of tries, with its error, if any.
+            """
+            if self.on_finish:
+                self.on_finish(tries=tries, error=error, elapsed=time.monotonic() - started)
 
         @staticmethod
         def make_wait_adjustor(wait_increment=None, wait_multiplier=None):
@@ -484,7 +531,8 @@ class Retry:
 
     @classmethod
     def retry_allowed(cls, name_key=None, retries_allowed=None, wait_seconds=None,
-                      wait_increment=None, wait_multiplier=None):
+                      wait_increment=None, wait_multiplier=None,
+                      retry_on=None, jitter=False, max_elapsed=None, on_retry=None, on_finish=None):
         """
         Used as a decorator on a function definition, makes that function do retrying before really failing.
         For example:
@@ -497,6 +545,8 @@ class Retry:
         either using the same wait each time or, if given a wait_multiplier or wait_increment, using
         that advice to adjust the wait time upward on each time.
 
+        The function may also be an async (def) function, in which case the wait is done by asyncio.sleep.
+
         Args:
 
             name_key: An optional key that can be used by qa_utils.RetryManager to adjust these parameters in testing.
@@ -505,6 +555,15 @@ class Retry:
             wait_seconds: The number of wait_seconds between retries. Default is cls.DEFAULT_WAIT_SECONDS.
             wait_increment: A fixed increment by which the number of wait_seconds is adjusted on each retry.
             wait_multiplier: A multiplier by which the number of wait_seconds is adjusted on each retry.
+            retry_on: An exception class (or tuple of them), or a predicate on the exception, telling which errors
+                      are retryable; others are raised right away. Default is any Exception.
+            jitter: Whether to wait a random number of seconds up to the wait_seconds (i.e. full jitter) rather than
+                    exactly wait_seconds, so concurrent callers do not all retry at once. Default is False.
+            max_elapsed: An overall budget in seconds; a retry is not done if it would be (i.e. start) after this.
+            on_retry: A hook called before each retry, with keyword arguments tries (so far), error (of the last
+                      try), wait_seconds (to wait before the retry), and elapsed (seconds since the first try).
+            on_finish: A hook called after the last try, with keyword arguments tries (in all), error (of the last
+                       try, or None if it succeeded) and elapsed (seconds since the first try).
         """
 
         def _decorator(function):
@@ -514,9 +573,10 @@ class Retry:
                 wait_seconds=cls._defaulted(wait_seconds, cls.DEFAULT_WAIT_SECONDS),
                 wait_increment=cls._defaulted(wait_increment, cls.DEFAULT_WAIT_INCREMENT),
                 wait_multiplier=cls._defaulted(wait_multiplier, cls.DEFAULT_WAIT_MULTIPLIER),
+                retry_on=retry_on, jitter=jitter, max_elapsed=max_elapsed, on_retry=on_retry, on_finish=on_finish
             )
 
-            check_true(isinstance(retries_allowed, int) and retries_allowed >= 0,
+            check_true(isinstance(function_profile.retries_allowed, int) and function_profile.retries_allowed >= 0,
                        "The retries_allowed must be a non-negative integer.",
                        error_class=ValueError)
 
@@ -524,31 +584,59 @@ class Retry:
             if function_name != 'anonymous':
                 cls._RETRY_OPTIONS_CATALOG[function_name] = function_profile  # Only for debugging.
 
+            if inspect.iscoroutinefunction(function):
+
+                @functools.wraps(function)
+                async def wrapped_coroutine_function(*args, **kwargs):
+                    started = time.monotonic()
+                    wait_seconds = function_profile.wait_seconds or 0
+                    tries = 0
+                    while True:
+                        tries += 1
+                        try:
+                            result = await function(*args, **kwargs)
+                        except Exception as e:
+                            wait = function_profile.wait_before_retry(tries, wait_seconds, e, started)
+                            if wait is None:
+                                function_profile.finish(tries, e, started)
+                                raise
+                            if wait > 0:
+                                await asyncio.sleep(wait)
+                            wait_seconds = function_profile.wait_adjustor(wait_seconds)
+                        else:
+                            function_profile.finish(tries, None, started)
+                            return result
+
+                return wrapped_coroutine_function
+
             @functools.wraps(function)
             def wrapped_function(*args, **kwargs):
-                tries_allowed = function_profile.tries_allowed
+                started = time.monotonic()
                 wait_seconds = function_profile.wait_seconds or 0
-                last_error = None
-                for i in range(tries_allowed):
-                    if i > 0:
-                        if i > 1:
-                            wait_seconds = function_profile.wait_adjustor(wait_seconds)
-                        if wait_seconds > 0:
-                            time.sleep(wait_seconds)
+                tries = 0
+                while True:
+                    tries += 1
                     try:
-                        success = function(*args, **kwargs)
-                        return success
+                        result = function(*args, **kwargs)
                     except Exception as e:
-                        last_error = e
-                if last_error is not None:
-                    raise last_error
+                        wait = function_profile.wait_before_retry(tries, wait_seconds, e, started)
+                        if wait is None:
+                            function_profile.finish(tries, e, started)
+                            raise
+                        if wait > 0:
+                            time.sleep(wait)
+                        wait_seconds = function_profile.wait_adjustor(wait_seconds)
+                    else:
+                        function_profile.finish(tries, None, started)
+                        return result
 
             return wrapped_function
 
         return _decorator
 
     @classmethod
-    def retrying(cls, fn, retries_allowed=None, wait_seconds=None, wait_increment=None, wait_multiplier=None):
+    def retrying(cls, fn, retries_allowed=None, wait_seconds=None, wait_increment=None, wait_multiplier=None,
+                 retry_on=None, jitter=False, max_elapsed=None, on_retry=None, on_finish=None):
         """
         Similar to the @Retry.retry_allowed decorator, but used around individual calls. e.g.,
 
@@ -576,6 +664,7 @@ class Retry:
             wait_seconds: The number of wait_seconds between retries. Default is cls.DEFAULT_WAIT_SECONDS.
             wait_increment: A fixed increment by which the number of wait_seconds is adjusted on each retry.
             wait_multiplier: A multiplier by which the number of wait_seconds is adjusted on each retry.
+            retry_on, jitter, max_elapsed, on_retry, on_finish: As for the @Retry.retry_allowed decorator.
 
         Returns: whatever the fn returns, assuming it returns normally/successfully.
         """
@@ -584,7 +673,8 @@ class Retry:
         # function values at the same point in code. -kmp 8-Jul-2020
         decorator_function = Retry.retry_allowed(
             name_key='anonymous', retries_allowed=retries_allowed, wait_seconds=wait_seconds,
-            wait_increment=wait_increment, wait_multiplier=wait_multiplier
+            wait_increment=wait_increment, wait_multiplier=wait_multiplier,
+            retry_on=retry_on, jitter=jitter, max_elapsed=max_elapsed, on_retry=on_retry, on_finish=on_finish
         )
         return decorator_function(fn)
 
@@ -956,6 +1046,114 @@ class RateManager:
         self.timestamps[soonest_expiration_pos] = datetime.datetime.now() + expiration_delta
 
 
+class TokenBucket:
+    """
+    This class is a token bucket rate limiter, for calls which can only be made at a certain (average) rate,
+    but which may be made in bursts of up to a certain number (the capacity) at once, e.g.:
+
+        rate_limiter = TokenBucket(rate=10, capacity=20, action="portal request")  # 10 per second, 20 at once
+        def foo():
+            rate_limiter.acquire()  # or: await rate_limiter.acquire_async()
+            do_guarded_action()
+
+    Unlike RateManager, this is thread-safe, and it may be awaited (by acquire_async) from asyncio code;
+    and (see redis_utils.RedisTokenBucket) its tokens may be shared by all processes using the same Redis.
+    """
+
+    def __init__(self, *, rate, capacity=None, action="metered action", enabled=True, log=None, wait_hook=None):
+        """
+        Creates a TokenBucket that cooperates in assuring that a guarded operation happens only at a certain rate.
+
+        Args:
+
+        rate float: The number of tokens (calls) added to the bucket per second, i.e. the average allowed rate.
+        capacity float: The number of tokens the bucket can hold, i.e. the allowed burst; by default rate (or 1).
+        action str: A noun or noun phrase describing the action being guarded.
+        enabled bool: A boolean controlling whether this facility is enabled. If False, waiting is disabled.
+        log object: A logger object (supporting operations like .debug, .info, .warning, and .error).
+        wait_hook: A hook not recommended for production, but intended for testing to know when waiting happens.
+        """
+        if not (isinstance(rate, (int, float)) and rate > 0):
+            raise TypeError("The rate must be a positive number: %s" % rate)
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.action = action
+        self.enabled = enabled
+        self.log = log or logging
+        self.wait_hook = wait_hook
+        self._tokens = self.capacity
+        self._timestamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens=1):
+        """
+        Takes the given number of tokens from the bucket if it has them, returning 0;
+        otherwise takes none and returns the number of seconds until it would have them.
+        """
+        if tokens > self.capacity:
+            raise ValueError("Cannot acquire %s tokens from a %s of capacity %s." %
+                             (tokens, self.__class__.__name__, self.capacity))
+        return self._take(tokens) if self.enabled else 0
+
+    def _take(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._timestamp) * self.rate)
+            self._timestamp = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def _waiting(self, wait_seconds):
+        if self.wait_hook:  # Hook primarily for testing
+            self.wait_hook(wait_seconds=wait_seconds)
+        self.log.debug("Waiting %s seconds before attempting %s." % (wait_seconds, self.action))
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Takes the given number of tokens from the bucket, waiting (using time.sleep) only if necessary,
+        and for the amount necessary. Returns True, or False if this would take longer than the given timeout.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while (wait_seconds := self.try_acquire(tokens)) > 0:
+            if deadline is not None and time.monotonic() + wait_seconds > deadline:
+                return False
+            self._waiting(wait_seconds)
+            time.sleep(wait_seconds)
+        return True
+
+    async def acquire_async(self, tokens=1, timeout=None):
+        """
+        Like acquire, but waits using asyncio.sleep (so other tasks may run meanwhile).
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while (wait_seconds := self.try_acquire(tokens)) > 0:
+            if deadline is not None and time.monotonic() + wait_seconds > deadline:
+                return False
+            self._waiting(wait_seconds)
+            await asyncio.sleep(wait_seconds)
+        return True
+
+    def limited(self, function):
+        """
+        Returns the given (possibly async) function wrapped so that it acquires a token before each call.
+        (This may also be used as a decorator.)
+        """
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def limited_coroutine_function(*args, **kwargs):
+                await self.acquire_async()
+                return await function(*args, **kwargs)
+            return limited_coroutine_function
+
+        @functools.wraps(function)
+        def limited_function(*args, **kwargs):
+            self.acquire()
+            return function(*args, **kwargs)
+        return limited_function
+
+
 def environ_bool(var, default=False):
     """
     Returns True if the named environment variable is set to 'true' (in any alphabetic case), False if something else.
@@ -1303,28 +1501,34 @@ def remove_empty_properties(data: Optional[Union[list, dict]],
                             raise_exception_on_nonempty_array_element_after_empty: bool = False) -> None:
     def _isempty(value: Any) -> bool:  # noqa
         return isempty(value) if callable(isempty) else value in [None, "", {}, []]
-    if isinstance(data, dict):
-        for key in list(data.keys()):
-            if _isempty(value := data[key]):
-                del data[key]
-            else:
-                remove_empty_properties(value, isempty=isempty, isempty_array_element=isempty_array_element,
-                                        raise_exception_on_nonempty_array_element_after_empty=  # noqa
-                                        raise_exception_on_nonempty_array_element_after_empty)
-    elif isinstance(data, list):
-        for item in data:
-            remove_empty_properties(item, isempty=isempty, isempty_array_element=isempty_array_element,
-                                    raise_exception_on_nonempty_array_element_after_empty=  # noqa
-                                    raise_exception_on_nonempty_array_element_after_empty)
-        if callable(isempty_array_element):
-            if raise_exception_on_nonempty_array_element_after_empty is True:
-                empty_element_seen = False
-                for item in data:
-                    if not empty_element_seen and isempty_array_element(item):
-                        empty_element_seen = True
-                    elif empty_element_seen and not isempty_array_element(item):
-                        raise Exception("Non-empty element found after empty element.")
-            data[:] = [item for item in data if not isempty_array_element(item)]
+    def _remove_empty_array_elements(data: list) -> None:  # noqa
+        if raise_exception_on_nonempty_array_element_after_empty is True:
+            empty_element_seen = False
+            for item in data:
+                if not empty_element_seen and isempty_array_element(item):
+                    empty_element_seen = True
+                elif empty_element_seen and not isempty_array_element(item):
+                    raise Exception("Non-empty element found after empty element.")
+        data[:] = [item for item in data if not isempty_array_element(item)]
+    # This is done iteratively (not recursively), so it works for arbitrarily deeply nested data. Properties are
+    # removed if empty before their values are themselves processed; array elements are removed (per
+    # isempty_array_element) after they are processed, so the array is pushed (again) before its elements.
+    stack = [(data, False)]
+    while stack:
+        data, elements_processed = stack.pop()
+        if isinstance(data, dict):
+            for key in list(data.keys()):
+                if _isempty(value := data[key]):
+                    del data[key]
+                elif isinstance(value, (dict, list)):
+                    stack.append((value, False))
+        elif isinstance(data, list):
+            if elements_processed:
+                _remove_empty_array_elements(data)
+                continue
+            if callable(isempty_array_element):
+                stack.append((data, True))
+            stack.extend((item, False) for item in reversed(data) if isinstance(item, (dict, list)))
 
 
 class ObsoleteError(Exception):
@@ -1792,12 +1996,112 @@ def copy_json(obj):
     do bookkeeping to avoid duplicating objects in a cyclic graph.
     This is intended to work fine for data deserialized from JSON,
     but won't work for everything.
+    This is done iteratively (not recursively), so it works for arbitrarily deeply nested objects.
+    """
+    def new_container(value):  # noqa
+        if isinstance(value, dict):
+            copied = {}
+        elif isinstance(value, list):
+            copied = []
+        else:
+            return value
+        stack.append((value, copied))
+        return copied
+    stack = []
+    result = new_container(obj)
+    while stack:
+        value, copied = stack.pop()
+        if isinstance(value, dict):
+            for k, v in value.items():
+                copied[k] = new_container(v)
+        else:
+            copied.extend(new_container(v) for v in value)
+    return result
+
+
+class CopyOnWriteNode:
     """
-    if isinstance(obj, dict):
-        obj = {k: copy_json(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        obj = [copy_json(v) for v in obj]
-    return obj
+    A node (i.e. the value, e.g. dict, list, or tuple, at some path) within a JSON-like object being walked,
+    iteratively, by a function which may change it (e.g. merge_objects or obfuscation_utils.obfuscate_json).
+    Unless copy is False, changing a node (via set, append, or replace) first (shallowly) copies it and its
+    ancestors, if not already; so the given object itself is not changed, and only the paths actually changed
+    are copied. The result (of the root node) is the changed object, sharing any unchanged parts with the given
+    object; or if there were no changes, the given object itself. A tuple (which is immutable) is copied as a
+    list, which is converted back into a tuple for the result.
+    """
+
+    __slots__ = ("value", "parent", "key", "root", "depth", "_copy", "_written", "_tuples", "_replaced")
+
+    def __init__(self, value: Any, parent: Optional['CopyOnWriteNode'] = None, key: Any = None, copy: bool = True):
+        self.value = value
+        self.parent = parent
+        self.key = key
+        self.root = parent.root if parent else self
+        self.depth = parent.depth + 1 if parent else 0
+        self._copy = copy is True
+        self._written = None  # The copy of the value (if copying), once changed.
+        self._tuples = []  # For the root only: the nodes with tuple values which have been copied (as lists).
+        self._replaced = None  # For the root only: a singleton list of its new value, if replaced.
+
+    def current(self) -> Any:
+        """
+        Returns the current value of this node, i.e. its copy, if it has been copied, else its given value.
+        """
+        return self._written if self._written is not None else self.value
+
+    def child(self, key: Any) -> 'CopyOnWriteNode':
+        """
+        Returns a new node for the value of the given key (or index) of this node.
+        """
+        return CopyOnWriteNode(self.current()[key], self, key)
+
+    def writable(self) -> Union[dict, list]:
+        """
+        Returns the value of this node to change, copying it (and its ancestors) first, if not already.
+        """
+        if not self.root._copy:
+            return self.value
+        uncopied = []
+        node = self
+        while node is not None and node._written is None:
+            uncopied.append(node)
+            node = node.parent
+        for node in reversed(uncopied):  # From the top down, so each parent is copied before its child.
+            node._written = dict(node.value) if isinstance(node.value, dict) else list(node.value)
+            if isinstance(node.value, tuple):
+                self.root._tuples.append(node)
+            if node.parent is not None:
+                node.parent._written[node.key] = node._written
+        return self._written
+
+    def set(self, key: Any, value: Any) -> None:
+        self.writable()[key] = value
+
+    def append(self, value: Any) -> None:
+        self.writable().append(value)
+
+    def replace(self, value: Any) -> None:
+        """
+        Replaces the value of this node (within its parent) with the given value.
+        """
+        if self.parent is not None:
+            self.parent.set(self.key, value)
+        else:
+            self._replaced = [value]
+
+    def result(self) -> Any:
+        """
+        Returns the resultant value of this (root) node, with all of the changes made to it and its descendants.
+        """
+        if self._replaced:
+            return self._replaced[0]
+        result = self.current()
+        for node in sorted(self._tuples, key=lambda node: -node.depth):  # From the bottom up.
+            if node.parent is not None:
+                node.parent._written[node.key] = tuple(node._written)
+            else:
+                result = tuple(node._written)
+        return result
 
 
 class UncustomizedInstance(Exception):
@@ -2351,7 +2655,9 @@ def merge_objects(target: Union[dict, List[Any]], source: Union[dict, List[Any]]
     """
     Merges the given source dictionary or list into the target dictionary or list and returns the
     result. This MAY well change the given target (dictionary or list) IN PLACE ... UNLESS the copy
-    argument is True, then the given target will not change as a local copy is made (and returned).
+    argument is True, then the given target will not change as a local copy is made (and returned);
+    only the parts of the target actually changed are copied (see CopyOnWriteNode), i.e. the result
+    shares any unchanged parts with the given target.
 
     If the expand_lists argument is True then any target lists longer than the
     source be will be filled out with the last element(s) of the source; the full
@@ -2371,32 +2677,47 @@ def merge_objects(target: Union[dict, List[Any]], source: Union[dict, List[Any]]
                 return False
         return True
 
+    def is_same_primitive(value: Any, other_value: Any) -> bool:  # noqa
+        return value is other_value or (type(value) is type(other_value) and
+                                        not isinstance(value, (dict, list, tuple)) and value == other_value)
+
     if target is None:
         return source
     if expand_lists not in (True, False):
         expand_lists = full is True
-    if (copy is True) and (_recursing is not True):
-        target = deepcopy(target)
-    if isinstance(target, dict) and isinstance(source, dict) and source:
-        for key, value in source.items():
-            if ((primitive_lists is True) and
-                (key in target) and is_primitive_list(target[key]) and is_primitive_list(value)):  # noqa
-                target[key] = value
-            else:
-                target[key] = merge_objects(target[key], value,
-                                            expand_lists=expand_lists, _recursing=True) if key in target else value
-    elif isinstance(target, list) and isinstance(source, list) and source:
-        for i in range(max(len(source), len(target))):
-            if i < len(target):
-                if i < len(source):
-                    target[i] = merge_objects(target[i], source[i], expand_lists=expand_lists, _recursing=True)
-                elif expand_lists is True:
-                    target[i] = merge_objects(target[i], source[len(source) - 1], expand_lists=expand_lists)
-            else:
-                target.append(source[i])
-    elif source not in (None, {}, []):
-        target = source
-    return target
+    root = CopyOnWriteNode(target, copy=(copy is True) and (_recursing is not True))
+    if (copy is True) and isinstance(target, (dict, list)):
+        root.writable()  # So that the result is never the given target itself.
+    # This is done iteratively (not recursively), so it works for arbitrarily deeply nested objects.
+    stack = [(root, source)]
+    while stack:
+        node, source = stack.pop()
+        target = node.current()
+        if target is None:
+            node.replace(source)
+        elif isinstance(target, dict) and isinstance(source, dict) and source:
+            for key, value in source.items():
+                if key not in target:
+                    node.set(key, value)
+                elif ((primitive_lists is True) and (node is root) and  # Only for the top-level properties.
+                      is_primitive_list(target[key]) and is_primitive_list(value)):  # noqa
+                    if target[key] != value:
+                        node.set(key, value)
+                else:
+                    stack.append((node.child(key), value))
+        elif isinstance(target, list) and isinstance(source, list) and source:
+            ntarget = len(target)
+            for i in range(max(len(source), ntarget)):
+                if i < ntarget:
+                    if i < len(source):
+                        stack.append((node.child(i), source[i]))
+                    elif expand_lists is True:
+                        stack.append((node.child(i), source[len(source) - 1]))
+                else:
+                    node.append(source[i])
+        elif source not in (None, {}, []) and not is_same_primitive(target, source):
+            node.replace(source)
+    return root.result()
 
 
 def load_json_from_file_expanding_environment_variables(file: str) -> Union[dict, list]:
@@ -2923,6 +3244,11 @@ def create_short_uuid(length: Optional[int] = None, upper: bool = False):
     return value
 
 
-def run_concurrently(functions: Iterable[Callable], nthreads: int = 4) -> None:
-    with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
-        concurrent.futures.as_completed([executor.submit(f) for f in functions])
+def run_concurrently(functions: Iterable[Callable], nthreads: int = 4,
+                     timeout: Optional[float] = None, progress: Optional[Callable] = None) -> list:
+    """
+    Calls the given (argumentless) functions concurrently, in nthreads threads, and returns their results (in
+    order), raising any error (or errors, as a MultiError); see task_utils.TaskGroup, for more control.
+    """
+    from dcicutils.task_utils import TaskGroup  # Here rather than at the top due to circular imports.
+    return TaskGroup.run(functions, max_workers=nthreads, timeout=timeout, progress=progress)
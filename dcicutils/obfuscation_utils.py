@@ -1,10 +1,9 @@
 # Some utilities related to obfuscating sensitive data (dmichaels/2022-07-20).
 
-import copy
 import re
 
 from .common import AnyJsonData
-from .misc_utils import check_true, StorageCell
+from .misc_utils import check_true, CopyOnWriteNode
 from typing import Optional, Any, Union
 
 
@@ -87,6 +86,8 @@ def obfuscate_json(item: Union[AnyJsonData, tuple], inplace: bool = False, show:
     i.e. the given dictionary is NOT modified if there are no values to obfuscate or if such values are
     already abfuscated. If the inplace argument is True, then any changes (value obfuscations) are made to
     the given dictionary itself in place (NOT a copy). In either case the resultant dictionary is returned.
+    The copy is only of the parts of the dictionary actually modified (see misc_utils.CopyOnWriteNode);
+    i.e. it shares any unmodified parts with the given dictionary.
     If the show argument is True then does not actually obfuscate and simply returns the given dictionary.
 
     :param item: Any JSON object that might be or contain a dictionary whose senstive values are to be obfuscated.
@@ -102,30 +103,25 @@ def obfuscate_json(item: Union[AnyJsonData, tuple], inplace: bool = False, show:
     if show:
         return item
 
-    orig_item = item
+    root = CopyOnWriteNode(item, copy=not inplace)
 
-    changed = StorageCell(False)
-
-    if not inplace:
-        item = copy.deepcopy(item)
-
-    def process_recursively(item: Union[AnyJsonData, tuple]):
-        # We only need to process non-atomic items recursively, since they are the only things
-        # that might conceivably be or contain a dictionary in need of obfuscation.
-        if isinstance(item, dict):
-            for key, value in item.items():
+    # We only need to process non-atomic items, since they are the only things that might conceivably be
+    # or contain a dictionary in need of obfuscation. This is done iteratively (not recursively), so it works
+    # for arbitrarily deeply nested items.
+    nodes = [root]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node.value, dict):
+            for key, value in node.value.items():
                 if should_obfuscate(key, value):
-                    changed.value = True
-                    item[key] = obfuscate(value, obfuscated=obfuscated)
-                else:
-                    process_recursively(value)
-        elif isinstance(item, list) or isinstance(item, tuple):
-            for element in item:
-                process_recursively(element)
-
-    process_recursively(item)
-
-    return item if changed.value else orig_item
+                    node.set(key, obfuscate(value, obfuscated=obfuscated))
+                elif isinstance(value, (dict, list, tuple)):
+                    nodes.append(node.child(key))
+        elif isinstance(node.value, (list, tuple)):
+            nodes.extend(node.child(index) for index, element in enumerate(node.value)
+                         if isinstance(element, (dict, list, tuple)))
+
+    return root.result()
 
 
 # The function obfuscate_dict is deprecated and will go away in a future major release.
@@ -0,0 +1,410 @@
+import io
+import json
+import math
+import os
+from pyramid.response import Response as PyramidResponse
+from pyramid.router import Router as PyramidRouter
+import random
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from uuid import UUID
+from wsgiref.simple_server import make_server as wsgi_make_server, WSGIRequestHandler, WSGIServer
+from dcicutils.misc_utils import to_camel_case, to_snake_case
+from dcicutils.portal_utils import Portal
+
+# In-memory (local) stand-in for a (smaht/cgap/fourfront) portal, for offline testing and benchmarking of
+# code which talks to a portal, e.g. ff_utils, portal_utils.Portal, and structured_data.StructuredDataSet.
+# Backed by loaded inserts; serves /profiles/, /health, /search/ (with from/limit paging), and item GET,
+# PATCH, and POST; with configurable (injected) latency, error rate, and (429) throttling. May be used
+# in-process (via a webtest vapp; see create_portal) or served over HTTP on localhost (see start).
+
+Latency = Optional[Union[float, Tuple[float, float], Callable[[], float]]]
+
+DEFAULT_IDENTIFYING_PROPERTIES = ["uuid", "accession", "submitted_id", "identifier", "aliases"]
+
+
+class PortalEmulator:
+
+    def __init__(self, inserts: Optional[Union[str, Dict[str, List[dict]]]] = None,
+                 schemas: Optional[Dict[str, dict]] = None,
+                 latency: Latency = None,
+                 error_rate: float = 0.0,
+                 throttle_rate: Optional[float] = None,
+                 throttle_burst: Optional[int] = None,
+                 seed: Optional[int] = None) -> None:
+        """
+        Inserts may be a dictionary of lists of items keyed by type name, or the path of a directory of
+        inserts files (i.e. {type_name}.json files each containing a list of items, as written by the
+        view-portal-object --insert-files option), or the path of a single JSON file containing such a
+        dictionary. Schemas is a dictionary of schemas keyed by type name; minimal schemas are inferred
+        for any types without one. The latency (seconds) may be a number, a (min, max) tuple for a uniform
+        random latency, or a callable; error_rate is the fraction of requests failing with HTTP 500; and
+        throttle_rate (requests per second, with throttle_burst capacity) causes HTTP 429 when exceeded.
+        The seed makes the random latency, errors, and generated uuids reproducible.
+        """
+        self._random = random.Random(seed)
+        self._latency = latency
+        self._error_rate = error_rate if isinstance(error_rate, (int, float)) and error_rate > 0 else 0.0
+        self._throttle_rate = throttle_rate if isinstance(throttle_rate, (int, float)) and throttle_rate > 0 else None
+        self._throttle_burst = max(throttle_burst if isinstance(throttle_burst, int) else 1, 1)
+        self._throttle_tokens = float(self._throttle_burst)
+        self._throttle_timestamp = time.monotonic()
+        self._lock = Lock()
+        self._items = {}  # uuid -> {"type": type_name, "data": raw item}
+        self._index = {}  # identifying value -> uuid
+        self._type_names = {}  # lower-case type name or collection name -> type name
+        self._schemas = dict(schemas) if isinstance(schemas, dict) else {}
+        self._stats = {}
+        self._router = None
+        self._server = None
+        self._server_thread = None
+        for type_name in self._schemas:
+            self._add_type_name(type_name)
+        if inserts:
+            self.load_inserts(inserts)
+
+    def load_inserts(self, inserts: Union[str, Dict[str, List[dict]]]) -> int:
+        """
+        Loads the given inserts (see constructor); returns the number of items loaded.
+        """
+        if isinstance(inserts, str):
+            inserts = self._read_inserts(inserts)
+        nitems = 0
+        for type_name, items in inserts.items():
+            for item in items if isinstance(items, list) else []:
+                if isinstance(item, dict):
+                    self.add_item(type_name, item)
+                    nitems += 1
+        return nitems
+
+    def add_item(self, type_name: str, item: dict) -> dict:
+        """
+        Adds the given item, of the given type, to this emulator; generating a uuid if it has none.
+        Returns the (raw) item as stored.
+        """
+        type_name = to_camel_case(type_name)
+        item = dict(item)
+        with self._lock:
+            if not item.get("uuid"):
+                item["uuid"] = str(UUID(int=self._random.getrandbits(128), version=4))
+            self._add_type_name(type_name)
+            self._items[item["uuid"]] = {"type": type_name, "data": item}
+            self._index_item(type_name, item)
+        return item
+
+    @property
+    def nitems(self) -> int:
+        return len(self._items)
+
+    @property
+    def type_names(self) -> List[str]:
+        return sorted(set(self._type_names.values()))
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns request counts keyed by "{method} {status}", e.g. "GET 200", "PATCH 429".
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    @property
+    def schemas(self) -> Dict[str, dict]:
+        return {type_name: self._schema(type_name) for type_name in self.type_names}
+
+    @property
+    def router(self) -> PyramidRouter:
+        if self._router is None:
+            self._router = Portal._create_router_for_testing([
+                {"path": "/health", "method": "GET", "function": self._endpoint(self._get_health)},
+                {"path": "/profiles/", "method": "GET", "function": self._endpoint(self._get_profiles)},
+                {"path": "/profiles/{name}", "method": "GET", "function": self._endpoint(self._get_profile)},
+                {"path": "/search/", "method": "GET", "function": self._endpoint(self._get_search)},
+                {"path": "/search", "method": "GET", "function": self._endpoint(self._get_search)},
+                {"path": "/{path:.*}", "method": "GET", "function": self._endpoint(self._get_item)},
+                {"path": "/{path:.*}", "method": "PATCH", "function": self._endpoint(self._patch_item)},
+                {"path": "/{path:.*}", "method": "POST", "function": self._endpoint(self._post_item)}
+            ])
+        return self._router
+
+    def create_portal(self, **kwargs) -> Portal:
+        """
+        Returns a Portal object for this emulator; this will be via HTTP if the emulator has been started
+        (see start), otherwise in-process via a (webtest) vapp. Any kwargs are passed to the Portal constructor.
+        """
+        if self._server:
+            return Portal(self.key, **kwargs)
+        return Portal(self.router, **kwargs)
+
+    def start(self, port: int = 0, host: str = "127.0.0.1") -> str:
+        """
+        Starts serving this emulator over HTTP (multi-threaded) in a background (daemon) thread; a port
+        of zero means any free port. Returns the server URL; see also the key property, for use with ff_utils.
+        """
+        if not self._server:
+            self._server = wsgi_make_server(host, port, self.router,
+                                            server_class=_ThreadingWSGIServer, handler_class=_QuietWSGIRequestHandler)
+            self._server_thread = Thread(target=self._server.serve_forever, daemon=True)
+            self._server_thread.start()
+        return self.server
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+            self._server = self._server_thread = None
+
+    def __enter__(self) -> "PortalEmulator":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    @property
+    def server(self) -> Optional[str]:
+        return f"http://{self._server.server_address[0]}:{self._server.server_port}" if self._server else None
+
+    @property
+    def key(self) -> Optional[dict]:
+        return {"key": "emulator", "secret": "emulator", "server": self.server} if self._server else None
+
+    def _endpoint(self, handler: Callable) -> Callable:
+        def endpoint(request) -> Any:
+            response = self._inject_faults(request) or handler(request)
+            status = response.status_code if isinstance(response, PyramidResponse) else 200
+            with self._lock:
+                self._stats[f"{request.method} {status}"] = self._stats.get(f"{request.method} {status}", 0) + 1
+            return response
+        return endpoint
+
+    def _inject_faults(self, request) -> Optional[PyramidResponse]:
+        if (latency := self._latency) is not None:
+            if callable(latency):
+                latency = latency()
+            elif isinstance(latency, tuple):
+                with self._lock:
+                    latency = self._random.uniform(*latency)
+            if latency > 0:
+                time.sleep(latency)
+        with self._lock:
+            if self._throttle_rate:
+                now = time.monotonic()
+                self._throttle_tokens = min(self._throttle_tokens + (now - self._throttle_timestamp) *
+                                            self._throttle_rate, self._throttle_burst)
+                self._throttle_timestamp = now
+                if self._throttle_tokens < 1:
+                    retry_after = math.ceil((1 - self._throttle_tokens) / self._throttle_rate)
+                    return _error_response(429, "Too Many Requests", headers={"Retry-After": str(retry_after)})
+                self._throttle_tokens -= 1
+            if self._error_rate and self._random.random() < self._error_rate:
+                return _error_response(500, "Internal Server Error", "Injected error.")
+        return None
+
+    def _get_health(self, request) -> dict:
+        return {"status": "ok", "@type": ["Health", "Portal"], "namespace": "emulator",
+                "project_version": "emulator", "nitems": self.nitems}
+
+    def _get_profiles(self, request) -> dict:
+        return self.schemas
+
+    def _get_profile(self, request) -> Union[dict, PyramidResponse]:
+        name = request.matchdict["name"]
+        if name.endswith(".json"):
+            name = name[:-5]
+        if not (type_name := self._type_names.get(name.lower().replace("_", ""))):
+            return _error_response(404, "Not Found", f"No schema for: {name}")
+        return self._schema(type_name)
+
+    def _get_search(self, request) -> dict:
+        type_names = [self._type_names.get(value.lower()) for value in request.params.getall("type")]
+        type_names = set(type_name for type_name in type_names if type_name and type_name != "Item")
+        with self._lock:
+            # As with the actual portal, a search for a type includes objects of its subtypes.
+            type_names = set(name for type_name in type_names for name in self._type_and_subtype_names(type_name))
+            items = [item for item in self._items.values() if not type_names or item["type"] in type_names]
+        total = len(items)
+        offset = _to_int(request.params.get("from"), 0)
+        if (limit := request.params.get("limit")) != "all":
+            items = items[offset:offset + _to_int(limit, 25)]
+        else:
+            items = items[offset:]
+        raw = request.params.get("frame") == "raw"
+        return {"@type": ["Search"], "total": total, "@graph": [self._view(item, raw=raw) for item in items]}
+
+    def _get_item(self, request) -> Union[dict, PyramidResponse]:
+        path = request.matchdict["path"]
+        segments = [segment for segment in path.split("/") if segment and not segment.startswith("@@")]
+        if len(segments) == 1 and (type_name := self._type_names.get(segments[0].lower())):
+            # Collection page, e.g. /Sample or /samples/, similar to a search for the type.
+            with self._lock:
+                items = [item for item in self._items.values() if item["type"] == type_name]
+            return {"@type": [f"{type_name}Collection", "Collection"], "total": len(items),
+                    "@graph": [self._view(item) for item in items[:_to_int(request.params.get("limit"), 25)]]}
+        if not (item := self._lookup(segments)):
+            return _error_response(404, "Not Found", f"Item not found: /{path}")
+        return self._view(item, raw=request.params.get("frame") == "raw")
+
+    def _patch_item(self, request) -> Union[dict, PyramidResponse]:
+        path = request.matchdict["path"]
+        if not (item := self._lookup([segment for segment in path.split("/") if segment])):
+            return _error_response(404, "Not Found", f"Item not found: /{path}")
+        if not isinstance(data := _request_json(request), dict):
+            return _error_response(422, "Unprocessable Entity", "Invalid JSON body.")
+        if data.get("uuid") and data["uuid"] != item["data"]["uuid"]:
+            return _error_response(422, "Unprocessable Entity", "Cannot change uuid.")
+        if request.params.get("check_only", "").lower() != "true":
+            with self._lock:
+                item["data"] = {**item["data"], **data}
+                self._index_item(item["type"], item["data"])
+        return {"status": "success", "@type": ["result"], "@graph": [self._view(item)]}
+
+    def _post_item(self, request) -> Union[dict, PyramidResponse]:
+        path = request.matchdict["path"]
+        segments = [segment for segment in path.split("/") if segment]
+        if len(segments) != 1 or not (type_name := self._type_names.get(segments[0].lower())):
+            return _error_response(404, "Not Found", f"No such type: /{path}")
+        if not isinstance(data := _request_json(request), dict):
+            return _error_response(422, "Unprocessable Entity", "Invalid JSON body.")
+        if (uuid := data.get("uuid")) and uuid in self._items:
+            return _error_response(409, "Conflict", f"Item already exists: {uuid}")
+        if request.params.get("check_only", "").lower() == "true":
+            return {"status": "success", "@type": ["result"], "@graph": [data]}
+        item = self.add_item(type_name, data)
+        response = PyramidResponse(json.dumps({"status": "success", "@type": ["result"],
+                                               "@graph": [self._view(self._items[item["uuid"]])]}),
+                                   status=201, content_type=f"{Portal.MIME_TYPE_JSON}; charset=utf-8")
+        return response
+
+    def _lookup(self, segments: List[str]) -> Optional[dict]:
+        with self._lock:
+            if len(segments) == 1:
+                uuid = self._index.get(segments[0])
+            elif len(segments) == 2 and (type_name := self._type_names.get(segments[0].lower())):
+                if (uuid := self._index.get(segments[1])) and (self._items[uuid]["type"] not in
+                                                               self._type_and_subtype_names(type_name)):
+                    uuid = None
+            else:
+                uuid = None
+            return self._items.get(uuid) if uuid else None
+
+    def _view(self, item: dict, raw: bool = False) -> dict:
+        if raw:
+            return dict(item["data"])
+        type_name = item["type"]
+        return {**item["data"], "@id": f"/{self._collection_name(type_name)}/{item['data']['uuid']}/",
+                "@type": [type_name, *self._super_type_names(type_name), "Item"]}
+
+    def _schema(self, type_name: str) -> dict:
+        if schema := self._schemas.get(type_name):
+            return schema
+        # Infer a minimal schema from the properties of the (first few thousand) items of this type.
+        properties = {}
+        for item in [item for item in self._items.values() if item["type"] == type_name][:5000]:
+            for property_name, property_value in item["data"].items():
+                if property_name not in properties:
+                    properties[property_name] = {"type": _json_type_name(property_value)}
+                    if isinstance(property_value, list):
+                        properties[property_name]["items"] = {"type": "string"}
+        return {"title": type_name, "$id": f"/profiles/{to_snake_case(type_name)}.json", "type": "object",
+                "identifyingProperties": [name for name in DEFAULT_IDENTIFYING_PROPERTIES if name in properties],
+                "properties": properties}
+
+    def _identifying_properties(self, type_name: str) -> List[str]:
+        if (schema := self._schemas.get(type_name)) and isinstance(schema.get("identifyingProperties"), list):
+            return list(set(["uuid", *schema["identifyingProperties"]]))
+        return DEFAULT_IDENTIFYING_PROPERTIES
+
+    def _index_item(self, type_name: str, item: dict) -> None:
+        for property_name in self._identifying_properties(type_name):
+            if isinstance(value := item.get(property_name), list):
+                for element in value:
+                    if isinstance(element, str) and element:
+                        self._index[element] = item["uuid"]
+            elif isinstance(value, str) and value:
+                self._index[value] = item["uuid"]
+
+    def _add_type_name(self, type_name: str) -> None:
+        self._type_names[type_name.lower()] = type_name
+        self._type_names[self._collection_name(type_name)] = type_name
+
+    def _super_type_names(self, type_name: str) -> List[str]:
+        super_type_names = []
+        while ((schema := self._schemas.get(type_name)) and
+               isinstance(super_type_name := schema.get("rdfs:subClassOf"), str) and
+               (super_type_name := super_type_name.replace("/profiles/", "").replace(".json", "")) and
+               (super_type_name != "Item") and (super_type_name not in super_type_names)):  # noqa
+            super_type_names.append(type_name := super_type_name)
+        return super_type_names
+
+    def _type_and_subtype_names(self, type_name: str) -> List[str]:
+        return [name for name in set(self._type_names.values())
+                if name == type_name or type_name in self._super_type_names(name)]
+
+    @staticmethod
+    def _collection_name(type_name: str) -> str:
+        return f"{to_snake_case(type_name).replace('_', '-')}s"
+
+    @staticmethod
+    def _read_inserts(path: str) -> Dict[str, List[dict]]:
+        if os.path.isdir(path):
+            inserts = {}
+            for file_name in sorted(os.listdir(path)):
+                if file_name.endswith(".json"):
+                    with io.open(os.path.join(path, file_name)) as f:
+                        inserts[to_camel_case(file_name[:-5])] = json.load(f)
+            return inserts
+        with io.open(path) as f:
+            return json.load(f)
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args) -> None:  # noqa
+        pass
+
+
+def _error_response(status: int, title: str, description: Optional[str] = None,
+                    headers: Optional[dict] = None) -> PyramidResponse:
+    # Similar in form to errors from the actual portal, e.g. with HTTPNotFound in the @type for 404.
+    error_type = {404: "HTTPNotFound", 409: "HTTPConflict", 422: "ValidationFailure",
+                  429: "HTTPTooManyRequests"}.get(status, "HTTPInternalServerError")
+    response = PyramidResponse(json.dumps({"status": "error", "code": status, "title": title,
+                                           "description": description or title, "@type": [error_type, "Error"]}),
+                               status=status, content_type=f"{Portal.MIME_TYPE_JSON}; charset=utf-8")
+    for header_name, header_value in (headers or {}).items():
+        response.headers[header_name] = header_value
+    return response
+
+
+def _request_json(request) -> Optional[Any]:
+    try:
+        return json.loads(request.body or b"null")
+    except Exception:
+        return None
+
+
+def _json_type_name(value: Any) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    elif isinstance(value, int):
+        return "integer"
+    elif isinstance(value, float):
+        return "number"
+    elif isinstance(value, list):
+        return "array"
+    elif isinstance(value, dict):
+        return "object"
+    return "string"
+
+
+def _to_int(value: Optional[str], default: int) -> int:
+    try:
+        return int(value)
+    except Exception:
+        return default
@@ -1,7 +1,7 @@
 from copy import deepcopy
-from functools import lru_cache
 from typing import Any, Callable, List, Optional, Tuple, Type, Union
 from dcicutils.data_readers import RowReader
+from dcicutils.function_cache_decorator import instance_cache
 from dcicutils.misc_utils import create_readonly_object
 from dcicutils.portal_utils import Portal
 from dcicutils.schema_utils import Schema
@@ -27,22 +27,22 @@ class PortalObject:
         return self._portal
 
     @property
-    @lru_cache(maxsize=1)
+    @instance_cache(maxsize=1)
     def type(self) -> str:
         return self._type or Portal.get_schema_type(self._data) or ""
 
     @property
-    @lru_cache(maxsize=1)
+    @instance_cache(maxsize=1)
     def types(self) -> Optional[List[str]]:
         return [self._type] if self._type else Portal.get_schema_types(self._data)
 
     @property
-    @lru_cache(maxsize=1)
+    @instance_cache(maxsize=1)
     def uuid(self) -> Optional[str]:
         return self._data.get("uuid") if isinstance(self._data, dict) else None
 
     @property
-    @lru_cache(maxsize=1)
+    @instance_cache(maxsize=1)
     def schema(self) -> Optional[dict]:
         return self._portal.get_schema(self.type) if self._portal else None
 
@@ -50,7 +50,7 @@ class PortalObject:
         return PortalObject(deepcopy(self.data), portal=self.portal, type=self.type)
 
     @property
-    @lru_cache(maxsize=1)
+    @instance_cache(maxsize=1)
     def identifying_properties(self) -> Optional[List[str]]:
         """
         Returns the list of all identifying property names of this Portal object which actually have values.
@@ -61,7 +61,7 @@ class PortalObject:
         # Migrating to and unifying this in portal_utils.Portal.get_identifying_paths (2024-05-26).
         return self._portal.get_identifying_property_names(self.type, portal_object=self._data) if self._portal else []
 
-    @lru_cache(maxsize=8192)
+    @instance_cache(maxsize=16)
     def lookup(self, raw: bool = False,
                ref_lookup_strategy: Optional[Callable] = None) -> Tuple[Optional[PortalObject], Optional[str], int]:
         if not (identifying_paths := self._get_identifying_paths(ref_lookup_strategy=ref_lookup_strategy)):
@@ -144,7 +144,7 @@ class PortalObject:
                 diffs[_path] = diff_updating(a, b)
         return diffs
 
-    @lru_cache(maxsize=1)
+    @instance_cache(maxsize=1)
     def _get_identifying_paths(self, ref_lookup_strategy: Optional[Callable] = None) -> Optional[List[str]]:
         if not self._portal and (uuid := self.uuid):
             return [f"/{uuid}"]
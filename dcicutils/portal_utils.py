@@ -1,6 +1,6 @@
 from collections import deque
 from functools import lru_cache
-from dcicutils.function_cache_decorator import function_cache
+from dcicutils.function_cache_decorator import instance_cache
 import io
 import json
 from pyramid.config import Configurator as PyramidConfigurator
@@ -10,22 +10,28 @@ from pyramid.router import Router as PyramidRouter
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
 from requests.models import Response
-from threading import Thread
-from typing import Callable, Dict, List, Optional, Tuple, Type, Union
+from threading import Lock, Thread
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
 # from urllib.parse import parse_qs as parse_url_query_string
 from uuid import uuid4 as uuid
 from webtest.app import TestApp, TestResponse
 from wsgiref.simple_server import make_server as wsgi_make_server
 from dcicutils.common import APP_SMAHT, OrchestratedApp, ORCHESTRATED_APPS
 from dcicutils.ff_utils import get_metadata, get_schema, patch_metadata, post_metadata
-from dcicutils.misc_utils import to_camel_case, VirtualApp
+from dcicutils.misc_utils import PRINT, to_camel_case, VirtualApp
 from dcicutils.schema_utils import get_identifying_properties
 from dcicutils.tmpfile_utils import temporary_file
 
 Portal = Type["Portal"]  # Forward type reference for type hints.
 OptionalResponse = Optional[Union[Response, TestResponse]]
 
+_ENDPOINT_TEMPLATE_UUID_REGEX = re.compile(r"^[0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}$")
+_ENDPOINT_TEMPLATE_ACCESSION_REGEX = re.compile(r"^[A-Z0-9]{3,}[0-9][A-Z0-9]{3,}$")
+_ENDPOINT_TEMPLATE_NAME_REGEX = re.compile(r"^[a-z][a-z_-]*$")
+
 
 class Portal:
     """
@@ -44,8 +50,17 @@ class Portal:
     7. From a given "vapp" value; which may be a webtest.app.TestApp,
        or a dcicutils.misc_utils.VirtualApp, or even a pyramid.router.Router.
     8. From another Portal object (i.e. copy constructor).
+
+    HTTP requests to a (non-vapp) server go through a requests.Session owned by this Portal object, so that
+    connections are pooled and reused across calls; the pool_size argument controls the maximum number of
+    pooled connections (per host) and max_retries the number of (urllib3 level) retries on connection errors.
+    Use the close method (or use as a context manager) to release the pooled connections when done.
+
+    An optional instrumentation callable may be given which will be called after each HTTP request with
+    a dictionary describing the request (see PortalInstrumentation for a ready-made implementation).
     """
     DEFAULT_APP = APP_SMAHT
+    DEFAULT_POOL_SIZE = 10
     KEYS_FILE_DIRECTORY = "~"
     MIME_TYPE_JSON = "application/json"
     FILE_TYPE_SCHEMA_NAME = "File"
@@ -71,7 +86,10 @@ class Portal:
                  arg: Optional[Union[Portal, TestApp, VirtualApp, PyramidRouter, dict, tuple, str]] = None,
                  env: Optional[str] = None, server: Optional[str] = None,
                  app: Optional[OrchestratedApp] = None,
-                 raise_exception: bool = True) -> None:
+                 raise_exception: bool = True,
+                 pool_size: Optional[int] = None,
+                 max_retries: Optional[int] = None,
+                 instrumentation: Optional[Callable[[dict], Any]] = None) -> None:
 
         def init(unspecified: Optional[list] = []) -> None:
             self._ini_file = None
@@ -93,6 +111,9 @@ class Portal:
             self._server = portal._server
             self._vapp = portal._vapp
             self._app = portal._app
+            self._pool_size = portal._pool_size
+            self._max_retries = portal._max_retries
+            self._instrumentation = portal._instrumentation
 
         def init_from_vapp(vapp: Union[TestApp, VirtualApp, PyramidRouter], unspecified: Optional[list] = []) -> None:
             init(unspecified=unspecified)
@@ -143,6 +164,11 @@ class Portal:
         if (valid_app := app) and not (valid_app := Portal._valid_app(app)):
             raise Exception(f"Portal initialization error; invalid app: {app}")
         self._app = valid_app
+        self._pool_size = Portal.DEFAULT_POOL_SIZE
+        self._max_retries = 0
+        self._instrumentation = None
+        self._session = None
+        self._session_lock = Lock()
         if isinstance(arg, Portal):
             init_from_portal(arg, unspecified=[env, server, app])
         elif isinstance(arg, (TestApp, VirtualApp, PyramidRouter)):
@@ -168,6 +194,12 @@ class Portal:
             init()
         if not self.vapp and not self.key and raise_exception:
             raise Exception("Portal initialization error; neither key nor vapp defined.")
+        if isinstance(pool_size, int) and pool_size > 0:
+            self._pool_size = pool_size
+        if isinstance(max_retries, int) and max_retries >= 0:
+            self._max_retries = max_retries
+        if callable(instrumentation):
+            self._instrumentation = instrumentation
 
     @property
     def ini_file(self) -> Optional[str]:
@@ -209,6 +241,49 @@ class Portal:
     def vapp(self) -> Optional[TestApp]:
         return self._vapp
 
+    @property
+    def pool_size(self) -> int:
+        return self._pool_size
+
+    @property
+    def instrumentation(self) -> Optional[Callable[[dict], Any]]:
+        return self._instrumentation
+
+    @instrumentation.setter
+    def instrumentation(self, value: Optional[Callable[[dict], Any]]) -> None:
+        self._instrumentation = value if callable(value) else None
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Returns the (lazily created) connection pooling requests.Session owned by this Portal object.
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self._pool_size, pool_maxsize=self._pool_size,
+                                          max_retries=self._max_retries)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def close(self) -> None:
+        """
+        Closes the pooled connections of this Portal object; they will be recreated if it is used again.
+        """
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __enter__(self) -> Portal:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
     def get(self, url: str, follow: bool = True,
             raw: bool = False, database: bool = False,
             limit: Optional[int] = None, offset: Optional[int] = None,
@@ -235,13 +310,14 @@ class Portal:
                 url += "&status=deleted"
             else:
                 url += "?status=deleted"
-        if not self.vapp:
-            response = requests.get(url, allow_redirects=follow, **self._kwargs(**kwargs))
-        else:
+        def get() -> OptionalResponse:  # noqa
+            if not self.vapp:
+                return self.session.get(url, allow_redirects=follow, **self._kwargs(**kwargs))
             response = self.vapp.get(url, **self._kwargs(**kwargs))
             if response and response.status_code in [301, 302, 303, 307, 308] and follow:
                 response = response.follow()
-            response = self._response(response)
+            return self._response(response)
+        response = self._instrumented("GET", url, get)
         if raise_for_status:
             response.raise_for_status()
         return response
@@ -249,11 +325,11 @@ class Portal:
     def patch(self, url: str, data: Optional[dict] = None, json: Optional[dict] = None,
               raise_for_status: bool = False, **kwargs) -> OptionalResponse:
         url = self.url(url)
-        if not self.vapp:
-            response = requests.patch(url, data=data, json=json, **self._kwargs(**kwargs))
-        else:
-            response = self.vapp.patch_json(url, json or data, **self._kwargs(**kwargs))
-            response = self._response(response)
+        def patch() -> OptionalResponse:  # noqa
+            if not self.vapp:
+                return self.session.patch(url, data=data, json=json, **self._kwargs(**kwargs))
+            return self._response(self.vapp.patch_json(url, json or data, **self._kwargs(**kwargs)))
+        response = self._instrumented("PATCH", url, patch)
         if raise_for_status:
             response.raise_for_status()
         return response
@@ -264,14 +340,15 @@ class Portal:
         if files and not ("headers" in kwargs):
             # Setting headers to None when using files implies content-type multipart/form-data.
             kwargs["headers"] = None
-        if not self.vapp:
-            response = requests.post(url, data=data, json=json, files=files, **self._kwargs(**kwargs))
-        else:
+        def post() -> OptionalResponse:  # noqa
+            if not self.vapp:
+                return self.session.post(url, data=data, json=json, files=files, **self._kwargs(**kwargs))
             if files:
                 response = self.vapp.post(url, json or data, upload_files=files, **self._kwargs(**kwargs))
             else:
                 response = self.vapp.post_json(url, json or data, upload_files=files, **self._kwargs(**kwargs))
-            response = self._response(response)
+            return self._response(response)
+        response = self._instrumented("POST", url, post)
         if raise_for_status:
             response.raise_for_status()
         return response
@@ -337,9 +414,9 @@ class Portal:
 
     def head(self, url: str, follow: bool = True, raise_exception: bool = False, **kwargs) -> Optional[int]:
         try:
-            response = requests.head(self.url(url), **self._kwargs(**kwargs))
-            if response and response.status_code in [301, 302, 303, 307, 308] and (follow is not False):
-                response = response.follow()
+            url = self.url(url)
+            response = self._instrumented("HEAD", url, lambda: self.session.head(
+                url, allow_redirects=follow is not False, **self._kwargs(**kwargs)))
             return response.status_code
         except Exception as e:
             if raise_exception is True:
@@ -361,14 +438,14 @@ class Portal:
         except Exception:
             return False
 
-    @lru_cache(maxsize=100)
+    @instance_cache(maxsize=100)
     def get_schema(self, schema_name: str) -> Optional[dict]:
         try:
             return get_schema(self.schema_name(schema_name), portal_vapp=self.vapp, key=self.key)
         except Exception:
             return None
 
-    @lru_cache(maxsize=1)
+    @instance_cache(maxsize=1)
     def get_schemas(self) -> dict:
         return self.get("/profiles/").json()
 
@@ -438,7 +515,7 @@ class Portal:
         if value_types := Portal.get_schema_types(portal_object):
             return value_types[0]
 
-    @lru_cache(maxsize=1)
+    @instance_cache(maxsize=1)
     def get_schemas_super_type_map(self) -> dict:
         """
         Returns the "super type map" for all of the known schemas (via /profiles).
@@ -471,7 +548,7 @@ class Portal:
             super_type_map_flattened[super_type_name] = list_breadth_first(super_type_map, super_type_name)
         return super_type_map_flattened
 
-    @lru_cache(maxsize=100)
+    @instance_cache(maxsize=100)
     def get_schema_super_type_names(self, schema_name: str, include_schema_name: bool = False) -> List[str]:
         super_types = set()
         if isinstance(schema_name, str) and (schema_name := self.schema_name(schema_name)):
@@ -484,13 +561,13 @@ class Portal:
             super_types.insert(0, schema_name)
         return super_types
 
-    @lru_cache(maxsize=100)
+    @instance_cache(maxsize=100)
     def get_schema_subtype_names(self, type_name: str) -> List[str]:
         if not (schemas_super_type_map := self.get_schemas_super_type_map()):
             return []
         return schemas_super_type_map.get(type_name, [])
 
-    @function_cache(maxsize=100, serialize_key=True)
+    @instance_cache(maxsize=100, serialize_key=True)
     def get_identifying_paths(self, portal_object: dict, portal_type: Optional[Union[str, dict]] = None,
                               first_only: bool = False,
                               lookup_strategy: Optional[Union[Callable, bool]] = None) -> List[str]:
@@ -593,7 +670,7 @@ class Portal:
                 return results
         return results
 
-    @function_cache(maxsize=100, serialize_key=True)
+    @instance_cache(maxsize=100, serialize_key=True)
     def get_identifying_path(self, portal_object: dict, portal_type: Optional[Union[str, dict]] = None,
                              lookup_strategy: Optional[Union[Callable, bool]] = None) -> Optional[str]:
         if identifying_paths := self.get_identifying_paths(portal_object, portal_type, first_only=True,
@@ -601,7 +678,7 @@ class Portal:
             return identifying_paths[0]
         return None
 
-    @function_cache(maxsize=100, serialize_key=True)
+    @instance_cache(maxsize=100, serialize_key=True)
     def get_identifying_property_names(self, schema: Union[str, dict],
                                        portal_object: Optional[dict] = None) -> List[str]:
         """
@@ -716,6 +793,72 @@ class Portal:
             url += ("&" if "?" in url else "?") + "datastore=database"
         return url
 
+    def _instrumented(self, verb: str, url: str, request: Callable[[], OptionalResponse]) -> OptionalResponse:
+        if not (instrumentation := self._instrumentation):
+            return request()
+        response = None
+        started = time.perf_counter()
+        try:
+            response = request()
+            return response
+        finally:
+            latency = time.perf_counter() - started
+            try:
+                instrumentation({"verb": verb, "endpoint": Portal.endpoint_template(url), "url": url,
+                                 "status": getattr(response, "status_code", None), "latency": latency,
+                                 "bytes": Portal._response_nbytes(response),
+                                 "retries": Portal._response_nretries(response)})
+            except Exception:
+                pass  # Instrumentation must never break the actual request.
+
+    @staticmethod
+    def endpoint_template(url: str) -> str:
+        """
+        Returns the given URL reduced to a template suitable for grouping requests by endpoint; i.e. the
+        server and query string are dropped, and any path component (other than the first) which is not
+        plainly a lower-case collection/endpoint name (e.g. a uuid, accession, alias, or type-name/file-name),
+        as well as a first path component which is a uuid or accession, is replaced with {id}; so for example
+        https://server/files-fastq/4DNFIXYZ1234/?frame=raw is reduced to /files-fastq/{id}/.
+        """
+        if not isinstance(url, str):
+            return ""
+        if (lowercase_url := url.lower()).startswith("http://") or lowercase_url.startswith("https://"):
+            url = url[url.find("//") + 2:]
+            url = url[url.find("/"):] if "/" in url else "/"
+        if (question_mark := url.find("?")) >= 0:
+            url = url[:question_mark]
+        segments = url.split("/")
+        for index, segment in enumerate(segments):
+            if not segment or segment.startswith("@@"):
+                continue
+            if index <= 1:
+                if _ENDPOINT_TEMPLATE_UUID_REGEX.match(segment) or _ENDPOINT_TEMPLATE_ACCESSION_REGEX.match(segment):
+                    segments[index] = "{id}"
+            elif not _ENDPOINT_TEMPLATE_NAME_REGEX.match(segment):
+                segments[index] = "{id}"
+        return "/".join(segments) or "/"
+
+    @staticmethod
+    def _response_nbytes(response: OptionalResponse) -> Optional[int]:
+        try:
+            if isinstance(response, Response):
+                if isinstance(content_length := response.headers.get("Content-Length"), str):
+                    return int(content_length)
+                return len(response.content)
+            elif response is not None:
+                # Note that the TestResponseWrapper (see _response) wraps the actual TestResponse.
+                return len(getattr(response, "_response", response).body)
+        except Exception:
+            pass
+        return None
+
+    @staticmethod
+    def _response_nretries(response: OptionalResponse) -> int:
+        try:
+            return len(response.raw.retries.history)
+        except Exception:
+            return 0
+
     def _kwargs(self, **kwargs) -> dict:
         if "headers" in kwargs:
             result_kwargs = {"headers": kwargs["headers"]}
@@ -794,6 +937,9 @@ class Portal:
                     self._response = response
                 def __getattr__(self, attr):  # noqa
                     return getattr(self._response, attr)
+                @property  # noqa
+                def status_code(self):  # Otherwise would be that of this (wrapper) TestResponse, i.e. always 200.
+                    return self._response.status_code
                 def json(self):  # noqa
                     return self._response.json
                 def raise_for_status(self):  # noqa
@@ -862,12 +1008,15 @@ class Portal:
             for endpoint in endpoints:
                 if (endpoint_path := endpoint.get("path")) and (endpoint_function := endpoint.get("function")):
                     endpoint_method = endpoint.get("method", "GET")
-                    def endpoint_wrapper(request):  # noqa
-                        response = endpoint_function(request)
+                    def endpoint_wrapper(request, endpoint_function=endpoint_function):  # noqa
+                        # Endpoint functions return JSON-able data, or an actual (Pyramid) response, e.g. for errors.
+                        if isinstance(response := endpoint_function(request), PyramidResponse):
+                            return response
                         return PyramidResponse(json.dumps(response),
                                                content_type=f"{Portal.MIME_TYPE_JSON}; charset=utf-8")
                     endpoint_id = str(uuid())
-                    config.add_route(endpoint_id, endpoint_path)
+                    # The request_method route predicate allows the same path for different methods.
+                    config.add_route(endpoint_id, endpoint_path, request_method=endpoint_method)
                     config.add_view(endpoint_wrapper, route_name=endpoint_id, request_method=endpoint_method)
                     nendpoints += 1
             if nendpoints == 0:
@@ -885,3 +1034,80 @@ class Portal:
                 server_thread.start()
                 return server_thread
             start_server()
+
+
+class PortalInstrumentation:
+    """
+    Ready-made instrumentation hook for the Portal class; records per-request verb, endpoint template,
+    status, latency, bytes, and retry count, and summarizes these by endpoint, with latency percentiles.
+    Thread-safe, so a single instance may be shared by any number of Portal objects. Typical usage:
+
+      instrumentation = PortalInstrumentation()
+      portal = Portal(env, instrumentation=instrumentation)
+      atexit.register(instrumentation.print_summary)
+    """
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self, max_records: Optional[int] = None) -> None:
+        self._records = deque(maxlen=max_records if isinstance(max_records, int) and max_records > 0 else None)
+        self._lock = Lock()
+
+    def __call__(self, record: dict) -> None:
+        with self._lock:
+            self._records.append(record)
+
+    @property
+    def records(self) -> List[dict]:
+        with self._lock:
+            return list(self._records)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Returns a dictionary, keyed by verb and endpoint template (e.g. "GET /{id}/"), of dictionaries
+        containing the request count, error count (no response or HTTP status >= 400), total bytes,
+        total retries, and latency (in seconds) total, mean, maximum, and percentiles (e.g. p50).
+        """
+        grouped = {}
+        for record in self.records:
+            grouped.setdefault(f"{record.get('verb')} {record.get('endpoint')}", []).append(record)
+        summary = {}
+        for endpoint in sorted(grouped):
+            records = grouped[endpoint]
+            latencies = sorted(record.get("latency") or 0 for record in records)
+            summary[endpoint] = {
+                "count": len(records),
+                "errors": len([record for record in records
+                               if not isinstance(status := record.get("status"), int) or status >= 400]),
+                "bytes": sum(record.get("bytes") or 0 for record in records),
+                "retries": sum(record.get("retries") or 0 for record in records),
+                "latency_total": sum(latencies),
+                "latency_mean": sum(latencies) / len(latencies),
+                "latency_max": latencies[-1],
+                **{f"latency_p{percentile}": _percentile(latencies, percentile) for percentile in self.PERCENTILES}
+            }
+        return summary
+
+    def print_summary(self, printf: Optional[Callable] = None) -> None:
+        printf = printf if callable(printf) else PRINT
+        if not (summary := self.summary()):
+            return
+        printf(f"Portal requests: {sum(item['count'] for item in summary.values())}")
+        for endpoint, item in summary.items():
+            percentiles = " ".join(f"p{percentile}={item[f'latency_p{percentile}'] * 1000:.1f}ms"
+                                   for percentile in self.PERCENTILES)
+            printf(f"- {endpoint}: count={item['count']} errors={item['errors']} retries={item['retries']}"
+                   f" bytes={item['bytes']} {percentiles} max={item['latency_max'] * 1000:.1f}ms")
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    """
+    Returns the given percentile (0-100) of the given (sorted) list of values using the nearest-rank method.
+    """
+    if not sorted_values:
+        return 0
+    rank = max(int(-(-percentile * len(sorted_values) // 100)), 1)  # i.e. ceiling
+    return sorted_values[min(rank, len(sorted_values)) - 1]
@@ -364,7 +364,7 @@ class RetryManager(Retry):
     @classmethod
     @contextlib.contextmanager
     def retry_options(cls, name_key, retries_allowed=None, wait_seconds=None,
-                      wait_increment=None, wait_multiplier=None):
+                      wait_increment=None, wait_multiplier=None, retry_on=None, jitter=None, max_elapsed=None):
         if not isinstance(name_key, str):
             raise ValueError("The required 'name_key' argument to the RetryManager.retry_options context manager"
                              " must be a string: %r" % name_key)
@@ -385,6 +385,13 @@ class RetryManager(Retry):
         if wait_increment is not None or wait_multiplier is not None:
             options['wait_adjustor'] = function_profile.make_wait_adjustor(wait_increment=wait_increment,
                                                                            wait_multiplier=wait_multiplier)
+        if retry_on is not None:
+            options['retry_on'] = retry_on
+            options['retryable'] = function_profile.make_retryable(retry_on)
+        if jitter is not None:
+            options['jitter'] = jitter
+        if max_elapsed is not None:
+            options['max_elapsed'] = max_elapsed
         with local_attrs(function_profile, **options):
             yield
 
@@ -2291,13 +2298,32 @@ class MockBotoS3Client(MockBoto3Client):
         with io.open(Filename, 'wb') as fp:
             self.download_fileobj(Bucket=Bucket, Key=Key, Fileobj=fp)
 
-    def get_object(self, Bucket, Key, **kwargs):  # noqa - Uppercase argument names are chosen by AWS
+    def get_object(self, Bucket, Key, Range=None, **kwargs):  # noqa - Uppercase argument names are chosen by AWS
         self.check_for_kwargs_required_by_mock("get_object", Bucket=Bucket, Key=Key, **kwargs)
 
         head_metadata = self.head_object(Bucket=Bucket, Key=Key, **kwargs)
 
         pseudo_filename = os.path.join(Bucket, Key)
 
+        if Range is not None:
+            content = self.s3_files.files[pseudo_filename]
+            size = len(content)
+            matched = re.match(r"^bytes=([0-9]+)-([0-9]*)$", Range)
+            assert matched, f"get_object mock doesn't support Range={Range!r}."
+            start = int(matched.group(1))
+            end = min(int(matched.group(2)) if matched.group(2) else size - 1, size - 1)
+            if start >= size:
+                raise ClientError(operation_name='GetObject',
+                                  error_response={  # noQA - PyCharm wrongly complains about this dictionary
+                                      "Error": {"Code": "InvalidRange",
+                                                "Message": "The requested range is not satisfiable"},
+                                      "ResponseMetadata": self.compute_mock_response_metadata(http_status_code=416),
+                                  })
+            return dict(head_metadata,
+                        ContentLength=end - start + 1,
+                        ContentRange=f"bytes {start}-{end}/{size}",
+                        Body=io.BytesIO(content[start:end + 1]))
+
         return dict(head_metadata,
                     Body=self.s3_files.open(pseudo_filename, 'rb'))
 
@@ -2330,6 +2356,111 @@ class MockBotoS3Client(MockBoto3Client):
             'ETag': self._content_etag(Body)
         }
 
+    MOCK_MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+
+    def _multipart_uploads(self) -> Dict[str, Dict[str, Any]]:
+        uploads_marker = '_s3_multipart_uploads'
+        uploads = self.boto3.shared_reality.get(uploads_marker)
+        if uploads is None:
+            self.boto3.shared_reality[uploads_marker] = uploads = {}
+        return uploads
+
+    def _multipart_objects(self) -> Dict[str, Dict[str, Any]]:
+        objects_marker = '_s3_multipart_objects'
+        objects = self.boto3.shared_reality.get(objects_marker)
+        if objects is None:
+            self.boto3.shared_reality[objects_marker] = objects = {}
+        return objects
+
+    def _multipart_object(self, filename, content) -> Optional[Dict[str, Any]]:
+        multipart_object = self._multipart_objects().get(filename)
+        if multipart_object and multipart_object['MD5'] == hashlib.md5(content).hexdigest():
+            return multipart_object
+        return None
+
+    def _object_etag(self, filename, content):
+        multipart_object = self._multipart_object(filename, content)
+        return multipart_object['ETag'] if multipart_object else self._content_etag(content)
+
+    def _multipart_upload(self, Bucket, Key, UploadId) -> Dict[str, Any]:  # noQA - AWS argument naming style
+        upload = self._multipart_uploads().get(UploadId)
+        if not upload or upload['Bucket'] != Bucket or upload['Key'] != Key:
+            raise ClientError(operation_name='UploadPart',
+                              error_response={  # noQA - PyCharm wrongly complains about this dictionary
+                                  "Error": {"Code": "NoSuchUpload", "Message": "The specified upload does not exist."},
+                                  "ResponseMetadata": self.compute_mock_response_metadata(http_status_code=404),
+                              })
+        return upload
+
+    def create_multipart_upload(self, *, Bucket, Key, ContentType=None,  # noQA - AWS argument naming style
+                                StorageClass=None, Tagging=None, ServerSideEncryption=None, SSEKMSKeyId=None,
+                                **kwargs):
+        # StorageClass, Tagging, and encryption arguments are accepted (as in GlacierUtils) but not modeled.
+        ignored(StorageClass, Tagging, ServerSideEncryption, SSEKMSKeyId)
+        assert not kwargs, "create_multipart_upload mock doesn't support %s." % kwargs
+        upload_id = str(uuid.uuid4()).replace('-', '')
+        self._multipart_uploads()[upload_id] = {'Bucket': Bucket, 'Key': Key, 'ContentType': ContentType, 'Parts': {}}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, *, Bucket, Key, UploadId, PartNumber, Body):  # noQA - AWS argument naming style
+        upload = self._multipart_upload(Bucket=Bucket, Key=Key, UploadId=UploadId)
+        assert 1 <= PartNumber <= 10000, f"Invalid PartNumber: {PartNumber}"
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        upload['Parts'][PartNumber] = Body
+        return {'ETag': self._content_etag(Body)}
+
+    def upload_part_copy(self, *, CopySource, Bucket, Key, UploadId, PartNumber,  # noQA - AWS argument naming style
+                         CopySourceRange=None, CopySourceVersionId=None):
+        ignored(CopySourceVersionId)
+        upload = self._multipart_upload(Bucket=Bucket, Key=Key, UploadId=UploadId)
+        assert 1 <= PartNumber <= 10000, f"Invalid PartNumber: {PartNumber}"
+        source_s3_filename = f"{CopySource['Bucket']}/{CopySource['Key']}"
+        content = self.s3_files.files.get(source_s3_filename)
+        if CopySource.get('VersionId'):
+            source_version = self._get_versioned_object(source_s3_filename, CopySource['VersionId'])
+            content = content if source_version.content is None else source_version.content
+        if content is None:
+            raise Exception(f"S3 location {source_s3_filename} does not exist.")
+        if CopySourceRange is not None:
+            matched = re.match(r"^bytes=([0-9]+)-([0-9]+)$", CopySourceRange)
+            assert matched, f"upload_part_copy mock doesn't support CopySourceRange={CopySourceRange!r}."
+            start, end = int(matched.group(1)), int(matched.group(2))
+            assert start <= end < len(content), f"Invalid CopySourceRange={CopySourceRange!r}."
+            content = content[start:end + 1]
+        upload['Parts'][PartNumber] = content
+        return {'CopyPartResult': {'ETag': self._content_etag(content)}}
+
+    def complete_multipart_upload(self, *, Bucket, Key, UploadId, MultipartUpload):  # noQA - AWS argument naming style
+        upload = self._multipart_upload(Bucket=Bucket, Key=Key, UploadId=UploadId)
+        part_numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert part_numbers and part_numbers == sorted(set(part_numbers)), "Parts must be in ascending order."
+        parts = []
+        for part in MultipartUpload['Parts']:
+            content = upload['Parts'].get(part['PartNumber'])
+            assert content is not None and part['ETag'] == self._content_etag(content), f"Invalid part: {part}"
+            parts.append(content)
+        assert all(len(part) >= self.MOCK_MULTIPART_MIN_PART_SIZE for part in parts[:-1]), (
+            "All parts but the last must be at least %s bytes." % self.MOCK_MULTIPART_MIN_PART_SIZE)
+        del self._multipart_uploads()[UploadId]
+        content = b''.join(parts)
+        self.put_object(Bucket=Bucket, Key=Key, Body=content, ContentType=upload['ContentType'])
+        # As with S3, the ETag of an object uploaded via multipart upload is the MD5 of its parts' MD5s, and its
+        # part sizes are remembered (e.g. for head_object with PartNumber), for as long as its content is unchanged.
+        etag = (f'"{hashlib.md5(b"".join(hashlib.md5(part).digest() for part in parts)).hexdigest()}'
+                f'-{len(parts)}"')
+        self._multipart_objects()[f"{Bucket}/{Key}"] = {
+            'ETag': etag, 'MD5': hashlib.md5(content).hexdigest(), 'PartSizes': [len(part) for part in parts]
+        }
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': etag}
+
+    def abort_multipart_upload(self, *, Bucket, Key, UploadId):  # noQA - AWS argument naming style
+        self._multipart_upload(Bucket=Bucket, Key=Key, UploadId=UploadId)
+        del self._multipart_uploads()[UploadId]
+        return {}
+
     @staticmethod
     def _content_etag(content):
         # For reasons known only to AWS, the ETag, though described as an MD5 hash, begins and ends with
@@ -2341,7 +2472,7 @@ class MockBotoS3Client(MockBoto3Client):
     def Bucket(self, name):  # noQA - AWS function naming style
         return MockBotoS3Bucket(s3=self, name=name)
 
-    def head_object(self, Bucket, Key, **kwargs):  # noQA - AWS argument naming style
+    def head_object(self, Bucket, Key, PartNumber=None, **kwargs):  # noQA - AWS argument naming style
         self.check_for_kwargs_required_by_mock("head_object", Bucket=Bucket, Key=Key, **kwargs)
 
         pseudo_filename = os.path.join(Bucket, Key)
@@ -2353,11 +2484,17 @@ class MockBotoS3Client(MockBoto3Client):
             result = {
                 'Bucket': Bucket,
                 'Key': Key,
-                'ETag': self._content_etag(content),
+                'ETag': self._object_etag(pseudo_filename, content),
                 'ContentLength': len(content),
                 'StorageClass': attribute_block.storage_class,  # self._object_storage_class(filename=pseudo_filename)
                 # Numerous others, but this is enough to make the dictionary non-empty and to satisfy some of our tools
             }
+            if PartNumber is not None:
+                multipart_object = self._multipart_object(pseudo_filename, content)
+                part_sizes = multipart_object['PartSizes'] if multipart_object else [len(content)]
+                assert 1 <= PartNumber <= len(part_sizes), f"Invalid PartNumber: {PartNumber}"
+                result['ContentLength'] = part_sizes[PartNumber - 1]
+                result['PartsCount'] = len(part_sizes)
             restoration = attribute_block.restoration
             if restoration:
                 assert isinstance(restoration, MockTemporaryRestoration)
@@ -2646,9 +2783,73 @@ class MockBotoS3Client(MockBoto3Client):
             # "StartAfter": ...,
         }
 
-    def list_objects_v2(self, Bucket):  # noQA - AWS argument naming style
-        # This is different but similar to list_objects. However, we don't really care about that.
-        return self.list_objects(Bucket=Bucket)
+    def list_objects_v2(self, Bucket, Prefix=None, ContinuationToken=None, StartAfter=None,  # noQA - AWS naming
+                        MaxKeys=1000):
+        # Ref: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/list_objects_v2.html
+        # Like list_objects but (unlike that mock) this pages results, in key order, MaxKeys at a time; our mock
+        # continuation token is simply the last key returned. Deleted (i.e. delete-marked) objects are omitted.
+        bucket_prefix = Bucket + "/"
+        bucket_prefix_length = len(bucket_prefix)
+        if not any(filename.startswith(bucket_prefix) for filename in list(self.s3_files.files)):
+            raise ClientError(operation_name='ListObjectsV2',
+                              error_response={  # noQA - PyCharm wrongly complains about this dictionary
+                                  "Error": {"Code": "NoSuchBucket", "Message": "The specified bucket does not exist"},
+                                  "ResponseMetadata": self.compute_mock_response_metadata(http_status_code=404),
+                              })
+        search_prefix = bucket_prefix + (Prefix or '')
+        start_after = ContinuationToken or StartAfter
+        filenames = sorted(filename for filename, content in list(self.s3_files.files.items())
+                           if (filename.startswith(search_prefix) and content is not None and
+                               len(filename) > bucket_prefix_length and
+                               (not start_after or filename[bucket_prefix_length:] > start_after)))
+        is_truncated = len(filenames) > MaxKeys
+        found = []
+        for filename in filenames[:MaxKeys]:
+            content = self.s3_files.files[filename]
+            found.append({
+                'Key': filename[bucket_prefix_length:],
+                'ETag': self._object_etag(filename, content),
+                'LastModified': self._object_last_modified(filename=filename),
+                "Size": len(content),
+                "StorageClass": self._object_storage_class(filename=filename),
+            })
+        result = {
+            "Contents": found,
+            "KeyCount": len(found),
+            "IsTruncated": is_truncated,
+            "MaxKeys": MaxKeys,
+            "Name": Bucket,
+            "Prefix": Prefix,
+        }
+        if is_truncated:
+            result["NextContinuationToken"] = found[-1]['Key']
+        return result
+
+    def delete_objects(self, Bucket, Delete):  # noQA - AWS argument naming style
+        # Ref: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/delete_objects.html
+        objects = Delete.get('Objects') or []
+        assert len(objects) <= 1000, "The delete_objects request may specify at most 1000 keys."
+        deleted = []
+        errors = []
+        for obj in objects:
+            s3_filename = f"{Bucket}/{obj['Key']}"
+            try:
+                if version_id := obj.get('VersionId'):
+                    props = self._delete_versioned_object(s3_filename=s3_filename, version_id=version_id)
+                elif self.s3_files.bucket_uses_versioning(Bucket):
+                    props = self._delete_current_version(s3_filename=s3_filename)
+                else:
+                    self.s3_files.files.pop(s3_filename, None)
+                    props = {}
+                deleted.append(dict(obj, **props))
+            except ClientError as e:
+                errors.append(dict(obj, Code=e.response['Error']['Code'], Message=e.response['Error']['Message']))
+        result = {'ResponseMetadata': self.compute_mock_response_metadata()}
+        if not Delete.get('Quiet'):
+            result['Deleted'] = deleted
+        if errors:
+            result['Errors'] = errors
+        return result
 
     def copy_object(self, CopySource, Bucket, Key, CopySourceVersionId=None,
                     StorageClass: Optional[S3StorageClass] = None):
@@ -2744,9 +2945,8 @@ class MockBotoS3Client(MockBoto3Client):
         delete_marker = self.archive_current_version(s3_filename, replacement_class=MockObjectDeleteMarker)
         if delete_marker:
             assert isinstance(delete_marker, MockObjectDeleteMarker)
-            all_versions = self._object_all_versions(s3_filename)
-            all_versions.append(delete_marker)
-            return {'DeleteMarker': True}
+            # The delete marker is already registered (as the newest version) by archive_current_version.
+            return {'DeleteMarker': True, 'DeleteMarkerVersionId': delete_marker.version_id}
         else:
             return {}
 
@@ -2846,7 +3046,7 @@ class MockBotoS3Client(MockBoto3Client):
                             'Key': key,
                             'VersionId': version.version_id,
                             'IsLatest': version == most_recent_version,
-                            'ETag': self._content_etag(content),
+                            'ETag': self._content_etag(content if version.content is None else version.content),
                             'Size': len(content if version.content is None else version.content),
                             'StorageClass': version.storage_class,
                             'LastModified': version.last_modified,  # type datetime.datetime
@@ -1,6 +1,7 @@
 import redis
 import datetime
-from typing import Union
+from typing import Callable, Iterator, Union
+from dcicutils.misc_utils import TokenBucket
 # Low level utilities for working with Redis
 
 
@@ -140,6 +141,71 @@ class RedisBase(object):
         encoded_dict = {self._encode_value(k): self._encode_value(v) for k, v in items.items()}
         return self.redis.hset(key, mapping=encoded_dict)
 
+    def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        """ Increments the (integer) value of field on hash key by amount https://redis.io/commands/hincrby/
+        :param key: hash key on which to increment the field
+        :param field: field whose value to increment (from 0 if it does not exist)
+        :param amount: amount by which to increment the value
+        :return: the value after the increment
+        """
+        return self.redis.hincrby(self._encode_value(key), self._encode_value(field), amount)
+
+    def scan_keys(self, pattern: str) -> Iterator[str]:
+        """ Iterates over the keys matching the given pattern https://redis.io/commands/scan/
+        :param pattern: glob-style pattern for keys to match
+        :return: generator of matching keys
+        """
+        for key in self.redis.scan_iter(match=self._encode_value(pattern)):
+            yield self._decode_value(key)
+
+    def register_script(self, script: str) -> Callable:
+        """ Registers the given Lua script, to be run atomically https://redis.io/commands/evalsha/
+        :param script: Lua script
+        :return: callable taking keys and args (lists) which runs the script on them
+        """
+        return self.redis.register_script(script)
+
     def dbsize(self) -> int:
         """ Returns number of keys in redis https://redis.io/commands/dbsize/ """
         return self.redis.dbsize()
+
+
+class RedisTokenBucket(TokenBucket):
+    """ A TokenBucket (see misc_utils) whose tokens are kept in Redis, under the given key, and so are shared by
+        all threads and processes (e.g. a fleet of workers) using it; its state is updated atomically by a Lua
+        script, using the Redis server clock (so the clocks of the clients need not agree).
+    """
+
+    TAKE_SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local capacity = tonumber(ARGV[2])
+        local requested = tonumber(ARGV[3])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+        local tokens = tonumber(state[1]) or capacity
+        local timestamp = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+        local wait = 0
+        if tokens >= requested then
+            tokens = tokens - requested
+        else
+            wait = (requested - tokens) / rate
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'timestamp', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+        return tostring(wait)
+    """
+
+    def __init__(self, redis_base: RedisBase, key: str, **kwargs):
+        """ Takes the same (keyword) arguments as TokenBucket
+        :param redis_base: RedisBase for the Redis in which to keep the tokens
+        :param key: key under which to keep the tokens, shared by all users of the same rate limit
+        """
+        super().__init__(**kwargs)
+        self.key = key
+        self._take_script = redis_base.register_script(self.TAKE_SCRIPT)
+
+    def _take(self, tokens):
+        return float(RedisBase._decode_value(self._take_script(keys=[self.key],
+                                                               args=[self.rate, self.capacity, tokens])))
@@ -1,12 +1,21 @@
 import boto3
+import datetime
+import hashlib
+import io
+import itertools
 import json
 import logging
 import mimetypes
 import os
-
-from io import BytesIO
-from typing import Optional, Any, Union, Literal
-from zipfile import ZipFile
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Optional, Any, Union, Literal, Callable, Iterable, Iterator, Dict, List, Tuple
+from zipfile import ZipFile, ZipInfo
 from .base import get_beanstalk_real_url
 from .common import (
     EnvName,
@@ -18,8 +27,9 @@ from .common import (
 from .env_base import s3Base
 from .env_manager import EnvManager
 from .env_utils import full_env_name, get_env_real_url, EnvUtils
-from .exceptions import InferredBucketConflict, BeanstalkOperationNotImplemented
-from .misc_utils import PRINT, exported, merge_key_value_dict_lists, key_value_dict
+from .exceptions import InferredBucketConflict, BeanstalkOperationNotImplemented, S3TransferVerificationError
+from .file_utils import S3_ETAG_MULTIPART_CHUNK_SIZE, S3_ETAG_MULTIPART_THRESHOLD, compute_multipart_etag
+from .misc_utils import PRINT, chunked, exported, ignored, merge_key_value_dict_lists, key_value_dict
 
 
 # For legacy reasons, other modules or repos might expect these names in this file.
@@ -87,7 +97,7 @@ class s3Utils(s3Base):  # NOQA - This class name violates style rules, but a lot
                  blob_bucket=None, metadata_bucket=None, tibanna_output_bucket=None,
                  tibanna_cwls_bucket=None,
                  # The env arg is not allowed to be passed positionally because we periodically add preceding args.
-                 *, env=None):
+                 *, env=None, rate_limiter=None):
         """ Initializes s3 utils in one of three ways:
         1) If 'GLOBAL_ENV_BUCKET' is set to an S3 env bucket, use that bucket to fetch the env for the buckets.
            We then use this env to build the bucket names. If there is only one such env, env can be None or omitted.
@@ -95,12 +105,15 @@ class s3Utils(s3Base):  # NOQA - This class name violates style rules, but a lot
            we use this kwarg to build the bucket names according to legacy conventions.
         3) With no GLOBAL_ENV_BUCKET or env kwarg,
            we expect bucket kwargs to be set, and use those as bucket names directly.
+        If a rate_limiter is given (see rate_limit_client), all calls by self.s3 are rate limited by it.
         """
         EnvUtils.init(env_name=env)
         self.url = ''
         self._health_json_url = None
         self._health_json = None
         self.s3 = boto3.client('s3', region_name='us-east-1')
+        if rate_limiter:
+            rate_limit_client(self.s3, rate_limiter)
         global_bucket = EnvManager.global_env_bucket_name()
         self.env_manager = None  # In a legacy environment, this will continue to be None
         if sys_bucket is None:
@@ -424,6 +437,94 @@ class s3Utils(s3Base):  # NOQA - This class name violates style rules, but a lot
             logger.warning(f'{bucket}/{key} could not be tagged: {str(e)}')
             raise e
 
+    S3_TAGGING_MAX_WORKERS = 16
+
+    def bulk_get_object_tags(self, objects: List[Tuple[str, str]], max_workers: Optional[int] = None) -> List[dict]:
+        """
+        Gets all tags of each of the given objects, like get_object_tags, but concurrently (up to max_workers
+        at a time), retrying if throttled by S3 (see s3_call_with_throttling_retries).
+
+        Args:
+            objects (list): List of (bucket, key) tuples.
+            max_workers (int): Maximum number of concurrent requests (default S3_TAGGING_MAX_WORKERS).
+
+        Returns:
+            List of results, in the same order as the given objects, each a dict with the bucket and key,
+            and either tags (the list of object tags) or error (a string describing the error).
+        """
+
+        def get_tags(bucket_and_key: Tuple[str, str]) -> dict:
+            bucket, key = bucket_and_key
+            try:
+                response = self.s3_call_with_throttling_retries(self.s3.get_object_tagging, Bucket=bucket, Key=key)
+                return {'bucket': bucket, 'key': key, 'tags': response['TagSet']}
+            except Exception as e:
+                logger.warning(f'Could not get tags for object {bucket}/{key}: {str(e)}')
+                return {'bucket': bucket, 'key': key, 'error': str(e)}
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.S3_TAGGING_MAX_WORKERS) as executor:
+            return list(executor.map(get_tags, objects))
+
+    def bulk_set_object_tags(self, objects: List[Tuple[str, str, KeyValuestringDictList]],
+                             merge_existing_tags: bool = True, max_workers: Optional[int] = None) -> List[dict]:
+        """
+        Adds or replaces tags of each of the given objects, like set_object_tags, but concurrently (up to
+        max_workers at a time), retrying if throttled by S3 (see s3_call_with_throttling_retries).
+
+        Args:
+            objects (list): List of (bucket, key, tags) tuples,
+                with tags of the form [{'Key': 'KEY1','Value': 'VALUE1'}, {...}]
+            merge_existing_tags (bool): If False, existing tags are replaced with the provided ones (use with care!).
+                Otherwise, the provided tags are merged with the existing ones (default)
+            max_workers (int): Maximum number of concurrent read-modify-write cycles (default S3_TAGGING_MAX_WORKERS).
+
+        Returns:
+            List of results, in the same order as the given objects, each a dict with the bucket and key, and either
+            tags (the resulting list of object tags) and version_id (of the object tagged), or error (a string
+            describing the error).
+        """
+
+        def set_tags(bucket_key_and_tags: Tuple[str, str, KeyValuestringDictList]) -> dict:
+            bucket, key, tags = bucket_key_and_tags
+            try:
+                new_tags = tags
+                if merge_existing_tags:
+                    existing_tags = self.s3_call_with_throttling_retries(self.s3.get_object_tagging,
+                                                                         Bucket=bucket, Key=key)['TagSet']
+                    if existing_tags:
+                        new_tags = merge_key_value_dict_lists(existing_tags, new_tags)
+                response = self.s3_call_with_throttling_retries(self.s3.put_object_tagging,
+                                                                Bucket=bucket, Key=key, Tagging={'TagSet': new_tags})
+                return {'bucket': bucket, 'key': key, 'tags': new_tags, 'version_id': response.get('VersionId')}
+            except Exception as e:
+                logger.warning(f'{bucket}/{key} could not be tagged: {str(e)}')
+                return {'bucket': bucket, 'key': key, 'error': str(e)}
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.S3_TAGGING_MAX_WORKERS) as executor:
+            return list(executor.map(set_tags, objects))
+
+    S3_THROTTLING_ERROR_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                                 'TooManyRequestsException', 'ServiceUnavailable', '503'}
+    S3_THROTTLING_RETRIES = 6
+    S3_THROTTLING_WAIT_SECONDS = 0.2  # Doubled on each retry (with jitter).
+
+    @classmethod
+    def s3_call_with_throttling_retries(cls, function: Callable, *args, **kwargs) -> Any:
+        """
+        Calls the given (S3 client) function with the given arguments, retrying (up to S3_THROTTLING_RETRIES times,
+        with exponential backoff and jitter) if it fails with an S3 throttling (e.g. SlowDown) error.
+        """
+        wait_seconds = cls.S3_THROTTLING_WAIT_SECONDS
+        for retry in range(cls.S3_THROTTLING_RETRIES + 1):
+            try:
+                return function(*args, **kwargs)
+            except ClientError as e:
+                if retry >= cls.S3_THROTTLING_RETRIES or e.response.get('Error', {}).get('Code') not in (
+                        cls.S3_THROTTLING_ERROR_CODES):
+                    raise
+            time.sleep(wait_seconds * random.uniform(0.5, 1.5))
+            wait_seconds *= 2
+
     def get_file_size(self, key: S3KeyName, bucket: Optional[S3BucketName] = None,
                       add_bytes: int = 0, add_gb: int = 0, size_in_gb: bool = False):
         """
@@ -447,23 +548,118 @@ class s3Utils(s3Base):  # NOQA - This class name violates style rules, but a lot
 
     @classmethod
     def size(cls, bucket: str) -> int:
-        """Slowly and expensively (if there are a lot of them), count the number of items in a bucket."""
-        sbuck = boto3.resource('s3').Bucket(bucket)  # get only head of objects so we can count them
-        # There is apparently no sbuck.objects.count(), so one has to enumerate them all.
-        # Although one avenue we didn't try that is mentioned in StackOverflow is to go to the billing department
-        # in the AWS console, whch knows how many objects there are.
-        # TODO: It is recommended that if there are expected to be a lot of objects, we should paginate through
-        #       them in chunks of 1000, rather than just pulling .all().
+        """Count the number of items in a bucket (see inventory, which does the real work)."""
+        # There is apparently no way to ask S3 for the count, so one has to enumerate them all; although one avenue
+        # we didn't try that is mentioned in StackOverflow is to go to the billing department in the AWS console,
+        # which knows how many objects there are.
         # Ref: https://stackoverflow.com/questions/2862617/how-can-i-tell-how-many-objects-ive-stored-in-an-s3-bucket
-        return sum(1 for _ in sbuck.objects.all())
+        return cls.inventory(bucket)['count']
 
-    def s3_put(self, obj, upload_key, acl=None):
+    S3_INVENTORY_MAX_WORKERS = 16
+    S3_INVENTORY_SHARD_CHARACTERS = '0123456789abcdef'  # Suits our (mostly) uuid-style keys.
+
+    @classmethod
+    def inventory(cls, bucket: str, prefix: str = '', shard_depth: int = 1, max_workers: Optional[int] = None,
+                  manifest_file: Optional[str] = None, s3=None) -> dict:
         """
-        try to guess content type
+        Returns an inventory of the objects in the given bucket (with keys starting with the given prefix), i.e.
+        the number of them and their total size, in total and by storage class, like:
+
+            {"bucket": "some-bucket", "prefix": "", "shard_depth": 1, "updated": "2026-10-18T12:34:56",
+             "count": 3, "bytes": 3000, "storage_classes": {"STANDARD": {"count": 2, "bytes": 1000},
+                                                            "GLACIER": {"count": 1, "bytes": 2000}},
+             "shards": [...]}
+
+        Rather than one (very long) serial listing, the listing is split into key range shards which are listed
+        concurrently (up to max_workers at a time). The shard boundaries are the prefix followed by each string
+        of shard_depth characters from S3_INVENTORY_SHARD_CHARACTERS, so 16 shards by default, or 256 if 2, etc.
+
+        If a manifest_file is given, the inventory is written to it. If it already exists, each shard is listed
+        only after the last key it previously saw, and the counts added to those there. This picks up new objects
+        whose keys sort after those previously seen (e.g. time-ordered keys), but not deleted ones; for a full
+        inventory, just remove the manifest file first.
         """
+        s3 = s3 or boto3.client('s3')
+        manifest = cls._read_inventory_manifest(manifest_file, bucket=bucket, prefix=prefix, shard_depth=shard_depth)
+        shards = manifest['shards'] if manifest else cls._inventory_shards(prefix=prefix, shard_depth=shard_depth)
+
+        def list_shard(shard: dict) -> dict:  # Returns a new (updated) shard.
+            shard = dict(shard, storage_classes={storage_class: dict(counts)
+                                                 for storage_class, counts in shard['storage_classes'].items()})
+            kwargs = {'Bucket': bucket, 'Prefix': prefix}
+            start_after = shard['last_key'] or shard['start_after']
+            if start_after:
+                kwargs['StartAfter'] = start_after
+            until = shard['until']
+            while True:
+                response = s3.list_objects_v2(**kwargs)
+                for obj in response.get('Contents') or []:
+                    if until is not None and obj['Key'] > until:
+                        return shard
+                    cls._add_to_inventory(shard, obj.get('StorageClass') or 'STANDARD', count=1, nbytes=obj['Size'])
+                    shard['last_key'] = obj['Key']
+                if not response.get('IsTruncated'):
+                    return shard
+                kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+        with ThreadPoolExecutor(max_workers=max_workers or cls.S3_INVENTORY_MAX_WORKERS) as executor:
+            shards = list(executor.map(list_shard, shards))
+
+        result = {'bucket': bucket, 'prefix': prefix, 'shard_depth': shard_depth,
+                  'updated': datetime.datetime.now().isoformat(timespec='seconds'),
+                  'count': 0, 'bytes': 0, 'storage_classes': {}, 'shards': shards}
+        for shard in shards:
+            for storage_class, counts in shard['storage_classes'].items():
+                cls._add_to_inventory(result, storage_class, count=counts['count'], nbytes=counts['bytes'])
+        if manifest_file:
+            with io.open(manifest_file + '.tmp', 'w') as fp:
+                json.dump(result, fp, indent=2)
+            os.replace(manifest_file + '.tmp', manifest_file)
+        return result
+
+    @classmethod
+    def _inventory_shards(cls, prefix: str, shard_depth: int) -> List[dict]:
+        # Each shard has the keys after its start_after up to and including its until (None meaning unbounded).
+        boundaries = [prefix + ''.join(characters)
+                      for characters in itertools.product(cls.S3_INVENTORY_SHARD_CHARACTERS, repeat=shard_depth)]
+        boundaries = [None] + boundaries[1:] + [None]
+        return [{'start_after': start_after, 'until': until, 'last_key': None,
+                 'count': 0, 'bytes': 0, 'storage_classes': {}}
+                for start_after, until in zip(boundaries, boundaries[1:])]
+
+    @staticmethod
+    def _add_to_inventory(inventory: dict, storage_class: str, count: int, nbytes: int) -> None:
+        inventory['count'] += count
+        inventory['bytes'] += nbytes
+        counts = inventory['storage_classes'].setdefault(storage_class, {'count': 0, 'bytes': 0})
+        counts['count'] += count
+        counts['bytes'] += nbytes
+
+    @staticmethod
+    def _read_inventory_manifest(manifest_file: Optional[str], bucket: str, prefix: str,
+                                 shard_depth: int) -> Optional[dict]:
+        if not manifest_file or not os.path.exists(manifest_file):
+            return None
+        with io.open(manifest_file) as fp:
+            manifest = json.load(fp)
+        if [manifest.get(name) for name in ('bucket', 'prefix', 'shard_depth')] != [bucket, prefix, shard_depth]:
+            raise ValueError(f"The inventory manifest {manifest_file} is for bucket {manifest.get('bucket')!r}"
+                             f" prefix {manifest.get('prefix')!r} shard depth {manifest.get('shard_depth')!r},"
+                             f" not bucket {bucket!r} prefix {prefix!r} shard depth {shard_depth!r}.")
+        return manifest
+
+    @staticmethod
+    def guess_content_type(upload_key: str) -> str:
         content_type = mimetypes.guess_type(upload_key)[0]
         if content_type is None:
             content_type = 'binary/octet-stream'
+        return content_type
+
+    def s3_put(self, obj, upload_key, acl=None):
+        """
+        try to guess content type
+        """
+        content_type = self.guess_content_type(upload_key)
         if isinstance(obj, dict):
             obj = json.dumps(obj)
         if acl:
@@ -479,6 +675,35 @@ class s3Utils(s3Base):  # NOQA - This class name violates style rules, but a lot
                                       Body=obj,
                                       ContentType=content_type)
 
+    def s3_put_stream(self, stream, upload_key, acl=None, part_size: Optional[int] = None) -> dict:
+        """
+        Uploads the content of the given (readable) stream to the given key, like s3_put, but via multipart
+        upload, a part (of part_size bytes) at a time, so the content need never be in memory all at once.
+        """
+        part_size = max(part_size or self.S3_MULTIPART_PART_SIZE, self.S3_MULTIPART_MIN_PART_SIZE)
+        acl_arg = {'ACL': acl} if acl else {}
+        upload_id = self.s3.create_multipart_upload(Bucket=self.outfile_bucket, Key=upload_key,
+                                                    ContentType=self.guess_content_type(upload_key),
+                                                    **acl_arg)['UploadId']
+        try:
+            parts = []
+            while True:
+                data = _read_fully(stream, part_size)
+                # An empty stream still gets one (empty) part; otherwise there are no empty parts.
+                if parts and not data:
+                    break
+                part_number = len(parts) + 1
+                response = self.s3.upload_part(Bucket=self.outfile_bucket, Key=upload_key, UploadId=upload_id,
+                                               PartNumber=part_number, Body=data)
+                parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+                if len(data) < part_size:
+                    break
+            return self.s3.complete_multipart_upload(Bucket=self.outfile_bucket, Key=upload_key, UploadId=upload_id,
+                                                     MultipartUpload={'Parts': parts})
+        except BaseException:
+            self.s3.abort_multipart_upload(Bucket=self.outfile_bucket, Key=upload_key, UploadId=upload_id)
+            raise
+
     def s3_put_secret(self, data, keyname, bucket=None, secret=None):
         if not bucket:
             bucket = self.sys_bucket
@@ -495,79 +720,650 @@ class s3Utils(s3Base):  # NOQA - This class name violates style rules, but a lot
     def s3_read_dir(self, prefix):
         return self.s3.list_objects(Bucket=self.outfile_bucket, Prefix=prefix)
 
-    def s3_delete_dir(self, prefix):
-        # one query get list of all the files we want to delete
-        obj_list = self.s3.list_objects(Bucket=self.outfile_bucket, Prefix=prefix)
-        files = obj_list.get('Contents', [])
+    def s3_list_objects(self, prefix: str = '', bucket: Optional[str] = None,
+                        start_after: Optional[str] = None) -> Iterator[dict]:
+        """
+        Generates (lazily) all of the objects (as list_objects_v2 Contents entries, i.e. with Key, Size,
+        StorageClass, etc.) whose keys start with the given prefix, in key order, from the outfile bucket
+        by default, paging through them (1000 at a time); optionally starting after the given key.
+        """
+        kwargs = {'Bucket': bucket or self.outfile_bucket, 'Prefix': prefix or ''}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        while True:
+            response = self.s3.list_objects_v2(**kwargs)
+            yield from response.get('Contents') or []
+            if not response.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def s3_list_object_versions(self, prefix: str = '', bucket: Optional[str] = None) -> Iterator[dict]:
+        """
+        Generates (lazily) all of the object versions and delete markers (as list_object_versions Versions
+        and DeleteMarkers entries, i.e. with Key, VersionId, etc.) whose keys start with the given prefix,
+        from the outfile bucket by default, paging through them (1000 at a time).
+        """
+        kwargs = {'Bucket': bucket or self.outfile_bucket, 'Prefix': prefix or ''}
+        while True:
+            response = self.s3.list_object_versions(**kwargs)
+            yield from response.get('Versions') or []
+            yield from response.get('DeleteMarkers') or []
+            if not response.get('IsTruncated'):
+                break
+            kwargs['KeyMarker'] = response['NextKeyMarker']
+            kwargs['VersionIdMarker'] = response['NextVersionIdMarker']
+
+    S3_DELETE_BATCH_SIZE = 1000  # The maximum number of keys per delete_objects request (an S3 limit).
+    S3_DELETE_MAX_WORKERS = 8
+    S3_UNZIP_MAX_WORKERS = 8
+    S3_MULTIPART_THRESHOLD = 64 * 1024 * 1024  # Larger files extracted by unzip_s3_to_s3 use s3_put_stream.
+    S3_UNZIP_MAX_MEMORY = 128 * 1024 * 1024  # The most (file content) bytes unzip_s3_to_s3 has in memory at once.
+    S3_MULTIPART_PART_SIZE = 16 * 1024 * 1024
+    S3_MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024  # An S3 limit (except for the last part).
+
+    def s3_delete_dir(self, prefix: str, bucket: Optional[str] = None, versions: bool = False,
+                      dry_run: bool = False, max_workers: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Deletes all objects whose keys start with the given prefix, from the outfile bucket by default.
+        These are paged through (via list_objects_v2) and deleted in batches of (up to) 1000 keys (via
+        delete_objects), with up to max_workers batches being deleted concurrently.
 
-        # morph file list into format that boto3 wants
-        delete_keys = {'Objects': [{'Key': k}
-                                   for k in [obj['Key']
-                                             for obj in files]]}
+        For a versioned bucket this just adds delete markers, unless versions is True, in which case all
+        versions and delete markers (via list_object_versions) with the prefix are permanently deleted.
+        If dry_run is True then nothing is actually deleted but the result counts what would have been.
 
-        # second query deletes all the files, NOTE: Max 1000 files
-        if delete_keys['Objects']:
-            self.s3.delete_objects(Bucket=self.outfile_bucket, Delete=delete_keys)
+        Returns a dictionary with 'deleted', the number of objects (or versions) deleted, and 'errors',
+        a list of dictionaries (with Key, VersionId if any, Code, and Message) for each object not deleted.
+        """
+        bucket = bucket or self.outfile_bucket
+        max_workers = max_workers or self.S3_DELETE_MAX_WORKERS
+        if versions:
+            objects = ({'Key': version['Key'], 'VersionId': version['VersionId']}
+                       for version in self.s3_list_object_versions(prefix, bucket=bucket))
+        else:
+            objects = ({'Key': obj['Key']} for obj in self.s3_list_objects(prefix, bucket=bucket))
+        batches = chunked(objects, chunk_size=self.S3_DELETE_BATCH_SIZE)
+        result = {'deleted': 0, 'errors': []}
+
+        if dry_run:
+            result['deleted'] = sum(len(batch) for batch in batches)
+            return result
+
+        def delete_batch(batch: List[dict]) -> Tuple[int, List[dict]]:  # Returns count deleted, and errors.
+            try:
+                response = self.s3.delete_objects(Bucket=bucket, Delete={'Objects': batch, 'Quiet': True})
+                errors = response.get('Errors') or []
+            except Exception as e:
+                errors = [dict(obj, Code=type(e).__name__, Message=str(e)) for obj in batch]
+            for error in errors:
+                logger.warning(f"Could not delete {bucket}/{error.get('Key')}"
+                               f"{' version ' + error['VersionId'] if error.get('VersionId') else ''}:"
+                               f" {error.get('Code')} {error.get('Message')}")
+            return len(batch) - len(errors), errors
+
+        def collect(batch_futures) -> None:
+            for batch_future in batch_futures:
+                deleted, errors = batch_future.result()
+                result['deleted'] += deleted
+                result['errors'].extend(errors)
+
+        # Bound the number of pending batches (each up to 1000 keys) so that memory use stays bounded
+        # regardless of how many objects there are; listing continues as batches complete.
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            for batch in batches:
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(delete_batch, batch))
+            collect(wait(pending).done)
+        return result
 
     def read_s3_zipfile(self, s3key, files_to_extract):
-        s3_stream = self.read_s3(s3key)
-        bytestream = BytesIO(s3_stream)
-        zipstream = ZipFile(bytestream, 'r')
+        """
+        Returns a dictionary of the content of each of the given files in the given zip file on S3.
+        Only the parts of the zip actually needed are read (see S3SeekableFile), rather than the whole thing.
+        """
+        zipped_file = S3SeekableFile(self.s3, self.outfile_bucket, s3key)
         ret_files = {}
-
-        for name in files_to_extract:
-            # search subdirectories for file with name
-            # so I don't have to worry about figuring out the subdirs
-            zipped_filename = find_file(name, zipstream)
-            if zipped_filename:
-                ret_files[name] = zipstream.open(zipped_filename).read()
+        with ZipFile(zipped_file, 'r') as zipstream:
+            for name in files_to_extract:
+                # search subdirectories for file with name
+                # so I don't have to worry about figuring out the subdirs
+                zipped_filename = find_file(name, zipstream)
+                if zipped_filename:
+                    ret_files[name] = zipstream.open(zipped_filename).read()
         return ret_files
 
-    def unzip_s3_to_s3(self, zipped_s3key, dest_dir, acl=None, store_results=True):
+    def unzip_s3_to_s3(self, zipped_s3key, dest_dir, acl=None, store_results=True, max_workers: Optional[int] = None,
+                       multipart_threshold: Optional[int] = None, part_size: Optional[int] = None,
+                       max_memory: Optional[int] = None):
         """stream the content of a zipped key on S3 to another location on S3.
-        if store_results=True, it saves the content and returns it in the dictionary format
-        (default)
+        if store_results=True, it returns (default) a dictionary, by file name, of the s3key (URL) of each file,
+        and, as its data, an S3ObjectHandle from which its content can be read (lazily) if/when needed.
+
+        Only the parts of the zip actually needed are read (see S3SeekableFile) rather than the whole thing;
+        files are uploaded concurrently (up to max_workers at a time), and those larger than multipart_threshold
+        are streamed up via multipart upload (see s3_put_stream), so memory use does not grow with zip size.
+        Uploads wait, as needed, so that the file content (or parts) being uploaded at once total no more than
+        max_memory bytes; except that a single file (or part) larger than that is uploaded on its own.
         """
 
         if not dest_dir.endswith('/'):
             dest_dir += '/'
+        if multipart_threshold is None:
+            multipart_threshold = self.S3_MULTIPART_THRESHOLD
+        max_memory = max_memory or self.S3_UNZIP_MAX_MEMORY
+        stream_part_size = max(part_size or self.S3_MULTIPART_PART_SIZE, self.S3_MULTIPART_MIN_PART_SIZE)
 
-        s3_stream = self.read_s3(zipped_s3key)
-        # read this badboy to memory, don't go to disk
-        bytestream = BytesIO(s3_stream)
-        zipstream = ZipFile(bytestream, 'r')
+        zipped_file = S3SeekableFile(self.s3, self.outfile_bucket, zipped_s3key)
+        with ZipFile(zipped_file, 'r') as zipstream:
+            file_infos = zipstream.infolist()
 
         # The contents of zip can sometimes be like
         # ["foo/", "file1", "file2", "file3"]
         # and other times like
         # ["file1", "file2", "file3"]
-        file_list = zipstream.namelist()
-        if file_list[0].endswith('/'):
+        if file_infos and file_infos[0].filename.endswith('/'):
             # in case directory first name in the list
-            basedir_name = file_list.pop(0)
+            basedir_name = file_infos.pop(0).filename
         else:
             basedir_name = ''
 
+        # Each thread reads the zip via its own ZipFile (and file position), sharing the cache of zip blocks.
+        thread_zipstreams = threading.local()
+        zipstreams = []
+        # The bytes reserved by the uploads in progress: the whole file, or one part at a time if streamed.
+        memory = threading.Condition()
+        memory_in_use = 0
+
+        def unzip_file(file_info: ZipInfo, s3_file_name: str) -> None:
+            nonlocal memory_in_use
+            zipstream = getattr(thread_zipstreams, 'zipstream', None)
+            if zipstream is None:
+                thread_zipstreams.zipstream = zipstream = ZipFile(zipped_file.clone(), 'r')
+                zipstreams.append(zipstream)
+            streamed = file_info.file_size > multipart_threshold
+            nbytes = min(file_info.file_size, stream_part_size) if streamed else file_info.file_size
+            with memory:
+                memory.wait_for(lambda: not memory_in_use or memory_in_use + nbytes <= max_memory)
+                memory_in_use += nbytes
+            try:
+                with zipstream.open(file_info, 'r') as file_stream:
+                    if streamed:
+                        self.s3_put_stream(file_stream, s3_file_name, acl=acl, part_size=part_size)
+                    else:
+                        self.s3_put(file_stream.read(), s3_file_name, acl=acl)
+            finally:
+                with memory:
+                    memory_in_use -= nbytes
+                    memory.notify_all()
+
         ret_files = {}
-        for file_name in file_list:
-            # don't copy dirs just files
-            if not file_name.endswith('/'):
-                if basedir_name:
-                    s3_file_name = file_name.replace(basedir_name, dest_dir)
-                else:
-                    s3_file_name = dest_dir + file_name
-                s3_key = "https://s3.amazonaws.com/%s/%s" % (self.outfile_bucket, s3_file_name)
-                # just perf optimization so we don't have to copy
-                # files twice that we want to further interrogate
-                the_file = zipstream.open(file_name, 'r').read()
-                file_to_find = os.path.basename(file_name)
-                if store_results:
-                    ret_files[file_to_find] = {'s3key': s3_key,
-                                               'data': the_file}
-                self.s3_put(the_file, s3_file_name, acl=acl)
+        with ThreadPoolExecutor(max_workers=max_workers or self.S3_UNZIP_MAX_WORKERS) as executor:
+            futures = []
+            for file_info in file_infos:
+                file_name = file_info.filename
+                # don't copy dirs just files
+                if not file_name.endswith('/'):
+                    if basedir_name:
+                        s3_file_name = file_name.replace(basedir_name, dest_dir)
+                    else:
+                        s3_file_name = dest_dir + file_name
+                    s3_key = "https://s3.amazonaws.com/%s/%s" % (self.outfile_bucket, s3_file_name)
+                    futures.append(executor.submit(unzip_file, file_info, s3_file_name))
+                    if store_results:
+                        ret_files[os.path.basename(file_name)] = {
+                            's3key': s3_key,
+                            'data': S3ObjectHandle(self.s3, self.outfile_bucket, s3_file_name,
+                                                   size=file_info.file_size)
+                        }
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:  # Only if something failed; no point in uploading the rest.
+                future.cancel()
+            for future in futures:
+                if not future.cancelled():
+                    future.result()  # Raises the (first) exception, if any.
+        for zipstream in zipstreams:
+            zipstream.close()
 
         return ret_files
 
+    S3_TRANSFER_MAX_WORKERS = 8
+    S3_TRANSFER_MAX_PARTS = 10000  # An S3 limit.
+
+    def s3_upload_file(self, file: str, key: str, bucket: Optional[str] = None, acl: Optional[str] = None,
+                       max_workers: Optional[int] = None, resume: bool = True, verify: bool = True) -> dict:
+        """
+        Uploads the given (local) file to the given key (in the outfile bucket by default), verifying it as it goes,
+        in a single pass over the file. Files of at least 8 MiB are uploaded via multipart upload, in parts of 8 MiB
+        (as for file_utils.compute_file_etag) uploaded concurrently (up to max_workers at a time), computing the MD5
+        of each part as it is uploaded. Each part ETag, and then the ETag of the whole, is checked against the one
+        S3 reports, raising S3TransferVerificationError if they differ (unless verify is False, as it must be for
+        SSE-KMS encrypted buckets, whose ETags are not MD5 based).
+
+        If resume is True (the default), the progress of a multipart upload is recorded in a sidecar file (the file
+        name plus .s3upload), so that if the upload fails or is interrupted, rerunning it uploads only the parts not
+        already uploaded (provided the file has not since changed, else the recorded upload is aborted and a new one
+        started); otherwise a failed upload is aborted.
+
+        Returns a dictionary of the bucket, key, size, number of parts (0 if not multipart), and ETag.
+        """
+        bucket = bucket or self.outfile_bucket
+        size = os.path.getsize(file)
+        acl_arg = {'ACL': acl} if acl else {}
+        content_type = self.guess_content_type(key)
+
+        if size < S3_ETAG_MULTIPART_THRESHOLD:
+            with io.open(file, 'rb') as fp:
+                data = fp.read()
+            etag = hashlib.md5(data).hexdigest()
+            response = self.s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType=content_type, **acl_arg)
+            if verify:
+                self._verify_etag(bucket, key, expected=etag, actual=response['ETag'])
+            return {'bucket': bucket, 'key': key, 'size': size, 'parts': 0, 'etag': etag}
+
+        part_size = self._transfer_part_size(size)
+        nparts = -(-size // part_size)
+        state_file = file + '.s3upload' if resume else None
+        state, parts = _read_transfer_state(state_file, {'bucket': bucket, 'key': key, 'size': size,
+                                                         'mtime': os.path.getmtime(file), 'part_size': part_size})
+        if not state.get('upload_id'):
+            self._abort_recorded_upload(state_file)
+            state['upload_id'] = self.s3.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type,
+                                                                 **acl_arg)['UploadId']
+            _write_transfer_state(state_file, state)
+        upload_id = state['upload_id']
+        lock = threading.Lock()
+
+        def upload_part(part_number: int) -> None:
+            with io.open(file, 'rb') as fp:
+                fp.seek((part_number - 1) * part_size)
+                data = fp.read(part_size)
+            md5 = hashlib.md5(data).hexdigest()
+            response = self.s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                           PartNumber=part_number, Body=data)
+            if verify:
+                self._verify_etag(bucket, key, expected=md5, actual=response['ETag'], part_number=part_number)
+            with lock:
+                parts[part_number] = {'part': part_number, 'md5': md5, 'etag': response['ETag']}
+                _append_transfer_state(state_file, parts[part_number])
+
+        try:
+            _run_concurrently(upload_part, (part_number for part_number in range(1, nparts + 1)
+                                            if part_number not in parts),
+                              max_workers=max_workers or self.S3_TRANSFER_MAX_WORKERS)
+            response = self.s3.complete_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={'Parts': [{'ETag': parts[part_number]['etag'], 'PartNumber': part_number}
+                                           for part_number in range(1, nparts + 1)]})
+        except Exception as e:
+            if not state_file:
+                self.s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            elif isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+                os.remove(state_file)  # E.g. aborted or expired, so there is nothing to resume.
+            raise
+        if state_file:
+            os.remove(state_file)
+        etag = compute_multipart_etag([bytes.fromhex(parts[part_number]['md5'])
+                                       for part_number in range(1, nparts + 1)])
+        if verify:
+            self._verify_etag(bucket, key, expected=etag, actual=response['ETag'])
+        return {'bucket': bucket, 'key': key, 'size': size, 'parts': nparts, 'etag': etag}
+
+    def _abort_recorded_upload(self, state_file: Optional[str]) -> None:
+        # The upload recorded in the given (s3_upload_file) state file, if any, cannot be resumed (e.g. the file
+        # has since changed), so it is aborted, rather than leaving its parts (billed for) until they expire.
+        recorded_state = _read_recorded_transfer_state(state_file)
+        if recorded_state and all(recorded_state.get(name) for name in ['bucket', 'key', 'upload_id']):
+            try:
+                self.s3.abort_multipart_upload(Bucket=recorded_state['bucket'], Key=recorded_state['key'],
+                                               UploadId=recorded_state['upload_id'])
+            except ClientError as e:  # E.g. NoSuchUpload, if already aborted or expired.
+                logger.warning(f"Could not abort upload {recorded_state['upload_id']} to"
+                               f" {recorded_state['bucket']}/{recorded_state['key']}: {e}")
+
+    def s3_download_file(self, key: str, file: str, bucket: Optional[str] = None, max_workers: Optional[int] = None,
+                         resume: bool = True, verify: bool = True) -> dict:
+        """
+        Downloads the given key (from the outfile bucket by default) to the given (local) file, verifying it as it
+        goes, in a single pass. The object is downloaded in parts, via ranged GETs, concurrently (up to max_workers
+        at a time), computing the MD5 of each part as it is written; and the ETag these imply is checked against
+        the object's, raising S3TransferVerificationError if they differ (unless verify is False). For an object
+        uploaded via multipart upload, the parts are the uploaded ones (assuming all but the last are the same
+        size, as with boto3 and the AWS CLI); otherwise they are (at least) 8 MiB, and are hashed in order.
+
+        The content is written to the file name plus .s3download.part, renamed to the given file when complete.
+        If resume is True (the default), the progress of downloading an object uploaded via multipart upload is
+        recorded in a sidecar file (the file name plus .s3download), so that if the download fails or is interrupted,
+        rerunning it downloads only the parts not already downloaded (provided the object has not since changed).
+
+        Returns a dictionary of the bucket, key, size, number of parts (0 if not multipart), and ETag.
+        """
+        bucket = bucket or self.outfile_bucket
+        head = self.s3.head_object(Bucket=bucket, Key=key)
+        size = head['ContentLength']
+        s3_etag = head['ETag'].strip('"')
+        multipart_nparts = int(s3_etag.split('-')[1]) if '-' in s3_etag else 0
+        if multipart_nparts:
+            nparts = multipart_nparts
+            part_size = self.s3.head_object(Bucket=bucket, Key=key, PartNumber=1)['ContentLength']
+        else:
+            part_size = self._transfer_part_size(size)
+            nparts = max(-(-size // part_size), 1)
+
+        part_file = file + '.s3download.part'
+        # Without per part ETags, the MD5 has to be computed across all parts in order, so cannot be resumed.
+        state_file = file + '.s3download' if resume and multipart_nparts else None
+        state, parts = _read_transfer_state(state_file, {'bucket': bucket, 'key': key, 'size': size,
+                                                         'etag': s3_etag, 'part_size': part_size})
+        if not parts or not os.path.exists(part_file) or os.path.getsize(part_file) != size:
+            parts = {}
+            with io.open(part_file, 'wb') as fp:
+                fp.truncate(size)
+            _write_transfer_state(state_file, state)
+        max_workers = max_workers or self.S3_TRANSFER_MAX_WORKERS
+        hashed = threading.Condition()
+        md5 = hashlib.md5()  # For the non-multipart case.
+        unhashed_parts = {}
+        next_part_number_to_hash = 1
+        failed = False
+
+        def download_part(part_number: int) -> None:
+            nonlocal next_part_number_to_hash, failed
+            start = (part_number - 1) * part_size
+            end = min(start + part_size, size) - 1
+            data = b''
+            try:
+                if end >= start:
+                    data = self.s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")['Body'].read()
+                with io.open(part_file, 'r+b') as fp:
+                    fp.seek(start)
+                    fp.write(data)
+            except Exception:
+                with hashed:
+                    failed = True
+                    hashed.notify_all()
+                raise
+            part_md5 = hashlib.md5(data).hexdigest()
+            with hashed:
+                parts[part_number] = {'part': part_number, 'md5': part_md5}
+                _append_transfer_state(state_file, parts[part_number])
+                if not multipart_nparts:
+                    unhashed_parts[part_number] = data
+                    while next_part_number_to_hash in unhashed_parts:
+                        md5.update(unhashed_parts.pop(next_part_number_to_hash))
+                        next_part_number_to_hash += 1
+                    hashed.notify_all()
+
+        def part_numbers_to_download() -> Iterator[int]:
+            for part_number in range(1, nparts + 1):
+                if part_number in parts:
+                    continue
+                if not multipart_nparts:
+                    # Parts are hashed in order, so those downloaded ahead of the next one to hash are kept in
+                    # memory until it is; so a part is not started until it is within 2 * max_workers parts of
+                    # that one, which bounds the memory used, however slow any one part is.
+                    with hashed:
+                        hashed.wait_for(lambda: failed or part_number - next_part_number_to_hash < 2 * max_workers)
+                        if failed:
+                            return
+                yield part_number
+
+        _run_concurrently(download_part, part_numbers_to_download(), max_workers=max_workers)
+        if multipart_nparts:
+            etag = compute_multipart_etag([bytes.fromhex(parts[part_number]['md5'])
+                                           for part_number in range(1, nparts + 1)])
+        else:
+            etag = md5.hexdigest()
+        try:
+            if verify:
+                self._verify_etag(bucket, key, expected=s3_etag, actual=etag)
+        except S3TransferVerificationError:
+            os.remove(part_file)
+            raise
+        finally:
+            if state_file and os.path.exists(state_file):
+                os.remove(state_file)
+        os.replace(part_file, file)
+        return {'bucket': bucket, 'key': key, 'size': size, 'parts': multipart_nparts, 'etag': etag}
+
+    @classmethod
+    def _transfer_part_size(cls, size: int) -> int:
+        # 8 MiB (as for file_utils.compute_file_etag), unless that would be more than the maximum number of parts.
+        part_size = S3_ETAG_MULTIPART_CHUNK_SIZE
+        if size > part_size * cls.S3_TRANSFER_MAX_PARTS:
+            mib = 1024 * 1024
+            part_size = -(-size // (cls.S3_TRANSFER_MAX_PARTS * mib)) * mib
+        return part_size
+
+    @staticmethod
+    def _verify_etag(bucket: str, key: str, expected: str, actual: str, part_number: Optional[int] = None) -> None:
+        expected = expected.strip('"')
+        actual = actual.strip('"')
+        if actual != expected:
+            raise S3TransferVerificationError(bucket=bucket, key=key, expected=expected, actual=actual,
+                                              part_number=part_number)
+
+
+class S3SeekableFile(io.RawIOBase):
+    """
+    A read-only, seekable, file-like object for an S3 object, which fetches only the parts of it actually read,
+    in blocks of block_size bytes via ranged GETs, keeping the most recently used (up to max_blocks) of these
+    in a cache. This lets, for example, ZipFile read the central directory and any members of a large zip file
+    on S3 without downloading all of it. Clones share the cache but each has its own position, so each thread
+    can have its own.
+    """
+
+    DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+    DEFAULT_MAX_BLOCKS = 16
+
+    def __init__(self, s3, bucket: str, key: str, size: Optional[int] = None,
+                 block_size: Optional[int] = None, max_blocks: Optional[int] = None):
+        super().__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = s3.head_object(Bucket=bucket, Key=key)['ContentLength'] if size is None else size
+        self.block_size = block_size or self.DEFAULT_BLOCK_SIZE
+        self.max_blocks = max(max_blocks or self.DEFAULT_MAX_BLOCKS, 1)
+        self._position = 0
+        self._blocks = OrderedDict()
+        self._blocks_lock = threading.Lock()
+
+    def clone(self) -> 'S3SeekableFile':
+        clone = S3SeekableFile(self.s3, self.bucket, self.key, size=self.size,
+                               block_size=self.block_size, max_blocks=self.max_blocks)
+        clone._blocks = self._blocks
+        clone._blocks_lock = self._blocks_lock
+        return clone
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence!r}")
+        if position < 0:
+            raise ValueError(f"Negative seek position: {position}")
+        self._position = position
+        return position
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._position
+        chunks = []
+        while size > 0 and self._position < self.size:
+            block_number, offset = divmod(self._position, self.block_size)
+            chunk = self._get_block(block_number)[offset:offset + size]
+            chunks.append(chunk)
+            self._position += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _get_block(self, block_number: int) -> bytes:
+        with self._blocks_lock:
+            block = self._blocks.get(block_number)
+            if block is not None:
+                self._blocks.move_to_end(block_number)
+                return block
+        # Fetched outside the lock so threads reading different blocks do not wait on each other.
+        start = block_number * self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        block = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}")['Body'].read()
+        with self._blocks_lock:
+            self._blocks[block_number] = block
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return block
+
+
+class S3ObjectHandle:
+    """
+    A lazy reference to (the content of) an S3 object; as returned by s3Utils.unzip_s3_to_s3 for each
+    extracted file, so that only the content actually wanted is ever read, and only when it is wanted.
+    """
+
+    def __init__(self, s3, bucket: str, key: str, size: Optional[int] = None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+
+    def read(self) -> bytes:
+        return self.s3.get_object(Bucket=self.bucket, Key=self.key)['Body'].read()
+
+    def open(self, **kwargs) -> S3SeekableFile:
+        return S3SeekableFile(self.s3, self.bucket, self.key, size=self.size, **kwargs)
+
+    def __bytes__(self) -> bytes:
+        return self.read()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} s3://{self.bucket}/{self.key}>"
+
+
+def rate_limit_client(client, rate_limiter) -> None:
+    """
+    Makes the given boto3 client acquire a token from the given rate limiter (e.g. a misc_utils.TokenBucket,
+    or a redis_utils.RedisTokenBucket to share the rate with other processes) before each API call it makes.
+    """
+    def acquire_token(**kwargs) -> None:
+        ignored(kwargs)
+        rate_limiter.acquire()
+    client.meta.events.register(f"before-parameter-build.{client.meta.service_model.service_name}", acquire_token)
+
+
+def _run_concurrently(function: Callable, args: Iterable, max_workers: int) -> None:
+    """
+    Calls the given function on each of the given args, concurrently on a pool of max_workers threads, with at
+    most twice that many calls outstanding at once (so the args can be generated lazily). If any call raises an
+    exception, no more are started, and that exception is raised once those in progress have finished.
+    This is not a task_utils.TaskGroup, which abandons the calls in progress when one fails; these calls
+    (parts of a transfer) must have finished before the caller cleans up (e.g. aborts the upload).
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        try:
+            for arg in args:
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(function, arg))
+            done, pending = wait(pending, return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _read_transfer_state(state_file: Optional[str], state: dict) -> Tuple[dict, Dict[int, dict]]:
+    """
+    Returns the state (e.g. with upload_id) and (completed) parts recorded in the given transfer state file (see
+    s3Utils.s3_upload_file and s3_download_file), if it exists and is for the same transfer, i.e. its state
+    includes the given one; otherwise returns the given state and no parts.
+    """
+    if state_file and os.path.exists(state_file):
+        with io.open(state_file) as fp:
+            lines = fp.read().splitlines()
+        recorded_state = _parse_transfer_state(lines)
+        if recorded_state and all(recorded_state.get(name) == value for name, value in state.items()):
+            parts = {}
+            for line in lines[1:]:
+                try:
+                    part = json.loads(line)
+                except ValueError:  # E.g. a partial last line if interrupted while writing it.
+                    continue
+                parts[part['part']] = part
+            return recorded_state, parts
+    return state, {}
+
+
+def _read_recorded_transfer_state(state_file: Optional[str]) -> Optional[dict]:
+    """
+    Returns the state recorded in the given transfer state file, whatever transfer it is for, if it exists.
+    """
+    if state_file and os.path.exists(state_file):
+        with io.open(state_file) as fp:
+            return _parse_transfer_state(fp.read().splitlines()[:1])
+    return None
+
+
+def _parse_transfer_state(lines: List[str]) -> Optional[dict]:
+    try:
+        recorded_state = json.loads(lines[0])
+    except (IndexError, ValueError):
+        return None
+    return recorded_state if isinstance(recorded_state, dict) else None
+
+
+def _write_transfer_state(state_file: Optional[str], state: dict) -> None:
+    if state_file:
+        with io.open(state_file, 'w') as fp:
+            fp.write(json.dumps(state) + '\n')
+
+
+def _append_transfer_state(state_file: Optional[str], part: dict) -> None:
+    if state_file:
+        with io.open(state_file, 'a') as fp:
+            fp.write(json.dumps(part) + '\n')
+
+
+def _read_fully(stream, size: int) -> bytes:
+    """
+    Reads from the given stream until size bytes or EOF; a single read may return less even before EOF.
+    """
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
 
 def find_file(name, zipstream):
     for zipped_filename in zipstream.namelist():
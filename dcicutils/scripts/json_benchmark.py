@@ -0,0 +1,232 @@
+# ------------------------------------------------------------------------------------------------------
+# Command-line utility to benchmark the JSON tree utilities (misc_utils.copy_json, merge_objects,
+# remove_empty_properties, and obfuscation_utils.obfuscate_json) against deepcopy-based baselines
+# (i.e. what these used to do), over synthetic but realistic portal items, i.e. deeply embedded frames
+# (files embedding file sets, samples, donors, quality metrics, etc) of a given total size in megabytes.
+# ------------------------------------------------------------------------------------------------------
+# Example command:
+#  json-benchmark --megabytes 10 --seed 1
+#
+# Example output:
+#  Items: 460 | megabytes: 10.0 | depth: 15
+#  copy_json: 0.51 seconds | baseline (deepcopy): 1.11 seconds | speedup: 2.2x
+#  merge_objects: 0.02 seconds | baseline (deepcopy): 0.94 seconds | speedup: 42.8x
+#  obfuscate_json: 1.64 seconds | baseline (deepcopy): 2.30 seconds | speedup: 1.4x
+#  remove_empty_properties: 0.88 seconds | baseline (deepcopy): 1.20 seconds | speedup: 1.4x
+#  deeply_nested: depth 20000 | 1.28 seconds
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+from copy import deepcopy
+import json
+import random
+import sys
+import time
+from typing import Callable, List, Optional
+from dcicutils.misc_utils import PRINT, copy_json, merge_objects, remove_empty_properties
+from dcicutils.obfuscation_utils import obfuscate_json
+
+SCENARIOS = ["copy_json", "merge_objects", "obfuscate_json", "remove_empty_properties", "deeply_nested"]
+
+DEFAULT_MEGABYTES = 10
+DEFAULT_DEEPLY_NESTED_DEPTH = 20000
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the JSON tree utilities over synthetic portal items.")
+    parser.add_argument("--megabytes", type=float, required=False, default=DEFAULT_MEGABYTES,
+                        help=f"Approximate total (JSON) size of the items in megabytes (default {DEFAULT_MEGABYTES}).")
+    parser.add_argument("--depth", type=int, required=False, default=DEFAULT_DEEPLY_NESTED_DEPTH,
+                        help="Depth of the deeply_nested scenario item.")
+    parser.add_argument("--repeat", type=int, required=False, default=1,
+                        help="Number of times to run each scenario (the best time is reported).")
+    parser.add_argument("--scenarios", nargs="+", required=False, default=SCENARIOS, choices=SCENARIOS,
+                        help="Scenarios to run.")
+    parser.add_argument("--seed", type=int, required=False, default=None, help="Random seed (reproducibility).")
+    parser.add_argument("--json", action="store_true", required=False, default=False, help="JSON output.")
+    args = parser.parse_args()
+
+    results = run_benchmark(megabytes=args.megabytes, depth=args.depth, repeat=args.repeat,
+                            scenarios=args.scenarios, seed=args.seed, printf=None if args.json else _print)
+    if args.json:
+        _print(json.dumps(results, indent=4))
+
+
+def run_benchmark(megabytes: float = DEFAULT_MEGABYTES, depth: int = DEFAULT_DEEPLY_NESTED_DEPTH,
+                  repeat: int = 1, scenarios: Optional[List[str]] = None, seed: Optional[int] = None,
+                  printf: Optional[Callable] = None) -> dict:
+    """
+    Runs the given benchmark scenarios (default all) over synthetic embedded portal items totalling
+    (approximately) the given number of megabytes (as JSON), and returns a dictionary of results; with
+    the (best of repeat) seconds for each scenario and for its deepcopy-based baseline, and whether
+    or not their results were the same (errors is the number of items for which they were not).
+    """
+    printf = printf if callable(printf) else lambda *args, **kwargs: None
+    scenarios = scenarios or SCENARIOS
+    randomizer = random.Random(seed)
+    items = _synthetic_items(megabytes, randomizer)
+    results = {"items": {"count": len(items), "megabytes": _megabytes(items), "depth": _depth(items)}}
+    printf(f"Items: {results['items']['count']} | megabytes: {results['items']['megabytes']:.1f}"
+           f" | depth: {results['items']['depth']}")
+    if "copy_json" in scenarios:
+        results["copy_json"] = _run_scenario(
+            items, repeat,
+            function=copy_json,
+            baseline=deepcopy)
+        _print_scenario_result(printf, "copy_json", results["copy_json"])
+    if "merge_objects" in scenarios:
+        # A typical (small) patch, of a few properties of a few embedded items, to each item.
+        patches = [_synthetic_patch(item, randomizer) for item in items]
+        patches_by_item = {id(item): patch for item, patch in zip(items, patches)}
+        results["merge_objects"] = _run_scenario(
+            items, repeat,
+            function=lambda item: merge_objects(item, patches_by_item[id(item)], copy=True),
+            baseline=lambda item: merge_objects(deepcopy(item), patches_by_item[id(item)]))
+        _print_scenario_result(printf, "merge_objects", results["merge_objects"])
+    if "obfuscate_json" in scenarios:
+        results["obfuscate_json"] = _run_scenario(
+            items, repeat,
+            function=obfuscate_json,
+            baseline=lambda item: obfuscate_json(deepcopy(item), inplace=True))
+        _print_scenario_result(printf, "obfuscate_json", results["obfuscate_json"])
+    if "remove_empty_properties" in scenarios:
+        def remove_empty_properties_from_copy(item: dict, copy: Callable = copy_json) -> dict:  # noqa
+            item = copy(item)
+            remove_empty_properties(item)
+            return item
+        results["remove_empty_properties"] = _run_scenario(
+            items, repeat,
+            function=remove_empty_properties_from_copy,
+            baseline=lambda item: remove_empty_properties_from_copy(item, deepcopy))
+        _print_scenario_result(printf, "remove_empty_properties", results["remove_empty_properties"])
+    if "deeply_nested" in scenarios:
+        results["deeply_nested"] = result = _run_deeply_nested_scenario(depth, repeat)
+        errors = f" | errors: {result['errors']}" if result["errors"] else ""
+        printf(f"deeply_nested: depth {depth} | {result['seconds']:.2f} seconds{errors}")
+    return results
+
+
+def _run_scenario(items: List[dict], repeat: int, function: Callable, baseline: Callable) -> dict:
+    seconds, outputs = _time(function, items, repeat)
+    baseline_seconds, baseline_outputs = _time(baseline, items, repeat)
+    errors = sum(1 for output, baseline_output in zip(outputs, baseline_outputs) if output != baseline_output)
+    return {"count": len(items), "seconds": seconds, "baseline_seconds": baseline_seconds,
+            "speedup": baseline_seconds / seconds if seconds > 0 else 0, "errors": errors}
+
+
+def _run_deeply_nested_scenario(depth: int, repeat: int) -> dict:
+    # Deeper than the (default) recursion limit, which the (recursive) baselines cannot handle at all.
+    item = {"value": None, "secret": "obfuscatethisvalue"}
+    for index in range(depth):
+        item = {"uuid": f"deeply-nested-{index}", "embedded": [item], "empty": ""}
+    started = time.perf_counter()
+    errors = 0
+    for _ in range(max(repeat, 1)):
+        try:
+            result = merge_objects(item, copy_json(item), copy=True)
+            result = obfuscate_json(result)
+            remove_empty_properties(copy_json(result))
+        except RecursionError:
+            errors += 1
+    return {"depth": depth, "seconds": (time.perf_counter() - started) / max(repeat, 1), "errors": errors}
+
+
+def _time(function: Callable, items: List[dict], repeat: int) -> tuple:
+    best_seconds, outputs = None, None
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        outputs = [function(item) for item in items]
+        seconds = time.perf_counter() - started
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+    return best_seconds, outputs
+
+
+def _synthetic_items(megabytes: float, randomizer: random.Random) -> List[dict]:
+    items = []
+    nbytes = 0
+    while nbytes < megabytes * 1024 * 1024 or not items:
+        items.append(_synthetic_file(len(items), randomizer))
+        nbytes += len(json.dumps(items[-1]))
+    return items
+
+
+def _synthetic_file(index: int, randomizer: random.Random) -> dict:
+    # Roughly the shape of a (frame=embedded) output file item, with its file sets, libraries,
+    # samples, donors, and quality metrics embedded, including some empty and obfuscatable properties.
+    def user(n: int) -> dict:  # noqa
+        return {"uuid": _uuid(randomizer), "display_title": f"User {n}", "email": f"user{n}@example.com",
+                "submission_centers": [{"uuid": _uuid(randomizer), "display_title": "Center", "code": "CTR"}]}
+    def donor(n: int) -> dict:  # noqa
+        return {"uuid": _uuid(randomizer), "submitted_id": f"DONOR_{n}", "age": randomizer.randrange(90),
+                "sex": randomizer.choice(["Male", "Female"]), "tags": [], "notes": None,
+                "medical_history": [{"condition": f"Condition {i}", "onset": randomizer.randrange(90),
+                                     "secret_notes": f"private note {i}"} for i in range(3)],
+                "submitted_by": user(n)}
+    def sample(n: int) -> dict:  # noqa
+        return {"uuid": _uuid(randomizer), "submitted_id": f"SAMPLE_{n}", "category": "Tissue",
+                "description": f"Sample {n} " + "x" * randomizer.randrange(100), "external_id": "",
+                "sample_sources": [{"uuid": _uuid(randomizer), "submitted_id": f"TISSUE_{n}_{i}",
+                                    "donor": donor(n), "anatomical_site": {"term": "UBERON:0000948",
+                                                                           "synonyms": [], "definition": None}}
+                                   for i in range(2)]}
+    def quality_metric(n: int) -> dict:  # noqa
+        return {"uuid": _uuid(randomizer), "overall_quality_status": randomizer.choice(["Pass", "Warn", "Fail"]),
+                "qc_values": [{"key": f"metric_{i}", "value": randomizer.random(), "flag": None,
+                               "derived_from": f"metric_{i}"} for i in range(20)],
+                "url": f"https://example.com/qc/{n}", "access_key": {"secret": _uuid(randomizer)}}
+    file_sets = [{"uuid": _uuid(randomizer), "submitted_id": f"FILE_SET_{index}_{i}",
+                  "libraries": [{"uuid": _uuid(randomizer), "submitted_id": f"LIBRARY_{index}_{i}_{j}",
+                                 "analytes": [{"uuid": _uuid(randomizer), "samples": [sample(index + k)]}
+                                              for k in range(2)]} for j in range(2)],
+                  "sequencing": {"uuid": _uuid(randomizer), "platform": "Illumina", "read_length": 150}}
+                 for i in range(2)]
+    return {"uuid": _uuid(randomizer), "@id": f"/output-files/{index}/", "@type": ["OutputFile", "File", "Item"],
+            "accession": f"SMAFI{index:07d}", "display_title": f"SMAFI{index:07d}.bam", "status": "released",
+            "file_size": randomizer.randrange(10 ** 9), "md5sum": "%032x" % randomizer.getrandbits(128),
+            "description": "", "aliases": [], "file_format": {"uuid": _uuid(randomizer), "identifier": "BAM"},
+            "file_sets": file_sets, "quality_metrics": [quality_metric(index + i) for i in range(3)],
+            "submitted_by": user(index), "upload_credentials": {"password": _uuid(randomizer)}}
+
+
+def _synthetic_patch(item: dict, randomizer: random.Random) -> dict:
+    libraries = [{} for _ in item["file_sets"][0]["libraries"]]
+    libraries[randomizer.randrange(len(libraries))] = {"analytes": [{"samples": [{"description": "Patched"}]}]}
+    return {"status": "archived", "file_sets": [{"libraries": libraries}], "alternate_accessions": ["SMAFIPATCHED"]}
+
+
+def _uuid(randomizer: random.Random) -> str:
+    value = "%032x" % randomizer.getrandbits(128)
+    return f"{value[0:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:32]}"
+
+
+def _megabytes(items: List[dict]) -> float:
+    return sum(len(json.dumps(item)) for item in items) / (1024 * 1024)
+
+
+def _depth(items: List[dict]) -> int:
+    max_depth = 0
+    stack = [(item, 1) for item in items]
+    while stack:
+        value, depth = stack.pop()
+        if isinstance(value, dict):
+            value = list(value.values())
+        if isinstance(value, list):
+            max_depth = max(max_depth, depth)
+            stack.extend((element, depth + 1) for element in value)
+    return max_depth
+
+
+def _print_scenario_result(printf: Callable, name: str, result: dict) -> None:
+    errors = f" | errors: {result['errors']}" if result["errors"] else ""
+    printf(f"{name}: {result['seconds']:.2f} seconds | baseline (deepcopy): {result['baseline_seconds']:.2f}"
+           f" seconds | speedup: {result['speedup']:.1f}x{errors}")
+
+
+def _print(*args, **kwargs) -> None:
+    PRINT(*args, **kwargs)
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# ------------------------------------------------------------------------------------------------------
+# Command-line utility to benchmark portal access (ff_utils, portal_utils.Portal, and StructuredDataSet)
+# offline, against a local (in-memory) portal emulator (dcicutils.portal_emulator.PortalEmulator),
+# served over HTTP on localhost, with configurable (injected) latency, error rate, and throttling.
+# ------------------------------------------------------------------------------------------------------
+# Example command:
+#  portal-benchmark --nitems 2000 --requests 500 --threads 8 --latency 0.005 --seed 1
+#
+# Example output:
+#  Portal emulator: http://127.0.0.1:53631 | items: 2000 | latency: 0.005 | error-rate: 0.0 | throttle: None
+#  ff_utils: 601 requests | 1.02 seconds | 589.2 requests/second
+#  portal: 1500 requests | 1.61 seconds | 931.7 requests/second
+#  structured_data: 1000 rows | 1.31 seconds | 763.4 rows/second
+#  Portal requests: 1500
+#  - GET /{id}: count=500 errors=0 retries=0 bytes=... p50=... p90=... p99=... max=...
+#  ...
+#
+# With --inserts (a directory of inserts files, or a single JSON file of inserts keyed by type name)
+# the emulator is loaded with those inserts rather than synthetic data; the structured_data benchmark
+# requires the synthetic data and so is skipped in that case.
+# --------------------------------------------------------------------------------------------------
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, List, Optional
+from dcicutils import ff_utils
+from dcicutils.misc_utils import PRINT
+from dcicutils.portal_emulator import PortalEmulator
+from dcicutils.portal_utils import PortalInstrumentation
+from dcicutils.structured_data import StructuredDataSet
+from dcicutils.task_utils import TaskGroup
+from dcicutils.tmpfile_utils import temporary_directory
+
+SCENARIOS = ["ff_utils", "portal", "structured_data"]
+
+_DONOR_TYPE = "BenchmarkDonor"
+_SAMPLE_TYPE = "BenchmarkSample"
+_SCHEMAS = {
+    _DONOR_TYPE: {
+        "title": _DONOR_TYPE, "$id": "/profiles/benchmark_donor.json", "type": "object",
+        "identifyingProperties": ["uuid", "submitted_id"],
+        "properties": {"uuid": {"type": "string"}, "submitted_id": {"type": "string"}, "age": {"type": "integer"}}
+    },
+    _SAMPLE_TYPE: {
+        "title": _SAMPLE_TYPE, "$id": "/profiles/benchmark_sample.json", "type": "object",
+        "identifyingProperties": ["uuid", "submitted_id"],
+        "properties": {"uuid": {"type": "string"}, "submitted_id": {"type": "string"},
+                       "donor": {"type": "string", "linkTo": _DONOR_TYPE},
+                       "description": {"type": "string"}, "nreads": {"type": "integer"}}
+    }
+}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark portal access against a local portal emulator.")
+    parser.add_argument("--inserts", type=str, required=False, default=None,
+                        help="Inserts directory or file to load (default is synthetic data).")
+    parser.add_argument("--nitems", type=int, required=False, default=1000,
+                        help="Number of synthetic items (per type).")
+    parser.add_argument("--requests", type=int, required=False, default=200,
+                        help="Number of requests (per request kind) per scenario.")
+    parser.add_argument("--threads", type=int, required=False, default=1, help="Number of concurrent threads.")
+    parser.add_argument("--latency", type=float, required=False, default=0.0,
+                        help="Injected latency (seconds) per request.")
+    parser.add_argument("--latency-max", type=float, required=False, default=None,
+                        help="If specified then random latency between --latency and this.")
+    parser.add_argument("--error-rate", type=float, required=False, default=0.0,
+                        help="Fraction of requests to fail (HTTP 500).")
+    parser.add_argument("--throttle", type=float, required=False, default=None,
+                        help="Maximum requests/second before throttling (HTTP 429).")
+    parser.add_argument("--throttle-burst", type=int, required=False, default=None,
+                        help="Burst capacity for --throttle.")
+    parser.add_argument("--scenarios", nargs="+", required=False, default=SCENARIOS, choices=SCENARIOS,
+                        help="Scenarios to run.")
+    parser.add_argument("--seed", type=int, required=False, default=None, help="Random seed (reproducibility).")
+    parser.add_argument("--json", action="store_true", required=False, default=False, help="JSON output.")
+    args = parser.parse_args()
+
+    latency = (args.latency, args.latency_max) if args.latency_max is not None else args.latency
+    results = run_benchmark(inserts=args.inserts, nitems=args.nitems, nrequests=args.requests,
+                            nthreads=args.threads, latency=latency, error_rate=args.error_rate,
+                            throttle_rate=args.throttle, throttle_burst=args.throttle_burst,
+                            scenarios=args.scenarios, seed=args.seed, printf=None if args.json else _print)
+    if args.json:
+        _print(json.dumps(results, indent=4))
+
+
+def run_benchmark(inserts: Optional[str] = None, nitems: int = 1000, nrequests: int = 200, nthreads: int = 1,
+                  latency: Optional[float] = None, error_rate: float = 0.0,
+                  throttle_rate: Optional[float] = None, throttle_burst: Optional[int] = None,
+                  scenarios: Optional[List[str]] = None, seed: Optional[int] = None,
+                  printf: Optional[Callable] = None) -> dict:
+    """
+    Runs the given benchmark scenarios (default all) against a (started) PortalEmulator and returns a
+    dictionary of results; with the number of requests (or rows), seconds, and throughput for each scenario,
+    and the per-endpoint summary (see PortalInstrumentation.summary) for the Portal requests made.
+    """
+    printf = printf if callable(printf) else lambda *args, **kwargs: None
+    scenarios = scenarios or SCENARIOS
+    randomizer = random.Random(seed)
+    if inserts:
+        emulator = PortalEmulator(inserts, latency=latency, error_rate=error_rate,
+                                  throttle_rate=throttle_rate, throttle_burst=throttle_burst, seed=seed)
+    else:
+        emulator = PortalEmulator(_synthetic_inserts(nitems), schemas=_SCHEMAS, latency=latency,
+                                  error_rate=error_rate, throttle_rate=throttle_rate,
+                                  throttle_burst=throttle_burst, seed=seed)
+    results = {"emulator": {"items": emulator.nitems, "latency": latency, "error_rate": error_rate,
+                            "throttle_rate": throttle_rate}}
+    instrumentation = PortalInstrumentation()
+    with emulator:
+        emulator.start()
+        printf(f"Portal emulator: {emulator.server} | items: {emulator.nitems} | latency: {latency}"
+               f" | error-rate: {error_rate} | throttle: {throttle_rate}")
+        items = [item for type_name in emulator.type_names for item in _search_all(emulator, type_name)]
+        if "ff_utils" in scenarios:
+            results["ff_utils"] = _run_ff_utils_scenario(emulator, items, nrequests, nthreads, randomizer)
+            _print_scenario_result(printf, "ff_utils", results["ff_utils"])
+        if "portal" in scenarios:
+            results["portal"] = _run_portal_scenario(emulator, items, nrequests, nthreads, randomizer,
+                                                     instrumentation)
+            _print_scenario_result(printf, "portal", results["portal"])
+        if "structured_data" in scenarios:
+            if inserts:
+                printf("structured_data: skipped (requires synthetic data)")
+            else:
+                results["structured_data"] = _run_structured_data_scenario(emulator, nitems, nrequests,
+                                                                           randomizer, instrumentation)
+                _print_scenario_result(printf, "structured_data", results["structured_data"], unit="rows")
+        results["emulator"]["stats"] = emulator.stats
+    results["endpoints"] = instrumentation.summary()
+    instrumentation.print_summary(printf=printf)
+    return results
+
+
+def _run_ff_utils_scenario(emulator: PortalEmulator, items: List[dict],
+                           nrequests: int, nthreads: int, randomizer: random.Random) -> dict:
+    key = emulator.key
+    uuids = [randomizer.choice(items)["uuid"] for _ in range(nrequests)] if items else []
+    def get_metadata(uuid: str) -> None:  # noqa
+        ff_utils.get_metadata(uuid, key=key)
+    started = time.perf_counter()
+    errors = _run_concurrently(get_metadata, uuids, nthreads)
+    nsearches = 0
+    for type_name in emulator.type_names:
+        for _ in ff_utils.get_search_generator(f"{key['server']}/search/?type={type_name}", auth=key):
+            nsearches += 1
+    return _scenario_result(len(uuids) + nsearches, time.perf_counter() - started, errors)
+
+
+def _run_portal_scenario(emulator: PortalEmulator, items: List[dict], nrequests: int, nthreads: int,
+                         randomizer: random.Random, instrumentation: PortalInstrumentation) -> dict:
+    portal = emulator.create_portal(pool_size=max(nthreads, 1), instrumentation=instrumentation)
+    targets = [randomizer.choice(items) for _ in range(nrequests)] if items else []
+    type_name = emulator.type_names[0] if emulator.type_names else None
+    def get(item: dict) -> None:  # noqa
+        portal.get(f"/{item['uuid']}", raise_for_status=True)
+    def patch(item: dict) -> None:  # noqa
+        portal.patch(f"/{item['uuid']}", json={"description": "benchmark"}, raise_for_status=True)
+    def post(index: int) -> None:  # noqa
+        portal.post(f"/{type_name}", json={"submitted_id": f"BENCHMARK_POST_{index}"}, raise_for_status=True)
+    started = time.perf_counter()
+    errors = _run_concurrently(get, targets, nthreads)
+    errors += _run_concurrently(patch, targets, nthreads)
+    errors += _run_concurrently(post, list(range(nrequests)) if type_name else [], nthreads)
+    result = _scenario_result(len(targets) * 2 + (nrequests if type_name else 0),
+                              time.perf_counter() - started, errors)
+    portal.close()
+    return result
+
+
+def _run_structured_data_scenario(emulator: PortalEmulator, nitems: int, nrows: int,
+                                  randomizer: random.Random, instrumentation: PortalInstrumentation) -> dict:
+    portal = emulator.create_portal(instrumentation=instrumentation)
+    with temporary_directory() as tmp_directory:
+        file = os.path.join(tmp_directory, f"{_SAMPLE_TYPE}.csv")
+        with open(file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["submitted_id", "donor", "description", "nreads"])
+            for index in range(nrows):
+                writer.writerow([f"BENCHMARK_NEW_SAMPLE_{index}", f"BENCHMARK_DONOR_{randomizer.randrange(nitems)}",
+                                 f"Benchmark sample {index}", str(index)])
+        started = time.perf_counter()
+        structured_data_set = StructuredDataSet.load(file, portal=portal)
+        duration = time.perf_counter() - started
+    errors = len(structured_data_set.ref_errors) + len(structured_data_set.errors)
+    portal.close()
+    return _scenario_result(nrows, duration, errors)
+
+
+def _run_concurrently(function: Callable, arguments: list, nthreads: int) -> int:
+    with TaskGroup(max_workers=nthreads, fail_fast=False, raise_error=False) as task_group:
+        for argument in arguments:
+            task_group.submit(function, argument)
+    return sum(1 for result in task_group.results() if isinstance(result, Exception))
+
+
+def _search_all(emulator: PortalEmulator, type_name: str) -> List[dict]:
+    return emulator.create_portal().get(f"/search/?type={type_name}&limit=all&frame=raw").json()["@graph"]
+
+
+def _synthetic_inserts(nitems: int) -> dict:
+    return {
+        _DONOR_TYPE: [{"submitted_id": f"BENCHMARK_DONOR_{index}", "age": index % 90}
+                      for index in range(nitems)],
+        _SAMPLE_TYPE: [{"submitted_id": f"BENCHMARK_SAMPLE_{index}", "donor": f"BENCHMARK_DONOR_{index}",
+                        "description": f"Benchmark sample {index}", "nreads": index}
+                       for index in range(nitems)]
+    }
+
+
+def _scenario_result(count: int, duration: float, errors: int) -> dict:
+    return {"count": count, "seconds": duration, "errors": errors,
+            "throughput": count / duration if duration > 0 else 0}
+
+
+def _print_scenario_result(printf: Callable, name: str, result: dict, unit: str = "requests") -> None:
+    errors = f" | errors: {result['errors']}" if result["errors"] else ""
+    printf(f"{name}: {result['count']} {unit} | {result['seconds']:.2f} seconds"
+           f" | {result['throughput']:.1f} {unit}/second{errors}")
+
+
+def _print(*args, **kwargs) -> None:
+    PRINT(*args, **kwargs)
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
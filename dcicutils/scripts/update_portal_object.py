@@ -7,14 +7,21 @@
 # update-portal-object --post {json-file | directory-with-json-files}
 # update-portal-object --upsert {json-file | directory-with-json-files}
 # update-portal-object --patch {json-file | directory-with-json-files}
+# update-portal-object --upsert {json-file | directory-with-json-files} --bulk --workers 16 --resume resume.txt
 #
 # The specified json-file or file withing directory-with-jaon-files must be JSON containing either
 # a list of objects, which which case the file name for the target schema name, or if not, then
 # the --schema option must be used to specified the target schema; or the JSON must be a dictionary
 # of schema names, where the value of each is a list of objects for that schema.
+#
+# With the --bulk option all of the items (for --post, --patch, or --upsert) are first read, then ordered
+# by their linkTo dependencies on each other, and then updated a layer at a time, each layer concurrently
+# (with --workers threads); with --validate each layer is first validated (via check_only); and with
+# --resume each successfully updated item is recorded in the given file and skipped on a subsequent run.
 # --------------------------------------------------------------------------------------------------
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 import glob
 import io
@@ -23,12 +30,15 @@ import os
 import re
 import shutil
 import sys
-from typing import Callable, List, Optional, Tuple, Union
+from threading import Lock
+from typing import Callable, List, Optional, Set, Tuple, Union
 from dcicutils.captured_output import captured_output
 from dcicutils.command_utils import yes_or_no
 from dcicutils.common import ORCHESTRATED_APPS, APP_CGAP, APP_FOURFRONT, APP_SMAHT
 from dcicutils.ff_utils import delete_metadata, purge_metadata
-from dcicutils.misc_utils import get_error_message, ignored, normalize_string, PRINT, to_camel_case, to_snake_case
+from dcicutils.misc_utils import (
+    CycleError, get_error_message, ignored, normalize_string, PRINT, to_camel_case, to_snake_case, TopologicalSorter
+)
 from dcicutils.portal_utils import Portal as PortalFromUtils
 from dcicutils.tmpfile_utils import temporary_directory
 
@@ -49,6 +59,7 @@ class Portal(PortalFromUtils):
 _DEFAULT_APP = "smaht"
 _SMAHT_ENV_ENVIRON_NAME = "SMAHT_ENV"
 _DEFAULT_INI_FILE_FOR_LOAD = "development.ini"
+_DEFAULT_BULK_WORKERS = 8
 
 # Schema properties to ignore (by default) for the view schema usage.
 _IGNORE_PROPERTIES_ON_UPDATE = [
@@ -141,6 +152,14 @@ def main():
     parser.add_argument("--ignore", nargs="+", help="Ignore these additional fields.")
     parser.add_argument("--unresolved-output", "--unresolved", type=str,
                         help="Output file to write unresolved references to for --load only.")
+    parser.add_argument("--bulk", action="store_true", required=False, default=False,
+                        help="Bulk post/patch/upsert concurrently in linkTo dependency order.")
+    parser.add_argument("--workers", type=int, required=False, default=_DEFAULT_BULK_WORKERS,
+                        help=f"Number of concurrent workers for --bulk (default: {_DEFAULT_BULK_WORKERS}).")
+    parser.add_argument("--validate", action="store_true", required=False, default=False,
+                        help="Validate (via check_only) each layer of items before updating for --bulk.")
+    parser.add_argument("--resume", type=str, required=False, default=None,
+                        help="Resume file for --bulk; updated items are recorded here and skipped on rerun.")
     parser.add_argument("--confirm", action="store_true", required=False, default=False, help="Confirm before action.")
     parser.add_argument("--verbose", action="store_true", required=False, default=False, help="Verbose output.")
     parser.add_argument("--quiet", action="store_true", required=False, default=False, help="Quiet output.")
@@ -158,6 +177,9 @@ def main():
     if not (args.post or args.patch or args.upsert or args.delete or args.purge or args.load):
         usage()
 
+    if args.bulk and args.confirm:
+        usage("The --confirm option is not supported with --bulk.")
+
     if not (portal := _create_portal(env=args.env, ini=args.ini, app=args.app, load=args.load,
                                      verbose=args.verbose, debug=args.debug, quiet=args.quiet)):
         exit(1)
@@ -172,33 +194,40 @@ def main():
         if not schema:
             usage(f"Unknown specified schema name: {args.schema}")
 
+    def post_or_patch_or_upsert(**kwargs) -> None:
+        if args.bulk:
+            _bulk_post_or_patch_or_upsert(**kwargs, nworkers=args.workers,
+                                          validate=args.validate, resume_file=args.resume)
+        else:
+            _post_or_patch_or_upsert(**kwargs)
+
     if args.post:
-        _post_or_patch_or_upsert(portal=portal,
-                                 file_or_directory=args.post,
-                                 explicit_schema_name=explicit_schema_name,
-                                 update_function=_post_data,
-                                 update_action_name="POST",
-                                 noignore=args.noignore, ignore=args.ignore,
-                                 confirm=args.confirm, verbose=args.verbose, quiet=args.quiet, debug=args.debug)
+        post_or_patch_or_upsert(portal=portal,
+                                file_or_directory=args.post,
+                                explicit_schema_name=explicit_schema_name,
+                                update_function=_post_data,
+                                update_action_name="POST",
+                                noignore=args.noignore, ignore=args.ignore,
+                                confirm=args.confirm, verbose=args.verbose, quiet=args.quiet, debug=args.debug)
     if args.patch:
-        _post_or_patch_or_upsert(portal=portal,
-                                 file_or_directory=args.patch,
-                                 explicit_schema_name=explicit_schema_name,
-                                 update_function=_patch_data,
-                                 update_action_name="PATCH",
-                                 patch_delete_fields=args.delete,
-                                 noignore=args.noignore, ignore=args.ignore,
-                                 confirm=args.confirm, verbose=args.verbose, quiet=args.quiet, debug=args.debug)
+        post_or_patch_or_upsert(portal=portal,
+                                file_or_directory=args.patch,
+                                explicit_schema_name=explicit_schema_name,
+                                update_function=_patch_data,
+                                update_action_name="PATCH",
+                                patch_delete_fields=args.delete,
+                                noignore=args.noignore, ignore=args.ignore,
+                                confirm=args.confirm, verbose=args.verbose, quiet=args.quiet, debug=args.debug)
         args.delete = None
     if args.upsert:
-        _post_or_patch_or_upsert(portal=portal,
-                                 file_or_directory=args.upsert,
-                                 explicit_schema_name=explicit_schema_name,
-                                 update_function=_upsert_data,
-                                 update_action_name="UPSERT",
-                                 patch_delete_fields=args.delete,
-                                 noignore=args.noignore, ignore=args.ignore,
-                                 confirm=args.confirm, verbose=args.verbose, quiet=args.quiet, debug=args.debug)
+        post_or_patch_or_upsert(portal=portal,
+                                file_or_directory=args.upsert,
+                                explicit_schema_name=explicit_schema_name,
+                                update_function=_upsert_data,
+                                update_action_name="UPSERT",
+                                patch_delete_fields=args.delete,
+                                noignore=args.noignore, ignore=args.ignore,
+                                confirm=args.confirm, verbose=args.verbose, quiet=args.quiet, debug=args.debug)
         args.delete = None
 
     if args.delete:
@@ -299,6 +328,163 @@ def _post_or_patch_or_upsert(portal: Portal, file_or_directory: str,
         _print(f"ERROR: Cannot find file or directory: {file_or_directory}")
 
 
+def _bulk_post_or_patch_or_upsert(portal: Portal, file_or_directory: str,
+                                  explicit_schema_name: str,
+                                  update_function: Callable, update_action_name: str,
+                                  patch_delete_fields: Optional[str] = None,
+                                  noignore: bool = False, ignore: Optional[List[str]] = None,
+                                  confirm: bool = False, verbose: bool = False,
+                                  quiet: bool = False, debug: bool = False,
+                                  nworkers: int = _DEFAULT_BULK_WORKERS, validate: bool = False,
+                                  resume_file: Optional[str] = None) -> bool:
+    """
+    Same as _post_or_patch_or_upsert but reads all of the items up front and orders them by their linkTo
+    dependencies on each other (via TopologicalSorter); each layer of items whose dependencies are done is
+    then updated concurrently with (at most) nworkers threads. If validate is True then each layer is first
+    validated (via check_only) and only valid items updated. Items depending on an item which failed are
+    not updated. If a resume_file is given then each updated item is appended to it (as its action and
+    identifying path), and items already recorded there are skipped; so that a large load which failed
+    part way through may simply be rerun. Returns True if all items were successfully updated (or skipped).
+    """
+    ignored(confirm)
+    items = []
+
+    def collect_item(portal: Portal, data: dict, schema_name: str,
+                     file: Optional[str] = None, index: int = 0, **kwargs) -> None:
+        ignored(portal, kwargs)
+        if isinstance(data, dict):
+            items.append((schema_name, data, file, index))
+
+    _post_or_patch_or_upsert(portal, file_or_directory, explicit_schema_name,
+                             update_function=collect_item, update_action_name=update_action_name,
+                             quiet=quiet, debug=debug)
+    if not items:
+        return True
+
+    # Identifying values (e.g. uuid, submitted_id, aliases) of the items being loaded, mapped to
+    # their item index; then any linkTo reference (within the items) to one of these is a dependency.
+    identifying_values = {}
+    for item_index, (schema_name, data, _, _) in enumerate(items):
+        for identifying_value in _get_identifying_values(portal, data, schema_name):
+            identifying_values.setdefault(identifying_value, item_index)
+    sorter = TopologicalSorter()
+    dependencies = []
+    for item_index, (schema_name, data, _, _) in enumerate(items):
+        schema = portal.get_schema(schema_name) or {}
+        dependencies.append(set())
+        for link in _get_linkto_values(schema.get("properties"), data):
+            link = [segment for segment in link.split("/") if segment][-1:]
+            if link and (((dependency := identifying_values.get(link[0])) is not None) and
+                         (dependency != item_index)):  # noqa
+                dependencies[item_index].add(dependency)
+        sorter.add(item_index, *dependencies[item_index])
+    item_keys = [f"{update_action_name} {portal.get_identifying_path(data, portal_type=schema_name)}"
+                 for schema_name, data, _, _ in items]
+    try:
+        sorter.prepare()
+    except CycleError as e:
+        # Items not in the cycle are still processed (see TopologicalSorter.prepare); those in it are not.
+        _print(f"ERROR: Circular linkTo dependencies among {update_action_name} items:"
+               f" {' → '.join(item_keys[item_index].split(' ', 1)[1] for item_index in e.args[1])}")
+
+    completed = _read_resume_file(resume_file) if resume_file else set()
+    resume_file_lock = Lock()
+    nupdated = nresumed = nfailed = nblocked = 0
+    failed = set()
+
+    def update_item(item_index: int, check_only: bool = False) -> bool:
+        schema_name, data, file, index = items[item_index]
+        try:
+            if update_function(portal, data, schema_name, file=file, index=index,
+                               patch_delete_fields=patch_delete_fields,
+                               noignore=noignore, ignore=ignore,
+                               verbose=verbose, debug=debug, check_only=check_only) is not True:
+                return False
+        except Exception as e:
+            _print(f"ERROR: Cannot {update_action_name} {schema_name} item: {item_keys[item_index]}")
+            _print(get_error_message(e))
+            return False
+        if resume_file and not check_only:
+            with resume_file_lock:
+                with io.open(resume_file, "a") as f:
+                    f.write(f"{item_keys[item_index]}\n")
+        return True
+
+    if not quiet:
+        _print(f"Bulk {update_action_name} items: {len(items)} (workers: {nworkers})")
+    with ThreadPoolExecutor(max_workers=max(nworkers, 1)) as executor:
+        while sorter.is_active() and (layer := sorter.get_ready()):
+            pending = []
+            for item_index in layer:
+                if dependencies[item_index] & failed:
+                    _print(f"ERROR: Not updating item due to failed dependency: {item_keys[item_index]}")
+                    failed.add(item_index)
+                    nblocked += 1
+                elif item_keys[item_index] in completed:
+                    nresumed += 1
+                else:
+                    pending.append(item_index)
+            if validate and pending:
+                valid = list(executor.map(lambda item_index: update_item(item_index, check_only=True), pending))
+                for item_index in [item_index for item_index, ok in zip(pending, valid) if not ok]:
+                    failed.add(item_index)
+                    nfailed += 1
+                pending = [item_index for item_index, ok in zip(pending, valid) if ok]
+            for item_index, ok in zip(pending, executor.map(update_item, pending)):
+                if ok:
+                    nupdated += 1
+                else:
+                    failed.add(item_index)
+                    nfailed += 1
+            sorter.done(*layer)
+    nunprocessed = len(items) - nupdated - nresumed - nfailed - nblocked
+    if not quiet:
+        _print(f"Bulk {update_action_name} done: {nupdated} updated"
+               f"{f', {nresumed} skipped (already done per resume file)' if nresumed else ''}"
+               f"{f', {nfailed} failed' if nfailed else ''}"
+               f"{f', {nblocked} not updated due to failed dependencies' if nblocked else ''}"
+               f"{f', {nunprocessed} not updated due to circular dependencies' if nunprocessed else ''}")
+    return (nfailed + nblocked + nunprocessed) == 0
+
+
+def _get_identifying_values(portal: Portal, data: dict, schema_name: str) -> List[str]:
+    identifying_values = []
+    for identifying_property in portal.get_identifying_property_names(schema_name):
+        if isinstance(identifying_value := data.get(identifying_property), str) and identifying_value:
+            identifying_values.append(identifying_value)
+        elif isinstance(identifying_value, list):
+            identifying_values.extend(value for value in identifying_value if isinstance(value, str) and value)
+    return identifying_values
+
+
+def _get_linkto_values(properties: Optional[dict], data: dict) -> List[str]:
+    # Returns the values of the (possibly nested or array) linkTo properties in the given data.
+    linkto_values = []
+    if not (isinstance(properties, dict) and isinstance(data, dict)):
+        return linkto_values
+    for property_name, property_value in data.items():
+        if not isinstance(property_schema := properties.get(property_name), dict):
+            continue
+        if (property_schema.get("type") == "array") and isinstance(property_schema.get("items"), dict):
+            property_schema = property_schema["items"]
+            property_values = property_value if isinstance(property_value, list) else [property_value]
+        else:
+            property_values = [property_value]
+        for property_value in property_values:
+            if property_schema.get("linkTo") and isinstance(property_value, str) and property_value:
+                linkto_values.append(property_value)
+            elif isinstance(property_value, dict):
+                linkto_values.extend(_get_linkto_values(property_schema.get("properties"), property_value))
+    return linkto_values
+
+
+def _read_resume_file(resume_file: str) -> Set[str]:
+    if not os.path.exists(resume_file):
+        return set()
+    with io.open(resume_file, "r") as f:
+        return set(line.strip() for line in f if line.strip())
+
+
 def _impose_special_ordering(data: List[dict], schema_name: str) -> List[dict]:
     if schema_name == "FileFormat":
         return sorted(data, key=lambda item: "extra_file_formats" in item)
@@ -309,94 +495,101 @@ def _post_data(portal: Portal, data: dict, schema_name: str,
                file: Optional[str] = None, index: int = 0,
                patch_delete_fields: Optional[str] = None,
                noignore: bool = False, ignore: Optional[List[str]] = None,
-               confirm: bool = False, verbose: bool = False, debug: bool = False) -> None:
+               confirm: bool = False, verbose: bool = False, debug: bool = False,
+               check_only: bool = False) -> bool:
     ignored(patch_delete_fields)
     if not (identifying_path := portal.get_identifying_path(data, portal_type=schema_name)):
         if isinstance(file, str) and isinstance(index, int):
             _print(f"ERROR: Item for POST has no identifying property: {file} (#{index + 1})")
         else:
             _print(f"ERROR: Item for POST has no identifying property.")
-        return
+        return False
     if portal.get_metadata(identifying_path, raise_exception=False):
         _print(f"ERROR: Item for POST already exists: {identifying_path}")
-        return
+        return False
     if (confirm is True) and not yes_or_no(f"POST data for: {identifying_path} ?"):
-        return
+        return False
     if verbose:
-        _print(f"POST {schema_name} item: {identifying_path}")
+        _print(f"POST{' (check only)' if check_only else ''} {schema_name} item: {identifying_path}")
     try:
         data = _prune_data_for_update(data, noignore=noignore, ignore=ignore)
-        portal.post_metadata(schema_name, data)
+        portal.post_metadata(schema_name, data, check_only=check_only)
         if debug:
             _print(f"DEBUG: POST {schema_name} item done: {identifying_path}")
+        return True
     except Exception as e:
         _print(f"ERROR: Cannot POST {schema_name} item: {identifying_path}")
         _print(get_error_message(e))
-        return
+        return False
 
 
 def _patch_data(portal: Portal, data: dict, schema_name: str,
                 file: Optional[str] = None, index: int = 0,
                 patch_delete_fields: Optional[str] = None,
                 noignore: bool = False, ignore: Optional[List[str]] = None,
-                confirm: bool = False, verbose: bool = False, debug: bool = False) -> None:
+                confirm: bool = False, verbose: bool = False, debug: bool = False,
+                check_only: bool = False) -> bool:
     if not (identifying_path := portal.get_identifying_path(data, portal_type=schema_name)):
         if isinstance(file, str) and isinstance(index, int):
             _print(f"ERROR: Item for PATCH has no identifying property: {file} (#{index + 1})")
         else:
             _print(f"ERROR: Item for PATCH has no identifying property.")
-        return
+        return False
     if not portal.get_metadata(identifying_path, raise_exception=False):
         _print(f"ERROR: Item for PATCH does not already exist: {identifying_path}")
-        return
+        return False
     if (confirm is True) and not yes_or_no(f"PATCH data for: {identifying_path}"):
-        return
+        return False
     if verbose:
-        _print(f"PATCH {schema_name} item: {identifying_path}")
+        _print(f"PATCH{' (check only)' if check_only else ''} {schema_name} item: {identifying_path}")
     try:
-        if delete_fields := _parse_delete_fields(patch_delete_fields):
+        if (not check_only) and (delete_fields := _parse_delete_fields(patch_delete_fields)):
             identifying_path += f"?delete_fields={delete_fields}"
         data = _prune_data_for_update(data, noignore=noignore, ignore=ignore)
-        portal.patch_metadata(identifying_path, data)
+        portal.patch_metadata(identifying_path, data, check_only=check_only)
         if debug:
             _print(f"DEBUG: PATCH {schema_name} item OK: {identifying_path}")
+        return True
     except Exception as e:
         _print(f"ERROR: Cannot PATCH {schema_name} item: {identifying_path}")
         _print(e)
-        return
+        return False
 
 
 def _upsert_data(portal: Portal, data: dict, schema_name: str,
                  file: Optional[str] = None, index: int = 0,
                  patch_delete_fields: Optional[str] = None,
                  noignore: bool = False, ignore: Optional[List[str]] = None,
-                 confirm: bool = False, verbose: bool = False, debug: bool = False) -> None:
+                 confirm: bool = False, verbose: bool = False, debug: bool = False,
+                 check_only: bool = False) -> bool:
     if not (identifying_path := portal.get_identifying_path(data, portal_type=schema_name)):
         if isinstance(file, str) and isinstance(index, int):
             _print(f"ERROR: Item for UPSERT has no identifying property: {file} (#{index + 1})")
         else:
             _print(f"ERROR: Item for UPSERT has no identifying property.")
-        return
+        return False
     exists = portal.get_metadata(identifying_path, raise_exception=False)
     if ((confirm is True) and not yes_or_no(f"{'PATCH' if exists else 'POST'} data for: {identifying_path} ?")):
-        return
+        return False
     if verbose:
-        _print(f"{'PATCH' if exists else 'POST'} {schema_name} item: {identifying_path}")
+        _print(f"{'PATCH' if exists else 'POST'}{' (check only)' if check_only else ''}"
+               f" {schema_name} item: {identifying_path}")
     try:
         if not exists:
             data = _prune_data_for_update(data, noignore=noignore, ignore=ignore)
-            portal.post_metadata(schema_name, data)
+            portal.post_metadata(schema_name, data, check_only=check_only)
         else:
-            if delete_fields := _parse_delete_fields(patch_delete_fields):
+            if (not check_only) and (delete_fields := _parse_delete_fields(patch_delete_fields)):
                 identifying_path += f"?delete_fields={delete_fields}"
             data = _prune_data_for_update(data, noignore=noignore, ignore=ignore)
-            portal.patch_metadata(identifying_path, data)
+            portal.patch_metadata(identifying_path, data, check_only=check_only)
         if debug:
             _print(f"DEBUG: UPSERT {schema_name} item OK: {identifying_path}")
+        return True
     except Exception as e:
         _print(f"ERROR: Cannot UPSERT {schema_name} item: {identifying_path}")
         _print(e)
-        return
+        return False
 
 
 def _load_data(portal: Portal, load: str, ini_file: str, explicit_schema_name: Optional[str] = None,
@@ -53,16 +53,26 @@
 # Note that instead of a uuid you can also actually use a path, for example:
 #   view-local-object /file-formats/vcf_gz_tbi
 #
+# To export (snapshot) all objects of one or more (comma-separated) types, or all types, to insert files,
+# streaming (paged) search results to disk, for each type concurrently, with bounded memory usage:
+#   view-portal-object all --stream --output snapshot-directory [--jsonl] [--workers 8] [--page-size 500]
+#
+# This also writes a manifest.json file to the output directory with item counts and timings per type.
+#
 # --------------------------------------------------------------------------------------------------
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 import io
 import json
 import pyperclip
 import os
+from queue import Full, Queue
 import sys
-from typing import Callable, List, Optional, TextIO, Tuple, Union
+from threading import Event, Thread
+import time
+from typing import Callable, Generator, Iterator, List, Optional, TextIO, Tuple, Union
 import yaml
 from dcicutils.captured_output import captured_output, uncaptured_output
 from dcicutils.command_utils import yes_or_no
@@ -79,6 +89,11 @@ _SCHEMAS_IGNORE_PROPERTIES = [
     "schema_version"
 ]
 
+_STREAM_DEFAULT_PAGE_SIZE = 100
+_STREAM_DEFAULT_WORKERS = 4
+_STREAM_DEFAULT_PREFETCH = 2
+_STREAM_MANIFEST_FILE_NAME = "manifest.json"
+
 _output_file: TextIO = None
 
 
@@ -107,6 +122,15 @@ def main():
     parser.add_argument("--insert-files", action="store_true", required=False, default=False,
                         help="Output for to insert files.")
     parser.add_argument("--ignore", nargs="+", help="Ignore these fields for --inserts.")
+    parser.add_argument("--stream", action="store_true", required=False, default=False,
+                        help="Stream all objects of the given (comma-separated) types, or all, to insert files.")
+    parser.add_argument("--jsonl", action="store_true", required=False, default=False,
+                        help="Write JSONL (one object per line) rather than JSON array files for --stream.")
+    parser.add_argument("--page-size", type=int, required=False, default=_STREAM_DEFAULT_PAGE_SIZE,
+                        help=f"Search page size for --stream (default: {_STREAM_DEFAULT_PAGE_SIZE}).")
+    parser.add_argument("--workers", type=int, required=False, default=_STREAM_DEFAULT_WORKERS,
+                        help=f"Number of types to export concurrently for --stream"
+                             f" (default: {_STREAM_DEFAULT_WORKERS}).")
     parser.add_argument("--tree", action="store_true", required=False, default=False, help="Tree output for schemas.")
     parser.add_argument("--database", action="store_true", required=False, default=False,
                         help="Read from database output.")
@@ -134,6 +158,9 @@ def main():
         _print("UUID or schema or path required.")
         _exit(1)
 
+    if args.stream:
+        args.insert_files = True
+
     if args.insert_files:
         args.inserts = True
         if args.output:
@@ -154,6 +181,16 @@ def main():
                     _exit(0)
         _output_file = io.open(args.output, "w")
 
+    if args.stream:
+        type_names = args.uuid.split(",") if args.uuid.lower() not in ["all", "item"] else None
+        output_directory = args.insert_files if isinstance(args.insert_files, str) else os.getcwd()
+        if not _stream_insert_files(portal, type_names=type_names, output_directory=output_directory,
+                                    page_size=args.page_size, nworkers=args.workers, jsonl=args.jsonl,
+                                    database=args.database, ignore=args.ignore,
+                                    force=args.force, verbose=args.verbose):
+            _exit(1)
+        return
+
     if args.uuid and ((args.uuid.lower() == "schemas") or (args.uuid.lower() == "schema")):
         _print_all_schema_names(portal=portal, terse=args.terse, all=args.all,
                                 tree=args.tree, summary=args.summary, yaml=args.yaml)
@@ -455,6 +492,177 @@ def _get_portal_object(portal: Portal, uuid: str,
     return response
 
 
+def _stream_insert_files(portal: Portal, type_names: Optional[List[str]], output_directory: str,
+                         page_size: int = _STREAM_DEFAULT_PAGE_SIZE, nworkers: int = _STREAM_DEFAULT_WORKERS,
+                         prefetch: int = _STREAM_DEFAULT_PREFETCH, jsonl: bool = False, database: bool = False,
+                         ignore: Optional[List[str]] = None, force: bool = False,
+                         verbose: bool = False) -> Optional[dict]:
+    """
+    Writes (raw frame) insert files, i.e. {type_name}.json (or .jsonl), to the given output directory, for
+    all objects of each of the given types (or all non-abstract types if None); abstract types are expanded
+    to their non-abstract subtypes. Unlike _get_portal_object (with insert_files) this never holds more
+    than a few pages of search results in memory per type: pages are fetched (ahead) in the background
+    and streamed to (temporary, then renamed) files; and up to nworkers types are exported concurrently.
+    Also writes a manifest.json file with counts and timings per type. Returns this manifest, or None
+    on error.
+    """
+    export_type_names = []
+    schemas = _get_schemas(portal) or {}
+    for given_type_name in (type_names if type_names else list(schemas.keys())):
+        schema, type_name = _get_schema(portal, given_type_name)
+        if not schema:
+            _print(f"Unknown type name: {given_type_name}")
+            return None
+        for type_name in ([type_name] if schema.get("isAbstract") is not True
+                          else portal.get_schema_subtype_names(type_name)):
+            if ((schemas.get(type_name) or {}).get("isAbstract") is not True) and (type_name not in export_type_names):
+                export_type_names.append(type_name)
+    file_extension = "jsonl" if jsonl else "json"
+    file_paths = {type_name: os.path.join(output_directory, f"{to_snake_case(type_name)}.{file_extension}")
+                  for type_name in export_type_names}
+    if existing_file_paths := [file_path for file_path in file_paths.values() if os.path.exists(file_path)]:
+        if directories := [file_path for file_path in existing_file_paths if os.path.isdir(file_path)]:
+            _print(f"Output file already exists as a directory: {directories[0]}")
+            return None
+        if not force:
+            _print(f"Output files already exist: {len(existing_file_paths)}")
+            if not yes_or_no(f"Overwrite these files?"):
+                return None
+
+    def export_type(type_name: str) -> dict:
+        file_path = file_paths[type_name]
+        temporary_file_path = f"{file_path}.tmp"
+        subtype_names = portal.get_schema_subtype_names(type_name)
+        started = time.time()
+        count = 0
+        npages = 0
+        try:
+            with io.open(temporary_file_path, "w") as f:
+                if not jsonl:
+                    f.write("[")
+                for page in _prefetching_generator(_search_pages(portal, type_name, page_size=page_size,
+                                                                 database=database,
+                                                                 exclude_subtypes=bool(subtype_names)),
+                                                   prefetch=prefetch):
+                    npages += 1
+                    for item in page:
+                        item.pop("schema_version", None)
+                        if isinstance(ignore, list) and ignore:
+                            item = {key: value for key, value in item.items() if key not in ignore}
+                        if jsonl:
+                            f.write(f"{json.dumps(item, default=str)}\n")
+                        else:
+                            f.write(f"{',' if count > 0 else ''}\n{json.dumps(item, default=str)}")
+                        count += 1
+                if not jsonl:
+                    f.write("\n]\n" if count > 0 else "]\n")
+            os.replace(temporary_file_path, file_path)
+        except Exception as e:
+            if os.path.exists(temporary_file_path):
+                os.remove(temporary_file_path)
+            _print(f"ERROR: Cannot export {type_name} objects: {get_error_message(e)}")
+            return {"file": os.path.basename(file_path), "error": get_error_message(e)}
+        duration = time.time() - started
+        if verbose:
+            _print(f"Wrote {type_name} (object{'s' if count != 1 else ''}: {count}) file: {file_path}"
+                   f" ({duration:.1f} seconds)")
+        return {"file": os.path.basename(file_path), "count": count, "pages": npages,
+                "bytes": os.path.getsize(file_path), "seconds": round(duration, 3)}
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(nworkers, 1)) as executor:
+        types = dict(zip(export_type_names, executor.map(export_type, export_type_names)))
+    manifest = {"server": portal.server, "env": portal.env, "database": database,
+                "format": file_extension, "page_size": page_size,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)),
+                "seconds": round(time.time() - started, 3),
+                "count": sum(value.get("count", 0) for value in types.values()),
+                "errors": len([value for value in types.values() if value.get("error")]),
+                "types": types}
+    with io.open(manifest_file_path := os.path.join(output_directory, _STREAM_MANIFEST_FILE_NAME), "w") as f:
+        json.dump(manifest, f, indent=4)
+    if verbose:
+        errors = f", errors: {manifest['errors']}" if manifest["errors"] else ""
+        _print(f"Wrote manifest (objects: {manifest['count']}, types: {len(types)}{errors}) file: {manifest_file_path}")
+    return manifest if not manifest["errors"] else None
+
+
+def _search_pages(portal: Portal, type_name: str, page_size: int = _STREAM_DEFAULT_PAGE_SIZE,
+                  database: bool = False, exclude_subtypes: bool = False) -> Generator[List[dict], None, None]:
+    # Yields successive pages of (raw frame) search results for the given type; sorted for stable paging, with
+    # uuid as a (unique) tiebreak, since many objects can have the same date_created (e.g. after a bulk load),
+    # and their order would otherwise be arbitrary, so that they could be duplicated or skipped across pages.
+    # A search for a type includes objects of its subtypes, which in the raw frame cannot be distinguished
+    # (no @type); so if exclude_subtypes then get the types for each page via a separate (non-raw) query.
+    def search(offset: int, raw: bool) -> List[dict]:
+        query = f"/search/?type={type_name}&sort=date_created&sort=uuid"
+        if not raw:
+            query += "&field=uuid&field=@type"
+        try:
+            response = portal.get(query, raw=raw, database=database, limit=page_size, offset=offset)
+        except Exception as e:
+            if "404" in str(e):  # Empty search results are returned as 404 (Not Found).
+                return []
+            raise
+        if response.status_code == 404:
+            return []
+        response.raise_for_status()
+        return response.json().get("@graph") or []
+    offset = 0
+    while results := search(offset, raw=True):
+        if exclude_subtypes:
+            result_types = {result.get("uuid"): (result.get("@type") or [type_name])[0]
+                            for result in search(offset, raw=False)}
+            yield [result for result in results if result_types.get(result.get("uuid"), type_name) == type_name]
+        else:
+            yield results
+        if len(results) < page_size:
+            break
+        offset += len(results)
+
+
+def _prefetching_generator(generator: Iterator, prefetch: int = _STREAM_DEFAULT_PREFETCH) -> Generator:
+    # Iterates the given generator in a background thread, up to prefetch values ahead of the consumer;
+    # any exception from the given generator is raised to the consumer. The background thread stops
+    # (at the next value) if the consumer stops early, i.e. if this generator is closed.
+    if not (isinstance(prefetch, int) and prefetch > 0):
+        yield from generator
+        return
+    queue = Queue(maxsize=prefetch)
+    stopped = Event()
+    end = object()
+
+    def put(value, exception: Optional[Exception] = None) -> bool:
+        while not stopped.is_set():
+            try:
+                queue.put((value, exception), timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for value in generator:
+                if not put(value):
+                    return
+            put(end)
+        except Exception as e:
+            put(end, e)
+
+    Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            value, exception = queue.get()
+            if value is end:
+                if exception:
+                    raise exception
+                return
+            yield value
+    finally:
+        stopped.set()
+
+
 def one_or_more_objects_of_types_exists(portal: Portal, schema_types: List[str], debug: bool = False) -> bool:
     for schema_type in schema_types:
         if one_or_more_objects_of_type_exists(portal, schema_type, debug=debug):
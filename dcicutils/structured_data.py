@@ -1,5 +1,4 @@
 import copy
-from functools import lru_cache
 import json
 from jsonschema import Draft7Validator as SchemaValidator
 from pyramid.router import Router
@@ -11,6 +10,7 @@ from webtest.app import TestApp
 from dcicutils.common import OrchestratedApp
 from dcicutils.data_readers import CsvReader, Excel, RowReader
 from dcicutils.datetime_utils import normalize_date_string, normalize_datetime_string
+from dcicutils.function_cache_decorator import instance_cache
 from dcicutils.misc_utils import (create_dict, create_readonly_object, is_uuid, load_json_if,
                                   merge_objects, remove_empty_properties, right_trim, split_string,
                                   to_boolean, to_enum, to_float, to_integer, VirtualApp)
@@ -977,7 +977,7 @@ class Portal(PortalBase):
         self._ref_total_found_count = 0
         self._ref_total_notfound_count = 0
 
-    @lru_cache(maxsize=10000)
+    @instance_cache(maxsize=10000)
     def ref_lookup_cached(self, object_name: str) -> Optional[dict]:
         return self.ref_lookup_uncached(object_name)
 
@@ -993,11 +993,11 @@ class Portal(PortalBase):
                 self._ref_lookup_error_count += 1
             return None
 
-    @lru_cache(maxsize=100)
+    @instance_cache(maxsize=100)
     def get_schema(self, schema_name: str) -> Optional[dict]:
         return schemas.get(Schema.type_name(schema_name), None) if (schemas := self.get_schemas()) else None
 
-    @lru_cache(maxsize=1)
+    @instance_cache(maxsize=1)
     def get_schemas(self) -> Optional[dict]:
         if not (schemas := super().get_schemas()) or (schemas.get("status") == "error"):
             return None
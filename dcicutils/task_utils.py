@@ -1,8 +1,15 @@
+from concurrent.futures import (
+    CancelledError, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError, wait
+)
+from itertools import islice
+import os
+import pickle
 import threading
+import time
 
 from dcicutils.exceptions import MultiError
 from dcicutils.lang_utils import n_of
-from dcicutils.misc_utils import chunked, environ_bool, PRINT
+from dcicutils.misc_utils import environ_bool, PRINT
 
 # Intended use (see tests for more examples):
 #
@@ -19,6 +26,11 @@ from dcicutils.misc_utils import chunked, environ_bool, PRINT
 #     list(map(lambda x: x + 1, range(100)))
 #
 # except that the mapping has parallelism (chunk size 10 by default, managed by keyword arguments).
+# The chunk size is the number of worker threads (each starting its next call as soon as its last finishes),
+# as well as the size of the lists of results that pmap_chunks yields. With ordered=False, the results are
+# yielded as they are completed rather than in order. With executor="process", the calls are made in a pool of
+# processes instead (for CPU-bound functions, which get no speedup from threads), batch_size at a time; or see
+# cpu_pmap_list, which does this only if it is worthwhile.
 #
 # To use the chunking, you might instead have written
 #
@@ -29,7 +41,8 @@ from dcicutils.misc_utils import chunked, environ_bool, PRINT
 # Caveats:
 #
 #  * This does not manage timeouts or other forms of abort, abandoned threads must still run to completion,
-#    so all functions mapped must arrange for their own timeouts.
+#    so all functions mapped must arrange for their own timeouts. (On an error with fail_fast, or if the
+#    results are abandoned, calls not yet started are cancelled, but those already running are not.)
 
 
 class Task:
@@ -85,17 +98,32 @@ class Task:
 class TaskManager:
 
     DEFAULT_CHUNK_SIZE = 10
+    DEFAULT_PROCESS_BATCH_SIZE = 16
+    THREAD_EXECUTOR = "thread"
+    PROCESS_EXECUTOR = "process"
     TASK_CLASS = Task
     VERBOSE = environ_bool("TASK_MANAGER_VERBOSE")
     _COUNTER_LOCK = threading.Lock()
     _ID_COUNTER = 0
 
-    def __init__(self, fail_fast=True, raise_error=True, chunk_size=None):
+    def __init__(self, fail_fast=True, raise_error=True, chunk_size=None, ordered=True, max_pending=None,
+                 executor=None, batch_size=None, max_workers=None):
         if fail_fast and not raise_error:
             raise ValueError("raise_erorr cannot be false if fail_fast is true.")
+        if executor not in (None, self.THREAD_EXECUTOR, self.PROCESS_EXECUTOR):
+            raise ValueError(f"executor must be {self.THREAD_EXECUTOR!r} or {self.PROCESS_EXECUTOR!r}: {executor!r}")
         self.fail_fast = fail_fast
         self.raise_error = raise_error
-        self.chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        self.executor = executor or self.THREAD_EXECUTOR
+        if self.executor == self.PROCESS_EXECUTOR:
+            self.chunk_size = chunk_size or os.cpu_count() or 1
+            self.batch_size = batch_size or self.DEFAULT_PROCESS_BATCH_SIZE
+        else:
+            self.chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+            self.batch_size = 1
+        self.max_workers = max_workers or self.chunk_size
+        self.ordered = ordered
+        self.max_pending = max(max_pending or 2 * self.chunk_size * self.batch_size, self.chunk_size * self.batch_size)
         self.manager_id = self.new_manager_id()
         self._call_id = 0
 
@@ -114,28 +142,34 @@ class TaskManager:
             return call_id
 
     @classmethod
-    def pmap(cls, fn, seq, *more_seqs, fail_fast=True, raise_error=True, chunk_size=None):
+    def pmap(cls, fn, seq, *more_seqs, fail_fast=True, raise_error=True, chunk_size=None,
+             ordered=True, max_pending=None, executor=None, batch_size=None):
         for chunk in cls.pmap_chunks(fn, seq, *more_seqs, fail_fast=fail_fast, raise_error=raise_error,
-                                     chunk_size=chunk_size):
+                                     chunk_size=chunk_size, ordered=ordered, max_pending=max_pending,
+                                     executor=executor, batch_size=batch_size):
             for item in chunk:
                 yield item
 
     @classmethod
-    def pmap_list(cls, fn, seq, *more_seqs, fail_fast=True, raise_error=True, chunk_size=None):
+    def pmap_list(cls, fn, seq, *more_seqs, fail_fast=True, raise_error=True, chunk_size=None,
+                  ordered=True, max_pending=None, executor=None, batch_size=None):
         result = []
         for chunk in cls.pmap_chunks(fn, seq, *more_seqs, fail_fast=fail_fast, raise_error=raise_error,
-                                     chunk_size=chunk_size):
+                                     chunk_size=chunk_size, ordered=ordered, max_pending=max_pending,
+                                     executor=executor, batch_size=batch_size):
             result += chunk
         return result
 
     @classmethod
-    def pmap_chunks(cls, fn, seq, *more_seqs, fail_fast=True, raise_error=True, chunk_size=None):  # generator
+    def pmap_chunks(cls, fn, seq, *more_seqs, fail_fast=True, raise_error=True, chunk_size=None,
+                    ordered=True, max_pending=None, executor=None, batch_size=None):  # generator
         """
-        Maps a function across given arguments with each call performed in a separate thread.
+        Maps a function across given arguments with the calls performed by a pool of chunk_size worker threads;
+        as soon as any call finishes, the next one starts. The results are yielded in lists of chunk_size.
         If errors occur, they are trapped and appropriate information is communicated to the main thread.
 
          * If fail_fast is False, any errors for each call are detected, not just the first error.
-           Otherwise, as soon as some error is detected, it is raised.
+           Otherwise, as soon as some error is detected, it is raised, and calls not yet started are cancelled.
          * If raise_error is False, the errors detected are returned rather than being raised.
 
         :param fn: The function to map
@@ -144,60 +178,345 @@ class TaskManager:
         :param fail_fast: Whether to stop as soon as an error is noticed.
         :param raise_error: Whether to raise errors that are detected. If false, the error object become results.
         :param chunk_size: How many items to do at once. If unsupplied, the .DEFAULT_CHUNK_SIZE will be used.
+        :param ordered: Whether to yield results in the order of the arguments, or else as they are completed.
+        :param max_pending: How many items may be read from the given sequences, but not yet yielded, at once
+           (i.e. how far ahead of the results the sequences are read). If unsupplied, twice chunk_size (times
+           batch_size).
+        :param executor: Either "thread" (the default) to make the calls in threads, or "process" to make them
+           in a pool of chunk_size (by default the number of CPUs) processes, for CPU-bound functions;
+           the function and arguments must then be picklable (e.g. the function cannot be a lambda).
+        :param batch_size: For executor="process", how many calls each process makes per task sent to it,
+           to amortize the overhead of sending it. If unsupplied, the .DEFAULT_PROCESS_BATCH_SIZE will be used.
         """
-        manager = TaskManager(fail_fast=fail_fast, raise_error=raise_error, chunk_size=chunk_size)
+        manager = TaskManager(fail_fast=fail_fast, raise_error=raise_error, chunk_size=chunk_size,
+                              ordered=ordered, max_pending=max_pending, executor=executor, batch_size=batch_size)
         return manager._pmap_chunks(fn, seq, *more_seqs)
 
     def _pmap_chunks(self, fn, seq1, *more_seqs):
         call_id = self.new_call_id()
-        chunk_post = 0
-        more_seq_generators = [(x for x in seq) for seq in more_seqs]
-        for chunk in chunked(seq1, chunk_size=self.chunk_size):
-            n = len(chunk)
-            tasks = [Task(manager=self, call_id=call_id, position=chunk_post + i,
-                          function=fn, arg1=chunk_element,
-                          more_args=[next(seq_generator) for seq_generator in more_seq_generators])
-                     for i, chunk_element in enumerate(chunk)]
-            for task in tasks:
-                task.init()
-            try:
-                for task in tasks:
-                    if self.VERBOSE:  # pragma: no cover
-                        PRINT(f"Starting {task}...")
-                    task.start()
-                for task in tasks:
-                    if self.VERBOSE:  # pragma: no cover
-                        PRINT(f"Finishing {task}...")
-                    task.finish()
-                    if task.error and self.fail_fast:
-                        if self.VERBOSE:  # pragma: no cover
-                            PRINT(f"While accumulating tasks, an error was found and is being raised due to fail_fast.")
-                        raise task.error
-                if not self.raise_error:
+        args = enumerate(zip(seq1, *more_seqs))
+        args_exhausted = False
+        pending = {}  # future -> tasks, for the tasks submitted to the pool (running or waiting to run)
+        n_pending = 0
+        completed = {}  # position -> task, for the tasks completed but not yet yielded (if ordered)
+        next_position = 0
+        chunk = []
+        if self.executor == self.PROCESS_EXECUTOR:
+            pickle.dumps(fn)  # So that an unpicklable function fails right away (rather than per batch).
+            executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                          thread_name_prefix=f"TaskManager-{self.manager_id}")
+        try:
+            while True:
+                # Only read ahead in the argument sequences as far as max_pending (backpressure).
+                while not args_exhausted and n_pending + len(completed) + len(chunk) < self.max_pending:
+                    batch = []
+                    for position, (arg1, *more_args) in islice(args, self.batch_size):
+                        batch.append(self.TASK_CLASS(manager=self, call_id=call_id, position=position,
+                                                     function=fn, arg1=arg1, more_args=more_args))
+                    if len(batch) < self.batch_size:
+                        args_exhausted = True
+                    if not batch:
+                        break
                     if self.VERBOSE:  # pragma: no cover
-                        PRINT(f"Because fail_fast is false, returning list of {n_of(n, 'error or result')}"
-                              f" for chunk {chunk}.")
-                    yield list(map(lambda record: record.error or record.result, tasks))
-                else:
-                    errors = [record.error for record in tasks if record.ready and record.error]
-                    if not errors:
-                        if self.VERBOSE:  # pragma: no cover
-                            PRINT(f"No errors to raise in chunk {chunk}.")
-                        yield [record.result for record in tasks]
-                    elif len(errors) == 1:
-                        if self.VERBOSE:  # pragma: no cover
-                            PRINT(f"Just one error to raise in chunk {chunk}.")
-                        raise errors[0]
+                        PRINT(f"Starting {n_of(batch, 'task')} from {batch[0]}...")
+                    if self.executor == self.PROCESS_EXECUTOR:
+                        future = executor.submit(_call_batch, fn, [(task.arg1, task.more_args) for task in batch])
                     else:
+                        future = executor.submit(batch[0].call)
+                    pending[future] = batch
+                    n_pending += len(batch)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    n_pending -= len(batch)
+                    if self.executor == self.PROCESS_EXECUTOR:
+                        self._set_batch_results(batch, future)
+                    for task in batch:
                         if self.VERBOSE:  # pragma: no cover
-                            PRINT(f"Multiple errors to raise as a MultiError in chunk {chunk}.")
-                        raise MultiError(*errors)
-            finally:
-                for task in tasks:
+                            PRINT(f"Finished {task}.")
+                        if task.error and self.fail_fast:
+                            if self.VERBOSE:  # pragma: no cover
+                                PRINT(f"While accumulating tasks, an error was found"
+                                      f" and is being raised due to fail_fast.")
+                            raise task.error
+                        completed[task.position] = task
+                if self.ordered:
+                    while next_position in completed:
+                        chunk.append(completed.pop(next_position))
+                        next_position += 1
+                else:
+                    chunk.extend(completed.pop(position) for position in sorted(completed))
+                while len(chunk) >= self.chunk_size:
+                    yield self._chunk_results(chunk[:self.chunk_size])
+                    chunk = chunk[self.chunk_size:]
+            if chunk:
+                yield self._chunk_results(chunk)
+        finally:
+            for future, batch in pending.items():
+                future.cancel()
+                for task in batch:
                     task.kill()
-            chunk_post += n
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _set_batch_results(tasks, future):
+        try:
+            results = future.result()
+        except Exception as e:  # E.g. the arguments could not be pickled, or the process died.
+            results = [(None, e)] * len(tasks)
+        for task, (result, error) in zip(tasks, results):
+            if error is not None:
+                task.set_error(error)
+            else:
+                task.set_result(result)
+
+    def _chunk_results(self, tasks):
+        n = len(tasks)
+        if not self.raise_error:
+            if self.VERBOSE:  # pragma: no cover
+                PRINT(f"Because fail_fast is false, returning list of {n_of(n, 'error or result')}"
+                      f" for chunk {[task.position for task in tasks]}.")
+            return list(map(lambda record: record.error or record.result, tasks))
+        errors = [record.error for record in tasks if record.ready and record.error]
+        if not errors:
+            if self.VERBOSE:  # pragma: no cover
+                PRINT(f"No errors to raise in chunk {[task.position for task in tasks]}.")
+            return [record.result for record in tasks]
+        elif len(errors) == 1:
+            if self.VERBOSE:  # pragma: no cover
+                PRINT(f"Just one error to raise in chunk {[task.position for task in tasks]}.")
+            raise errors[0]
+        else:
+            if self.VERBOSE:  # pragma: no cover
+                PRINT(f"Multiple errors to raise as a MultiError in chunk {[task.position for task in tasks]}.")
+            raise MultiError(*errors)
+
+
+def _call_batch(function, args_list):
+    """
+    Calls the given function with each of the given (arg1, more_args) in the given list, in a process of
+    the pool of a TaskManager with executor="process", returning the (result, error) of each.
+    """
+    results = []
+    for arg1, more_args in args_list:
+        try:
+            results.append((function(arg1, *more_args), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
 
 
 pmap_chunks = TaskManager.pmap_chunks
 pmap = TaskManager.pmap
 pmap_list = TaskManager.pmap_list
+
+
+def cpu_pmap_list(fn, seq, *more_seqs, fail_fast=True, raise_error=True, max_workers=None, batch_size=None):
+    """
+    Like pmap_list, but for a CPU-bound function (e.g. validating, coercing, hashing or diffing), which gets no
+    speedup from threads, making the calls in a pool of max_workers (by default the number of CPUs) processes.
+    If there are too few calls (fewer than two batches) or CPUs for this to be worthwhile, they are just made
+    serially in this process. The function and arguments must be picklable. The results are all treated as
+    one chunk; so with fail_fast False (and raise_error True), all the errors are raised (as a MultiError).
+    """
+    args_list = list(zip(seq, *more_seqs))
+    max_workers = max_workers or os.cpu_count() or 1
+    batch_size = batch_size or max(1, min(TaskManager.DEFAULT_PROCESS_BATCH_SIZE, len(args_list) // max_workers))
+    manager = TaskManager(fail_fast=fail_fast, raise_error=raise_error, chunk_size=len(args_list) or 1,
+                          executor=TaskManager.PROCESS_EXECUTOR, batch_size=batch_size, max_workers=max_workers)
+    if max_workers > 1 and len(args_list) >= 2 * batch_size:
+        return [result for chunk in manager._pmap_chunks(fn, *zip(*args_list)) for result in chunk]
+    call_id = manager.new_call_id()
+    tasks = []
+    for position, (arg1, *more_args) in enumerate(args_list):
+        task = manager.TASK_CLASS(manager=manager, call_id=call_id, position=position,
+                                  function=fn, arg1=arg1, more_args=more_args)
+        task.call()
+        if task.error and fail_fast:
+            raise task.error
+        tasks.append(task)
+    return manager._chunk_results(tasks) if tasks else []
+
+
+class TaskGroup:
+    """
+    Runs callables concurrently, in a pool of max_workers threads, and returns their results (in the order
+    they were submitted), with their errors raised (one error as itself, several as a MultiError), e.g.:
+
+        with TaskGroup(max_workers=8, timeout=60) as task_group:
+            for uuid in uuids:
+                task_group.submit(portal.get_metadata, uuid)
+        items = task_group.results()
+
+    or equivalently:
+
+        items = TaskGroup.run([functools.partial(portal.get_metadata, uuid) for uuid in uuids],
+                              max_workers=8, timeout=60)
+
+     * If fail_fast is True, as soon as some error is detected, the calls not yet started are cancelled,
+       and it is raised; otherwise the errors for all calls are raised, after they have all finished.
+     * If raise_error is False, the errors are returned (in place of results) rather than being raised.
+     * The timeout is the overall deadline (in seconds) for all of the calls, and a per call timeout
+       may also be given to submit (or task_timeout to run); a call which times out gets a TimeoutError
+       (its thread cannot be stopped, so it is just abandoned), as do all the unfinished calls if the
+       overall deadline passes.
+     * If given, progress is called (with 1) each time a call finishes, e.g. ProgressBar.increment_progress.
+     * Calls may be submitted (e.g. from other threads, even while waiting) until the group is exited
+       (or cancelled, or fails fast), when its pool of threads is shut down.
+    """
+
+    TIMEOUT_POLL_SECONDS = 0.1  # How often to check for the per call timeouts of calls not yet started.
+
+    def __init__(self, max_workers=None, fail_fast=True, raise_error=True, timeout=None, progress=None):
+        if fail_fast and not raise_error:
+            raise ValueError("raise_erorr cannot be false if fail_fast is true.")
+        self.max_workers = max_workers or TaskManager.DEFAULT_CHUNK_SIZE
+        self.fail_fast = fail_fast
+        self.raise_error = raise_error
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.progress = progress if callable(progress) else None
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="TaskGroup")
+        self._tasks = []
+        self._pending = {}  # future -> task, for the calls not yet finished
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is not None:
+                self.cancel()
+            else:
+                self.wait()
+        finally:
+            self._executor.shutdown(wait=False)
+        return False
+
+    @classmethod
+    def run(cls, functions, max_workers=None, fail_fast=True, raise_error=True, timeout=None, task_timeout=None,
+            progress=None):
+        """
+        Calls each of the given (argumentless) functions concurrently, returning their results, per TaskGroup.
+        """
+        with cls(max_workers=max_workers, fail_fast=fail_fast, raise_error=raise_error, timeout=timeout,
+                 progress=progress) as task_group:
+            for function in functions:
+                task_group.submit(function, timeout=task_timeout)
+        return task_group.results()
+
+    def submit(self, function, *args, timeout=None, **kwargs):
+        """
+        Calls the given function with the given arguments (concurrently), with the given timeout (in seconds)
+        if any, from when it starts, for the call; returns its position in the results.
+        """
+        with self._lock:
+            task = _TaskGroupTask(position=len(self._tasks), timeout=timeout)
+
+            def call():
+                task.started = time.monotonic()
+                return function(*args, **kwargs)
+
+            self._tasks.append(task)
+            self._pending[self._executor.submit(call)] = task
+        return task.position
+
+    def cancel(self):
+        """
+        Cancels the calls not yet started, which (like any unfinished calls) get a CancelledError;
+        the calls already in progress cannot be stopped, so they are just abandoned.
+        """
+        with self._lock:
+            self._finish_pending(CancelledError("Task cancelled."))
+        self._executor.shutdown(wait=False)
+
+    def wait(self):
+        """
+        Waits for all of the calls submitted so far to finish (or time out), and returns their results.
+        """
+        while True:
+            with self._lock:
+                if not self._pending:
+                    break
+                pending = list(self._pending)
+                timeout = self._seconds_until_next_timeout()
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            with self._lock:
+                for future in done:
+                    if (task := self._pending.pop(future, None)) is not None:
+                        try:
+                            task.set_result(future.result())
+                        except Exception as e:
+                            task.set_error(e)
+                        self._report_progress()
+                        if task.error and self.fail_fast:
+                            self._finish_pending(CancelledError("Task cancelled due to an earlier error."))
+                            self._executor.shutdown(wait=False)
+                            raise task.error
+                now = time.monotonic()
+                if self.deadline and now >= self.deadline:
+                    self._finish_pending(TimeoutError("Task group timed out."))
+                for future, task in list(self._pending.items()):
+                    if task.timeout and task.started and now >= task.started + task.timeout:
+                        del self._pending[future]
+                        task.set_error(TimeoutError(f"Task {task.position} timed out after {task.timeout} seconds."))
+                        self._report_progress()
+        return self.results()
+
+    def results(self):
+        """
+        Returns the results of the calls, in the order they were submitted, or raises their error(s), per TaskGroup;
+        any calls not yet finished are waited for.
+        """
+        if self._pending:
+            return self.wait()
+        if not self.raise_error:
+            return [task.error or task.result for task in self._tasks]
+        # The calls cancelled (due to another error, if any) are only reported if there are no other errors.
+        errors = ([task.error for task in self._tasks if task.error and not isinstance(task.error, CancelledError)]
+                  or [task.error for task in self._tasks if task.error][:1])
+        if not errors:
+            return [task.result for task in self._tasks]
+        elif len(errors) == 1:
+            raise errors[0]
+        else:
+            raise MultiError(*errors)
+
+    def _seconds_until_next_timeout(self):  # Must be called with the lock held.
+        deadlines = [task.started + task.timeout for task in self._pending.values() if task.timeout and task.started]
+        if self.deadline:
+            deadlines.append(self.deadline)
+        if any(task.timeout and not task.started for task in self._pending.values()):
+            deadlines.append(time.monotonic() + self.TIMEOUT_POLL_SECONDS)  # For calls not started yet.
+        return max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+
+    def _finish_pending(self, error):  # Must be called with the lock held.
+        for future, task in self._pending.items():
+            future.cancel()
+            task.set_error(error)
+            self._report_progress()
+        self._pending.clear()
+
+    def _report_progress(self):
+        if self.progress:
+            self.progress(1)
+
+
+class _TaskGroupTask:
+
+    def __init__(self, position, timeout=None):
+        self.position = position
+        self.timeout = timeout
+        self.started = None
+        self.result = None
+        self.error = None
+
+    def set_result(self, result):
+        self.result = result
+
+    def set_error(self, error):
+        self.error = error
@@ -1,4 +1,6 @@
 import pytest
+import threading
+import time
 
 from dcicutils.es_utils import (
     create_es_client, execute_lucene_query_on_es, get_bulk_uuids_embedded, ElasticSearchServiceClient,
@@ -154,6 +156,48 @@ def test_get_bulk_uuids_embedded(es_client_fixture):
         assert doc['uuid'] in uuids  # check uuids from gen
 
 
+class MockMGetClient:
+    """ Mock ES client whose mget finds only even-numbered uuids, recording the number of uuids asked for """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def mget(self, body):
+        with self.lock:
+            self.requests.append(len(body['docs']))
+        time.sleep(self.delay)
+        return {'docs': [{'_id': doc['_id'], '_index': doc['_index'], 'found': False} if int(doc['_id']) % 2 else
+                         {'_id': doc['_id'], '_index': doc['_index'], 'found': True,
+                          '_source': {'embedded': {'uuid': doc['_id'], 'source': doc['_source']}}}
+                         for doc in body['docs']]}
+
+
+def test_get_bulk_uuids_embedded_chunked():
+    client = MockMGetClient()
+    uuids = [str(i) for i in range(25)]
+    result = get_bulk_uuids_embedded(client, 'index', uuids, chunk_size=10)
+    assert [doc['uuid'] for doc in result] == [str(i) for i in range(0, 25, 2)]  # missing docs are skipped
+    assert result[0]['source'] == ['embedded.*']
+    assert sorted(client.requests) == [5, 10, 10]
+    result = get_bulk_uuids_embedded(client, 'index', iter(uuids), chunk_size=10, is_generator=True)
+    assert sorted(doc['uuid'] for doc in result) == sorted(str(i) for i in range(0, 25, 2))
+    result = get_bulk_uuids_embedded(client, 'index', uuids[:3], source=['embedded.uuid', 'uuid'])
+    assert result == [{'embedded': {'uuid': '0', 'source': ['embedded.uuid', 'uuid']}},
+                      {'embedded': {'uuid': '2', 'source': ['embedded.uuid', 'uuid']}}]
+    assert get_bulk_uuids_embedded(client, 'index', []) == []
+
+
+def test_get_bulk_uuids_embedded_streaming():
+    client = MockMGetClient(delay=0.05)
+    uuids = (str(i) for i in range(10000))
+    result = get_bulk_uuids_embedded(client, 'index', uuids, chunk_size=10, max_workers=2, is_generator=True)
+    assert next(result)['uuid'] in ('0', '10')  # yields results as soon as the first request completes
+    result.close()
+    assert len(client.requests) <= 4  # without getting ahead of the consumer
+
+
 @pytest.mark.skip(reason="Direct ES search cannot work outside the firewall.")
 @pytest.mark.integrated
 @pytest.mark.direct_es_query
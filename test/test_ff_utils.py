@@ -11,7 +11,9 @@ import time
 from botocore.exceptions import ClientError
 from dcicutils import es_utils, ff_utils, s3_utils
 from dcicutils.ff_mocks import mocked_s3utils_with_sse, TestScenarios, RequestsTestRecorder
-from dcicutils.misc_utils import make_counter, remove_prefix, remove_suffix, check_true, ignorable, file_contents
+from dcicutils.misc_utils import (
+    make_counter, remove_prefix, remove_suffix, check_true, ignorable, file_contents, TokenBucket
+)
 from dcicutils.qa_utils import (
     check_duplicated_items_by_key, ignored, raises_regexp, MockResponse, MockBoto3, MockBotoSQSClient, is_subdict,
 )
@@ -143,6 +145,23 @@ def test_get_response_json_unit():
         check_get_response_json()
 
 
+@pytest.mark.unit
+def test_authorized_request_with_rate_limiter():
+    waits = []
+    rate_limiter = TokenBucket(rate=20, capacity=2, wait_hook=lambda wait_seconds: waits.append(wait_seconds))
+
+    def mocked_get(url, auth, **kwargs):
+        ignored(auth, kwargs)
+        return MockResponse(200, content='{"url": "%s"}' % url)
+
+    with mock.patch.dict(ff_utils.REQUESTS_VERBS, {"GET": mocked_get}):
+        for _ in range(4):
+            response = ff_utils.authorized_request("http://portal/foo", auth=("key", "secret"),
+                                                   rate_limiter=rate_limiter)
+            assert response.json() == {"url": "http://portal/foo"}
+    assert len(waits) == 2  # The first two requests were within the burst capacity.
+
+
 def check_get_response_json():
     # use responses from http://httpbin.org
     good_res = requests.get('http://httpbin.org/json')
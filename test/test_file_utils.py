@@ -1,8 +1,14 @@
+import hashlib
 import importlib
+import io
 import pytest
 import os
-from dcicutils.file_utils import normalize_path, search_for_file
+from dcicutils.file_utils import (
+    S3_ETAG_MULTIPART_CHUNK_SIZE, FileDigestCache, _compute_file_etag, compute_file_digests, compute_file_etag,
+    compute_file_md5, compute_multipart_etag, normalize_path, search_for_file
+)
 from dcicutils.tmpfile_utils import temporary_directory
+from unittest import mock
 
 HOME_DIRECTORY = "/Some/HomeDirectory"
 CURRENT_DIRECTORY = os.path.abspath(os.path.curdir)
@@ -83,3 +89,88 @@ def test_normalize_path():
     assert normalize_path(f"{HOME_DIRECTORY}/", expand_home=False) == "~"
     assert normalize_path(f"{HOME_DIRECTORY}/.ssh", expand_home=False) == "~/.ssh"
     assert normalize_path(f"~/.ssh", expand_home=True) == f"{HOME_DIRECTORY}/.ssh"
+
+
+def test_compute_multipart_etag():
+    content = os.urandom(1024) * (2 * S3_ETAG_MULTIPART_CHUNK_SIZE // 1024 + 5)
+    parts = [content[start:start + S3_ETAG_MULTIPART_CHUNK_SIZE]
+             for start in range(0, len(content), S3_ETAG_MULTIPART_CHUNK_SIZE)]
+    assert len(parts) == 3
+    etag = compute_multipart_etag([hashlib.md5(part).digest() for part in parts])
+    assert etag.endswith("-3")
+    with temporary_directory() as tmpdir:
+        with io.open(file := os.path.join(tmpdir, "file.bin"), "wb") as f:
+            f.write(content)
+        assert compute_file_etag(file) == etag
+
+
+def test_compute_file_digests():
+    with temporary_directory() as tmpdir:
+        for size in [0, 1000, S3_ETAG_MULTIPART_CHUNK_SIZE, 5 * S3_ETAG_MULTIPART_CHUNK_SIZE + 3]:
+            content = os.urandom(size)
+            with io.open(file := os.path.join(tmpdir, f"file{size}.bin"), "wb") as f:
+                f.write(content)
+            with io.open(file, "rb") as f:
+                expected_etag = _compute_file_etag(f)
+            for max_workers in [1, 2, 8]:
+                assert compute_file_digests(file, sha256=True, max_workers=max_workers) == {
+                    "size": size, "md5": hashlib.md5(content).hexdigest(), "etag": expected_etag,
+                    "sha256": hashlib.sha256(content).hexdigest()
+                }
+            assert compute_file_digests(file, md5=False) == {"size": size, "etag": expected_etag}
+            assert compute_file_md5(file) == hashlib.md5(content).hexdigest()
+            assert compute_file_etag(file) == expected_etag
+        with pytest.raises(ValueError):
+            compute_file_digests(tmpdir)
+        assert compute_file_md5(tmpdir, raise_exception=False) == ""
+
+
+def test_file_digest_cache():
+    with temporary_directory() as tmpdir:
+        cache = FileDigestCache(os.path.join(tmpdir, "cache", "digests.jsonl"))
+        with io.open(file := os.path.join(tmpdir, "file.txt"), "w") as f:
+            f.write("some content")
+        file_utils_module = importlib.import_module("dcicutils.file_utils")
+        with mock.patch.object(file_utils_module, "_compute_file_digests",
+                               wraps=file_utils_module._compute_file_digests) as mock_compute_file_digests:
+            md5 = compute_file_md5(file, cache=cache)
+            assert mock_compute_file_digests.call_count == 1
+            assert compute_file_md5(file, cache=cache) == md5
+            assert mock_compute_file_digests.call_count == 1
+            assert compute_file_etag(file, cache=cache) == md5  # Not yet cached
+            assert mock_compute_file_digests.call_count == 2
+            # Another cache instance (e.g. in another process) using the same file.
+            other_cache = FileDigestCache(cache.file)
+            assert compute_file_digests(file, cache=other_cache) == {"size": 12, "md5": md5, "etag": md5}
+            assert mock_compute_file_digests.call_count == 2
+            assert compute_file_digests(file, sha256=True, cache=other_cache)["sha256"]
+            assert mock_compute_file_digests.call_count == 3
+            assert cache.get(file)["sha256"]
+            # A changed file is rehashed.
+            with io.open(file, "a") as f:
+                f.write(" and some more")
+            os.utime(file, ns=(0, 12345))
+            assert compute_file_md5(file, cache=cache) == hashlib.md5(b"some content and some more").hexdigest()
+            assert mock_compute_file_digests.call_count == 4
+
+
+def test_file_digest_cache_compaction():
+    with temporary_directory() as tmpdir:
+        cache = FileDigestCache(os.path.join(tmpdir, "digests.jsonl"))
+        other_cache = FileDigestCache(cache.file)  # E.g. in another process.
+        with io.open(file := os.path.join(tmpdir, "file.txt"), "w") as f:
+            f.write("some content")
+        with mock.patch.object(FileDigestCache, "COMPACT_THRESHOLD", 5):
+            compute_file_md5(file, cache=other_cache)
+            for index in range(20):  # The file keeps changing, and is rehashed each time.
+                os.utime(file, ns=(0, index))
+                compute_file_digests(file, cache=cache)
+                compute_file_digests(file, sha256=True, cache=cache)
+            with io.open(cache.file) as f:
+                assert len(f.readlines()) <= 2 * 5
+            assert sorted(os.listdir(tmpdir)) == ["digests.jsonl", "file.txt"]
+            digests = cache.get(file)
+            assert digests["md5"] == hashlib.md5(b"some content").hexdigest() and digests["sha256"]
+            # The other cache notices the file was rewritten, and rereads it.
+            assert other_cache.get(file) == digests
+            assert len(other_cache._digests) == 1
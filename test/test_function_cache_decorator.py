@@ -1,6 +1,19 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+import threading
 import time
-from dcicutils.function_cache_decorator import function_cache
+import gc
+import json
+import os
+import weakref
+from dcicutils import function_cache_decorator as function_cache_decorator_module
+from dcicutils.function_cache_decorator import (
+    _get_function_name, approximate_sizeof, BoundedCache, DiskFunctionCacheBackend, function_cache, instance_cache,
+    RedisFunctionCacheBackend
+)
+from dcicutils.redis_utils import RedisBase
+from dcicutils.tmpfile_utils import temporary_directory
 
 
 def test_function_cache_decorator():
@@ -273,3 +286,430 @@ def test_function_cache_decorator_with_key_function():
     assert f.cache_info().hits == 1
     assert f.cache_info().misses == 1
     assert f.cache_info().size == 1
+
+
+def test_function_cache_decorator_single_flight():
+
+    called = 0
+    lock = threading.Lock()
+    started = threading.Event()
+    release = threading.Event()
+
+    @function_cache
+    def f(n):
+        nonlocal called
+        with lock:
+            called += 1
+        started.set()
+        release.wait()
+        if n < 0:
+            raise ValueError(n)
+        return n * n
+
+    def call_f_concurrently(n, nthreads=8):
+        started.clear()
+        release.clear()
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            futures = [executor.submit(f, n)]
+            started.wait()  # the first call is in progress, so the others must wait for it
+            futures += [executor.submit(f, n) for _ in range(nthreads - 1)]
+            time.sleep(0.1)
+            release.set()
+            return [future.exception() or future.result() for future in futures]
+
+    assert call_f_concurrently(3) == [9] * 8
+    assert called == 1
+    assert f.cache_info().misses == 1
+    assert f.cache_info().hits == 7
+    assert f(3) == 9
+    assert called == 1
+
+    # An exception is raised to all of the callers waiting on it, and nothing is cached.
+    results = call_f_concurrently(-1)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert called == 2
+    assert f.cache_info().size == 1
+
+    # Concurrent calls for different keys do not wait on each other.
+    release.set()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(f, range(100))) == [n * n for n in range(100)]
+    assert f.cache_info().size == 100
+
+
+def test_function_cache_decorator_thread_safety():
+
+    @function_cache(maxsize=10)
+    def f(n):
+        return n * n
+
+    def call_f(i):
+        for n in range(200):
+            assert f((n * 7 + i) % 25) == ((n * 7 + i) % 25) ** 2
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for future in [executor.submit(call_f, i) for i in range(16)]:
+            future.result()
+    info = f.cache_info()
+    assert info.size == 10
+    assert info.hits + info.misses == 16 * 200
+
+
+def test_function_cache_decorator_with_stale_while_revalidate():
+
+    called = 0
+    refreshed = threading.Event()
+
+    @function_cache(ttl=timedelta(milliseconds=200), stale_while_revalidate=timedelta(seconds=5))
+    def f(n):
+        nonlocal called
+        called += 1
+        if called > 1:
+            time.sleep(0.2)
+            refreshed.set()
+        return n * called
+
+    assert f(3) == 3  # miss
+    time.sleep(0.3)
+    assert f(3) == 3  # stale, so returned while refreshed in the background
+    assert f(3) == 3  # still stale, but already being refreshed
+    assert refreshed.wait(5)
+    time.sleep(0.05)
+    assert f(3) == 6  # refreshed
+    assert called == 2
+
+    @function_cache(ttl=timedelta(milliseconds=100), stale_while_revalidate=timedelta(milliseconds=100))
+    def g(n):
+        nonlocal called
+        called += 1
+        return n * called
+
+    called = 0
+    assert g(3) == 3
+    time.sleep(0.3)
+    assert g(3) == 6  # too stale to return while refreshing
+    assert called == 2
+
+
+def test_function_cache_decorator_with_disk_backend():
+
+    with temporary_directory() as tmpdir:
+
+        backend = DiskFunctionCacheBackend(tmpdir, namespace="test")
+        called = 0
+
+        def define_f(**kwargs):
+            # Each definition of f is like that in a different process, sharing only the backend.
+            @function_cache(backend=backend, **kwargs)
+            def f(n):
+                nonlocal called
+                called += 1
+                return {"n": n, "square": n * n} if n >= 0 else None
+            return f
+
+        f = define_f()
+        assert f(3) == {"n": 3, "square": 9}  # miss
+        assert f(3) == {"n": 3, "square": 9}  # hit (in-process)
+        assert called == 1
+        f = define_f()
+        assert f(3) == {"n": 3, "square": 9}  # miss (in-process) but hit (backend)
+        assert called == 1
+        assert f(4) == {"n": 4, "square": 16}  # miss
+        assert called == 2
+        info = f.cache_info()
+        assert (info.hits, info.misses, info.size) == (0, 2, 2)
+        assert info.backend == "DiskFunctionCacheBackend(test)"
+        assert (info.backend_hits, info.backend_misses) == (None, None)  # not kept for disk
+
+        # Expired entries are not used.
+        f = define_f(ttl=timedelta(milliseconds=100), ttl_none=timedelta(milliseconds=50))
+        assert f(5) == {"n": 5, "square": 25} and f(-1) is None
+        assert called == 4
+        time.sleep(0.2)
+        f = define_f(ttl=timedelta(milliseconds=100))
+        assert f(5) == {"n": 5, "square": 25} and f(-1) is None
+        assert called == 6
+
+        # Custom serialization, and namespaces.
+        other_backend = DiskFunctionCacheBackend(tmpdir, namespace="other",
+                                                 serialize=lambda value: json.dumps(sorted(value)),
+                                                 deserialize=lambda value: set(json.loads(value)))
+
+        @function_cache(backend=other_backend)
+        def g(n):
+            nonlocal called
+            called += 1
+            return set(range(n))
+
+        assert g(3) == {0, 1, 2}
+        g.cache_clear()
+        assert g(3) == {0, 1, 2}
+        assert called == 7
+        assert sorted(os.listdir(tmpdir)) == ["other", "test"]
+        other_backend.clear()
+        assert sorted(os.listdir(tmpdir)) == ["test"]
+
+
+def test_function_cache_decorator_with_redis_backend(redisdb):
+
+    backend = RedisFunctionCacheBackend(RedisBase(redisdb), namespace="test")
+    called = 0
+
+    def define_f():
+        @function_cache(backend=backend, ttl=timedelta(seconds=60))
+        def f(n):
+            nonlocal called
+            called += 1
+            return [n, n * n]
+        return f
+
+    assert define_f()(3) == [3, 9]
+    assert define_f()(3) == [3, 9]
+    assert called == 1
+    info = define_f().cache_info()
+    assert (info.backend_hits, info.backend_misses) == (1, 1)
+    assert 0 < RedisBase(redisdb).ttl(backend.backend_key(_get_function_name(define_f()), (3,))) <= 60
+    backend.clear()
+    assert define_f()(3) == [3, 9]
+    assert called == 2
+
+
+def test_function_cache_decorator_with_max_bytes():
+
+    called = 0
+
+    @function_cache(max_bytes=1000, sizeof=len)
+    def f(n):
+        nonlocal called
+        called += 1
+        return "x" * n
+
+    assert f(400) == "x" * 400  # miss
+    assert f(300) == "x" * 300  # miss
+    assert f(400) == "x" * 400  # hit (and now most recently used)
+    assert f.cache_info().bytes == 700
+    assert f(500) == "x" * 500  # miss; evicts 300
+    assert f.cache_info().bytes == 900
+    assert f.cache_info().evictions == 1
+    assert [entry["key"] for entry in f.cache_entries()] == [(400,), (500,)]
+    assert f(2000) == "x" * 2000  # miss; too big to cache
+    assert f(2000) == "x" * 2000  # miss
+    assert f.cache_info().size == 2
+    assert f(300) == "x" * 300  # miss
+    assert called == 6
+    assert f.cache_info().evictions == 2
+    f.cache_clear()
+    assert (f.cache_info().bytes, f.cache_info().evictions) == (0, 0)
+
+
+def test_function_cache_decorator_sweeps_expired():
+
+    @function_cache(ttl=timedelta(milliseconds=200))
+    def f(n):
+        return n * n
+
+    for n in range(10):
+        assert f(n) == n * n
+    assert f.cache_info().size == 10
+    time.sleep(0.3)
+    assert f(10) == 100  # sweeps the other (expired) values
+    assert f.cache_info().size == 1
+    assert f.cache_info().expired == 10
+
+
+def test_function_cache_decorator_cache_entries():
+
+    @function_cache
+    def f(n):
+        time.sleep(0.05)
+        return n * n
+
+    assert f(2) == 4
+    assert f(2) == 4
+    assert f(2) == 4
+    assert f(3) == 9
+    entries = f.cache_entries()
+    assert [(entry["key"], entry["hits"], entry["bytes"]) for entry in entries] == [((2,), 2, None), ((3,), 0, None)]
+    assert all(entry["duration"] >= 50 for entry in entries)
+    assert f.cache_info().saved >= 100
+
+
+def test_function_cache_decorator_async():
+
+    called = 0
+
+    @function_cache(nocache=None)
+    async def f(n):
+        nonlocal called
+        called += 1
+        await asyncio.sleep(0.1)
+        if n < 0:
+            raise ValueError(n)
+        return n * n if n else None
+
+    async def run():
+        assert await asyncio.gather(*[f(3) for _ in range(10)]) == [9] * 10
+        assert await f(3) == 9
+        assert called == 1
+        assert (f.cache_info().hits, f.cache_info().misses) == (10, 1)
+        results = await asyncio.gather(*[f(-1) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert called == 2
+        assert await f(0) is None
+        assert await f(0) is None
+        assert called == 4
+
+    asyncio.run(run())
+    assert f.cache_info().size == 1
+
+
+def test_function_cache_decorator_async_cancelled():
+
+    @function_cache
+    async def f(n):
+        await asyncio.sleep(0.2)
+        return n * n
+
+    async def run():
+        leader = asyncio.ensure_future(f(3))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.ensure_future(f(3))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        results = await asyncio.gather(leader, waiter, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert results[1] == 9  # The waiter calls the function itself (rather than being cancelled).
+        assert await f(3) == 9
+        assert f.cache_info().size == 1
+
+    asyncio.run(run())
+
+
+def test_function_cache_decorator_async_stale_while_revalidate():
+
+    called = 0
+
+    @function_cache(ttl=timedelta(milliseconds=100), stale_while_revalidate=timedelta(seconds=5))
+    async def f(n):
+        nonlocal called
+        called += 1
+        await asyncio.sleep(0.1)
+        return n * called
+
+    async def run():
+        assert await f(3) == 3
+        await asyncio.sleep(0.15)
+        assert await f(3) == 3  # stale, so returned while refreshed in the background
+        # The background refresh task is referenced (so cannot be garbage collected) until it is done.
+        assert len(function_cache_decorator_module._background_tasks) == 1
+        gc.collect()
+        await asyncio.sleep(0.2)
+        assert not function_cache_decorator_module._background_tasks
+        assert await f(3) == 6  # refreshed
+        assert called == 2
+
+    asyncio.run(run())
+
+
+def test_bounded_cache():
+
+    cache = BoundedCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # hit; now b is least recently used
+    cache.put("c", 3)  # evicts b
+    assert "b" not in cache
+    assert cache.get("b") is None  # miss
+    assert cache.get("b", "default") == "default"  # miss
+    assert cache.get("c") == 3  # hit
+    assert len(cache) == 2
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.size, info.maxsize) == (2, 2, 1, 2, 2)
+    assert cache.pop("a") == 1
+    assert len(cache) == 1
+    cache.clear()
+    assert cache.info(as_dict=True) == {"hits": 0, "misses": 0, "evictions": 0, "size": 0,
+                                        "maxsize": 2, "bytes": 0, "max_bytes": None}
+
+
+def test_bounded_cache_max_bytes():
+
+    cache = BoundedCache(max_bytes=1000, sizeof=len)
+    cache.put("a", "x" * 400)
+    cache.put("b", "x" * 400)
+    assert cache.info().bytes == 800
+    cache.put("c", "x" * 400)  # evicts a
+    assert "a" not in cache and "b" in cache and "c" in cache
+    assert cache.info().bytes == 800
+    assert cache.info().evictions == 1
+    cache.put("b", "x" * 100)  # replaces b
+    assert cache.info().bytes == 500
+    cache.put("d", "x" * 2000)  # too big to cache at all; nothing else evicted
+    assert "d" not in cache and "b" in cache and "c" in cache
+    assert cache.info().evictions == 1
+
+    assert approximate_sizeof({"a": [1, 2, {"b": "c" * 1000}]}) > 1000
+    assert approximate_sizeof([[]] * 10) > approximate_sizeof([])
+
+
+def test_instance_cache():
+
+    class Thing:
+
+        ncalls = 0
+
+        def __init__(self, value):
+            self.value = value
+
+        @instance_cache(maxsize=2)
+        def compute(self, n, multiplier=1):
+            Thing.ncalls += 1
+            return self.value * n * multiplier
+
+        @property
+        @instance_cache
+        def double(self):
+            Thing.ncalls += 1
+            return self.value * 2
+
+        @instance_cache(serialize_key=True, nocache_none=True)
+        def lookup(self, data):
+            Thing.ncalls += 1
+            return data.get("name")
+
+    a = Thing(1)
+    b = Thing(10)
+    assert a.compute(2) == 2
+    assert a.compute(2) == 2
+    assert b.compute(2) == 20  # Separate cache per instance.
+    assert a.compute(2, multiplier=3) == 6
+    assert a.compute(5) == 5  # Evicts a.compute(2); maxsize is per instance.
+    assert Thing.ncalls == 4
+    assert a.compute.cache_info().hits == 1
+    assert a.compute.cache_info().misses == 3
+    assert a.compute.cache_info().evictions == 1
+    assert a.compute.cache_info().size == 2
+    assert b.compute.cache_info().size == 1
+    assert b.compute(2) == 20
+    assert Thing.ncalls == 4
+
+    assert a.double == 2 and a.double == 2 and b.double == 20
+    assert Thing.ncalls == 6
+
+    assert a.lookup({"name": "foo"}) == "foo"
+    assert a.lookup({"name": "foo"}) == "foo"
+    assert a.lookup({}) is None
+    assert a.lookup({}) is None
+    assert Thing.ncalls == 9
+
+    a.compute.cache_clear()
+    assert a.compute.cache_info().size == 0
+    assert b.compute.cache_info().size == 1
+    assert a.compute(2) == 2
+    assert Thing.ncalls == 10
+
+    # Cached values (and the instance itself) must not be kept alive by the cache.
+    reference = weakref.ref(a)
+    del a
+    gc.collect()
+    assert reference() is None
@@ -1,11 +1,17 @@
 import io
+import os
 import pytest
+import threading
+import time
 
 from unittest import mock
 
+from dcicutils.common import MAX_MULTIPART_CHUNKS
 from dcicutils.ff_mocks import mocked_s3utils
-from dcicutils.glacier_utils import GlacierUtils, GlacierRestoreException
-from dcicutils.qa_utils import MockFileSystem
+from dcicutils.glacier_utils import GlacierUtils, GlacierRestoreException, GlacierRestoreScheduler
+from dcicutils.misc_utils import ignored
+from dcicutils.qa_utils import MockBoto3, MockFileSystem
+from dcicutils.tmpfile_utils import temporary_directory
 
 
 def mock_keydict() -> dict:
@@ -504,6 +510,48 @@ class TestGlacierUtils:
                     assert gu.restore_all_from_search(search_query='/search', phase=4, confirm=False,
                                                       search_generator=True) == (expected_success, [])
 
+    def test_glacier_utils_phases_resolve_metadata_up_front(self, glacier_utils):
+        """ Tests that the phases resolve the metadata for all @ids before working on them concurrently,
+            erroring only on the @ids that cannot be resolved or processed, and preserving their order """
+        gu = glacier_utils
+        atids = [f'/files/{i}/' for i in range(20)]
+        resolved = []
+
+        def get_metadata(atid, **kwargs):
+            ignored(kwargs)
+            if atid == '/files/3/':
+                raise Exception('Not found')
+            resolved.append(atid)
+            return {'@id': atid, '@type': ['File'], 'upload_key': f'{atid.split("/")[2]}/file.txt'}
+
+        def copy_object_back_to_original_location(bucket, key, **kwargs):
+            ignored(bucket, kwargs)
+            assert sorted(resolved) == sorted(set(atids) - {'/files/3/'})  # all were resolved first
+            return key != '5/file.txt' or None
+
+        expected_success = [atid for atid in atids if atid not in ['/files/3/', '/files/5/']]
+        with mock.patch('dcicutils.glacier_utils.get_metadata', side_effect=get_metadata):
+            with mock.patch.object(gu, 'copy_object_back_to_original_location',
+                                   side_effect=copy_object_back_to_original_location):
+                assert gu.restore_glacier_phase_two_copy(atids, parallel=True, num_threads=8) == (
+                    expected_success, ['/files/3/', '/files/5/']
+                )
+            resolved.clear()
+            with mock.patch.object(gu, 'restore_s3_from_glacier', return_value={'success': True}):
+                success, errors = gu.restore_glacier_phase_one_restore(atids, num_threads=8)
+                assert success == [atid for atid in atids if atid != '/files/3/'] and errors == ['/files/3/']
+
+        def patch_metadata(patch, atid, **kwargs):
+            ignored(patch, kwargs)
+            if atid == '/files/5/':
+                raise Exception('Patch failed')
+            return {'success': True}
+
+        with mock.patch('dcicutils.glacier_utils.patch_metadata', side_effect=patch_metadata):
+            assert gu.restore_glacier_phase_three_patch(atids, num_threads=8) == (
+                [atid for atid in atids if atid != '/files/5/'], ['/files/5/']
+            )
+
     def test_glacier_utils_multipart_upload(self, glacier_utils):
         """ Tests the basics of a multipart upload """
         gu = glacier_utils
@@ -513,6 +561,79 @@ class TestGlacierUtils:
                     with mock.patch.object(gu.s3, 'head_object', return_value={'ContentLength': 600000000000}):
                         assert gu.copy_object_back_to_original_location('bucket', 'key', preserve_lifecycle_tag=True)
 
+    @pytest.mark.parametrize('total_size, max_workers, expected', [
+        (600 * 1024 ** 3, 16, GlacierUtils.GLACIER_COPY_PART_SIZE),  # default part size
+        (6 * 1024 ** 3, 64, 6 * 1024 ** 3 // 64),  # smaller, so all threads have a part to copy
+        (10, 16, GlacierUtils.GLACIER_COPY_MIN_PART_SIZE),  # but no smaller than S3 allows
+        (5000 * 1024 ** 3, 16, 5000 * 1024 ** 3 // MAX_MULTIPART_CHUNKS),  # larger, so there are not too many parts
+    ])
+    def test_glacier_utils_choose_part_size(self, total_size, max_workers, expected):
+        assert GlacierUtils._choose_part_size(total_size, max_workers) == expected
+
+    def test_glacier_utils_multipart_upload_concurrently(self, glacier_utils):
+        """ Tests that parts are copied concurrently, in the right ranges, and completed in order """
+        gu = glacier_utils
+        total_size = 1000
+        ranges = {}
+
+        def upload_part_copy(**kwargs):
+            ranges[kwargs['PartNumber']] = kwargs['CopySourceRange']
+            time.sleep(0.01 * (10 - kwargs['PartNumber']))  # finish in reverse order
+            return {'CopyPartResult': {'ETag': f'etag{kwargs["PartNumber"]}'}}
+
+        with mock.patch.object(GlacierUtils, 'GLACIER_COPY_MIN_PART_SIZE', 100):
+            with mock.patch.object(gu.s3, 'create_multipart_upload', return_value={'UploadId': '123'}):
+                with mock.patch.object(gu.s3, 'upload_part_copy', side_effect=upload_part_copy):
+                    with mock.patch.object(gu.s3, 'complete_multipart_upload',
+                                           return_value={'success': True}) as mock_complete:
+                        assert gu._do_multipart_upload('bucket', 'key', total_size, max_workers=4)
+        # Part size is 250 bytes, the smallest (over 100) that gives each of the 4 threads a part.
+        assert ranges == {1: 'bytes=0-249', 2: 'bytes=250-499', 3: 'bytes=500-749', 4: 'bytes=750-999'}
+        assert mock_complete.call_args[1]['MultipartUpload']['Parts'] == [
+            {'PartNumber': part_number, 'ETag': f'etag{part_number}'} for part_number in range(1, 5)
+        ]
+
+    def test_glacier_utils_multipart_upload_retry_and_abort(self, glacier_utils):
+        """ Tests that part copies are retried, and the multipart upload is aborted if one ultimately fails """
+        gu = glacier_utils
+        total_size = 3 * 1024 ** 2  # 3 parts of 1 MB
+        attempts = []
+
+        def upload_part_copy(**kwargs):
+            attempts.append(kwargs['PartNumber'])
+            if kwargs['PartNumber'] == 2 and (attempts.count(2) < 3 or fail):
+                raise Exception('SlowDown')
+            return {'CopyPartResult': {'ETag': 'abc'}}
+
+        with mock.patch.object(gu, 'GLACIER_COPY_RETRY_WAIT_SECONDS', 0):
+            with mock.patch.object(gu.s3, 'create_multipart_upload', return_value={'UploadId': '123'}):
+                with mock.patch.object(gu.s3, 'upload_part_copy', side_effect=upload_part_copy):
+                    with mock.patch.object(gu.s3, 'complete_multipart_upload', return_value={'success': True}):
+                        with mock.patch.object(gu.s3, 'abort_multipart_upload') as mock_abort:
+                            fail = False
+                            assert gu._do_multipart_upload('bucket', 'key', total_size, part_size=1, max_workers=2)
+                            assert attempts.count(2) == 3
+                            mock_abort.assert_not_called()
+                            fail = True
+                            attempts.clear()
+                            assert gu._do_multipart_upload('bucket', 'key', total_size, part_size=1,
+                                                           max_workers=2) is None
+                            assert attempts.count(2) == gu.GLACIER_COPY_RETRIES + 1
+                            mock_abort.assert_called_once_with(Bucket='bucket', Key='key', UploadId='123')
+
+    def test_glacier_utils_multipart_upload_with_mock_s3(self, glacier_utils):
+        """ Tests a multipart copy with our mock S3, which checks the parts' ranges, order and ETags """
+        gu = glacier_utils
+        s3 = MockBoto3().client('s3')
+        content = bytes(range(256)) * 40
+        s3.put_object(Bucket='foo', Key='file.txt', Body=content)
+        with mock.patch.object(gu, 's3', s3):
+            with mock.patch.object(s3, 'MOCK_MULTIPART_MIN_PART_SIZE', 1000):
+                with mock.patch.object(GlacierUtils, 'GLACIER_COPY_MIN_PART_SIZE', 1000):
+                    assert gu._do_multipart_upload('foo', 'file.txt', len(content), max_workers=4)
+        assert s3.s3_files.files['foo/file.txt'] == content
+        assert s3.head_object(Bucket='foo', Key='file.txt', PartNumber=1)['PartsCount'] == 4
+
     def test_glacier_utils_with_mock_s3(self, glacier_utils):
         """ Uses our mock_s3 system to test some operations with object versioning enabled """
         gu = glacier_utils
@@ -538,3 +659,136 @@ class TestGlacierUtils:
                     assert gu.restore_s3_from_glacier(bucket_name, key2_name, version_id=version_1)
                     assert gu.copy_object_back_to_original_location(bucket_name, key2_name, version_id=version_1,
                                                                     preserve_lifecycle_tag=True)
+
+
+class TestGlacierRestoreScheduler:
+
+    @staticmethod
+    def file_meta(name: str) -> dict:
+        return {'@id': f'/files/{name}/', '@type': ['File'], 'upload_key': f'{name}/file.txt'}
+
+    @pytest.mark.parametrize('tier, storage_class, elapsed, expected', [
+        ('Standard', None, 0, 3 * 3600),  # wait until the earliest the restore could finish
+        ('Standard', 'GLACIER', 3600, 2 * 3600),
+        ('Standard', 'GLACIER', 3 * 3600, 20 * 60),  # then poll 6 times until the latest it should finish
+        ('Standard', 'GLACIER', 9 * 3600, 3600),  # then back off, the longer it is overdue
+        ('Bulk', 'DEEP_ARCHIVE', 24 * 3600, 3600),  # but not too rarely
+        ('Expedited', 'GLACIER', 60, 40),
+        ('Expedited', 'GLACIER', 30, 30),
+    ])
+    def test_glacier_restore_scheduler_next_poll_seconds(self, glacier_utils, tier, storage_class, elapsed,
+                                                         expected):
+        scheduler = GlacierRestoreScheduler(glacier_utils)
+        assert scheduler._next_poll_seconds({'tier': tier, 'storage_class': storage_class}, elapsed) == expected
+
+    def test_glacier_restore_scheduler(self, glacier_utils):
+        """ Tests that objects are copied as soon as their restores are complete, and that a run can be resumed """
+        gu = glacier_utils
+        polls, events = {}, []
+        restores_needed = {'a/file.txt': 1, 'b/file.txt': 3, 'c/file.txt': 1000}
+
+        def head_object(Bucket, Key):  # noQA - AWS argument naming style
+            ignored(Bucket)
+            polls[Key] = polls.get(Key, 0) + 1
+            events.append(('poll', Key))
+            ongoing = 'true' if polls[Key] < restores_needed[Key] else 'false'
+            return {'StorageClass': 'GLACIER', 'Restore': f'ongoing-request="{ongoing}"'}
+
+        def copy_object_back_to_original_location(bucket, key, **kwargs):
+            ignored(bucket, kwargs)
+            events.append(('copy', key))
+            return {'success': True}
+
+        with mock.patch.object(GlacierRestoreScheduler, 'RESTORE_TIER_SECONDS', {'Standard': {'GLACIER': (0, 0)}}):
+            with mock.patch.object(GlacierRestoreScheduler, 'MIN_POLL_SECONDS', 0):
+                with mock.patch.object(gu.s3, 'restore_object', return_value={'success': True}) as mock_restore:
+                    with mock.patch.object(gu.s3, 'head_object', side_effect=head_object):
+                        with mock.patch.object(gu, 'copy_object_back_to_original_location',
+                                               side_effect=copy_object_back_to_original_location):
+                            with temporary_directory() as tmpdir:
+                                state_file = os.path.join(tmpdir, 'state.json')
+                                scheduler = GlacierRestoreScheduler(gu, state_file=state_file)
+                                atid_list = [self.file_meta(name) for name in ['a', 'b', 'c']]
+                                assert scheduler.request_restores(atid_list) == (
+                                    ['/files/a/', '/files/b/', '/files/c/'], []
+                                )
+                                assert mock_restore.call_count == 3
+                                # c never finishes restoring, so this times out, having copied a and b.
+                                assert scheduler.run(timeout=0.5) == (['/files/a/', '/files/b/'], [])
+                                # a was copied as soon as it was restored, before b was.
+                                b_restored = [i for i, event in enumerate(events) if event == ('poll', 'b/file.txt')][2]
+                                assert events.index(('copy', 'a/file.txt')) < b_restored
+                                assert events.count(('copy', 'a/file.txt')) == 1
+                                # A new scheduler resumes from the state saved, so needn't request restores again.
+                                restores_needed['c/file.txt'] = 0
+                                events.clear()
+                                scheduler = GlacierRestoreScheduler(gu, state_file=state_file)
+                                assert scheduler.request_restores(atid_list) == ([], [])
+                                assert mock_restore.call_count == 3
+                                assert scheduler.run() == (['/files/a/', '/files/b/', '/files/c/'], [])
+                                assert events == [('poll', 'c/file.txt'), ('copy', 'c/file.txt')]
+
+    def test_glacier_restore_scheduler_batches_with_timeout(self, glacier_utils):
+        """ Tests that, with a timeout, objects due beyond the first poll batch are polled right away """
+        gu = glacier_utils
+        names = ['a', 'b', 'c', 'd', 'e']
+        polled, all_polled = [], threading.Event()
+
+        def head_object(Bucket, Key):  # noQA - AWS argument naming style
+            ignored(Bucket)
+            polled.append(Key)
+            if len(polled) == len(names):
+                all_polled.set()
+            return {'StorageClass': 'GLACIER', 'Restore': 'ongoing-request="false"'}
+
+        def copy_object_back_to_original_location(bucket, key, **kwargs):
+            ignored(bucket, key, kwargs)
+            all_polled.wait(timeout=10)  # copies only finish once every object has been polled
+            return {'success': True}
+
+        with mock.patch.object(GlacierRestoreScheduler, 'RESTORE_TIER_SECONDS', {'Standard': {'GLACIER': (0, 0)}}):
+            with mock.patch.object(GlacierRestoreScheduler, 'MIN_POLL_SECONDS', 0):
+                with mock.patch.object(GlacierRestoreScheduler, 'POLL_BATCH_SIZE', 2):
+                    with mock.patch.object(gu.s3, 'restore_object', return_value={'success': True}):
+                        with mock.patch.object(gu.s3, 'head_object', side_effect=head_object):
+                            with mock.patch.object(gu, 'copy_object_back_to_original_location',
+                                                   side_effect=copy_object_back_to_original_location):
+                                scheduler = GlacierRestoreScheduler(gu)
+                                atid_list = [self.file_meta(name) for name in names]
+                                assert scheduler.request_restores(atid_list) == (
+                                    [f'/files/{name}/' for name in names], []
+                                )
+                                started = time.time()
+                                assert scheduler.run(timeout=5) == ([f'/files/{name}/' for name in names], [])
+                                assert time.time() - started < 4
+                                assert sorted(polled) == [f'{name}/file.txt' for name in names]
+
+    def test_glacier_restore_scheduler_failures(self, glacier_utils):
+        """ Tests that @ids whose restores cannot be requested, or are lost, or cannot be copied are errors """
+        gu = glacier_utils
+
+        def restore_object(Bucket, Key, RestoreRequest):  # noQA - AWS argument naming style
+            ignored(Bucket, RestoreRequest)
+            assert RestoreRequest['GlacierJobParameters'] == {'Tier': 'Bulk'}
+            if Key == 'a/file.txt':
+                raise Exception('InvalidObjectState')
+            return {'success': True}
+
+        def head_object(Bucket, Key):  # noQA - AWS argument naming style
+            ignored(Bucket)
+            if Key == 'b/file.txt':
+                return {'StorageClass': 'GLACIER'}  # no restore in progress
+            return {'StorageClass': 'GLACIER', 'Restore': 'ongoing-request="false"'}
+
+        with mock.patch.object(GlacierRestoreScheduler, 'RESTORE_TIER_SECONDS', {'Standard': {'GLACIER': (0, 0)}}):
+            with mock.patch.object(GlacierRestoreScheduler, 'MIN_POLL_SECONDS', 0):
+                with mock.patch.object(gu.s3, 'restore_object', side_effect=restore_object):
+                    with mock.patch.object(gu.s3, 'head_object', side_effect=head_object):
+                        with mock.patch.object(gu, 'copy_object_back_to_original_location',
+                                               side_effect=lambda bucket, key, **kwargs: key == 'd/file.txt' or None):
+                            scheduler = GlacierRestoreScheduler(gu)
+                            atid_list = [self.file_meta(name) for name in ['a', 'b', 'c', 'd']]
+                            assert scheduler.request_restores(atid_list, tier='Bulk') == (
+                                ['/files/b/', '/files/c/', '/files/d/'], ['/files/a/']
+                            )
+                            assert scheduler.run() == (['/files/d/'], ['/files/a/', '/files/b/', '/files/c/'])
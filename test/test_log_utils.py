@@ -1,8 +1,12 @@
 from dcicutils import log_utils, ff_utils, es_utils
+import contextlib
+import datetime
 import pytest
 import structlog
+import threading
 import time
 import logging
+from unittest import mock
 pytestmark = pytest.mark.working
 
 
@@ -34,6 +38,139 @@ def test_set_logging_prod_but_no_es(caplog):
     assert len(log_record._logger.handlers) == 0  # noQA - PyCharm doesn't like the reference to ._logger
 
 
+@contextlib.contextmanager
+def mocked_es_handler(fail_ids=(), block=None, **kwargs):
+    """ Yields an ElasticsearchHandler (and a list of its bulk posts) that posts to a mock ES """
+    posts = []
+
+    def streaming_bulk(client, actions, **kwargs):
+        if block:
+            block.wait()
+        actions = list(actions)
+        posts.append(actions)
+        for action in actions:
+            yield action['_id'] not in fail_ids, {'index': {'_id': action['_id']}}
+
+    with mock.patch.object(log_utils.ElasticsearchHandler, 'get_namespace', return_value='ns-'):
+        with mock.patch.object(es_utils, 'create_es_client'):
+            with mock.patch.object(log_utils.helpers, 'streaming_bulk', side_effect=streaming_bulk):
+                handler = log_utils.ElasticsearchHandler('env', 'es_server', **kwargs)
+                try:
+                    yield handler, posts
+                finally:
+                    if block:
+                        block.set()
+                    handler.close()
+
+
+def log_record(n):
+    return logging.LogRecord('test', logging.INFO, __file__, 0, {'event': f'event{n}', 'log_uuid': str(n)}, (), None)
+
+
+def test_elasticsearch_handler_ships_in_bulk():
+    with mocked_es_handler(flush_size=3, flush_seconds=60) as (handler, posts):
+        for n in range(7):
+            handler.emit(log_record(n))
+        handler.emit(logging.LogRecord('test', logging.INFO, __file__, 0, {'event': 'skip', '_skip_es': True}, (),
+                                       None))
+        deadline = time.time() + 5
+        while len(posts) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert [[action['_id'] for action in post] for post in posts] == [['0', '1', '2'], ['3', '4', '5']]
+        handler.flush()  # doesn't wait for flush_seconds
+        assert [action['_id'] for action in posts[-1]] == ['6']
+        assert posts[0][0] == {'_index': handler.calculate_log_index(), '_type': 'log', '_id': '0',
+                               '_source': {'event': 'event0', 'log_uuid': '0'}}
+    with mocked_es_handler(flush_size=100, flush_seconds=0.05) as (handler, posts):
+        handler.emit(log_record(0))
+        time.sleep(0.2)
+        assert len(posts) == 1  # posted after flush_seconds
+        handler.emit(log_record(1))
+    assert len(posts) == 2  # posted when the handler was closed
+
+
+def test_elasticsearch_handler_resends_failures():
+    with mocked_es_handler(fail_ids={'1'}) as (handler, posts):
+        with mock.patch.object(handler, 'schedule_resend') as mock_schedule_resend:
+            for n in range(3):
+                handler.emit(log_record(n))
+            handler.flush()
+            assert [message[0] for message in handler.messages_to_resend] == ['1']
+            mock_schedule_resend.assert_called_once()
+
+
+def test_elasticsearch_handler_drops_when_full():
+    block = threading.Event()
+    with mocked_es_handler(block=block, queue_size=2, flush_size=1) as (handler, posts):
+        handler.emit(log_record(0))
+        while not handler.queue.empty():  # wait for the shipper to be stuck posting 0
+            time.sleep(0.01)
+        for n in range(1, 5):
+            handler.emit(log_record(n))  # so 1 and 2 are queued
+        assert handler.dropped == 2
+        block.set()
+    assert sorted(action['_id'] for post in posts for action in post) == ['0', '1', '2']
+
+
+def test_elasticsearch_handler_log_index_cached_by_month():
+
+    class MockDatetime(datetime.datetime):
+        now = datetime.datetime(2026, 12, 31, 23, 59)
+
+        @classmethod
+        def utcnow(cls):
+            return cls.now
+
+    with mocked_es_handler() as (handler, posts):
+        with mock.patch.object(log_utils.datetime, 'datetime', MockDatetime):
+            with mock.patch.object(log_utils.time, 'time', return_value=MockDatetime.now.replace(
+                    tzinfo=datetime.timezone.utc).timestamp()) as mock_time:
+                handler.log_index_expires = 0
+                assert handler.calculate_log_index() == 'ns-logs-2026-12'
+                MockDatetime.now = datetime.datetime(2027, 1, 1, 0, 0)
+                assert handler.calculate_log_index() == 'ns-logs-2026-12'  # cached until the end of the month
+                mock_time.return_value += 60
+                assert handler.calculate_log_index() == 'ns-logs-2027-01'
+
+
+def test_elasticsearch_logger_factory_shares_handler():
+    posts = []
+
+    def streaming_bulk(client, actions, **kwargs):
+        actions = list(actions)
+        posts.append(actions)
+        for action in actions:
+            yield True, {'index': {'_id': action['_id']}}
+
+    with mock.patch.object(log_utils.ElasticsearchHandler, 'get_namespace', return_value='ns-'):
+        with mock.patch.object(es_utils, 'create_es_client') as mock_create_es_client:
+            with mock.patch.object(log_utils.helpers, 'streaming_bulk', side_effect=streaming_bulk):
+                factory = log_utils.ElasticsearchLoggerFactory(env='env', es_server='es_server', in_prod=True)
+                loggers = [factory('test_shared_handler_a'), factory('test_shared_handler_b'),
+                           factory('test_shared_handler_a')]
+                handler = loggers[0].handlers[0]
+                try:
+                    # One handler (shipper thread, queue and ES client) for all the loggers.
+                    assert all(logger.handlers == [handler] for logger in loggers)
+                    assert log_utils.ElasticsearchHandler.get_shared_handlers() == [handler]
+                    assert mock_create_es_client.call_count == 1
+                    handler.flush_seconds = 60
+                    for n in range(3):
+                        loggers[n % 2].handle(log_record(n))
+                    log_utils.flush_elasticsearch_logs()  # doesn't wait for flush_seconds
+                    assert [[action['_id'] for action in post] for post in posts] == [['0', '1', '2']]
+                finally:
+                    for logger in loggers:
+                        logger.removeHandler(handler)
+                    handler.close()
+                assert log_utils.ElasticsearchHandler.get_shared_handlers() == []
+                # A closed handler is replaced (rather than shared) by the next logger.
+                logger = factory('test_shared_handler_c')
+                assert logger.handlers[0] is not handler
+                logger.handlers[0].close()
+                logger.removeHandler(logger.handlers[0])
+
+
 @pytest.mark.integrated
 def test_set_logging_level(caplog, integrated_ff):
     """ Provides log_dir, log_name and level args to set_logging """
@@ -1,3 +1,4 @@
+import asyncio
 import botocore.exceptions
 import datetime as datetime_module
 import functools
@@ -8,6 +9,8 @@ import pytest
 import pytz
 import random
 import re
+import sys
+import threading
 import time
 import uuid
 import warnings
@@ -32,8 +35,10 @@ from dcicutils.misc_utils import (
     deduplicate_list, chunked, parse_in_radix, format_in_radix, managed_property, future_datetime,
     MIN_DATETIME, MIN_DATETIME_UTC, INPUT, builtin_print, map_chunked, to_camel_case, json_file_contents,
     pad_to, JsonLinesReader, split_string, merge_objects, to_float, to_integer,
-    load_json_from_file_expanding_environment_variables, create_readonly_object
+    load_json_from_file_expanding_environment_variables, create_readonly_object, run_concurrently, TokenBucket,
+    CopyOnWriteNode, remove_empty_properties
 )
+from dcicutils.scripts.json_benchmark import run_benchmark as run_json_benchmark
 from dcicutils.qa_utils import (
     Occasionally, ControlledTime, override_environ as qa_override_environ, MockFileSystem, printed_output,
     raises_regexp, MockId, MockLog, input_series,
@@ -774,6 +779,98 @@ def test_retrying_error_handling():
                        wait_increment=3, wait_multiplier=1.25)
 
 
+def test_retry_on():
+
+    rarely_add3 = Occasionally(_adder(3), success_frequency=3)
+    calls = []
+
+    def add3_or_fail(x):
+        calls.append(x)
+        if x < 0:
+            raise TypeError(x)
+        return rarely_add3(x)
+
+    # Occasionally raises a plain Exception, which is retryable here; a TypeError is not.
+    reliably_add3 = Retry.retrying(add3_or_fail, retries_allowed=4,
+                                   retry_on=lambda e: not isinstance(e, TypeError))
+    assert reliably_add3(1) == 4
+    assert len(calls) == 3
+    with pytest.raises(TypeError):
+        reliably_add3(-1)
+    assert len(calls) == 4  # Not retried.
+
+    @Retry.retry_allowed(retries_allowed=4, retry_on=(KeyError, ValueError))
+    def fail_with(error_class):
+        calls.append(error_class)
+        raise error_class("failed")
+
+    calls = []
+    with pytest.raises(ValueError):
+        fail_with(ValueError)
+    assert len(calls) == 5
+    calls = []
+    with pytest.raises(RuntimeError):
+        fail_with(RuntimeError)
+    assert len(calls) == 1
+    with pytest.raises(ValueError):
+        Retry.retrying(fail_with, retry_on="not an exception class")
+
+
+def test_retry_jitter_max_elapsed_and_hooks():
+
+    retries = []
+    finishes = []
+
+    def always_fail():
+        raise Exception("failed")
+
+    reliably_fail = Retry.retrying(always_fail, retries_allowed=10, wait_seconds=2, wait_multiplier=2, jitter=True,
+                                   on_retry=lambda **kwargs: retries.append(kwargs),
+                                   on_finish=lambda **kwargs: finishes.append(kwargs))
+    with mock.patch("time.sleep") as mock_sleep:
+        with pytest.raises(Exception):
+            reliably_fail()
+    waits = [call.args[0] for call in mock_sleep.call_args_list]
+    assert len(waits) == 10
+    assert all(0 <= wait <= 2 * 2 ** index for index, wait in enumerate(waits))
+    assert [retry["tries"] for retry in retries] == list(range(1, 11))
+    assert [retry["wait_seconds"] for retry in retries] == waits
+    assert len(finishes) == 1 and finishes[0]["tries"] == 11 and str(finishes[0]["error"]) == "failed"
+
+    retries = []
+    finishes = []
+    reliably_fail = Retry.retrying(always_fail, retries_allowed=10, wait_seconds=0.1, max_elapsed=0.25,
+                                   on_retry=lambda **kwargs: retries.append(kwargs),
+                                   on_finish=lambda **kwargs: finishes.append(kwargs))
+    with pytest.raises(Exception):
+        reliably_fail()
+    assert len(retries) == 2  # A third retry would have started after max_elapsed.
+    assert finishes[0]["tries"] == 3 and 0.2 <= finishes[0]["elapsed"] < 0.25
+
+    finishes = []
+    assert Retry.retrying(lambda: 17, on_finish=lambda **kwargs: finishes.append(kwargs))() == 17
+    assert finishes[0]["tries"] == 1 and finishes[0]["error"] is None
+
+
+def test_retry_async():
+
+    rarely_add3 = Occasionally(_adder(3), success_frequency=5)
+
+    @Retry.retry_allowed(retries_allowed=4, wait_seconds=0.01, wait_multiplier=2)
+    async def reliably_add3(x):
+        await asyncio.sleep(0)
+        return rarely_add3(x)
+
+    async def run():
+        with mock.patch.object(asyncio, "sleep", wraps=asyncio.sleep) as mock_sleep:
+            with mock.patch("time.sleep") as mock_time_sleep:
+                assert await reliably_add3(1) == 4
+            assert mock_time_sleep.call_count == 0
+            assert [call.args[0] for call in mock_sleep.call_args_list if call.args[0]] == [0.01, 0.02, 0.04, 0.08]
+
+    asyncio.run(run())
+
+
 def test_apply_dict_overrides():
 
     x = {'a': 1, 'b': 2}
@@ -2101,6 +2198,27 @@ def test_copy_json_side_effects():
     assert obj_copy == {'foo': [1, 2, 3], 'bar': [{'x': 4, 'y': 5}, {'x': 2, 'y': 7}]}
 
 
+def _deeply_nested(depth, leaf):
+    obj = leaf
+    for index in range(depth):
+        obj = {"child": obj, "index": index} if index % 2 else [obj, index]
+    return obj
+
+
+def _deepest(obj):
+    while isinstance(obj, list) or (isinstance(obj, dict) and "child" in obj):
+        obj = obj["child"] if isinstance(obj, dict) else obj[0]
+    return obj.get("leaf", obj.get("other"))
+
+
+def test_copy_json_deeply_nested():
+    obj = _deeply_nested(sys.getrecursionlimit() * 2, {"leaf": "value"})
+    obj_copy = copy_json(obj)
+    assert _deepest(obj_copy) == "value"
+    assert obj_copy["index"] == obj["index"]
+    assert obj_copy["child"] is not obj["child"]
+
+
 class SampleClass:
 
     def __init__(self, favorite_fruit):
@@ -3700,6 +3818,88 @@ def test_merge_objects_9():
     assert id(target) == id(result)
 
 
+def test_merge_objects_copy_on_write():
+    target = {"abc": {"def": [1, 2, 3]}, "ghi": {"jkl": {"mno": 1, "pqr": [{"stu": 2}, {"vwx": 3}]}}}
+    target_copy = copy_json(target)
+    source = {"ghi": {"jkl": {"pqr": [{"stu": 2}, {"vwx": 4}]}}}
+    result = merge_objects(target, source, copy=True)
+    assert result == {"abc": {"def": [1, 2, 3]}, "ghi": {"jkl": {"mno": 1, "pqr": [{"stu": 2}, {"vwx": 4}]}}}
+    assert target == target_copy
+    assert result is not target
+    # Only the path actually changed (ghi.jkl.pqr[1]) is copied.
+    assert result["abc"] is target["abc"]
+    assert result["ghi"]["jkl"]["pqr"][0] is target["ghi"]["jkl"]["pqr"][0]
+    assert result["ghi"]["jkl"]["pqr"][1] is not target["ghi"]["jkl"]["pqr"][1]
+    # Nothing changes, so nothing but the top level is copied.
+    result = merge_objects(target, copy_json(target), copy=True)
+    assert result == target and result is not target
+    assert all(result[key] is target[key] for key in target)
+    # And in place, as before.
+    result = merge_objects(target, source)
+    assert result is target
+    assert target["ghi"]["jkl"]["pqr"][1] == {"vwx": 4}
+
+
+def test_merge_objects_deeply_nested():
+    depth = sys.getrecursionlimit() * 2
+    target = _deeply_nested(depth, {"leaf": "value"})
+    result = merge_objects(target, _deeply_nested(depth, {"leaf": "new value", "other": 1}), copy=True)
+    assert _deepest(result) == "new value"
+    assert _deepest(target) == "value"
+
+
+def test_remove_empty_properties():
+    data = {"a": None, "b": "", "c": {"d": None}, "e": [{"f": None}, {"g": 1}, [], {"h": []}], "i": 0}
+    assert remove_empty_properties(data) is None
+    assert data == {"c": {}, "e": [{}, {"g": 1}, [], {}], "i": 0}
+    data = {"e": [{"f": None}, {"g": 1}, [], {"h": []}]}
+    remove_empty_properties(data, isempty_array_element=lambda element: element in ({}, []))
+    assert data == {"e": [{"g": 1}]}
+    data = {"e": [{"f": None}, {"g": 1}]}
+    with pytest.raises(Exception):
+        remove_empty_properties(data, isempty_array_element=lambda element: element == {},
+                                raise_exception_on_nonempty_array_element_after_empty=True)
+    data = {"a": 0, "b": {"c": 0, "d": 1}}
+    remove_empty_properties(data, isempty=lambda value: value == 0)
+    assert data == {"b": {"d": 1}}
+    data = _deeply_nested(sys.getrecursionlimit() * 2, {"leaf": None, "other": 1})
+    remove_empty_properties(data)
+    assert _deepest(data) == 1
+
+
+def test_copy_on_write_node():
+    obj = {"a": ({"b": 1}, {"c": 2}), "d": [{"e": 3}]}
+    root = CopyOnWriteNode(obj)
+    root.child("a").child(1).set("c", 20)
+    result = root.result()
+    assert result == {"a": ({"b": 1}, {"c": 20}), "d": [{"e": 3}]}
+    assert isinstance(result["a"], tuple)
+    assert result["a"][0] is obj["a"][0] and result["d"] is obj["d"]
+    assert obj == {"a": ({"b": 1}, {"c": 2}), "d": [{"e": 3}]}
+    root = CopyOnWriteNode(obj, copy=False)
+    root.child("d").child(0).set("e", 30)
+    assert root.result() is obj
+    assert obj["d"] == [{"e": 30}]
+    assert CopyOnWriteNode(obj).result() is obj
+    root = CopyOnWriteNode(obj)
+    root.replace(17)
+    assert root.result() == 17
+
+
+def test_json_benchmark():
+    printed = []
+    results = run_json_benchmark(megabytes=0.1, depth=sys.getrecursionlimit() * 2, seed=1, printf=printed.append)
+    assert results["items"]["count"] > 1
+    assert results["items"]["depth"] > 10
+    for scenario in ["copy_json", "merge_objects", "obfuscate_json", "remove_empty_properties"]:
+        assert results[scenario]["count"] == results["items"]["count"]
+        assert results[scenario]["errors"] == 0
+        assert results[scenario]["seconds"] > 0
+    assert results["deeply_nested"]["errors"] == 0
+    assert printed[0].startswith("Items: ")
+    assert len(printed) == 6
+
+
 def test_to_integer():
 
     assert to_integer("0") == 0
@@ -3884,3 +4084,66 @@ def test_create_readonly_object():
     assert a.ghi == 456
     assert a.jk == "xyzzy"
     assert a.lmnop == {"greeting": "Hello, world!"}
+
+
+def test_run_concurrently():
+
+    def fail():
+        raise ValueError("failed")
+
+    progress = []
+    assert run_concurrently([lambda n=n: n * n for n in range(10)], progress=progress.append) == [
+        n * n for n in range(10)]
+    assert progress == [1] * 10
+    with pytest.raises(ValueError):
+        run_concurrently([lambda: 1, fail])  # Errors are no longer silently lost.
+
+
+def test_token_bucket():
+
+    waits = []
+    bucket = TokenBucket(rate=20, capacity=3, wait_hook=lambda wait_seconds: waits.append(wait_seconds))
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]  # The burst.
+    assert 0 < bucket.try_acquire() <= 0.05
+    assert not bucket.acquire(3, timeout=0.01)
+    with pytest.raises(ValueError):
+        bucket.acquire(4)
+    start = time.monotonic()
+    for _ in range(5):
+        assert bucket.acquire()
+    assert 0.2 <= time.monotonic() - start < 0.5
+    assert len(waits) >= 5
+    assert TokenBucket(rate=1, enabled=False).try_acquire() == 0
+    with pytest.raises(TypeError):
+        TokenBucket(rate=0)
+
+
+def test_token_bucket_threads_and_async():
+
+    bucket = TokenBucket(rate=50, capacity=5)
+    ncalls = 0
+
+    @bucket.limited
+    def f():
+        nonlocal ncalls
+        ncalls += 1
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=f) for _ in range(15)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ncalls == 15
+    assert 0.18 <= time.monotonic() - start < 0.6  # 5 at once, then 10 at 50 per second.
+
+    @bucket.limited
+    async def g(n):
+        return n * n
+
+    async def run():
+        return await asyncio.gather(*[g(n) for n in range(10)])
+
+    start = time.monotonic()
+    assert asyncio.run(run()) == [n * n for n in range(10)]
+    assert 0.18 <= time.monotonic() - start < 0.6
@@ -1,4 +1,5 @@
 import copy
+import sys
 
 from dcicutils.obfuscation_utils import (
     is_obfuscated, should_obfuscate, obfuscate, obfuscate_json, obfuscate_dict,
@@ -172,3 +173,30 @@ def test_obfuscate_json_with_tuple():
     x = obfuscate_json(d, obfuscated="<REDACTED>")
     assert x == o
     assert d == d_copy
+
+
+def test_obfuscate_json_copies_only_modified_paths():
+
+    d = {"abc": {"def": [1, 2, 3]}, "ghi": [{"jkl": "hello"}, {"mno": {"password": "obfuscatethisvalue"}}]}
+    d_copy = copy.deepcopy(d)
+    x = obfuscate_json(d, obfuscated="<REDACTED>")
+    assert x == {"abc": {"def": [1, 2, 3]}, "ghi": [{"jkl": "hello"}, {"mno": {"password": "<REDACTED>"}}]}
+    assert d == d_copy
+    assert x["abc"] is d["abc"]
+    assert x["ghi"][0] is d["ghi"][0]
+    assert x["ghi"][1] is not d["ghi"][1]
+    d = {"abc": {"def": [1, 2, 3]}}
+    assert obfuscate_json(d) is d
+    assert obfuscate_json(d, inplace=True) is d
+
+
+def test_obfuscate_json_deeply_nested():
+
+    d = {"secret": "obfuscatethisvalue"}
+    for _ in range(sys.getrecursionlimit() * 2):
+        d = {"child": [d]}
+    x = obfuscate_json(d, obfuscated="<REDACTED>")
+    for _ in range(sys.getrecursionlimit() * 2):
+        d, x = d["child"][0], x["child"][0]
+    assert d == {"secret": "obfuscatethisvalue"}
+    assert x == {"secret": "<REDACTED>"}
@@ -0,0 +1,150 @@
+import json
+import os
+import pytest
+from unittest import mock
+from dcicutils import ff_utils
+from dcicutils.portal_emulator import PortalEmulator
+from dcicutils.portal_utils import Portal
+from dcicutils.scripts.portal_benchmark import run_benchmark
+from dcicutils.structured_data import StructuredDataSet
+from dcicutils.tmpfile_utils import temporary_directory
+
+
+_DONOR_UUID = "d13d06c1-218e-4f61-aaf0-91f226248b3c"
+_INSERTS = {
+    "Donor": [{"uuid": _DONOR_UUID, "submitted_id": "TEST_DONOR_1", "age": 42}],
+    "Sample": [{"submitted_id": f"TEST_SAMPLE_{index}", "donor": "TEST_DONOR_1"} for index in range(30)]
+}
+_SCHEMAS = {
+    "Donor": {"title": "Donor", "type": "object", "identifyingProperties": ["uuid", "submitted_id"],
+              "properties": {"uuid": {"type": "string"}, "submitted_id": {"type": "string"},
+                             "age": {"type": "integer"}}},
+    "Sample": {"title": "Sample", "type": "object", "identifyingProperties": ["uuid", "submitted_id"],
+               "properties": {"uuid": {"type": "string"}, "submitted_id": {"type": "string"},
+                              "donor": {"type": "string", "linkTo": "Donor"}}}
+}
+
+
+@pytest.fixture(autouse=True)
+def emulator_schemas():
+    # Importing test_structured_data replaces Portal.get_schemas (for the whole class) with a canned schemas
+    # dump; these tests need the schemas the emulator itself serves, whatever order the tests run in.
+    with mock.patch.object(Portal, "get_schemas", lambda self: self.get("/profiles/").json()):
+        yield
+
+
+def test_portal_emulator_vapp():
+
+    emulator = PortalEmulator(_INSERTS, schemas=_SCHEMAS, seed=1)
+    assert emulator.nitems == 31
+    assert emulator.type_names == ["Donor", "Sample"]
+    portal = emulator.create_portal()
+
+    assert portal.get("/health").json()["status"] == "ok"
+    assert set(portal.get_schemas()) == {"Donor", "Sample"}
+    assert portal.get_schema("Donor")["identifyingProperties"] == ["uuid", "submitted_id"]
+
+    for path in [f"/{_DONOR_UUID}", f"/{_DONOR_UUID}/", "/Donor/TEST_DONOR_1", "/donors/TEST_DONOR_1/"]:
+        item = portal.get(path).json()
+        assert item["uuid"] == _DONOR_UUID
+        assert item["@type"] == ["Donor", "Item"]
+        assert item["@id"] == f"/donors/{_DONOR_UUID}/"
+    assert "@id" not in portal.get("/Donor/TEST_DONOR_1", raw=True).json()
+    with pytest.raises(Exception):
+        portal.get("/Sample/TEST_DONOR_1")  # Wrong type.
+
+    response = portal.get("/search/?type=Sample&from=25&limit=10").json()
+    assert response["total"] == 30
+    assert [item["submitted_id"] for item in response["@graph"]] == [f"TEST_SAMPLE_{n}" for n in range(25, 30)]
+    assert len(portal.get("/search/?type=Sample&limit=all").json()["@graph"]) == 30
+    assert portal.get("/search/?type=Item&limit=all").json()["total"] == 31
+
+    assert portal.patch("/Donor/TEST_DONOR_1", json={"age": 43}).status_code == 200
+    assert portal.get("/Donor/TEST_DONOR_1").json()["age"] == 43
+    assert portal.patch_metadata("TEST_DONOR_1", {"age": 44}, check_only=True)["status"] == "success"
+    assert portal.get("/Donor/TEST_DONOR_1").json()["age"] == 43
+
+    response = portal.post("/Sample", json={"submitted_id": "TEST_SAMPLE_NEW"})
+    assert response.status_code == 201
+    assert (uuid := response.json()["@graph"][0]["uuid"])
+    assert portal.get(f"/Sample/{uuid}").json()["submitted_id"] == "TEST_SAMPLE_NEW"
+    assert emulator.nitems == 32
+    assert emulator.stats["POST 201"] == 1
+
+
+def test_portal_emulator_inserts_directory():
+
+    with temporary_directory() as directory:
+        for type_name, file_name in [("Donor", "donor.json"), ("Sample", "sample.json")]:
+            with open(os.path.join(directory, file_name), "w") as f:
+                json.dump(_INSERTS[type_name], f)
+        emulator = PortalEmulator(directory)
+        assert emulator.nitems == 31
+        # Minimal schemas are inferred when not given.
+        schema = emulator.create_portal().get_schema("Sample")
+        assert schema["identifyingProperties"] == ["uuid", "submitted_id"]
+        assert set(schema["properties"]) == {"uuid", "submitted_id", "donor"}
+
+
+def test_portal_emulator_faults():
+
+    emulator = PortalEmulator(_INSERTS, error_rate=0.5, seed=1)
+    portal = emulator.create_portal()
+    nerrors = 0
+    for _ in range(100):
+        try:
+            portal.get("/health")
+        except Exception:
+            nerrors += 1
+    assert 25 < nerrors < 75
+    assert emulator.stats["GET 500"] == nerrors
+
+    emulator = PortalEmulator(_INSERTS, throttle_rate=0.001, throttle_burst=3)
+    portal = emulator.create_portal()
+    for _ in range(3):
+        assert portal.get("/health").status_code == 200
+    with pytest.raises(Exception) as e:
+        portal.get("/health")
+    assert "429" in str(e.value)
+
+
+def test_portal_emulator_served():
+
+    with PortalEmulator(_INSERTS, schemas=_SCHEMAS, latency=(0.0, 0.002), seed=1) as emulator:
+        server = emulator.start()
+        assert server.startswith("http://127.0.0.1:")
+        assert emulator.key["server"] == server
+        assert ff_utils.get_metadata("TEST_DONOR_1", key=emulator.key)["uuid"] == _DONOR_UUID
+        assert len(ff_utils.search_metadata("search/?type=Sample", key=emulator.key, page_limit=7)) == 30
+        assert ff_utils.patch_metadata({"age": 50}, obj_id=_DONOR_UUID, key=emulator.key)["status"] == "success"
+        portal = emulator.create_portal()
+        assert portal.get(f"/{_DONOR_UUID}").json()["age"] == 50
+        assert portal.head("/health") == 200
+        portal.close()
+    assert emulator.server is None
+
+
+def test_portal_emulator_structured_data():
+
+    emulator = PortalEmulator(_INSERTS, schemas=_SCHEMAS)
+    with temporary_directory() as directory:
+        with open(file := os.path.join(directory, "sample.csv"), "w") as f:
+            f.write("submitted_id,donor\nTEST_SAMPLE_X,TEST_DONOR_1\nTEST_SAMPLE_Y,TEST_DONOR_UNKNOWN\n")
+        structured_data_set = StructuredDataSet.load(file, portal=emulator.create_portal())
+        assert len(structured_data_set.data["Sample"]) == 2
+        assert len(structured_data_set.ref_errors) == 1
+        assert "TEST_DONOR_UNKNOWN" in json.dumps(structured_data_set.ref_errors)
+
+
+def test_portal_benchmark():
+
+    printed = []
+    results = run_benchmark(nitems=20, nrequests=10, nthreads=2, seed=1, printf=printed.append)
+    assert results["emulator"]["items"] == 40
+    for scenario in ["ff_utils", "portal", "structured_data"]:
+        assert results[scenario]["count"] > 0
+        assert results[scenario]["errors"] == 0
+        assert results[scenario]["throughput"] > 0
+    assert results["portal"]["count"] == 30
+    assert results["endpoints"]["GET /{id}"]["count"] == 10
+    assert printed[0].startswith("Portal emulator: http://127.0.0.1:")
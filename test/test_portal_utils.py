@@ -1,6 +1,7 @@
 import json
 import os
-from dcicutils.portal_utils import Portal
+import pytest
+from dcicutils.portal_utils import Portal, PortalInstrumentation
 from dcicutils.zip_utils import temporary_file
 from unittest import mock
 from .conftest_settings import TEST_DIR
@@ -175,3 +176,73 @@ def test_portal_schemas_super_type_map():
         assert portal.is_schema_type({"@type": "SubmittedFile"}, "SUBMITTED_FILE") is True
         assert portal.is_schema_type({"@type": "SubmittedFile"}, "File") is True
         assert portal.is_schema_type({"@type": "foo", "data_type": "UnalignedReads"}, "UnalignedReads") is True
+
+
+def test_portal_endpoint_template():
+    assert Portal.endpoint_template("/health") == "/health"
+    assert Portal.endpoint_template("http://localhost:8000/profiles/") == "/profiles/"
+    assert Portal.endpoint_template("https://xyzzy.org/profiles/File.json?frame=raw") == "/profiles/{id}"
+    assert Portal.endpoint_template("https://xyzzy.org/d13d06c1-218e-4f61-aaf0-91f226248b3c/") == "/{id}/"
+    assert Portal.endpoint_template("/files-formats/d13d06c1-218e-4f61-aaf0-91f226248b3c/") == "/files-formats/{id}/"
+    assert Portal.endpoint_template("/SMAFSFXF1RO4?frame=raw") == "/{id}"
+    assert Portal.endpoint_template("/File/UW_FILE-SET_COLO-829BL_HI-C_1") == "/File/{id}"
+    assert Portal.endpoint_template("/search/?type=File&limit=10") == "/search/"
+    assert Portal.endpoint_template("/files-fastq/4DNFIXYZ1234/@@upload") == "/files-fastq/{id}/@@upload"
+    assert Portal.endpoint_template("http://localhost:8000") == "/"
+
+
+def test_portal_session():
+
+    portal = Portal(_TEST_KEY, server="http://localhost:8000", pool_size=4, max_retries=2)
+    assert portal.pool_size == 4
+    assert (session := portal.session) is portal.session
+    adapter = session.get_adapter("http://localhost:8000/")
+    assert adapter._pool_connections == 4
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+    assert Portal(portal).pool_size == 4
+    assert Portal(portal).session is not session
+    portal.close()
+    assert portal.session is not session
+
+    with mock.patch.object(portal.session, "get") as mocked_get:
+        mocked_get.return_value.status_code = 200
+        assert portal.get("/health").status_code == 200
+        assert mocked_get.call_args[0][0] == "http://localhost:8000/health"
+
+
+def test_portal_instrumentation():
+
+    instrumentation = PortalInstrumentation()
+    portal = Portal.create_for_testing({"path": "/{type}/{id}", "method": "GET",
+                                        "function": lambda request: {"id": request.matchdict["id"]}})
+    portal.instrumentation = instrumentation
+    for _ in range(3):
+        assert portal.get("/Sample/d13d06c1-218e-4f61-aaf0-91f226248b3c").json()["id"] is not None
+    assert portal.get("/Sample/SMAFSFXF1RO4").status_code == 200
+    with pytest.raises(Exception):
+        portal.get("/xyzzy")  # The (webtest) vapp raises on 404; still recorded, but with no status.
+
+    records = instrumentation.records
+    assert len(records) == 5
+    assert all(record["verb"] == "GET" and record["latency"] >= 0 for record in records)
+    assert records[0]["endpoint"] == "/Sample/{id}"
+    assert records[0]["status"] == 200
+    assert records[0]["bytes"] > 0
+    assert records[0]["retries"] == 0
+    assert records[4]["status"] is None
+
+    summary = instrumentation.summary()
+    assert list(summary) == ["GET /Sample/{id}", "GET /xyzzy"]
+    assert summary["GET /Sample/{id}"]["count"] == 4
+    assert summary["GET /Sample/{id}"]["errors"] == 0
+    assert summary["GET /xyzzy"]["errors"] == 1
+    assert summary["GET /Sample/{id}"]["latency_p50"] <= summary["GET /Sample/{id}"]["latency_max"]
+
+    printed = []
+    instrumentation.print_summary(printf=printed.append)
+    assert printed[0] == "Portal requests: 5"
+    assert printed[1].startswith("- GET /Sample/{id}: count=4 errors=0")
+
+    instrumentation.clear()
+    assert instrumentation.summary() == {}
@@ -1,7 +1,7 @@
 import json
 import time
 import datetime
-from dcicutils.redis_utils import RedisBase
+from dcicutils.redis_utils import RedisBase, RedisTokenBucket
 
 
 class TestRedisBase:
@@ -88,3 +88,25 @@ class TestRedisBase:
         assert rd.get(my_key_meta) == 'hello'
         time.sleep(3)
         assert not rd.get(my_key_meta)
+
+    def test_redis_hincrby_scan_keys(self, redisdb):
+        """ Tests incrementing hash fields and scanning for keys """
+        rd = RedisBase(redisdb)
+        assert rd.hincrby('stats', 'hits') == 1
+        assert rd.hincrby('stats', 'hits', 2) == 3
+        assert rd.hget('stats', 'hits') == '3'
+        rd.set('cache:a', 'x')
+        rd.set('cache:b', 'y')
+        assert sorted(rd.scan_keys('cache:*')) == ['cache:a', 'cache:b']
+
+    def test_redis_token_bucket(self, redisdb):
+        """ Tests that the tokens of RedisTokenBucket are shared by all users of the same key """
+        rd = RedisBase(redisdb)
+        bucket1 = RedisTokenBucket(rd, 'rate:portal', rate=10, capacity=3)
+        bucket2 = RedisTokenBucket(rd, 'rate:portal', rate=10, capacity=3)
+        assert bucket1.try_acquire() == 0
+        assert bucket2.try_acquire(2) == 0
+        assert 0 < bucket1.try_acquire() <= 0.1
+        assert RedisTokenBucket(rd, 'rate:other', rate=10, capacity=3).try_acquire(3) == 0
+        assert bucket2.acquire(timeout=1)
+        assert 0 < rd.ttl('rate:portal') <= 2
@@ -1,5 +1,7 @@
+import boto3
 import botocore.client
 import botocore.exceptions
+import botocore.stub
 import contextlib
 import datetime
 import hashlib
@@ -9,6 +11,10 @@ import os
 import pytest
 import re
 import requests
+import tempfile
+import threading
+import time
+import zipfile
 
 from dcicutils import s3_utils as s3_utils_module
 from dcicutils.beanstalk_utils import get_beanstalk_real_url
@@ -23,11 +29,14 @@ from dcicutils.env_utils_legacy import (
     FF_PUBLIC_URL_STG, FF_PUBLIC_URL_PRD,
      _CGAP_MGB_PUBLIC_URL_PRD,  # noQA - Yes, we do want to import a protected member (for testing)
 )
-from dcicutils.exceptions import SynonymousEnvironmentVariablesMismatched, CannotInferEnvFromManyGlobalEnvs
+from dcicutils.exceptions import (
+    SynonymousEnvironmentVariablesMismatched, CannotInferEnvFromManyGlobalEnvs, S3TransferVerificationError
+)
+from dcicutils.file_utils import compute_file_etag
 from dcicutils.ff_mocks import make_mock_es_url, make_mock_portal_url, mocked_s3utils
-from dcicutils.misc_utils import ignored, ignorable, override_environ, exported, file_contents
+from dcicutils.misc_utils import ignored, ignorable, override_environ, exported, file_contents, TokenBucket
 from dcicutils.qa_utils import MockBoto3, MockResponse, known_bug_expected, MockBotoS3Client, MockFileSystem
-from dcicutils.s3_utils import s3Utils, HealthPageKey
+from dcicutils.s3_utils import s3Utils, HealthPageKey, S3ObjectHandle, S3SeekableFile
 from requests.exceptions import ConnectionError
 from typing import Optional, Callable, Dict
 from unittest import mock
@@ -1521,3 +1530,534 @@ def test_get_and_set_object_tags():
         expected = [{'Key': 'a', 'Value': 'alpha_2'}, {'Key': 'b', 'Value': 'bravo'}, {'Key': 'c', 'Value': 'gamma'}]
         # print(f"actual={actual} expected={expected}")
         assert actual == expected, f"Got {actual} but expected {expected}"
+
+
+@contextlib.contextmanager
+def recording_calls(obj, method_name):
+    """
+    Like mock.patch.object with wraps, but (unlike a MagicMock's call_count) the calls recorded are reliable
+    even when made concurrently from several threads. Yields the list of (keyword) arguments of each call.
+    """
+    calls = []
+    method = getattr(obj, method_name)
+
+    def recorded_method(*args, **kwargs):
+        calls.append(kwargs)
+        return method(*args, **kwargs)
+
+    with mock.patch.object(obj, method_name, new=recorded_method):
+        yield calls
+
+
+@using_fresh_ff_state_for_testing()
+def test_s3_delete_dir():
+
+    mock_boto3 = MockBoto3()
+
+    bucket = 'sample-bucket'
+    prefix = 'workflow/output/'
+
+    with mock.patch.object(s3_utils_module, "boto3", mock_boto3):
+
+        s3u = s3Utils(sys_bucket='irrelevant', outfile_bucket=bucket)
+
+        s3 = s3u.s3
+
+        assert isinstance(s3, MockBotoS3Client)
+
+        # More than 1000 objects, which previously was the most s3_delete_dir would delete.
+        for i in range(2500):
+            s3.put_object(Bucket=bucket, Key=f"{prefix}{i:05}", Body=b'irrelevant')
+        s3.put_object(Bucket=bucket, Key="workflow/other", Body=b'irrelevant')
+
+        assert [obj['Key'] for obj in s3u.s3_list_objects(prefix)] == [f"{prefix}{i:05}" for i in range(2500)]
+        assert [obj['Key'] for obj in s3u.s3_list_objects(prefix, start_after=f"{prefix}02497")] == [
+            f"{prefix}02498", f"{prefix}02499"]
+
+        assert s3u.s3_delete_dir(prefix, dry_run=True) == {'deleted': 2500, 'errors': []}
+        assert len(list(s3u.s3_list_objects(prefix))) == 2500
+
+        with recording_calls(s3, "delete_objects") as delete_objects_calls:
+            assert s3u.s3_delete_dir(prefix, max_workers=2) == {'deleted': 2500, 'errors': []}
+            assert len(delete_objects_calls) == 3  # 1000 + 1000 + 500
+        assert list(s3u.s3_list_objects(prefix)) == []
+        assert [obj['Key'] for obj in s3u.s3_list_objects("workflow/")] == ["workflow/other"]
+
+        # The (mock) bucket is versioned, so the objects are still there as versions (under delete markers).
+        assert len(list(s3u.s3_list_object_versions(prefix))) == 5000
+        assert s3u.s3_delete_dir(prefix, versions=True, dry_run=True) == {'deleted': 5000, 'errors': []}
+        assert s3u.s3_delete_dir(prefix, versions=True) == {'deleted': 5000, 'errors': []}
+        assert list(s3u.s3_list_object_versions(prefix)) == []
+
+        error = {'Key': 'workflow/other', 'Code': 'AccessDenied', 'Message': 'Access Denied'}
+        with mock.patch.object(s3, "delete_objects") as mock_delete_objects:
+            mock_delete_objects.return_value = {'Errors': [error]}
+            assert s3u.s3_delete_dir("workflow/") == {'deleted': 0, 'errors': [error]}
+            mock_delete_objects.side_effect = Exception("Service Unavailable")
+            assert s3u.s3_delete_dir("workflow/") == {'deleted': 0, 'errors': [
+                {'Key': 'workflow/other', 'Code': 'Exception', 'Message': 'Service Unavailable'}]}
+
+
+@using_fresh_ff_state_for_testing()
+def test_s3_seekable_file():
+
+    mock_boto3 = MockBoto3()
+
+    bucket = 'sample-bucket'
+    key = 'sample.txt'
+    content = bytes(index % 251 for index in range(10000))
+
+    with mock.patch.object(s3_utils_module, "boto3", mock_boto3):
+
+        s3u = s3Utils(sys_bucket='irrelevant', outfile_bucket=bucket)
+        s3 = s3u.s3
+        s3.put_object(Bucket=bucket, Key=key, Body=content)
+
+        with recording_calls(s3, "get_object") as get_object_calls:
+            s3_file = S3SeekableFile(s3, bucket, key, block_size=1000, max_blocks=2)
+            assert s3_file.size == 10000
+            assert s3_file.seekable() and s3_file.readable()
+            assert s3_file.read(10) == content[:10]
+            assert s3_file.read(1500) == content[10:1510]
+            assert len(get_object_calls) == 2  # 2 blocks
+            assert s3_file.seek(-5, io.SEEK_END) == 9995
+            assert s3_file.read() == content[9995:]
+            assert s3_file.read(10) == b''
+            assert s3_file.seek(1200) == 1200
+            assert s3_file.read(10) == content[1200:1210]  # Cached
+            assert len(get_object_calls) == 3
+            assert s3_file.seek(-1210, io.SEEK_CUR) == 0
+            assert s3_file.read(1) == content[:1]  # No longer cached (at most 2 blocks)
+            assert len(get_object_calls) == 4
+            assert get_object_calls[-1]['Range'] == 'bytes=0-999'
+            clone = s3_file.clone()
+            assert clone.tell() == 0 and s3_file.tell() == 1
+            assert clone.read(5) == content[:5]  # Shares the cache
+            assert len(get_object_calls) == 4
+            buffer = bytearray(3)
+            assert s3_file.readinto(buffer) == 3 and bytes(buffer) == content[1:4]
+            with pytest.raises(ValueError):
+                s3_file.seek(-1)
+
+        assert S3ObjectHandle(s3, bucket, key).read() == content
+        assert bytes(S3ObjectHandle(s3, bucket, key)) == content
+        assert S3ObjectHandle(s3, bucket, key).open(block_size=100).read(5) == content[:5]
+
+
+@using_fresh_ff_state_for_testing()
+def test_unzip_s3_to_s3_ranged_and_multipart():
+
+    mock_boto3 = MockBoto3()
+
+    bucket = 'sample-bucket'
+    zip_key = 'fastqc/report.zip'
+    large_content = os.urandom(1024 * 1024) * 11  # Large enough for multipart upload with minimal (5MB) parts.
+    small_contents = {f"report/file{index}.txt": f"file {index} content".encode('utf-8') for index in range(20)}
+
+    zip_bytes = io.BytesIO()
+    with zipfile.ZipFile(zip_bytes, 'w', compression=zipfile.ZIP_STORED) as zip_file:
+        zip_file.writestr("report/", b"")
+        zip_file.writestr("report/large.txt", large_content)
+        for name, content in small_contents.items():
+            zip_file.writestr(name, content)
+
+    with mock.patch.object(s3_utils_module, "boto3", mock_boto3):
+
+        s3u = s3Utils(sys_bucket='irrelevant', outfile_bucket=bucket)
+        s3 = s3u.s3
+        s3.put_object(Bucket=bucket, Key=zip_key, Body=zip_bytes.getvalue())
+
+        with recording_calls(s3, "get_object") as get_object_calls:
+            files = s3u.read_s3_zipfile(zip_key, ['file3.txt', 'file4.txt', 'missing.txt'])
+            assert files == {'file3.txt': b"file 3 content", 'file4.txt': b"file 4 content"}
+            # Just the last 4MB block, with the central directory and small files, rather than the whole zip.
+            assert len(get_object_calls) == 1
+            assert get_object_calls[-1]['Range'].startswith('bytes=8388608-')
+
+        with recording_calls(s3, "upload_part") as upload_part_calls:
+            ret_files = s3u.unzip_s3_to_s3(zip_key, 'extracted', max_workers=4,
+                                           multipart_threshold=10 * 1024 * 1024, part_size=5 * 1024 * 1024)
+            assert len(upload_part_calls) == 3  # 5MB + 5MB + 1MB, for large.txt only
+
+        assert sorted(ret_files) == sorted(['large.txt'] + [os.path.basename(name) for name in small_contents])
+        assert ret_files['large.txt']['s3key'] == f"https://s3.amazonaws.com/{bucket}/extracted/large.txt"
+        handle = ret_files['file7.txt']['data']
+        assert isinstance(handle, S3ObjectHandle)
+        assert handle.key == 'extracted/file7.txt'
+        assert handle.read() == b"file 7 content"
+        assert ret_files['large.txt']['data'].read() == large_content
+        assert ret_files['large.txt']['data'].size == len(large_content)
+        assert len(s3u.s3_read_dir('extracted/')['Contents']) == 21
+
+        assert s3u.unzip_s3_to_s3(zip_key, 'extracted2/', store_results=False) == {}
+        assert s3.get_object(Bucket=bucket, Key='extracted2/large.txt')['Body'].read() == large_content
+
+        # If an upload fails, so does the whole thing, and any (multipart) upload in progress is aborted.
+        with mock.patch.object(s3, "upload_part", side_effect=Exception("Upload failed")):
+            with recording_calls(s3, "abort_multipart_upload") as abort_multipart_upload_calls:
+                with pytest.raises(Exception, match="Upload failed"):
+                    s3u.unzip_s3_to_s3(zip_key, 'extracted3/', multipart_threshold=0)
+                assert len(abort_multipart_upload_calls) >= 1
+        assert not mock_boto3.shared_reality['_s3_multipart_uploads']
+
+
+@using_fresh_ff_state_for_testing()
+def test_unzip_s3_to_s3_bounds_memory():
+
+    mock_boto3 = MockBoto3()
+
+    bucket = 'sample-bucket'
+    zip_key = 'fastqc/report.zip'
+    mib = 1024 * 1024
+    contents = {f"report/file{index}.txt": os.urandom(mib) for index in range(8)}
+
+    zip_bytes = io.BytesIO()
+    with zipfile.ZipFile(zip_bytes, 'w', compression=zipfile.ZIP_STORED) as zip_file:
+        for name, content in contents.items():
+            zip_file.writestr(name, content)
+
+    with mock.patch.object(s3_utils_module, "boto3", mock_boto3):
+
+        s3u = s3Utils(sys_bucket='irrelevant', outfile_bucket=bucket)
+        s3u.s3.put_object(Bucket=bucket, Key=zip_key, Body=zip_bytes.getvalue())
+
+        lock = threading.Lock()
+        in_memory, max_in_memory = 0, 0
+        s3_put = s3u.s3_put
+
+        def measured_s3_put(obj, upload_key, acl=None):
+            nonlocal in_memory, max_in_memory
+            with lock:
+                in_memory += len(obj)
+                max_in_memory = max(max_in_memory, in_memory)
+            time.sleep(0.05)  # Long enough for the other workers to start their uploads (if they can).
+            try:
+                return s3_put(obj, upload_key, acl=acl)
+            finally:
+                with lock:
+                    in_memory -= len(obj)
+
+        with mock.patch.object(s3u, "s3_put", side_effect=measured_s3_put):
+            s3u.unzip_s3_to_s3(zip_key, 'extracted', max_workers=8, max_memory=2 * mib + mib // 2)
+
+        # At most 2 of the 8 (1MB) files are in memory at once, rather than all 8 (one per worker).
+        assert max_in_memory == 2 * mib
+        for name, content in contents.items():
+            assert s3u.s3.get_object(Bucket=bucket, Key=f'extracted/{name}')['Body'].read() == content
+
+
+@using_fresh_ff_state_for_testing()
+def test_s3_inventory():
+
+    mock_boto3 = MockBoto3()
+
+    bucket = 'sample-bucket'
+
+    with mock.patch.object(s3_utils_module, "boto3", mock_boto3):
+
+        s3 = mock_boto3.client('s3')
+
+        def put_objects(keys):
+            for key in keys:
+                s3.put_object(Bucket=bucket, Key=key, Body=b'x' * (len(key) % 7))
+                if key.endswith('9'):
+                    s3._set_object_storage_class_for_testing(f"{bucket}/{key}", 'GLACIER')  # noQA - for testing
+
+        def expected_inventory(prefix=''):
+            expected = {'count': 0, 'bytes': 0, 'storage_classes': {}}
+            for key, content in s3.s3_files.files.items():
+                if key.startswith(f"{bucket}/{prefix}"):
+                    storage_class = 'GLACIER' if key.endswith('9') else 'STANDARD'
+                    counts = expected['storage_classes'].setdefault(storage_class, {'count': 0, 'bytes': 0})
+                    for counted in [expected, counts]:
+                        counted['count'] += 1
+                        counted['bytes'] += len(content)
+            return expected
+
+        def summary(inventory):
+            return {'count': inventory['count'], 'bytes': inventory['bytes'],
+                    'storage_classes': inventory['storage_classes']}
+
+        # Mostly uuid-style keys, but also some that sort before and after the usual (hex) shard boundaries.
+        put_objects([f"{index * 7919 % 4096:03x}{index}" for index in range(3000)])
+        put_objects(["/odd", "0", "1", "Upper", "f", "fff", "g", "zzz9"])
+
+        assert s3Utils.size(bucket) == 3008
+        with pytest.raises(Exception, match='.*NoSuchBucket.*'):
+            s3Utils.size('not_a_bucket')
+
+        for shard_depth in [1, 2]:
+            with recording_calls(s3, "list_objects_v2") as list_objects_v2_calls:
+                inventory = s3Utils.inventory(bucket, shard_depth=shard_depth, max_workers=4, s3=s3)
+                assert summary(inventory) == expected_inventory()
+                assert len(inventory['shards']) == 16 ** shard_depth
+                assert sum(shard['count'] for shard in inventory['shards']) == 3008
+                assert len(list_objects_v2_calls) >= 16 ** shard_depth
+
+        assert summary(s3Utils.inventory(bucket, prefix='a', s3=s3)) == expected_inventory('a')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest_file = os.path.join(tmpdir, 'inventory.json')
+            inventory = s3Utils.inventory(bucket, manifest_file=manifest_file, s3=s3)
+            with io.open(manifest_file) as fp:
+                assert json.load(fp) == inventory
+            # New keys sorting after those already seen (in each shard) are picked up incrementally.
+            put_objects(["zzzzzz", "zzzzz9", "1ffff", "2fffz9"])
+            with recording_calls(s3, "list_objects_v2") as list_objects_v2_calls:
+                inventory = s3Utils.inventory(bucket, manifest_file=manifest_file, s3=s3)
+                assert summary(inventory) == expected_inventory()
+                assert inventory['count'] == 3012
+                assert all(call.get('StartAfter') for call in list_objects_v2_calls)
+            with io.open(manifest_file) as fp:
+                assert json.load(fp)['count'] == 3012
+            with pytest.raises(ValueError):
+                s3Utils.inventory(bucket, shard_depth=2, manifest_file=manifest_file, s3=s3)
+
+
+@using_fresh_ff_state_for_testing()
+def test_s3_upload_and_download_file():
+
+    mock_boto3 = MockBoto3()
+
+    bucket = 'sample-bucket'
+    mib = 1024 * 1024
+
+    with mock.patch.object(s3_utils_module, "boto3", mock_boto3):
+
+        s3u = s3Utils(sys_bucket='irrelevant', outfile_bucket=bucket)
+        s3 = s3u.s3
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+
+            def local_file(name, content=None):
+                file = os.path.join(tmpdir, name)
+                if content is not None:
+                    with io.open(file, 'wb') as fp:
+                        fp.write(content)
+                return file
+
+            def file_content(file):
+                with io.open(file, 'rb') as fp:
+                    return fp.read()
+
+            small_file = local_file('small.txt', b'small content')
+            result = s3u.s3_upload_file(small_file, 'small.txt')
+            assert result == {'bucket': bucket, 'key': 'small.txt', 'size': 13, 'parts': 0,
+                              'etag': compute_file_etag(small_file)}
+            assert s3u.s3_download_file('small.txt', local_file('small.copy.txt')) == result
+            assert file_content(local_file('small.copy.txt')) == b'small content'
+
+            large_content = os.urandom(mib) * 20 + b'end'
+            large_file = local_file('large.txt', large_content)
+            with recording_calls(s3, "upload_part") as upload_part_calls:
+                result = s3u.s3_upload_file(large_file, 'large.txt', max_workers=2)
+                assert len(upload_part_calls) == 3  # 8MiB + 8MiB + 4MiB (and a bit)
+            assert result == {'bucket': bucket, 'key': 'large.txt', 'size': 20 * mib + 3, 'parts': 3,
+                              'etag': compute_file_etag(large_file)}
+            assert s3.head_object(Bucket=bucket, Key='large.txt')['ETag'] == f'"{result["etag"]}"'
+            assert not os.path.exists(large_file + '.s3upload')
+            with recording_calls(s3, "get_object") as get_object_calls:
+                assert s3u.s3_download_file('large.txt', local_file('large.copy.txt'), max_workers=2) == result
+                assert len(get_object_calls) == 3
+            assert file_content(local_file('large.copy.txt')) == large_content
+            assert not os.path.exists(local_file('large.copy.txt.s3download.part'))
+
+            # Not uploaded via multipart upload, so the download is hashed as a whole.
+            s3.put_object(Bucket=bucket, Key='single.txt', Body=large_content)
+            result = s3u.s3_download_file('single.txt', local_file('single.copy.txt'), max_workers=3)
+            assert result['parts'] == 0 and result['etag'] == hashlib.md5(large_content).hexdigest()
+            assert file_content(local_file('single.copy.txt')) == large_content
+
+            # And however slow the first part, no more than 2 * max_workers parts are downloaded ahead of it,
+            # i.e. held in memory until they can be hashed.
+            s3.put_object(Bucket=bucket, Key='slow.txt', Body=os.urandom(mib) * 48)
+            get_object = s3.get_object
+            first_part_started = threading.Event()
+            first_part_released = threading.Event()
+            started_parts = []
+            started_parts_while_first_part_blocked = []
+
+            def slow_first_part_get_object(**kwargs):
+                started_parts.append(kwargs['Range'])
+                if kwargs['Range'].startswith("bytes=0-"):
+                    first_part_started.set()
+                    first_part_released.wait(timeout=10)
+                return get_object(**kwargs)
+
+            def release_first_part():
+                first_part_started.wait(timeout=10)
+                time.sleep(0.5)  # Time enough for every other part to be downloaded, if not bounded.
+                started_parts_while_first_part_blocked.extend(started_parts)
+                first_part_released.set()
+
+            release_thread = threading.Thread(target=release_first_part)
+            release_thread.start()
+            with mock.patch.object(s3, "get_object", side_effect=slow_first_part_get_object):
+                result = s3u.s3_download_file('slow.txt', local_file('slow.copy.txt'), max_workers=2)
+            release_thread.join()
+            assert len(started_parts_while_first_part_blocked) == 4
+            assert len(started_parts) == 6
+            assert result['etag'] == s3.head_object(Bucket=bucket, Key='slow.txt')['ETag'].strip('"')
+            os.remove(local_file('slow.copy.txt'))
+
+            # A failed upload can be resumed, uploading only the remaining parts.
+            upload_part = s3.upload_part
+
+            def failing_upload_part(**kwargs):
+                if kwargs['PartNumber'] == 2:
+                    raise Exception("Upload failed")
+                return upload_part(**kwargs)
+
+            with mock.patch.object(s3, "upload_part", side_effect=failing_upload_part):
+                with pytest.raises(Exception, match="Upload failed"):
+                    s3u.s3_upload_file(large_file, 'resumed.txt', max_workers=1)
+            with io.open(large_file + '.s3upload') as fp:
+                uploaded_parts = [json.loads(line)['part'] for line in fp.read().splitlines()[1:]]
+            assert 1 in uploaded_parts and 2 not in uploaded_parts  # Part 3 may or may not have been uploaded.
+            with recording_calls(s3, "upload_part") as upload_part_calls:
+                with mock.patch.object(s3, "create_multipart_upload") as mock_create_multipart_upload:
+                    assert s3u.s3_upload_file(large_file, 'resumed.txt')['etag'] == compute_file_etag(large_file)
+                    assert len(upload_part_calls) == 3 - len(uploaded_parts)
+                    assert mock_create_multipart_upload.call_count == 0
+            assert not os.path.exists(large_file + '.s3upload')
+            assert s3.get_object(Bucket=bucket, Key='resumed.txt')['Body'].read() == large_content
+
+            # But if the file has since changed, the failed upload is aborted (not orphaned), and a new one started.
+            with mock.patch.object(s3, "upload_part", side_effect=failing_upload_part):
+                with pytest.raises(Exception, match="Upload failed"):
+                    s3u.s3_upload_file(large_file, 'changed.txt', max_workers=1)
+            with io.open(large_file + '.s3upload') as fp:
+                failed_upload_id = json.loads(fp.readline())['upload_id']
+            os.utime(large_file, (0, 12345))
+            with recording_calls(s3, "abort_multipart_upload") as abort_multipart_upload_calls:
+                assert s3u.s3_upload_file(large_file, 'changed.txt')['etag'] == compute_file_etag(large_file)
+                assert [call['UploadId'] for call in abort_multipart_upload_calls] == [failed_upload_id]
+            assert not mock_boto3.shared_reality['_s3_multipart_uploads']
+            assert not os.path.exists(large_file + '.s3upload')
+
+            # Without resume, a failed upload is aborted.
+            with mock.patch.object(s3, "upload_part", side_effect=failing_upload_part):
+                with recording_calls(s3, "abort_multipart_upload") as abort_multipart_upload_calls:
+                    with pytest.raises(Exception, match="Upload failed"):
+                        s3u.s3_upload_file(large_file, 'aborted.txt', resume=False)
+                    assert len(abort_multipart_upload_calls) == 1
+            assert not os.path.exists(large_file + '.s3upload')
+
+            with mock.patch.object(s3, "upload_part", return_value={'ETag': '"not-the-etag"'}):
+                with pytest.raises(S3TransferVerificationError):
+                    s3u.s3_upload_file(large_file, 'unverified.txt', resume=False)
+
+            # A failed download can be resumed, downloading only the remaining parts.
+            get_object = s3.get_object
+
+            def failing_get_object(**kwargs):
+                if kwargs['Range'].startswith(f"bytes={8 * mib}-"):
+                    raise Exception("Download failed")
+                return get_object(**kwargs)
+
+            with mock.patch.object(s3, "get_object", side_effect=failing_get_object):
+                with pytest.raises(Exception, match="Download failed"):
+                    s3u.s3_download_file('large.txt', local_file('resumed.txt'), max_workers=1)
+            with io.open(local_file('resumed.txt.s3download')) as fp:
+                downloaded_parts = [json.loads(line)['part'] for line in fp.read().splitlines()[1:]]
+            assert 1 in downloaded_parts and 2 not in downloaded_parts
+            with recording_calls(s3, "get_object") as get_object_calls:
+                s3u.s3_download_file('large.txt', local_file('resumed.txt'))
+                assert len(get_object_calls) == 3 - len(downloaded_parts)
+            assert file_content(local_file('resumed.txt')) == large_content
+            assert sorted(os.listdir(tmpdir)) == ['large.copy.txt', 'large.txt', 'resumed.txt',
+                                                  'single.copy.txt', 'small.copy.txt', 'small.txt']
+
+            def corrupting_get_object(**kwargs):
+                response = get_object(**kwargs)
+                return dict(response, Body=io.BytesIO(response['Body'].read()[:-1] + b'?'))
+
+            with mock.patch.object(s3, "get_object", side_effect=corrupting_get_object):
+                with pytest.raises(S3TransferVerificationError):
+                    s3u.s3_download_file('large.txt', local_file('corrupted.txt'))
+            assert not os.path.exists(local_file('corrupted.txt'))
+            assert not os.path.exists(local_file('corrupted.txt.s3download.part'))
+
+
+@using_fresh_ff_state_for_testing()
+def test_bulk_get_and_set_object_tags():
+
+    mock_boto3 = MockBoto3()
+
+    bucket = 'sample-bucket'
+    keys = [f"file{index}.txt" for index in range(50)]
+
+    with mock.patch.object(s3_utils_module, "boto3", mock_boto3):
+
+        s3u = s3Utils(sys_bucket='irrelevant')
+        s3 = s3u.s3
+
+        for key in keys:
+            s3.create_object_for_testing("irrelevant", Bucket=bucket, Key=key)
+        s3u.set_object_tags(bucket=bucket, key=keys[0], tags=[{'Key': 'a', 'Value': 'alpha'}])
+
+        results = s3u.bulk_set_object_tags([(bucket, key, [{'Key': 'b', 'Value': key}]) for key in keys],
+                                           max_workers=4)
+        assert [result['key'] for result in results] == keys
+        assert results[0]['tags'] == [{'Key': 'a', 'Value': 'alpha'}, {'Key': 'b', 'Value': keys[0]}]
+        assert all(result['tags'] == [{'Key': 'b', 'Value': result['key']}] for result in results[1:])
+
+        results = s3u.bulk_get_object_tags([(bucket, key) for key in keys])
+        assert [result['tags'] for result in results] == (
+            [[{'Key': 'a', 'Value': 'alpha'}, {'Key': 'b', 'Value': keys[0]}]] +
+            [[{'Key': 'b', 'Value': key}] for key in keys[1:]])
+
+        results = s3u.bulk_set_object_tags([(bucket, keys[0], [{'Key': 'c', 'Value': 'charlie'}])],
+                                           merge_existing_tags=False)
+        assert results[0]['tags'] == [{'Key': 'c', 'Value': 'charlie'}]
+        assert s3u.get_object_tags(bucket=bucket, key=keys[0]) == [{'Key': 'c', 'Value': 'charlie'}]
+
+        # Throttled requests are retried; other failures are reported (per key).
+        put_object_tagging = s3.put_object_tagging
+        throttled = []
+
+        def flaky_put_object_tagging(**kwargs):
+            if kwargs['Key'] == keys[2]:
+                raise botocore.exceptions.ClientError(operation_name='PutObjectTagging', error_response={
+                    "Error": {"Code": "AccessDenied", "Message": "Access Denied"}})
+            if len(throttled) < 10:
+                throttled.append(kwargs['Key'])
+                raise botocore.exceptions.ClientError(operation_name='PutObjectTagging', error_response={
+                    "Error": {"Code": "SlowDown", "Message": "Please reduce your request rate."}})
+            return put_object_tagging(**kwargs)
+
+        with mock.patch.object(s3, "put_object_tagging", side_effect=flaky_put_object_tagging):
+            with mock.patch.object(s3Utils, "S3_THROTTLING_WAIT_SECONDS", 0):
+                results = s3u.bulk_set_object_tags([(bucket, key, [{'Key': 'd', 'Value': 'delta'}]) for key in keys],
+                                                   max_workers=8)
+        assert len(throttled) == 10
+        assert 'AccessDenied' in results[2]['error']
+        assert all('error' not in result for index, result in enumerate(results) if index != 2)
+        expected = [{'Key': 'b', 'Value': keys[3]}, {'Key': 'd', 'Value': 'delta'}]
+        assert s3u.get_object_tags(bucket=bucket, key=keys[3]) == expected
+
+        slow_down = botocore.exceptions.ClientError(operation_name='GetObjectTagging', error_response={
+            "Error": {"Code": "SlowDown", "Message": "Please reduce your request rate."}})
+        with mock.patch.object(s3, "get_object_tagging", side_effect=slow_down) as mock_get_object_tagging:
+            with mock.patch.object(s3_utils_module.time, "sleep") as mock_sleep:
+                assert 'SlowDown' in s3u.bulk_get_object_tags([(bucket, keys[0])])[0]['error']
+                assert mock_get_object_tagging.call_count == s3Utils.S3_THROTTLING_RETRIES + 1
+                # Exponential backoff (with jitter)
+                waits = [call.args[0] for call in mock_sleep.call_args_list]
+                assert len(waits) == s3Utils.S3_THROTTLING_RETRIES
+                assert all(0.5 * 2 ** index <= wait / s3Utils.S3_THROTTLING_WAIT_SECONDS <= 1.5 * 2 ** index
+                           for index, wait in enumerate(waits))
+
+
+def test_rate_limit_client():
+
+    waits = []
+    s3 = boto3.client('s3', region_name='us-east-1', aws_access_key_id='key', aws_secret_access_key='secret')
+    s3_utils_module.rate_limit_client(s3, TokenBucket(rate=20, capacity=2,
+                                                      wait_hook=lambda wait_seconds: waits.append(wait_seconds)))
+    with botocore.stub.Stubber(s3) as stubber:
+        for _ in range(4):
+            stubber.add_response('list_buckets', {'Buckets': []})
+        for _ in range(4):
+            assert s3.list_buckets()['Buckets'] == []
+    assert len(waits) == 2  # The first two calls were within the burst capacity.
@@ -1,10 +1,12 @@
+from concurrent.futures import TimeoutError
 import pytest
+import threading
 import time
 
 from dcicutils.exceptions import MultiError
-from dcicutils.misc_utils import print_error_message
+from dcicutils.misc_utils import chunked, print_error_message
 from dcicutils.qa_utils import Timer
-from dcicutils.task_utils import Task, TaskManager, pmap_chunks, pmap, pmap_list
+from dcicutils.task_utils import Task, TaskGroup, TaskManager, cpu_pmap_list, pmap_chunks, pmap, pmap_list
 
 
 def _add1(x):
@@ -223,3 +225,210 @@ def test_pmap_parallelism():
               f" expected e={expected:.3f}"
               f" range e*{lo_factor:.1f}={expected_lo:.3f} < t < e*{hi_factor:.2f}={expected_hi:.3f}")
         assert expected_lo < n_secs < expected_hi
+
+
+def test_pmap_unordered():
+
+    def slow_add1(x):
+        time.sleep(x / 100)
+        return x + 1
+
+    assert pmap_list(slow_add1, [30, 20, 10, 0], chunk_size=4) == [31, 21, 11, 1]
+    assert pmap_list(slow_add1, [30, 20, 10, 0], chunk_size=4, ordered=False) == [1, 11, 21, 31]
+    assert sorted(pmap(_adder, range(50), range(50), ordered=False)) == list(range(0, 100, 2))
+
+
+def test_pmap_backpressure():
+
+    n_read = 0
+
+    def the_input():
+        nonlocal n_read
+        for x in range(1000):
+            n_read += 1
+            yield x
+
+    results = pmap(_add1, the_input(), chunk_size=5, max_pending=10)
+    assert next(results) == 1
+    time.sleep(0.1)
+    assert n_read <= 10 + 5  # max_pending plus (at most) the one chunk yielded
+    results.close()
+    assert list(pmap(_add1, the_input(), chunk_size=5, max_pending=10)) == list(range(1, 1001))
+
+
+def test_pmap_fail_fast_cancels():
+
+    n_called = 0
+
+    def slow_add1(x):
+        nonlocal n_called
+        n_called += 1
+        time.sleep(0.05)
+        return x + 1
+
+    with pytest.raises(_BadArgument):
+        pmap_list(slow_add1, ['a'] + list(range(100)), chunk_size=2, fail_fast=True)
+    time.sleep(0.2)
+    assert n_called < 10  # The calls not yet started were cancelled.
+
+
+def test_pmap_skewed_latency():
+
+    # A benchmark of the worker pool against waiting for each whole chunk (as this used to do) on a workload
+    # where one call in each chunk is slow. For example, a sample test run with
+    #    pytest -s -vv -k test_pmap_skewed_latency
+    # showed:
+    # Total seconds (chunk at a time): 1.026, (worker pool): 0.146
+
+    print()  # start on a fresh line
+
+    chunk_size = 10
+    slowness = 0.1
+
+    def skewed_add1(x):
+        time.sleep(slowness if x % chunk_size == 0 else slowness / 100)
+        return x + 1
+
+    the_input = range(10 * chunk_size)
+
+    def chunk_at_a_time_pmap(fn, seq):
+        result = []
+        for chunk in chunked(seq, chunk_size=chunk_size):
+            result += pmap_list(fn, chunk, chunk_size=chunk_size)
+        return result
+
+    with Timer() as timer:
+        assert chunk_at_a_time_pmap(skewed_add1, the_input) == [x + 1 for x in the_input]
+    chunked_secs = timer.duration_seconds()
+    with Timer() as timer:
+        assert pmap_list(skewed_add1, the_input, chunk_size=chunk_size, max_pending=len(the_input)) == [
+            x + 1 for x in the_input]
+    pool_secs = timer.duration_seconds()
+    print(f"Total seconds (chunk at a time): {chunked_secs:.3f}, (worker pool): {pool_secs:.3f}")
+    assert chunked_secs > 10 * slowness
+    assert pool_secs < chunked_secs / 2
+
+
+def _square_or_fail(x):
+    if x < 0:
+        raise ValueError(x)
+    return x * x
+
+
+def test_pmap_process_executor():
+
+    for batch_size in [1, 3, None]:
+        assert pmap_list(_add1, range(100), executor="process", chunk_size=2, batch_size=batch_size) == list(
+            range(1, 101))
+        assert pmap_list(_adder, range(10), range(10), executor="process", batch_size=batch_size) == list(
+            range(0, 20, 2))
+        assert [len(chunk) for chunk in pmap_chunks(_add1, range(10), executor="process", chunk_size=4,
+                                                    batch_size=batch_size)] == [4, 4, 2]
+
+    with pytest.raises(ValueError):
+        pmap_list(_square_or_fail, [1, 2, -3, 4], executor="process", chunk_size=2, batch_size=2)
+    with pytest.raises(MultiError) as exc:
+        pmap_list(_square_or_fail, [1, -2, -3, 4], executor="process", fail_fast=False, chunk_size=4, batch_size=2)
+    assert [e.args for e in exc.value.errors] == [(-2,), (-3,)]
+    r1, r2, r3 = pmap_list(_square_or_fail, [1, -2, 3], executor="process", fail_fast=False, raise_error=False)
+    assert (r1, r3) == (1, 9) and isinstance(r2, ValueError)
+
+    with pytest.raises(Exception):
+        pmap_list(lambda x: x, range(10), executor="process")  # Lambdas cannot be pickled.
+    with pytest.raises(ValueError):
+        pmap_list(_add1, range(10), executor="fiber")
+
+
+def test_cpu_pmap_list():
+
+    assert cpu_pmap_list(_square_or_fail, range(1000), max_workers=2) == [x * x for x in range(1000)]
+    assert cpu_pmap_list(_square_or_fail, range(3), max_workers=2) == [0, 1, 4]  # Done serially.
+    assert cpu_pmap_list(_adder, range(100), range(100), max_workers=1, batch_size=5) == list(range(0, 200, 2))
+    assert cpu_pmap_list(_add1, []) == []
+    for max_workers in [1, 2]:
+        with pytest.raises(ValueError):
+            cpu_pmap_list(_square_or_fail, [1, -2, 3, -4] * 10, max_workers=max_workers)
+        with pytest.raises(MultiError):
+            cpu_pmap_list(_square_or_fail, [1, -2, 3, -4] * 10, max_workers=max_workers, fail_fast=False)
+        results = cpu_pmap_list(_square_or_fail, [1, -2] * 10, max_workers=max_workers,
+                                fail_fast=False, raise_error=False)
+        assert results[0::2] == [1] * 10 and all(isinstance(result, ValueError) for result in results[1::2])
+
+
+def test_task_group():
+
+    def slow_square(x, delay=0.0):
+        time.sleep(delay)
+        return _square_or_fail(x)
+
+    progress = []
+    with TaskGroup(max_workers=4, progress=progress.append) as task_group:
+        for x in range(10):
+            assert task_group.submit(slow_square, x, delay=(10 - x) / 100) == x
+    assert task_group.results() == [x * x for x in range(10)]
+    assert progress == [1] * 10
+
+    assert TaskGroup.run([lambda: 1, lambda: 2]) == [1, 2]
+    assert TaskGroup.run([]) == []
+    with pytest.raises(MultiError) as exc:
+        TaskGroup.run([lambda: slow_square(-1), lambda: 2, lambda: slow_square(-3)], fail_fast=False)
+    assert [e.args for e in exc.value.errors] == [(-1,), (-3,)]
+    with pytest.raises(ValueError):
+        TaskGroup.run([lambda: slow_square(-1), lambda: 2], fail_fast=False)
+    r1, r2 = TaskGroup.run([lambda: slow_square(-1), lambda: 2], fail_fast=False, raise_error=False)
+    assert isinstance(r1, ValueError) and r2 == 2
+
+
+def test_task_group_fail_fast():
+
+    started = []
+
+    def slow_square(x):
+        started.append(x)
+        time.sleep(0.05)
+        return _square_or_fail(x)
+
+    with Timer() as timer:
+        with pytest.raises(ValueError):
+            TaskGroup.run([lambda x=x: slow_square(x) for x in [-1] + list(range(100))], max_workers=2)
+    assert timer.duration_seconds() < 1
+    time.sleep(0.1)
+    assert len(started) < 10  # The calls not yet started were cancelled.
+
+
+def test_task_group_timeouts():
+
+    with Timer() as timer:
+        with pytest.raises(TimeoutError) as exc:
+            TaskGroup.run([lambda: time.sleep(0.05), lambda: time.sleep(2)], task_timeout=0.2)
+    assert str(exc.value) == "Task 1 timed out after 0.2 seconds."
+    assert timer.duration_seconds() < 1
+
+    with Timer() as timer:
+        results = TaskGroup.run([lambda: 1] + [lambda: time.sleep(2)] * 3, max_workers=2, timeout=0.2,
+                                fail_fast=False, raise_error=False)
+    assert timer.duration_seconds() < 1
+    assert results[0] == 1
+    assert all(isinstance(result, TimeoutError) for result in results[1:])
+
+    with pytest.raises(TimeoutError):
+        with TaskGroup() as task_group:
+            task_group.submit(lambda: 1)
+            task_group.submit(lambda: time.sleep(2), timeout=0.1)
+
+
+def test_task_group_submit_while_waiting():
+
+    # Calls can be submitted (from another thread) while waiting, which must not interfere with the wait.
+    with TaskGroup(max_workers=4, timeout=30) as task_group:
+
+        def submit_all():
+            for n in range(1000):
+                task_group.submit(lambda n=n: n, timeout=10)
+
+        submitter = threading.Thread(target=submit_all)
+        submitter.start()
+        while submitter.is_alive():
+            task_group.wait()
+        submitter.join()
+    assert task_group.results() == list(range(1000))
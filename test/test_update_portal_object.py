@@ -0,0 +1,99 @@
+import io
+import json
+import os
+from dcicutils.portal_emulator import PortalEmulator
+from dcicutils.portal_utils import PortalInstrumentation
+from dcicutils.scripts.update_portal_object import (
+    _bulk_post_or_patch_or_upsert, _get_linkto_values, _post_data, _upsert_data, Portal
+)
+from dcicutils.tmpfile_utils import temporary_directory
+
+
+_SCHEMAS = {
+    "Donor": {"title": "Donor", "type": "object", "identifyingProperties": ["uuid", "submitted_id"],
+              "properties": {"uuid": {"type": "string"}, "submitted_id": {"type": "string"},
+                             "age": {"type": "integer"}}},
+    "Sample": {"title": "Sample", "type": "object", "identifyingProperties": ["uuid", "submitted_id"],
+               "properties": {"uuid": {"type": "string"}, "submitted_id": {"type": "string"},
+                              "donor": {"type": "string", "linkTo": "Donor"},
+                              "parents": {"type": "array", "items": {"type": "string", "linkTo": "Sample"}},
+                              "protocol": {"type": "object", "properties": {
+                                  "donor": {"type": "string", "linkTo": "Donor"}}}}}
+}
+
+
+def _create_portal(emulator: PortalEmulator, instrumentation=None) -> Portal:
+    return Portal(emulator.router, instrumentation=instrumentation)
+
+
+def test_get_linkto_values():
+    properties = _SCHEMAS["Sample"]["properties"]
+    data = {"submitted_id": "S1", "donor": "D1", "parents": ["/Sample/S2/", "S3"], "protocol": {"donor": "D2"}}
+    assert _get_linkto_values(properties, data) == ["D1", "/Sample/S2/", "S3", "D2"]
+    assert _get_linkto_values(properties, {"submitted_id": "S1", "unknown": "D1"}) == []
+    assert _get_linkto_values(None, data) == []
+
+
+def test_bulk_post_in_dependency_order():
+    # Deliberately listed (and in files named) such that dependents come before their dependencies.
+    data = {
+        "Sample": [{"submitted_id": "S3", "donor": "D1", "parents": ["/Sample/S2/"]},
+                   {"submitted_id": "S2", "donor": "D2", "parents": ["S1"]},
+                   {"submitted_id": "S1", "protocol": {"donor": "D1"}}],
+        "Donor": [{"submitted_id": "D1", "age": 1}, {"submitted_id": "D2", "age": 2}]
+    }
+    emulator = PortalEmulator(schemas=_SCHEMAS, seed=1)
+    instrumentation = PortalInstrumentation()
+    portal = _create_portal(emulator, instrumentation)
+    with temporary_directory() as tmpdir:
+        with io.open(file := os.path.join(tmpdir, "inserts.json"), "w") as f:
+            json.dump(data, f)
+        assert _bulk_post_or_patch_or_upsert(portal, file, None, update_function=_post_data,
+                                             update_action_name="POST", nworkers=4, validate=True) is True
+    assert emulator.nitems == 5
+    posts = [record["url"] for record in instrumentation.records
+             if record["verb"] == "POST" and "check_only" not in record["url"]]
+    assert [post.split("/")[-1] for post in posts][:2] == ["Donor", "Donor"]
+    assert len(posts) == 5
+    assert len([record for record in instrumentation.records if "check_only" in record["url"]]) == 5
+    for submitted_id in ["S1", "S2", "S3"]:
+        assert portal.get(f"/Sample/{submitted_id}").status_code == 200
+
+
+def test_bulk_upsert_with_failure_and_resume():
+    data = {
+        "Donor": [{"submitted_id": "D1", "age": 1}, {"submitted_id": "D2", "age": 2}],
+        "Sample": [{"submitted_id": "S1", "donor": "D1"}, {"submitted_id": "S2", "donor": "D2"}]
+    }
+    emulator = PortalEmulator({"Donor": [{"submitted_id": "D1", "age": 0}]}, schemas=_SCHEMAS, seed=1)
+    portal = _create_portal(emulator)
+    with temporary_directory() as tmpdir:
+        with io.open(file := os.path.join(tmpdir, "inserts.json"), "w") as f:
+            json.dump(data, f)
+        resume_file = os.path.join(tmpdir, "resume.txt")
+
+        # Fail (only) the D2 upsert; S2 (which depends on it) should then not even be tried.
+        def failing_upsert_data(portal, data, schema_name, **kwargs):
+            if data.get("submitted_id") == "D2":
+                return False
+            return _upsert_data(portal, data, schema_name, **kwargs)
+
+        assert _bulk_post_or_patch_or_upsert(portal, file, None, update_function=failing_upsert_data,
+                                             update_action_name="UPSERT", resume_file=resume_file) is False
+        assert portal.get("/Donor/D1").json()["age"] == 1
+        assert portal.get("/Sample/S1").status_code == 200
+        assert emulator.nitems == 2
+        with io.open(resume_file) as f:
+            assert sorted(f.read().split("\n")) == ["", "UPSERT /Donor/D1", "UPSERT /Sample/S1"]
+
+        # Rerun; only the previously failed (or not tried) items should be updated.
+        instrumentation = PortalInstrumentation()
+        portal.instrumentation = instrumentation
+        assert _bulk_post_or_patch_or_upsert(portal, file, None, update_function=_upsert_data,
+                                             update_action_name="UPSERT", resume_file=resume_file) is True
+        assert emulator.nitems == 4
+        assert sorted(record["url"].split("/")[-1] for record in instrumentation.records
+                      if record["verb"] == "POST") == ["Donor", "Sample"]
+        assert not [record for record in instrumentation.records if record["verb"] == "PATCH"]
+        with io.open(resume_file) as f:
+            assert len(f.read().split()) == 8
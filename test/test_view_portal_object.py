@@ -0,0 +1,114 @@
+import io
+import json
+import os
+import pytest
+from unittest import mock
+from dcicutils.portal_emulator import PortalEmulator
+from dcicutils.portal_utils import Portal
+from dcicutils.scripts.view_portal_object import _prefetching_generator, _search_pages, _stream_insert_files
+from dcicutils.tmpfile_utils import temporary_directory
+
+
+def _schema(type_name: str, super_type_name: str = "Item", abstract: bool = False) -> dict:
+    return {"title": type_name, "type": "object", "isAbstract": abstract,
+            "rdfs:subClassOf": f"/profiles/{super_type_name}.json",
+            "identifyingProperties": ["uuid", "submitted_id"],
+            "properties": {"uuid": {"type": "string"}, "submitted_id": {"type": "string"},
+                           "schema_version": {"type": "string"}, "secret": {"type": "string"}}}
+
+
+_SCHEMAS = {
+    "Donor": _schema("Donor"),
+    "Sample": _schema("Sample", abstract=True),
+    "TissueSample": _schema("TissueSample", "Sample"),
+    "CellSample": _schema("CellSample", "Sample"),
+    "QualityMetric": _schema("QualityMetric"),
+    "QualityMetricQc": _schema("QualityMetricQc", "QualityMetric")
+}
+_COUNTS = {"Donor": 7, "TissueSample": 3, "CellSample": 2, "QualityMetric": 2, "QualityMetricQc": 3}
+_INSERTS = {type_name: [{"submitted_id": f"{type_name.upper()}_{index}", "schema_version": "1", "secret": "x"}
+                        for index in range(count)] for type_name, count in _COUNTS.items()}
+
+
+@pytest.fixture(autouse=True)
+def emulator_schemas():
+    # Importing test_structured_data replaces Portal.get_schemas (for the whole class) with a canned
+    # schemas dump; these tests need the schemas the emulator serves, whatever order the tests run in.
+    with mock.patch.object(Portal, "get_schemas", lambda self: self.get("/profiles/").json()):
+        yield
+
+
+def test_stream_insert_files():
+    portal = PortalEmulator(_INSERTS, schemas=_SCHEMAS, seed=1).create_portal()
+    with temporary_directory() as tmpdir:
+        manifest = _stream_insert_files(portal, None, tmpdir, page_size=2, nworkers=3, ignore=["secret"])
+        assert manifest["count"] == sum(_COUNTS.values())
+        assert manifest["errors"] == 0
+        assert manifest["format"] == "json"
+        assert set(manifest["types"]) == set(_COUNTS)  # No (abstract) Sample.
+        assert manifest["types"]["Donor"]["pages"] == 4
+        with io.open(os.path.join(tmpdir, "manifest.json")) as f:
+            assert json.load(f)["types"]["TissueSample"]["count"] == 3
+        for type_name, count in _COUNTS.items():
+            assert manifest["types"][type_name]["count"] == count
+            with io.open(os.path.join(tmpdir, manifest["types"][type_name]["file"])) as f:
+                items = json.load(f)
+            # Objects of a subtype (e.g. QualityMetricQc) are not also exported with their supertype.
+            assert sorted(item["submitted_id"] for item in items) == [f"{type_name.upper()}_{index}"
+                                                                      for index in range(count)]
+            assert all("schema_version" not in item and "secret" not in item and item["uuid"] for item in items)
+        assert sorted(os.listdir(tmpdir)) == ["cell_sample.json", "donor.json", "manifest.json",
+                                              "quality_metric.json", "quality_metric_qc.json", "tissue_sample.json"]
+
+
+def test_stream_insert_files_jsonl():
+    portal = PortalEmulator(_INSERTS, schemas=_SCHEMAS, seed=1).create_portal()
+    with temporary_directory() as tmpdir:
+        manifest = _stream_insert_files(portal, ["Sample", "Donor"], tmpdir, page_size=100, jsonl=True)
+        assert set(manifest["types"]) == {"TissueSample", "CellSample", "Donor"}
+        with io.open(os.path.join(tmpdir, "donor.jsonl")) as f:
+            assert [json.loads(line)["submitted_id"] for line in f] == [f"DONOR_{index}" for index in range(7)]
+        assert _stream_insert_files(portal, ["NoSuchType"], tmpdir) is None
+
+
+def test_prefetching_generator():
+
+    def generator(n, fail=False):
+        for value in range(n):
+            yield value
+        if fail:
+            raise ValueError("failed")
+
+    assert list(_prefetching_generator(generator(10), prefetch=2)) == list(range(10))
+    assert list(_prefetching_generator(generator(10), prefetch=0)) == list(range(10))
+    with pytest.raises(ValueError):
+        list(_prefetching_generator(generator(3, fail=True)))
+    prefetching_generator = _prefetching_generator(generator(1000), prefetch=1)
+    assert next(prefetching_generator) == 0
+    prefetching_generator.close()
+
+
+def test_search_pages_sorted_uniquely():
+
+    class Response:
+        status_code = 200
+        def __init__(self, graph):  # noqa
+            self.graph = graph
+        def json(self):  # noqa
+            return {"@graph": self.graph}
+        def raise_for_status(self):  # noqa
+            pass
+
+    class Portal:
+        queries = []
+        def get(self, query, raw=False, limit=None, offset=0, **kwargs):  # noqa
+            self.queries.append(query)
+            return Response([{"uuid": str(index), "@type": ["Donor"]}
+                             for index in range(offset, min(offset + limit, 5))])
+
+    portal = Portal()
+    pages = list(_search_pages(portal, "Donor", page_size=2, exclude_subtypes=True))
+    assert [[item["uuid"] for item in page] for page in pages] == [["0", "1"], ["2", "3"], ["4"]]
+    assert len(portal.queries) == 6
+    # Both the raw query and the paired (subtype) query are sorted by the same unique key.
+    assert all("&sort=date_created&sort=uuid" in query for query in portal.queries)